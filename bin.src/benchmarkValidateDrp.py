@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from lsst.validate.drp import benchmark
+
+
+description = """
+Benchmark the validate_drp metric calculations on synthetic star fields.
+
+Times the star reduction, AMx, PA1 and TEx calculations for each requested
+number of stars, and records wall time and peak Python memory.  No Butler
+repository or network access is needed.
+
+Example call:
+benchmarkValidateDrp.py --nObjects 1000 3000 10000 --output bench.json \\
+    --baseline bench_reference.json
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nObjects', type=int, nargs='+', default=[1000, 3000, 10000],
+                        help='Numbers of synthetic stars to benchmark.')
+    parser.add_argument('--nVisits', type=int, default=5,
+                        help='Number of visits of each synthetic field.')
+    parser.add_argument('--density', type=float, default=5000.,
+                        help='Stars per square degree.')
+    parser.add_argument('--output', default=None,
+                        help='JSON file to write the results to.')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON file of earlier results to check for regressions.')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Maximum allowed ratio of new to baseline time or memory.')
+    parser.add_argument('--minMemory', type=float, default=1.0,
+                        help='Memory peaks (MB) below which no regression is reported.')
+    parser.add_argument('--backend', choices=['afw', 'arrays'], default='afw',
+                        help='Store the matched catalog in an afw GroupView or in numpy arrays.')
+    parser.add_argument('--readOrder', default=False, action='store_true',
+                        help="""
+                        Instead, measure how the visit matching order (visit order,
+                        deepest or best-seeing visit first) changes the matched objects.
+                        """)
+
+    parser.add_argument('--matcher', choices=['multiMatch', 'objectMatcher'], default='multiMatch',
+                        help="""
+                        Matcher of the --readOrder benchmark: afw MultiMatch, as the default
+                        matching, or the ObjectMatcher of the other matching options.
+                        """)
+
+    args = parser.parse_args()
+
+    if args.readOrder:
+        results = benchmark.runReadOrderBenchmark(nObjects=args.nObjects[-1], nVisits=args.nVisits,
+                                                  density=args.density, matcher=args.matcher)
+        if args.output:
+            benchmark.writeBenchmark(results, args.output)
+        sys.exit(0)
+
+    results = benchmark.runScalingBenchmark(args.nObjects, nVisits=args.nVisits,
+                                            density=args.density, backend=args.backend)
+    if args.output:
+        benchmark.writeBenchmark(results, args.output)
+
+    if args.baseline:
+        regressions = benchmark.findRegressions(results, benchmark.loadBenchmark(args.baseline),
+                                                tolerance=args.tolerance,
+                                                minMemory=args.minMemory)
+        for regression in regressions:
+            print('REGRESSION:', regression)
+        if regressions:
+            sys.exit(1)
@@ -27,7 +27,8 @@ import os.path
 import sys
 
 from lsst.utils import getPackageDir
-from lsst.validate.drp import validate, util
+from lsst.validate.drp import validate, util, estimate
+from lsst.validate.drp.matchreduce import findOptionConflict
 from lsst.verify import MetricSet
 
 
@@ -68,11 +69,99 @@ if __name__ == "__main__":
     parser.add_argument('--noplot', dest='makePlot',
                         default=True, action='store_false',
                         help='Skip making plots of performance.')
+    parser.add_argument('--forcePlot', default=False, action='store_true',
+                        help='Remake plots even if they are up to date with their inputs.')
+    parser.add_argument('--maxScatterPoints', type=int, default=None,
+                        help='Draw error model plots of more stars than this as densities.')
+    parser.add_argument('--traceMemory', default=False, action='store_true',
+                        help='Record Python memory allocations of each stage (slower).')
+    parser.add_argument('--incremental', default=False, action='store_true',
+                        help="""
+                        Persist the matched catalog next to the JSON output and, on later
+                        runs, only load and match data IDs that are not yet in it.
+                        """)
+    parser.add_argument('--streaming', default=False, action='store_true',
+                        help="""
+                        Keep only per-star statistics instead of all matched sources.
+                        Bounds memory use, but only the error models are computed.
+                        """)
+    parser.add_argument('--tileSize', type=float, default=None,
+                        help='Match sources in independent sky tiles of about this size (degrees).')
+    parser.add_argument('--processes', '-j', type=int, default=1,
+                        help='Number of sky tiles matched in parallel with --tileSize.')
+    parser.add_argument('--prefilter', default=False, action='store_true',
+                        help='Drop flagged and non-finite sources before matching.')
+    parser.add_argument('--dense', default=False, action='store_true',
+                        help='Compute AMx and PA1 from object-by-visit arrays. Repeat detections '
+                             'of an object in one visit, and stars with fewer than two distinct '
+                             'visits, are left out, so the results can differ from the default.')
+    parser.add_argument('--compact', default=False, action='store_true',
+                        help='Store magnitudes, SNR and ellipticities in single precision.')
+    parser.add_argument('--checkpoint', default=False, action='store_true',
+                        help='Save the calibrated catalog of each data ID as it is loaded.')
+    parser.add_argument('--resume', default=False, action='store_true',
+                        help="""
+                        Continue an interrupted --checkpoint or --resume run,
+                        loading only the data IDs it had not reached.
+                        """)
+    parser.add_argument('--readOrder', choices=['given', 'visit'], default='given',
+                        help='Read and match data IDs in the given order or grouped by visit.')
+    parser.add_argument('--seedVisit', default=None,
+                        help="""
+                        Visit to match first: a visit number, 'deepest' (most sources)
+                        or 'bestSeeing' (smallest PSF). Implies --readOrder visit.
+                        """)
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='Load up to this many catalogs ahead of the matching in a background thread.')
+    parser.add_argument('--cache', default=None,
+                        help="""
+                        Directory in which to keep matched datasets, so that the metrics
+                        of a repeated run are computed without matching again.
+                        """)
+    parser.add_argument('--resultStore', default=None,
+                        help='SQLite file in which to record the measurements for trending.')
+    parser.add_argument('--maxMemory', type=float, default=None,
+                        help="""
+                        Memory budget in MB: release intermediates early and spill large
+                        arrays to memory-mapped temporary files when it would be exceeded.
+                        """)
+    parser.add_argument('--exportMatches', choices=['npy', 'arrow'], default=None,
+                        help="""
+                        Write the matched dataset to <outputPrefix>_matches as memory-mappable
+                        .npy columns, and with 'arrow' also as an Arrow IPC file.
+                        """)
+    parser.add_argument('--profile', default=False, action='store_true',
+                        help="""
+                        Profile each stage with cProfile, and write the profiles and the
+                        hot functions of each stage to <outputPrefix>_profile.
+                        """)
+    parser.add_argument('--estimate', default=False, action='store_true',
+                        help="""
+                        Print the predicted detections, objects, AMx pairs, run time per
+                        stage and peak memory from the catalog row counts, and exit.
+                        """)
+    parser.add_argument('--costModel', nargs='+', default=None,
+                        help='JSON outputs of earlier runs to calibrate --estimate with.')
+    parser.add_argument('--discovery', choices=['scan', 'stat', 'butler'], default='scan',
+                        help="""
+                        How to check that the datasets found without a configFile exist:
+                        list their directories, stat each file in parallel,
+                        or ask the butler about each one.
+                        """)
     parser.add_argument('--level', type=str, default='design',
                         help='Level of SRD requirement to meet: "minimum", "design", "stretch"')
 
     args = parser.parse_args()
 
+    conflict = findOptionConflict([('--streaming', args.streaming),
+                                   ('--tileSize', args.tileSize is not None),
+                                   ('--prefilter', args.prefilter),
+                                   ('--incremental', args.incremental)],
+                                  [('--compact', args.compact), ('--dense', args.dense),
+                                   ('--cache', args.cache is not None)])
+    if conflict is not None:
+        parser.error(conflict)
+
     # Should clean up the duplication here between this and validate.run
     if args.repo[-5:] == '.json':
         load_json = True
@@ -87,14 +176,46 @@ if __name__ == "__main__":
             kwargs = pbStruct.getDict()
 
         if not args.configFile or not pbStruct.dataIds:
-            kwargs['dataIds'] = util.discoverDataIds(args.repo)
+            kwargs['dataIds'] = util.discoverDataIds(args.repo, existenceCheck=args.discovery)
             if args.verbose:
                 print("VISITDATAIDS: ", kwargs['dataIds'])
 
+        if args.estimate:
+            model = estimate.CostModel.fromJobs(args.costModel) if args.costModel else None
+            dataIdsByFilter = {}
+            for dataId in kwargs['dataIds']:
+                dataIdsByFilter.setdefault(dataId['filter'], []).append(dataId)
+            for filterName, dataIds in sorted(dataIdsByFilter.items()):
+                estimate.printPlan(estimate.estimateCost(args.repo, dataIds, model=model),
+                                   filterName=filterName)
+            sys.exit(0)
+
         kwargs['metrics_package'] = args.metricsPackage
+        kwargs['traceMemory'] = args.traceMemory
+        kwargs['incremental'] = args.incremental
+        kwargs['streaming'] = args.streaming
+        kwargs['tileSize'] = args.tileSize
+        kwargs['nProcesses'] = args.processes
+        kwargs['prefilter'] = args.prefilter
+        kwargs['dense'] = args.dense
+        kwargs['compact'] = args.compact
+        kwargs['checkpoint'] = args.checkpoint
+        kwargs['resume'] = args.resume
+        kwargs['readOrder'] = args.readOrder
+        kwargs['prefetch'] = args.prefetch
+        kwargs['cacheDir'] = args.cache
+        kwargs['resultStore'] = args.resultStore
+        kwargs['maxMemory'] = args.maxMemory
+        kwargs['exportMatches'] = args.exportMatches
+        kwargs['profile'] = args.profile
+        kwargs['seedVisit'] = args.seedVisit
+        if args.seedVisit not in (None, 'deepest', 'bestSeeing'):
+            kwargs['seedVisit'] = int(args.seedVisit)
 
     kwargs['verbose'] = args.verbose
     kwargs['makePlot'] = args.makePlot
+    kwargs['forcePlot'] = args.forcePlot
+    kwargs['maxScatterPoints'] = args.maxScatterPoints
     kwargs['level'] = args.level
     kwargs['outputPrefix'] = args.outputPrefix
 
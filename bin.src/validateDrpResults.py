@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import time
+
+from lsst.validate.drp.resultstore import ResultStore
+
+description = """
+Record validate_drp runs in a SQLite database and query trends across them.
+
+Examples:
+validateDrpResults.py results.sqlite3 import Cfht_output_r.json Cfht_output_i.json
+validateDrpResults.py results.sqlite3 runs --instrument CFHT
+validateDrpResults.py results.sqlite3 trend AM1 --filter r
+validateDrpResults.py results.sqlite3 trend photScatter --blob PhotometricErrorModel
+validateDrpResults.py results.sqlite3 export 12 run12.json
+"""
+
+
+def formatTime(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database', help='SQLite file of the result store.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    importParser = subparsers.add_parser('import', help='Record runs from JSON files.')
+    importParser.add_argument('json_files', nargs='+', help='JSON files written by validateDrp.py.')
+    importParser.add_argument('--codeVersion', default=None,
+                              help='Version of the code that made the measurements.')
+
+    exportParser = subparsers.add_parser('export', help='Write the JSON file of a run.')
+    exportParser.add_argument('runId', type=int, help='Identifier of the run.')
+    exportParser.add_argument('json_file', help='Output JSON file.')
+
+    for name, help in (('runs', 'List runs.'), ('trend', 'List the values of a metric.')):
+        queryParser = subparsers.add_parser(name, help=help)
+        if name == 'trend':
+            queryParser.add_argument('metric', help="Metric name, e.g. 'AM1', or Datum name.")
+            queryParser.add_argument('--blob', default=None,
+                                     help="Blob of the Datum, e.g. 'PhotometricErrorModel'.")
+        queryParser.add_argument('--instrument', default=None)
+        queryParser.add_argument('--filter', dest='filterName', default=None)
+        queryParser.add_argument('--dataset', default=None)
+        queryParser.add_argument('--codeVersion', default=None)
+
+    args = parser.parse_args()
+
+    with ResultStore(args.database) as store:
+        if args.command == 'import':
+            runIds = store.importJson(args.json_files, codeVersion=args.codeVersion)
+            print("Recorded runs %s" % ', '.join(str(runId) for runId in runIds))
+        elif args.command == 'export':
+            store.exportJson(args.runId, args.json_file)
+        elif args.command == 'runs':
+            runs = store.runs(instrument=args.instrument, filterName=args.filterName,
+                              dataset=args.dataset, codeVersion=args.codeVersion)
+            for run in runs:
+                print("%5d  %s  %-8s %-4s %-12s %s" %
+                      (run['id'], formatTime(run['timestamp']), run['instrument'],
+                       run['filter_name'], run['code_version'], run['dataset']))
+        elif args.command == 'trend':
+            trend = store.trend(args.metric, instrument=args.instrument,
+                                filterName=args.filterName, dataset=args.dataset,
+                                codeVersion=args.codeVersion, blob=args.blob)
+            for row in trend:
+                print("%5d  %s  %-4s %-12s %10.4g %s" %
+                      (row['id'], formatTime(row['timestamp']), row['filter_name'],
+                       row['code_version'], row['value'], row['unit']))
+        else:
+            parser.error("Give one of the commands import, export, runs or trend.")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+
+from __future__ import division, print_function, absolute_import
+
+import argparse
+
+from lsst.validate.drp.service import ValidationService, serve
+
+description = """
+Serve validate_drp metrics over HTTP, keeping butlers and matched datasets in
+memory between requests, so that metrics can be recomputed with different
+parameters without loading and matching the catalogs again.
+
+Example:
+validateDrpService.py --port 8732 &
+curl -d '{"repo": "CFHT/output", "filter": "r", "metrics": ["AM1"], "annulusWidth": 1}' \\
+    localhost:8732/metrics
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost',
+                        help='Address to listen on.  The default only accepts local connections.')
+    parser.add_argument('--port', type=int, default=8732,
+                        help='Port to listen on.')
+    parser.add_argument('--metricsPackage',
+                        default='verify_metrics',
+                        help='Name of the repository with YAML definitions of LPM-17 metrics.')
+    parser.add_argument('--maxDatasets', type=int, default=4,
+                        help='Number of matched datasets kept in memory.')
+    parser.add_argument('--cache', default=None,
+                        help='Directory in which to keep matched datasets across restarts.')
+    parser.add_argument('--dense', default=False, action='store_true',
+                        help='Compute AMx and PA1 from object-by-visit arrays.')
+    parser.add_argument('--compact', default=False, action='store_true',
+                        help='Store magnitudes, SNR and ellipticities in single precision.')
+
+    args = parser.parse_args()
+
+    service = ValidationService(metrics_package=args.metricsPackage,
+                                maxDatasets=args.maxDatasets, cacheDir=args.cache,
+                                dense=args.dense, compact=args.compact)
+    serve(service, host=args.host, port=args.port)
@@ -155,7 +155,7 @@ def build_astrometric_error_model(matchedMultiVisitDataset, brightSnr=100,
     _compute(blob,
         matchedMultiVisitDataset['snr'].quantity,
         matchedMultiVisitDataset['dist'].quantity,
-        len(matchedMultiVisitDataset.goodMatches),
+        len(matchedMultiVisitDataset['snr'].quantity),
         brightSnr, medianRef, matchRef)
     return blob
 
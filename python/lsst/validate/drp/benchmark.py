@@ -0,0 +1,329 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Scaling benchmarks of the metric calculations on synthetic star fields.
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import json
+import time
+
+import numpy as np
+import astropy.units as u
+
+from .instrumentation import StageTimer
+from .synthetic import makeSyntheticStarField, makeSyntheticMatchedDataset
+from .calcsrd.amx import calcRmsDistances
+from .calcsrd.pa1 import calcPa1
+from .calcsrd.tex import correlation_function_ellipticity_from_matches
+from .incremental import ObjectMatcher
+
+
+__all__ = ['runScalingBenchmark', 'runReadOrderBenchmark', 'writeBenchmark',
+           'loadBenchmark', 'findRegressions']
+
+
+def _benchmarkOne(nObjects, nVisits, density, seed, backend='afw'):
+    """Time the reduction and metric calculations for one synthetic field.
+
+    The stages are run twice: once timed, and once with memory tracing,
+    whose overhead would otherwise be part of the timings.
+    """
+    # Keep the density constant so that the number of pairs in each AMx
+    # annulus grows like the number of stars, as in real data.
+    footprint = np.sqrt(nObjects / density)
+    field = makeSyntheticStarField(nObjects=nObjects, nVisits=nVisits,
+                                   footprint=footprint, seed=seed)
+
+    summary = _runStages(field, StageTimer(), backend)
+    memory = _runStages(field, StageTimer(traceMemory=True), backend)
+    for stage, record in summary.items():
+        if 'traced_peak_mb' in memory.get(stage, {}):
+            record['traced_peak_mb'] = memory[stage]['traced_peak_mb']
+    return summary
+
+
+def _runStages(field, timer, backend):
+    with timer.stage('reduceStars'):
+        dataset = makeSyntheticMatchedDataset(field, backend=backend)
+    with timer.stage('AMx'):
+        calcRmsDistances(dataset.safeMatches, np.array([4., 6.]) * u.arcmin,
+                         magRange=np.array([17.0, 21.5]) * u.mag)
+    with timer.stage('PA1'):
+        calcPa1(dataset.safeMatches, dataset.magKey)
+    with timer.stage('TEx'):
+        correlation_function_ellipticity_from_matches(dataset.safeMatches)
+    return timer.summary()
+
+
+def runScalingBenchmark(nObjectsList=(1000, 3000, 10000), nVisits=5,
+                        density=5000., seed=12345, backend='afw'):
+    """Measure wall time and memory of the metric calculations versus N.
+
+    Parameters
+    ----------
+    nObjectsList : sequence of `int`, optional
+        Numbers of stars to benchmark.
+    nVisits : `int`, optional
+        Number of visits of each synthetic field.
+    density : `float`, optional
+        Number of stars per square degree.
+    seed : `int`, optional
+        Seed for the synthetic fields, so that runs are comparable.
+    backend : {'afw', 'arrays'}, optional
+        Storage of the matched catalog, see
+        `lsst.validate.drp.synthetic.makeSyntheticMatchedDataset`.
+
+    Returns
+    -------
+    results : `list` of `dict`
+        One entry per number of stars and stage with keys ``backend``,
+        ``nObjects``, ``nVisits``, ``stage``, ``wall_s``, ``cpu_s`` and
+        ``traced_peak_mb``.
+    """
+    results = []
+    for nObjects in nObjectsList:
+        summary = _benchmarkOne(nObjects, nVisits, density, seed, backend=backend)
+        for stage, record in summary.items():
+            results.append({'backend': backend,
+                            'nObjects': nObjects,
+                            'nVisits': nVisits,
+                            'stage': stage,
+                            'wall_s': record['wall_s'],
+                            'cpu_s': record['cpu_s'],
+                            'traced_peak_mb': record.get('traced_peak_mb', np.nan)})
+            print('{0:8d} objects {1:12s} {2:8.2f} s {3:8.1f} MB'.format(
+                nObjects, stage, record['wall_s'], record.get('traced_peak_mb', np.nan)))
+    return results
+
+
+def _matchInOrder(ra, dec, visitIndex, visitOrder, matchRadius, matcher):
+    """Match detections one visit at a time.
+
+    Returns
+    -------
+    rows : `numpy.ndarray`
+        Index of the detection of each match.
+    objectIds : `numpy.ndarray`
+        Object id of each match.
+    """
+    if matcher == 'objectMatcher':
+        objectMatcher = ObjectMatcher(np.deg2rad(matchRadius / 3600))
+        allRows = []
+        allObjects = []
+        for v in visitOrder:
+            rows = np.flatnonzero(visitIndex == v)
+            matchRows, objectIds = objectMatcher.match(ra[rows], dec[rows])
+            allRows.append(rows[matchRows])
+            allObjects.append(objectIds)
+        return np.concatenate(allRows), np.concatenate(allObjects)
+    elif matcher != 'multiMatch':
+        raise ValueError("Unknown matcher '%s'; use 'multiMatch' or 'objectMatcher'" % matcher)
+
+    import lsst.afw.geom as afwGeom
+    import lsst.afw.table as afwTable
+
+    schema = afwTable.SourceTable.makeMinimalSchema()
+    multiMatch = afwTable.MultiMatch(schema, dataIdFormat={'visit': np.int32},
+                                     radius=afwGeom.Angle(matchRadius, afwGeom.arcseconds),
+                                     RecordClass=afwTable.SimpleRecord)
+    for v in visitOrder:
+        rows = np.flatnonzero(visitIndex == v)
+        catalog = afwTable.SourceCatalog(schema)
+        catalog.resize(len(rows))
+        catalog['id'][:] = rows
+        catalog['coord_ra'][:] = ra[rows]
+        catalog['coord_dec'][:] = dec[rows]
+        multiMatch.add(catalog=catalog, dataId={'visit': int(v) + 1})
+    # Copy to a contiguous catalog to read the columns as arrays.
+    matchCat = multiMatch.finish().copy(deep=True)
+    return np.array(matchCat['id']), np.array(matchCat['object'])
+
+
+def runReadOrderBenchmark(nObjects=3000, nVisits=8, density=5000., matchRadius=1.0,
+                          depthRange=(22.5, 25.0), seeingScaleRange=(1.0, 4.0), seed=12345,
+                          matcher='multiMatch'):
+    """Measure how the visit matching order changes the matched objects.
+
+    A synthetic field is observed in visits of different depth and seeing,
+    and its catalogs are matched one visit at a time.  The visits are
+    matched in visit order, and with the deepest and the best-seeing visit
+    first; here these are chosen from the known depth and seeing of the
+    visits.
+
+    Parameters
+    ----------
+    nObjects : `int`, optional
+        Number of stars.
+    nVisits : `int`, optional
+        Number of visits.
+    density : `float`, optional
+        Number of stars per square degree.
+    matchRadius : `float`, optional
+        Match radius in arcseconds.
+    depthRange : 2-element sequence, optional
+        Range of the magnitude limits of the visits.
+    seeingScaleRange : 2-element sequence, optional
+        Range of the factors by which the position errors of the visits are
+        scaled.
+    seed : `int`, optional
+        Seed for the synthetic field.
+    matcher : {'multiMatch', 'objectMatcher'}, optional
+        Match with `lsst.afw.table.MultiMatch`, as the default matching of
+        `lsst.validate.drp.matchreduce.build_matched_dataset` does, or with
+        `lsst.validate.drp.incremental.ObjectMatcher`, as the incremental,
+        streaming, sharded and pre-filtered matching do.
+
+    Returns
+    -------
+    results : `list` of `dict`
+        One entry per order with keys ``matcher``, ``order``,
+        ``seedVisit``, ``wall_s`` (matching time), ``nObjects`` (number of
+        matched objects), ``nStars`` (number of detected stars),
+        ``fragmentedFraction`` (fraction of detected stars that are the
+        reference of more than one object) and ``multiAssignedFraction``
+        (fraction of detections matched to more than one object, which
+        only `~lsst.validate.drp.incremental.ObjectMatcher` does).
+
+    Notes
+    -----
+    Both matchers take the first detection of an object as its reference
+    position, so a star whose detection is too far from its reference
+    starts a new object (fragmentation).  The reference of an object is
+    found here as its detection that was matched first.
+    """
+    rng = np.random.RandomState(seed)
+    footprint = np.sqrt(nObjects / density)
+    field = makeSyntheticStarField(nObjects=nObjects, nVisits=nVisits, footprint=footprint,
+                                   magRange=(17.0, depthRange[1]), seed=seed)
+
+    depth = rng.uniform(depthRange[0], depthRange[1], nVisits)
+    seeingScale = rng.uniform(seeingScaleRange[0], seeingScaleRange[1], nVisits)
+    visitIndex = field.visit - 1
+    star = field.object - 1
+    detected = field.trueMag[star] < depth[visitIndex]
+    scale = seeingScale[visitIndex][detected]
+    ra = field.trueRa[star][detected] + scale*(field.coord_ra[detected] - field.trueRa[star][detected])
+    dec = field.trueDec[star][detected] + \
+        scale*(field.coord_dec[detected] - field.trueDec[star][detected])
+    visitIndex = visitIndex[detected]
+    star = star[detected]
+    nStars = len(np.unique(star))
+
+    orders = [('visit', None),
+              ('deepest', int(np.argmax(depth))),
+              ('bestSeeing', int(np.argmin(seeingScale)))]
+    results = []
+    for order, seedIndex in orders:
+        visitOrder = list(range(nVisits))
+        if seedIndex is not None:
+            visitOrder.remove(seedIndex)
+            visitOrder.insert(0, seedIndex)
+
+        start = time.time()
+        rows, objectIds = _matchInOrder(ra, dec, visitIndex, visitOrder, matchRadius, matcher)
+        wall = time.time() - start
+
+        # Rank of each detection in matching order.
+        rank = np.empty(len(ra), dtype=np.int64)
+        matchOrder = np.concatenate([np.flatnonzero(visitIndex == v) for v in visitOrder])
+        rank[matchOrder] = np.arange(len(ra))
+        objects, objectIndex = np.unique(objectIds, return_inverse=True)
+        firstRank = np.full(len(objects), len(ra), dtype=np.int64)
+        np.minimum.at(firstRank, objectIndex, rank[rows])
+        refStar = star[matchOrder[firstRank]]
+        objectsPerDetection = np.bincount(rows, minlength=len(ra))
+
+        results.append({'matcher': matcher,
+                        'order': order,
+                        'seedVisit': None if seedIndex is None else seedIndex + 1,
+                        'wall_s': wall,
+                        'nObjects': len(objects),
+                        'nStars': nStars,
+                        'fragmentedFraction':
+                            float((np.bincount(refStar) > 1).sum()) / max(nStars, 1),
+                        'multiAssignedFraction':
+                            float((objectsPerDetection > 1).sum()) / max(len(ra), 1)})
+        print('{0:14s} {1:12s} {2:8.2f} s {3:8d} objects for {4:8d} stars, '
+              '{5:6.2%} fragmented, {6:6.2%} of detections in several objects'.format(
+                  matcher, order, wall, len(objects), nStars,
+                  results[-1]['fragmentedFraction'], results[-1]['multiAssignedFraction']))
+    return results
+
+
+def writeBenchmark(results, filename):
+    """Write benchmark results to a JSON file."""
+    with open(filename, 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+
+
+def loadBenchmark(filename):
+    """Read benchmark results written by `writeBenchmark`."""
+    with open(filename, 'r') as infile:
+        return json.load(infile)
+
+
+def findRegressions(results, baseline, tolerance=1.5, minTime=0.05, minMemory=1.0):
+    """Compare benchmark results against a baseline run.
+
+    Parameters
+    ----------
+    results : `list` of `dict`
+        Output of `runScalingBenchmark`.
+    baseline : `list` of `dict`
+        Earlier results, e.g. from `loadBenchmark`.
+    tolerance : `float`, optional
+        Maximum allowed ratio of new to baseline time or memory.
+    minTime : `float`, optional
+        Timings shorter than this (seconds) in both runs are not compared,
+        because they are dominated by noise.
+    minMemory : `float`, optional
+        Memory peaks smaller than this (MB) in both runs are not compared,
+        so that growth from a baseline of almost nothing is not reported.
+
+    Returns
+    -------
+    regressions : `list` of `str`
+        Description of every stage and size that got slower or bigger.
+        Entries without a baseline counterpart of the same backend are
+        ignored; baselines without a backend were run with ``'afw'``.
+    """
+    def comparisonKey(r):
+        return (r.get('backend', 'afw'), r['nObjects'], r['nVisits'], r['stage'])
+
+    reference = {comparisonKey(r): r for r in baseline}
+
+    regressions = []
+    for result in results:
+        key = comparisonKey(result)
+        if key not in reference:
+            continue
+        old = reference[key]
+        if max(result['wall_s'], old['wall_s']) > minTime and \
+                result['wall_s'] > tolerance * old['wall_s']:
+            regressions.append('{stage} with {n} objects ({backend}): {new:.2f} s vs. {old:.2f} s'.format(
+                stage=result['stage'], n=result['nObjects'], backend=key[0],
+                new=result['wall_s'], old=old['wall_s']))
+        if max(result['traced_peak_mb'], old['traced_peak_mb']) > minMemory and \
+                result['traced_peak_mb'] > tolerance * old['traced_peak_mb']:
+            regressions.append('{stage} with {n} objects ({backend}): {new:.1f} MB vs. {old:.1f} MB'.format(
+                stage=result['stage'], n=result['nObjects'], backend=key[0],
+                new=result['traced_peak_mb'], old=old['traced_peak_mb']))
+    return regressions
@@ -0,0 +1,212 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Cache of built matched datasets, so that the metrics of a run can be
+recomputed without loading and matching its catalogs again.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from past.builtins import basestring
+
+from .incremental import dataIdToKey
+from .matcharrays import MatchedArrays, setStarStatistics, starStatisticNames
+from .version import __version__
+
+
+__all__ = ['MatchedDatasetCache', 'repositoryName']
+
+
+def repositoryName(repo):
+    """Name that identifies the inputs of a repository.
+
+    Parameters
+    ----------
+    repo : `str` or `lsst.daf.persistence.Butler`
+        A Butler or a repository URL.
+
+    Returns
+    -------
+    name : `str` or `None`
+        ``repo`` itself if it is a URL, otherwise the roots of the input
+        repositories of the Butler, or `None` if they cannot be found.
+    """
+    if isinstance(repo, basestring):
+        return repo
+    try:
+        return ','.join(sorted(str(repoData.cfg.root) for repoData in repo._repos.inputs()))
+    except AttributeError:
+        return None
+
+
+class MatchedDatasetCache(object):
+    """Directory of matched datasets, keyed by the inputs and configuration
+    they were built from.
+
+    Parameters
+    ----------
+    directory : `str`
+        Cache directory; created if needed.
+
+    Notes
+    -----
+    Each entry is a ``.npz`` file with the columns of the matched catalog
+    (see `lsst.validate.drp.matcharrays.MatchedArrays`), the object ids of
+    the good and safe matches and the per-star statistics.  A dataset read
+    from the cache therefore has the same ``goodMatches``, ``safeMatches``
+    and statistics as the one that was saved, but its matches are always
+    ``MatchedArrays`` and ``_catalog`` is not available.
+
+    The key includes the package version, so entries written by another
+    version are never used; `clear` removes them.
+    """
+
+    version = 3
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, repoName, dataIds, matchRadius, safeSnr, useJointCal, compact=False,
+            matching=None, skipTEx=False):
+        """Key of the dataset built with these inputs and options.
+
+        Parameters
+        ----------
+        repoName : `str`
+            Repository, see `repositoryName`.
+        dataIds : `list` of `dict`
+            Data IDs of the matched catalogs, in the order they are read.
+            Matching assigns sources to objects in read order, so the same
+            data IDs read in another order (e.g. with another seed visit)
+            give another key.
+        matchRadius : `float`
+            Match radius (arcseconds).
+        safeSnr : `float`
+            Minimum median SNR of safe matches.
+        useJointCal : `bool`
+            Whether jointcal/meas_mosaic calibrations are used.
+        compact : `bool`, optional
+            Whether the matches are stored in single precision.
+        matching : `dict`, optional
+            JSON-serializable description of how the catalogs are matched,
+            e.g. ``{'method': 'sharded', 'tileSize': 0.5}``; `None` for
+            ``{'method': 'multiMatch'}``.
+        skipTEx : `bool`, optional
+            Whether the ellipticities were left out of the matches.
+
+        Returns
+        -------
+        key : `str`
+            Hexadecimal digest.
+        """
+        config = {'repo': repoName,
+                  'dataIds': [dataIdToKey(dataId) for dataId in dataIds],
+                  'matchRadius': float(matchRadius),
+                  'safeSnr': float(safeSnr),
+                  'useJointCal': bool(useJointCal),
+                  'compact': bool(compact),
+                  'skipTEx': bool(skipTEx),
+                  'matching': matching if matching is not None else {'method': 'multiMatch'},
+                  'packageVersion': __version__,
+                  'cacheVersion': self.version}
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, 'matched_%s.npz' % key)
+
+    def has(self, key):
+        """Is a dataset with this key in the cache?"""
+        return os.path.exists(self._filename(key))
+
+    def save(self, key, blob):
+        """Write a matched dataset.
+
+        Parameters
+        ----------
+        key : `str`
+            Key from `key`.
+        blob : `lsst.verify.Blob`
+            ``MatchedMultiVisitDataset`` with its ``goodMatches`` and
+            ``safeMatches``.
+        """
+        matches = blob._matchedCatalog
+        if not isinstance(matches, MatchedArrays):
+            matches = MatchedArrays.fromGroupView(matches)
+
+        arrays = {'goodIds': np.asarray(blob.goodMatches.ids),
+                  'safeIds': np.asarray(blob.safeMatches.ids)}
+        for name, values in matches.columns.items():
+            arrays['column_' + name] = values
+        for name in starStatisticNames:
+            arrays['statistic_' + name] = blob[name].quantity.value
+        meta = {'filterName': blob['filterName'].quantity,
+                'useJointCal': bool(blob['useJointCal'].quantity),
+                'groupField': matches.groupField}
+
+        # Write to a temporary file first so that an interrupted run does
+        # not leave a truncated entry behind.
+        filename = self._filename(key)
+        tmpFilename = filename + '.tmp.npz'
+        np.savez(tmpFilename, meta=np.array(json.dumps(meta)), **arrays)
+        os.rename(tmpFilename, filename)
+
+    def load(self, key, blob):
+        """Read a matched dataset into a Blob.
+
+        Parameters
+        ----------
+        key : `str`
+            Key of a dataset in the cache.
+        blob : `lsst.verify.Blob`
+            ``MatchedMultiVisitDataset`` with ``filterName`` and
+            ``useJointCal`` Datums, to which the statistics, matches and
+            ``magKey`` are added.
+        """
+        with np.load(self._filename(key)) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['filterName'] != blob['filterName'].quantity:
+                raise ValueError("Cached dataset %s is for filter %s, not %s" %
+                                 (key, meta['filterName'], blob['filterName'].quantity))
+            columns = {name[len('column_'):]: data[name] for name in data.files
+                       if name.startswith('column_')}
+            goodIds = data['goodIds']
+            safeIds = data['safeIds']
+            setStarStatistics(blob, **{name: data['statistic_' + name]
+                                       for name in starStatisticNames})
+
+        matches = MatchedArrays(columns, groupField=meta['groupField'], isSorted=True)
+        blob._catalog = None
+        blob._matchedCatalog = matches
+        blob.magKey = matches.schema.find("base_PsfFlux_mag").key
+        blob.goodMatches = matches.subset(np.in1d(matches.ids, goodIds))
+        blob.safeMatches = blob.goodMatches.subset(np.in1d(blob.goodMatches.ids, safeIds))
+
+    def clear(self):
+        """Remove all cached datasets."""
+        for filename in os.listdir(self.directory):
+            if filename.startswith('matched_') and filename.endswith('.npz'):
+                os.remove(os.path.join(self.directory, filename))
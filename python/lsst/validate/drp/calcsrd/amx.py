@@ -19,7 +19,7 @@
 # see <https://www.lsstcorp.org/LegalNotices/>.
 
 from __future__ import print_function, absolute_import
-from builtins import zip
+from builtins import range, zip
 
 import numpy as np
 import astropy.units as u
@@ -28,6 +28,7 @@ from lsst.verify import Measurement, Datum
 
 from ..util import (averageRaFromCat, averageDecFromCat,
                     sphDist)
+from ..densematches import DenseMatches
 
 
 def measureAMx(metric, matchedDataset, D, width=2., magRange=None, verbose=False):
@@ -99,6 +100,9 @@ def measureAMx(metric, matchedDataset, D, width=2., magRange=None, verbose=False
     """
 
     matches = matchedDataset.safeMatches
+    denseMatches = getattr(matchedDataset, 'denseSafeMatches', None)
+    if denseMatches is not None:
+        matches = denseMatches
 
     datums = {}
 
@@ -146,7 +150,9 @@ def calcRmsDistances(groupView, annulus, magRange, verbose=False):
     Parameters
     ----------
     groupView : lsst.afw.table.GroupView
-        GroupView object of matched observations from MultiMatch.
+        GroupView object of matched observations from MultiMatch, or
+        `lsst.validate.drp.densematches.DenseMatches`, in which case
+        `calcRmsDistancesDense` is used.
     annulus : length-2 `astropy.units.Quantity`
         Distance range (i.e., arcmin) in which to compare objects.
         E.g., `annulus=np.array([19, 21]) * u.arcmin` would consider all
@@ -161,6 +167,8 @@ def calcRmsDistances(groupView, annulus, magRange, verbose=False):
     rmsDistances : `astropy.units.Quantity`
         RMS angular separations of a set of matched objects over visits.
     """
+    if isinstance(groupView, DenseMatches):
+        return calcRmsDistancesDense(groupView, annulus, magRange, verbose=verbose)
 
     # First we make a list of the keys that we want the fields for
     importantKeys = [groupView.schema.find(name).key for
@@ -220,6 +228,83 @@ def calcRmsDistances(groupView, annulus, magRange, verbose=False):
     return rmsDistances
 
 
+def calcRmsDistancesDense(dense, annulus, magRange, verbose=False):
+    """Calculate the RMS distance of matched objects over visits from
+    object-by-visit arrays.
+
+    Same as `calcRmsDistances`, but visits are matched by column instead of
+    by sorting the visits of each pair of objects.
+
+    Parameters
+    ----------
+    dense : `lsst.validate.drp.densematches.DenseMatches`
+        Matched observations with ``coord_ra``, ``coord_dec`` and
+        ``base_PsfFlux_mag`` columns.
+    annulus : length-2 `astropy.units.Quantity`
+        Distance range (i.e., arcmin) in which to compare objects.
+    magRange : length-2 `astropy.units.Quantity`
+        Magnitude range from which to select objects.
+    verbose : bool, optional
+        Output additional information on the analysis steps.
+
+    Returns
+    -------
+    rmsDistances : `astropy.units.Quantity`
+        RMS angular separations of a set of matched objects over visits.
+    """
+    minMag, maxMag = magRange.to(u.mag).value
+
+    mag = np.ma.masked_invalid(dense['base_PsfFlux_mag'])
+    with np.errstate(invalid='ignore'):
+        medianMag = np.ma.filled(np.ma.median(mag, axis=1), np.nan)
+        inRange = (minMag <= medianMag) & (medianMag < maxMag)
+    dense = dense.subset(inRange)
+
+    observed = ~np.ma.getmaskarray(dense['coord_ra'])
+    ra = np.where(observed, np.ma.getdata(dense['coord_ra']), 0.)
+    dec = np.where(observed, np.ma.getdata(dense['coord_dec']), 0.)
+
+    # Mean position of each object: direction of the sum of unit vectors.
+    cosDec = np.where(observed, np.cos(dec), 0.)
+    x = np.sum(cosDec*np.cos(ra), axis=1)
+    y = np.sum(cosDec*np.sin(ra), axis=1)
+    z = np.sum(np.where(observed, np.sin(dec), 0.), axis=1)
+    meanRa = np.arctan2(y, x) % (2*np.pi)
+    meanDec = np.arctan2(z, np.hypot(x, y))
+
+    # Visits with finite positions; as in `matchVisitComputeDistance`.
+    usable = observed & np.isfinite(ra) & np.isfinite(dec)
+
+    annulusRadians = arcminToRadians(annulus.to(u.arcmin).value)
+
+    rmsDistances = list()
+    for obj1 in range(len(dense)):
+        dist = sphDist(meanRa[obj1], meanDec[obj1], meanRa[obj1+1:], meanDec[obj1+1:])
+        objectsInAnnulus, = np.where((annulusRadians[0] <= dist) &
+                                     (dist < annulusRadians[1]))
+        if len(objectsInAnnulus) == 0:
+            continue
+        obj2 = objectsInAnnulus + obj1 + 1
+
+        shared = usable[obj1] & usable[obj2]
+        with np.errstate(invalid='ignore'):
+            distances = sphDist(ra[obj1], dec[obj1], ra[obj2], dec[obj2])
+        distances = np.where(shared, distances, 0.)
+        nShared = shared.sum(axis=1)
+        if verbose:
+            for obj in obj2[nShared == 0]:
+                print("No matching visits found for objs: %d and %d" % (obj1, obj))
+
+        hasShared = nShared > 0
+        mean = distances[hasShared].sum(axis=1) / nShared[hasShared]
+        deviation = np.where(shared[hasShared], distances[hasShared] - mean[:, np.newaxis], 0.)
+        rmsDistances.extend(np.sqrt(np.sum(deviation**2, axis=1) / nShared[hasShared]))
+
+    # return quantity
+    rmsDistances = np.array(rmsDistances) * u.radian
+    return rmsDistances
+
+
 def matchVisitComputeDistance(visit_obj1, ra_obj1, dec_obj1,
                               visit_obj2, ra_obj2, dec_obj2):
     """Calculate obj1-obj2 distance for each visit in which both objects are seen.
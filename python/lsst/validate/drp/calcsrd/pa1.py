@@ -27,9 +27,10 @@ import numpy as np
 import scipy.stats
 import astropy.units as u
 
-import lsst.pipe.base as pipeBase
 from lsst.verify import Measurement, Datum
 
+from ..densematches import DenseMatches
+
 
 def measurePA1(metric, matchedDataset, filterName, numRandomShuffles=50):
     """Measurement of the PA1 metric: photometric repeatability of
@@ -60,7 +61,12 @@ def measurePA1(metric, matchedDataset, filterName, numRandomShuffles=50):
 
     matches = matchedDataset.safeMatches
     magKey = matchedDataset.magKey
-    results = calcPa1(matches, magKey, numRandomShuffles=numRandomShuffles)
+    denseMatches = getattr(matchedDataset, 'denseSafeMatches', None)
+    if denseMatches is not None:
+        matches = denseMatches
+        magKey = 'base_PsfFlux_mag'
+    results = calcPa1(matches, magKey, numRandomShuffles=numRandomShuffles,
+                      memoryBudget=getattr(matchedDataset, 'memoryBudget', None))
     datums = {}
     datums['filter_name'] = Datum(filterName, label='filter',
                                   description='Name of filter for this measurement')
@@ -79,7 +85,7 @@ def measurePA1(metric, matchedDataset, filterName, numRandomShuffles=50):
     return Measurement(metric, results['PA1'], extras=datums)
 
 
-def calcPa1(matches, magKey, numRandomShuffles=50):
+def calcPa1(matches, magKey, numRandomShuffles=50, memoryBudget=None):
     """Calculate the photometric repeatability of measurements across a set
     of randomly selected pairs of visits.
 
@@ -89,13 +95,19 @@ def calcPa1(matches, magKey, numRandomShuffles=50):
         `~lsst.afw.table.GroupView` of stars matched between visits,
         from MultiMatch, provided by
         `lsst.validate.drp.matchreduce.build_matched_dataset`.
+        A `lsst.validate.drp.densematches.DenseMatches` may be given
+        instead, in which case pairs are drawn with `calcPa1SampleDense`.
     magKey : `lsst.afw.table` schema key
         Magnitude column key in the ``groupView``.
         E.g., ``magKey = allMatches.schema.find("base_PsfFlux_mag").key``
         where ``allMatches`` is the result of
-        `lsst.afw.table.MultiMatch.finish()`.
+        `lsst.afw.table.MultiMatch.finish()`.  For `DenseMatches`, the
+        column name.
     numRandomShuffles : int
         Number of times to draw random pairs from the different observations.
+    memoryBudget : `lsst.validate.drp.memory.MemoryBudget`, optional
+        If given, ``magDiff`` and ``magMean`` are memory-mapped from disk
+        when they would not fit in the budget.
 
     Returns
     -------
@@ -177,13 +189,32 @@ def calcPa1(matches, magKey, numRandomShuffles=50):
     >>> psfMagKey = allMatches.schema.find("base_PsfFlux_mag").key
     >>> pa1 = calcPa1(allMatches, psfMagKey)
     """
-    pa1Samples = [calcPa1Sample(matches, magKey)
-                  for n in range(numRandomShuffles)]
-
-    rms = np.array([pa1.rms for pa1 in pa1Samples]) * u.mmag
-    iqr = np.array([pa1.iqr for pa1 in pa1Samples]) * u.mmag
-    magDiff = np.array([pa1.magDiffs for pa1 in pa1Samples]) * u.mmag
-    magMean = np.array([pa1.magMean for pa1 in pa1Samples]) * u.mag
+    if isinstance(matches, DenseMatches):
+        sample = calcPa1SampleDense
+    else:
+        sample = calcPa1Sample
+    empty = np.empty if memoryBudget is None else memoryBudget.empty
+
+    # Fill preallocated arrays rather than keeping every sample, so that
+    # only one copy of the (numRandomShuffles, nMatches) arrays exists.
+    rms = np.empty(numRandomShuffles)
+    iqr = np.empty(numRandomShuffles)
+    magDiff = magMean = np.empty((numRandomShuffles, 0))
+    for n in range(numRandomShuffles):
+        pa1Sample = sample(matches, magKey)
+        if n == 0:
+            shape = (numRandomShuffles, len(pa1Sample.magDiffs))
+            magDiff = empty(shape, dtype=np.asarray(pa1Sample.magDiffs).dtype)
+            magMean = empty(shape, dtype=np.asarray(pa1Sample.magMean).dtype)
+        rms[n] = pa1Sample.rms
+        iqr[n] = pa1Sample.iqr
+        magDiff[n] = pa1Sample.magDiffs
+        magMean[n] = pa1Sample.magMean
+
+    rms = rms * u.mmag
+    iqr = iqr * u.mmag
+    magDiff = u.Quantity(magDiff, u.mmag, copy=False)
+    magMean = u.Quantity(magMean, u.mag, copy=False)
     pa1 = np.mean(iqr)
     return {'rms': rms, 'iqr': iqr, 'magDiff': magDiff, 'magMean': magMean,
             'PA1': pa1}
@@ -231,6 +262,8 @@ def calcPa1Sample(matches, magKey):
     example of how to call ``calcPa1Sample`` directly given a Butler output
     repository:
     """
+    import lsst.pipe.base as pipeBase
+
     magDiffs = matches.aggregate(getRandomDiffRmsInMmags, field=magKey)
     magMean = matches.aggregate(np.mean, field=magKey)
     rmsPA1, iqrPA1 = computeWidths(magDiffs)
@@ -238,6 +271,49 @@ def calcPa1Sample(matches, magKey):
                            magDiffs=magDiffs, magMean=magMean,)
 
 
+def calcPa1SampleDense(dense, magKey='base_PsfFlux_mag'):
+    """Compute one realization of PA1 from object-by-visit arrays.
+
+    Like `calcPa1Sample`, but the random pair of visits of every star is
+    drawn at once.
+
+    Parameters
+    ----------
+    dense : `lsst.validate.drp.densematches.DenseMatches`
+        Stars matched between visits.
+    magKey : `str`, optional
+        Name of the magnitude column.
+
+    Returns
+    -------
+    metrics : `lsst.pipe.base.Struct`
+        Same fields as `calcPa1Sample`.  Stars detected in fewer than two
+        distinct visits are left out.
+    """
+    import lsst.pipe.base as pipeBase
+
+    mags = dense[magKey]
+    observed = ~np.ma.getmaskarray(mags)
+    nObserved = observed.sum(axis=1)
+    rows = np.flatnonzero(nObserved >= 2)
+    nObserved = nObserved[rows]
+
+    # Columns of the observed visits of each star come first.
+    order = np.argsort(~observed[rows], axis=1, kind='mergesort')
+    first = (np.random.random(len(rows)) * nObserved).astype(int)
+    second = (np.random.random(len(rows)) * (nObserved - 1)).astype(int)
+    second += second >= first
+
+    values = np.ma.getdata(mags)[rows]
+    index = np.arange(len(rows))
+    diff = values[index, order[index, first]] - values[index, order[index, second]]
+    magDiffs = (1000/math.sqrt(2)) * diff
+    magMean = np.ma.filled(mags[rows].mean(axis=1), np.nan)
+    rmsPA1, iqrPA1 = computeWidths(magDiffs)
+    return pipeBase.Struct(rms=rmsPA1, iqr=iqrPA1,
+                           magDiffs=magDiffs, magMean=magMean,)
+
+
 def getRandomDiffRmsInMmags(array):
     """Calculate the RMS difference in mmag between a random pairing of
     visits of a star.
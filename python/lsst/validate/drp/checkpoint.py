@@ -0,0 +1,158 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Checkpoints of the calibrated source catalogs of a matched-dataset build,
+so that an interrupted run can be resumed.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import json
+import os
+import shutil
+
+from lsst.afw.table import SourceCatalog
+
+from .incremental import dataIdToKey
+
+
+__all__ = ['CatalogCheckpoint']
+
+
+class CatalogCheckpoint(object):
+    """Directory of the calibrated catalogs of the data IDs loaded so far.
+
+    Each catalog is written to its own FITS file as soon as it is loaded,
+    and the data ID is then appended to a progress file, so a run that is
+    killed loses at most the catalog it was loading.
+
+    Parameters
+    ----------
+    directory : `str`
+        Checkpoint directory; created if needed.
+    config : `dict`
+        Inputs and options that change the calibrated catalogs (e.g. the
+        repository, the data IDs and ``useJointCal``).  A checkpoint written
+        with a different configuration is discarded.
+    resume : `bool`, optional
+        Reuse the catalogs of an earlier run.  If `False`, any existing
+        checkpoint is discarded.
+
+    Notes
+    -----
+    The progress file has one JSON line per data ID with its catalog file.
+    Data IDs that could not be loaded are not recorded, so that a resumed
+    run tries them again.  An incomplete last line, from a run killed while
+    writing it, is ignored.
+
+    `lsst.afw.table.MultiMatch` cannot be persisted, so a resumed run adds
+    the checkpointed catalogs to the matcher again; this is fast compared
+    with reading and calibrating them.
+    """
+
+    version = 1
+    progressName = 'progress.jsonl'
+
+    def __init__(self, directory, config, resume=False):
+        self.directory = directory
+        self.config = dict(config, version=self.version)
+        self.done = {}
+
+        progressFile = os.path.join(directory, self.progressName)
+        if resume and os.path.exists(progressFile):
+            if self._readProgress(progressFile):
+                print("Resuming from %d checkpointed data IDs in %s" %
+                      (len(self.done), directory))
+            else:
+                print("Checkpoint %s was made with a different configuration; "
+                      "starting again." % directory)
+                self.done = {}
+                self.clear()
+        else:
+            self.clear()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if not self.done:
+            with open(progressFile, 'w') as outfile:
+                outfile.write(json.dumps({'config': self.config}, sort_keys=True) + '\n')
+
+    def _readProgress(self, progressFile):
+        with open(progressFile) as infile:
+            lines = infile.read().split('\n')
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return False
+        if header.get('config') != json.loads(json.dumps(self.config)):
+            return False
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Empty or truncated line
+                continue
+            self.done[entry['dataId']] = entry['file']
+        return True
+
+    def hasDataId(self, dataId):
+        """Was the catalog of ``dataId`` already checkpointed?"""
+        return dataIdToKey(dataId) in self.done
+
+    def load(self, dataId):
+        """Read the checkpointed catalog of a data ID.
+
+        Returns
+        -------
+        catalog : `lsst.afw.table.SourceCatalog`
+            The calibrated sources.
+        """
+        filename = self.done[dataIdToKey(dataId)]
+        return SourceCatalog.readFits(os.path.join(self.directory, filename))
+
+    def save(self, dataId, catalog):
+        """Checkpoint the calibrated catalog of a data ID.
+
+        Parameters
+        ----------
+        dataId : `dict`
+            Data ID of the catalog.
+        catalog : `lsst.afw.table.SourceCatalog` or `None`
+            The calibrated sources, or `None` if the data ID could not be
+            loaded, in which case nothing is recorded.
+        """
+        if catalog is None:
+            return
+        key = dataIdToKey(dataId)
+        filename = 'catalog_%06d.fits' % len(self.done)
+        tmpFilename = os.path.join(self.directory, filename + '.tmp')
+        catalog.writeFits(tmpFilename)
+        os.rename(tmpFilename, os.path.join(self.directory, filename))
+
+        with open(os.path.join(self.directory, self.progressName), 'a') as outfile:
+            outfile.write(json.dumps({'dataId': key, 'file': filename}) + '\n')
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        self.done[key] = filename
+
+    def clear(self):
+        """Delete the checkpoint directory."""
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
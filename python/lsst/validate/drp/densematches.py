@@ -0,0 +1,149 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Matched detections as dense object-by-visit arrays.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import numpy as np
+
+from .matcharrays import MatchedArrays
+
+
+__all__ = ['DenseMatches', 'denseColumnNames']
+
+
+denseColumnNames = ['coord_ra', 'coord_dec', 'base_PsfFlux_mag', 'base_PsfFlux_magErr',
+                    'e1', 'e2', 'psf_e1', 'psf_e2']
+
+
+class DenseMatches(object):
+    """Per-object, per-visit values of matched detections.
+
+    Each column is a `numpy.ma.MaskedArray` of shape ``(nObjects, nVisits)``
+    that is masked where an object was not detected in a visit.  Visits are
+    referred to by their index in ``visits``, their visit code.
+
+    Parameters
+    ----------
+    objectIds : `numpy.ndarray`
+        Object id of each row.
+    visits : `numpy.ndarray`
+        Sorted visit of each column.
+    columns : `dict` of `numpy.ma.MaskedArray`
+        Values by column name.
+    nDuplicates : `int`, optional
+        Number of detections left out because their object was already
+        detected in the same visit.
+
+    Notes
+    -----
+    Build instances with `fromMatches`.
+    """
+
+    def __init__(self, objectIds, visits, columns, nDuplicates=0):
+        self.objectIds = objectIds
+        self.visits = visits
+        self.columns = columns
+        self.nDuplicates = nDuplicates
+
+    @classmethod
+    def fromMatches(cls, matches, names=None):
+        """Arrange matched detections by object and visit.
+
+        Parameters
+        ----------
+        matches : `lsst.afw.table.GroupView` or `lsst.validate.drp.matcharrays.MatchedArrays`
+            Matched detections with a ``visit`` column.
+        names : `list` of `str`, optional
+            Columns to arrange.  Default: those of ``denseColumnNames`` that
+            exist in ``matches``.
+
+        Returns
+        -------
+        dense : `DenseMatches`
+
+        Notes
+        -----
+        If an object has several detections in one visit (e.g. on
+        overlapping CCDs), only the first one is kept, and the number of
+        detections left out is printed.
+        """
+        schemaNames = matches.schema.getNames()
+        if names is None:
+            names = [name for name in denseColumnNames if name in schemaNames]
+        if not isinstance(matches, MatchedArrays):
+            matches = MatchedArrays.fromGroupView(matches, names=list(names) + ['visit'])
+
+        nObjects = len(matches)
+        objectIndex = np.repeat(np.arange(nObjects), matches.counts)
+        visits, visitCode = np.unique(matches.column('visit'), return_inverse=True)
+        nVisits = len(visits)
+
+        cell = objectIndex * nVisits + visitCode
+        cells, first = np.unique(cell, return_index=True)
+        mask = np.ones(nObjects * nVisits, dtype=bool)
+        mask[cells] = False
+        mask = mask.reshape(nObjects, nVisits)
+
+        columns = {}
+        for name in names:
+            values = matches.column(name)
+            data = np.zeros(nObjects * nVisits, dtype=values.dtype)
+            data[cells] = values[first]
+            columns[name] = np.ma.MaskedArray(data.reshape(nObjects, nVisits), mask=mask.copy())
+
+        nDuplicates = len(cell) - len(cells)
+        if nDuplicates > 0:
+            print("Dense matches: left out %d of %d detections of objects already detected "
+                  "in the same visit" % (nDuplicates, len(cell)))
+        return cls(np.asarray(matches.ids), visits, columns, nDuplicates=nDuplicates)
+
+    @property
+    def nObjects(self):
+        return len(self.objectIds)
+
+    @property
+    def nVisits(self):
+        return len(self.visits)
+
+    def __len__(self):
+        return self.nObjects
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def visitCode(self, visit):
+        """Column index of one or more visits."""
+        code = np.searchsorted(self.visits, visit)
+        if np.any(np.asarray(self.visits)[np.minimum(code, self.nVisits - 1)] != visit):
+            raise KeyError("Visit(s) %s not in the matched dataset" % (visit,))
+        return code
+
+    def nObserved(self):
+        """Number of visits in which each object was detected."""
+        return (~np.ma.getmaskarray(self['coord_ra'])).sum(axis=1)
+
+    def subset(self, rows):
+        """Objects selected by a boolean mask or index array."""
+        return DenseMatches(self.objectIds[rows], self.visits,
+                            {name: values[rows] for name, values in self.columns.items()},
+                            nDuplicates=self.nDuplicates)
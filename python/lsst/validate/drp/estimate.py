@@ -0,0 +1,308 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Predict the size, memory use and run time of a validation run from the
+row counts of its catalogs, before loading them.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+import lsst.daf.persistence as dafPersist
+import lsst.pipe.base as pipeBase
+from lsst.afw.fits import FitsError
+
+from .matcharrays import MatchedArrays
+from .readorder import _estimateSourceCount
+
+
+__all__ = ['CostModel', 'estimateCost', 'measureWorkload', 'printPlan']
+
+
+# Quantity whose size sets the run time of each stage.
+stageUnits = OrderedDict([('butler', 'detections'),
+                          ('calibrate', 'detections'),
+                          ('match', 'detections'),
+                          ('reduceStars', 'detections'),
+                          ('errorModels', 'goodObjects'),
+                          ('AMx', 'amxComparisons'),
+                          ('PA1', 'safeObjects'),
+                          ('TEx', 'safeObjects')])
+
+# Annuli of AM1, AM2 and AM3: (D, width) in arcmin.
+amxAnnuli = OrderedDict([('AM1', (5., 2.)), ('AM2', (20., 2.)), ('AM3', (200., 2.))])
+
+
+class CostModel(object):
+    """Cost per unit of work of each pipeline stage.
+
+    Parameters
+    ----------
+    secondsPerUnit : `dict`, optional
+        Wall time of each stage of ``stageUnits`` per unit of its work.
+    baseMb : `float`, optional
+        Memory use (MB) independent of the data.
+    mbPerDetection : `float`, optional
+        Peak memory (MB) per detection.
+    detectionsPerObjectPerVisit : `float`, optional
+        Fraction of the visits in which an object is detected.
+    goodFraction, safeFraction : `float`, optional
+        Fractions of the objects that are good matches, and of the good
+        matches that are safe.
+
+    Notes
+    -----
+    The defaults are order-of-magnitude values for the afw matching path.
+    Predictions are much better with a model calibrated on earlier runs of
+    the same code on similar data, see `fromJobs`.
+    """
+
+    defaultSecondsPerUnit = {'butler': 2e-5, 'calibrate': 5e-6, 'match': 1e-5,
+                             'reduceStars': 2e-5, 'errorModels': 1e-6, 'AMx': 5e-8,
+                             'PA1': 2e-4, 'TEx': 1e-4}
+
+    def __init__(self, secondsPerUnit=None, baseMb=400., mbPerDetection=2e-3,
+                 detectionsPerObjectPerVisit=0.6, goodFraction=0.5, safeFraction=0.2):
+        self.secondsPerUnit = dict(self.defaultSecondsPerUnit)
+        if secondsPerUnit:
+            self.secondsPerUnit.update(secondsPerUnit)
+        self.baseMb = baseMb
+        self.mbPerDetection = mbPerDetection
+        self.detectionsPerObjectPerVisit = detectionsPerObjectPerVisit
+        self.goodFraction = goodFraction
+        self.safeFraction = safeFraction
+
+    @classmethod
+    def fromJobs(cls, filenames):
+        """Calibrate a model on the JSON files of earlier runs.
+
+        Parameters
+        ----------
+        filenames : `list` of `str`
+            JSON files written by ``validateDrp.py``, with ``performance``
+            and ``workload`` in their metadata.
+
+        Returns
+        -------
+        model : `CostModel`
+            Costs are the totals over the runs divided by the total work;
+            costs that the runs do not constrain keep their defaults.
+        """
+        seconds = {}
+        units = {}
+        totals = {}
+        peakMb = []
+        for filename in filenames:
+            with open(filename) as infile:
+                meta = json.load(infile)['meta']
+            if 'performance' not in meta or 'workload' not in meta:
+                print("%s has no performance or workload record; skipping it." % filename)
+                continue
+            performance, workload = meta['performance'], meta['workload']
+            for name, value in workload.items():
+                if value is not None:
+                    totals[name] = totals.get(name, 0) + value
+            for stage, unit in stageUnits.items():
+                if stage in performance and workload.get(unit):
+                    seconds[stage] = seconds.get(stage, 0.) + performance[stage]['wall_s']
+                    units[stage] = units.get(stage, 0) + workload[unit]
+            if workload.get('detections'):
+                peakMb.append((max(record['peak_rss_mb'] for record in performance.values()),
+                               workload['detections']))
+
+        model = cls(secondsPerUnit={stage: seconds[stage] / units[stage] for stage in seconds})
+        if len(peakMb) > 1:
+            # Separate the fixed and per-detection memory with a linear fit.
+            slope, intercept = np.polyfit([n for mb, n in peakMb], [mb for mb, n in peakMb], 1)
+            if slope > 0 and intercept > 0:
+                model.mbPerDetection, model.baseMb = slope, intercept
+        elif peakMb:
+            mb, n = peakMb[0]
+            model.mbPerDetection = max(mb - model.baseMb, 0.) / n
+        if totals.get('objects') and totals.get('visitDetections'):
+            model.detectionsPerObjectPerVisit = totals['detections'] / totals['visitDetections']
+        if totals.get('objects') and totals.get('goodObjects') is not None:
+            model.goodFraction = totals['goodObjects'] / totals['objects']
+        if totals.get('goodObjects') and totals.get('safeObjects') is not None:
+            model.safeFraction = totals['safeObjects'] / totals['goodObjects']
+        return model
+
+
+def measureWorkload(matchedDataset, dataIds):
+    """Sizes of a run, for calibrating a `CostModel`.
+
+    Parameters
+    ----------
+    matchedDataset : `lsst.verify.Blob`
+        Output of `lsst.validate.drp.matchreduce.build_matched_dataset`.
+    dataIds : `list` of `dict`
+        Data IDs that were matched.
+
+    Returns
+    -------
+    workload : `dict`
+        JSON-serializable counts: ``dataIds``, ``visits``, ``detections``,
+        ``objects``, ``goodObjects``, ``safeObjects``,
+        ``amxComparisons`` and ``visitDetections`` (objects times
+        visits).  Counts that are not available, e.g. the detections of a
+        streaming run, are `None`.
+    """
+    nVisits = len(set(dataId['visit'] for dataId in dataIds))
+    workload = OrderedDict([('dataIds', len(dataIds)), ('visits', nVisits),
+                            ('detections', None), ('objects', None),
+                            ('goodObjects', len(matchedDataset['snr'].quantity)),
+                            ('safeObjects', None), ('amxComparisons', None),
+                            ('visitDetections', None)])
+    matches = matchedDataset._matchedCatalog
+    if matches is not None:
+        if getattr(matchedDataset, '_catalog', None) is not None:
+            detections = len(matchedDataset._catalog)
+        elif isinstance(matches, MatchedArrays):
+            detections = int(matches.counts.sum())
+        else:
+            detections = sum(len(group) for group in matches.groups)
+        workload['detections'] = detections
+        workload['objects'] = len(matches)
+        workload['visitDetections'] = len(matches) * nVisits
+    if matchedDataset.safeMatches is not None:
+        nSafe = len(matchedDataset.safeMatches)
+        workload['safeObjects'] = nSafe
+        workload['amxComparisons'] = len(amxAnnuli) * nSafe * (nSafe - 1) // 2
+    return workload
+
+
+def _visitAreaDeg2(butler, dataIds):
+    """Sky area of the largest visit, from the header of one calexp."""
+    ccdsPerVisit = {}
+    for dataId in dataIds:
+        ccdsPerVisit[dataId['visit']] = ccdsPerVisit.get(dataId['visit'], 0) + 1
+    try:
+        metadata = butler.get('calexp_md', dataIds[0])
+        bbox = afwImage.bboxFromMetadata(metadata)
+        wcs = afwGeom.makeSkyWcs(metadata, strip=False)
+    except (dafPersist.NoResults, FitsError, LookupError, RuntimeError, TypeError) as e:
+        print(e)
+        print("Could not read the WCS of %s; AMx pair counts are not estimated." % dataIds[0])
+        return None
+    pixelScaleDeg = wcs.getPixelScale().asDegrees()
+    ccdArea = bbox.getArea() * pixelScaleDeg**2
+    return max(ccdsPerVisit.values()) * ccdArea
+
+
+def estimateCost(repo, dataIds, model=None, sampleSize=None):
+    """Predict the work, memory and run time of validating some data IDs.
+
+    Only the row counts of the ``src`` catalogs (``src_len``, i.e. their
+    FITS headers) and the header of one ``calexp`` are read.
+
+    Parameters
+    ----------
+    repo : `str` or `lsst.daf.persistence.Butler`
+        A Butler or a repository URL that can be used to construct one.
+    dataIds : `list` of `dict`
+        Data IDs of one filter.
+    model : `CostModel`, optional
+        Costs of the stages.  Default: `CostModel` defaults.
+    sampleSize : `int`, optional
+        Count the rows of only this many randomly chosen data IDs and
+        scale up, for very large runs.  Rows are counted without reading
+        the catalogs where possible; otherwise up to 5 catalogs are read
+        and the others are assumed to be as large.
+
+    Returns
+    -------
+    estimate : `lsst.pipe.base.Struct`
+        ``workload``: predicted counts, as from `measureWorkload`;
+        ``amxPairs``: predicted number of safe star pairs in each AMx
+        annulus (`None` if the sky area is unknown); ``stageSeconds``:
+        predicted wall time of each stage; ``totalSeconds``;
+        ``peakMb``: predicted peak memory.
+
+    Notes
+    -----
+    Stars are assumed to be spread uniformly over the area of one visit,
+    and the visits to overlap, so pair counts of annuli larger than the
+    field are overestimated.
+    """
+    if model is None:
+        model = CostModel()
+    if isinstance(repo, dafPersist.Butler):
+        butler = repo
+    else:
+        butler = dafPersist.Butler(repo)
+
+    sample = dataIds
+    if sampleSize is not None and sampleSize < len(dataIds):
+        rng = np.random.RandomState(12345)
+        sample = [dataIds[i] for i in rng.choice(len(dataIds), sampleSize, replace=False)]
+    sampleCount, nRead = _estimateSourceCount(butler, sample, maxCatalogs=5)
+    if nRead:
+        print("Could not count the sources without reading the src catalogs; "
+              "estimated them from %d catalogs." % nRead)
+    detections = int(round(sampleCount * len(dataIds) / max(len(sample), 1)))
+
+    nVisits = len(set(dataId['visit'] for dataId in dataIds))
+    objects = int(round(detections / max(nVisits * model.detectionsPerObjectPerVisit, 1.)))
+    goodObjects = int(round(objects * model.goodFraction))
+    safeObjects = int(round(goodObjects * model.safeFraction))
+    workload = OrderedDict([('dataIds', len(dataIds)), ('visits', nVisits),
+                            ('detections', detections), ('objects', objects),
+                            ('goodObjects', goodObjects), ('safeObjects', safeObjects),
+                            ('amxComparisons', len(amxAnnuli) * safeObjects * (safeObjects - 1) // 2),
+                            ('visitDetections', objects * nVisits)])
+
+    amxPairs = None
+    areaDeg2 = _visitAreaDeg2(butler, dataIds) if dataIds else None
+    if areaDeg2:
+        amxPairs = OrderedDict()
+        for name, (D, width) in amxAnnuli.items():
+            annulusFraction = min(2*np.pi*D*width / (areaDeg2 * 3600.), 1.)
+            amxPairs[name] = int(round(safeObjects * (safeObjects - 1) / 2 * annulusFraction))
+
+    stageSeconds = OrderedDict((stage, model.secondsPerUnit[stage] * workload[unit])
+                               for stage, unit in stageUnits.items())
+    return pipeBase.Struct(workload=workload, amxPairs=amxPairs, areaDeg2=areaDeg2,
+                           stageSeconds=stageSeconds,
+                           totalSeconds=sum(stageSeconds.values()),
+                           peakMb=model.baseMb + model.mbPerDetection * detections)
+
+
+def printPlan(estimate, filterName=''):
+    """Print an estimate from `estimateCost`."""
+    workload = estimate.workload
+    print("Estimated plan%s:" % (" for filter %s" % filterName if filterName else ""))
+    print("  %d data IDs in %d visits" % (workload['dataIds'], workload['visits']))
+    print("  %d detections, ~%d objects, ~%d good, ~%d safe" %
+          (workload['detections'], workload['objects'], workload['goodObjects'],
+           workload['safeObjects']))
+    if estimate.amxPairs is not None:
+        print("  visit area ~%.2f deg^2; safe pairs per AMx annulus: %s" %
+              (estimate.areaDeg2, ', '.join('%s ~%d' % item for item in estimate.amxPairs.items())))
+    print('  {0:20s} {1:>12s}'.format('stage', 'wall [s]'))
+    for stage, seconds in estimate.stageSeconds.items():
+        print('  {0:20s} {1:12.1f}'.format(stage, seconds))
+    print('  {0:20s} {1:12.1f}'.format('total', estimate.totalSeconds))
+    print("  peak memory ~%.0f MB" % estimate.peakMb)
@@ -0,0 +1,127 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Export of matched datasets as memory-mappable column files, for
+analysis without the LSST stack.
+
+The export of a dataset is a directory with one ``.npy`` file per
+per-detection column, sorted by object, and per-object arrays of group
+offsets, object ids, good/safe selections and star statistics, described
+by a ``manifest.json``.  `openMatchedDataset` maps it with numpy only, so
+notebooks can open multi-GB datasets without reading them; it is defined
+in `lsst.validate.drp.exportreader`, which can be used without the stack.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from .matcharrays import MatchedArrays, starStatisticNames
+from .exportreader import ExportedMatches, openMatchedDataset, formatVersion, manifestName
+
+
+__all__ = ['exportMatchedDataset', 'openMatchedDataset', 'ExportedMatches']
+
+
+# Units of the exported columns and statistics, for the manifest.
+columnUnits = {'coord_ra': 'rad', 'coord_dec': 'rad', 'base_PsfFlux_mag': 'mag',
+               'base_PsfFlux_magErr': 'mag', 'snr': '', 'mag': 'mag', 'magrms': 'mag',
+               'magerr': 'mag', 'dist': 'marcsec'}
+
+
+def exportMatchedDataset(matchedDataset, directory, arrow=False):
+    """Write a matched dataset as column files.
+
+    Parameters
+    ----------
+    matchedDataset : `lsst.verify.Blob`
+        ``MatchedMultiVisitDataset`` from
+        `lsst.validate.drp.matchreduce.build_matched_dataset` with its
+        matches (i.e. not built with ``streaming``).
+    directory : `str`
+        Output directory; replaced if it exists.
+    arrow : `bool`, optional
+        Also write the per-detection columns as an Arrow IPC file,
+        ``detections.arrow``, which needs ``pyarrow``.
+
+    Notes
+    -----
+    The layout of the files is described in
+    `lsst.validate.drp.exportreader`.
+    """
+    matches = matchedDataset._matchedCatalog
+    if matches is None:
+        raise ValueError("The matched dataset has no matches to export (streaming run?)")
+    if not isinstance(matches, MatchedArrays):
+        matches = MatchedArrays.fromGroupView(matches)
+    if arrow and pyarrow is None:
+        raise RuntimeError("Arrow export needs pyarrow, which is not installed")
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    for subdirectory in ('columns', 'statistics'):
+        os.makedirs(os.path.join(directory, subdirectory))
+
+    ids = np.asarray(matches.ids)
+    columns = {}
+    for name, values in sorted(matches.columns.items()):
+        np.save(os.path.join(directory, 'columns', name + '.npy'), values)
+        columns[name] = {'dtype': values.dtype.str, 'unit': columnUnits.get(name, '')}
+    np.save(os.path.join(directory, 'offsets.npy'), np.asarray(matches.offsets, dtype=np.int64))
+    np.save(os.path.join(directory, 'ids.npy'), ids)
+    np.save(os.path.join(directory, 'good.npy'),
+            np.in1d(ids, np.asarray(matchedDataset.goodMatches.ids)))
+    np.save(os.path.join(directory, 'safe.npy'),
+            np.in1d(ids, np.asarray(matchedDataset.safeMatches.ids)))
+    statistics = {}
+    for name in starStatisticNames:
+        values = np.asarray(matchedDataset[name].quantity.value)
+        np.save(os.path.join(directory, 'statistics', name + '.npy'), values)
+        statistics[name] = {'dtype': values.dtype.str, 'unit': columnUnits.get(name, '')}
+
+    if arrow:
+        table = pyarrow.Table.from_arrays([pyarrow.array(matches.columns[name])
+                                           for name in sorted(columns)],
+                                          names=sorted(columns))
+        with pyarrow.OSFile(os.path.join(directory, 'detections.arrow'), 'wb') as sink:
+            writer = pyarrow.RecordBatchFileWriter(sink, table.schema)
+            writer.write_table(table)
+            writer.close()
+
+    manifest = {'formatVersion': formatVersion,
+                'filterName': matchedDataset['filterName'].quantity,
+                'useJointCal': bool(matchedDataset['useJointCal'].quantity),
+                'groupField': matches.groupField,
+                'nObjects': len(ids),
+                'nDetections': int(matches.offsets[-1]),
+                'columns': columns,
+                'statistics': statistics,
+                'arrow': bool(arrow)}
+    with open(os.path.join(directory, manifestName), 'w') as outfile:
+        json.dump(manifest, outfile, indent=2, sort_keys=True)
@@ -0,0 +1,150 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Reader of the matched datasets written by
+`lsst.validate.drp.export.exportMatchedDataset`.
+
+This module only needs numpy and imports nothing from the LSST stack, so
+it can be used where the stack is not set up.  Importing it as
+``lsst.validate.drp.exportreader`` needs the stack, because the ``lsst``
+package does; instead, copy this file next to the analysis code and
+``import exportreader``, or load it by its path::
+
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('exportreader', path)
+    exportreader = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(exportreader)
+    matches = exportreader.openMatchedDataset('matches_r')
+
+The files can also be read with `numpy.load` alone.  An export is a
+directory with
+
+``manifest.json``
+    ``formatVersion``, ``filterName``, ``useJointCal``, ``nObjects``,
+    ``nDetections``, and the ``dtype`` and ``unit`` of each entry of
+    ``columns`` and ``statistics``.  It is written last, so an export
+    without it is incomplete.
+``columns/<name>.npy``
+    Per-detection columns (e.g. ``coord_ra`` in radians, ``visit``),
+    sorted by object.
+``offsets.npy``
+    Start of the detections of each object, and the total count; the
+    detections of object ``i`` are ``offsets[i]:offsets[i + 1]``.
+``ids.npy``, ``good.npy``, ``safe.npy``
+    Object ids, and whether each object is a good or a safe match.
+``statistics/<name>.npy``
+    Per-star statistics (``snr``, ``mag``, ``magrms``, ``magerr``,
+    ``dist``) of the good objects, in id order.
+``detections.arrow``
+    The per-detection columns as an Arrow IPC file, if the manifest has
+    ``arrow`` set.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import json
+import os
+
+import numpy as np
+
+
+__all__ = ['openMatchedDataset', 'ExportedMatches']
+
+
+formatVersion = 1
+manifestName = 'manifest.json'
+
+
+class ExportedMatches(object):
+    """Matched dataset read by `openMatchedDataset`.
+
+    Attributes
+    ----------
+    meta : `dict`
+        Contents of the manifest.
+    columns : `dict` of `numpy.ndarray`
+        Per-detection columns, sorted by object.
+    offsets : `numpy.ndarray`
+        Start of the detections of each object, and the total count.
+    ids, good, safe : `numpy.ndarray`
+        Object ids, and good and safe selections, per object.
+    statistics : `dict` of `numpy.ndarray`
+        Per-star statistics of the good objects.
+    """
+
+    def __init__(self, meta, columns, offsets, ids, good, safe, statistics):
+        self.meta = meta
+        self.columns = columns
+        self.offsets = offsets
+        self.ids = ids
+        self.good = good
+        self.safe = safe
+        self.statistics = statistics
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def counts(self):
+        """Number of detections of each object."""
+        return np.diff(self.offsets)
+
+    def group(self, index):
+        """Columns of the detections of the object at ``index``."""
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        return {name: values[start:stop] for name, values in self.columns.items()}
+
+    def objectIndex(self):
+        """Index of the object of each detection, e.g. for ``numpy.bincount``."""
+        return np.repeat(np.arange(len(self.ids)), self.counts)
+
+
+def openMatchedDataset(directory, mmapMode='r'):
+    """Open a matched dataset written by `exportMatchedDataset`.
+
+    Parameters
+    ----------
+    directory : `str`
+        Export directory.
+    mmapMode : `str` or `None`, optional
+        Memory-map mode of `numpy.load`; the default maps the files
+        read-only, so only the pages that are used are read.  `None` reads
+        them into memory.
+
+    Returns
+    -------
+    matches : `ExportedMatches`
+    """
+    manifestFile = os.path.join(directory, manifestName)
+    if not os.path.exists(manifestFile):
+        raise IOError("%s is not a complete matched-dataset export" % directory)
+    with open(manifestFile) as infile:
+        meta = json.load(infile)
+    if meta['formatVersion'] != formatVersion:
+        raise ValueError("Export %s has format version %s, expected %s" %
+                         (directory, meta['formatVersion'], formatVersion))
+
+    def load(*path):
+        return np.load(os.path.join(directory, *path), mmap_mode=mmapMode)
+
+    columns = {name: load('columns', name + '.npy') for name in meta['columns']}
+    statistics = {name: load('statistics', name + '.npy') for name in meta['statistics']}
+    return ExportedMatches(meta, columns, load('offsets.npy'), load('ids.npy'),
+                           load('good.npy'), load('safe.npy'), statistics)
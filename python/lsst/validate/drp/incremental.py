@@ -0,0 +1,578 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Persisted multi-visit match state, so that runs over a growing list of
+visits only need to load and match the new data.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .matcharrays import MatchedArrays, setStarStatistics
+from .util import positionRmsFromCat
+
+
+__all__ = ['ObjectMatcher', 'MatchState']
+
+
+flagNames = ['base_PixelFlags_flag_%s' % flag for flag in ("saturated", "cr", "bad", "edge")]
+
+# Selection of good and safe matches, as in
+# `lsst.validate.drp.matcharrays.reduceStars`.
+nMatchesRequired = 2
+goodSnr = 3
+safeMaxExtended = 1.0
+
+statisticNames = ['nDetections', 'nFlagged', 'nNonFinite', 'medianSnr', 'meanMag',
+                  'magRms', 'medianMagErr', 'posRms', 'maxExtended']
+
+
+def _unitVectors(ra, dec):
+    cosDec = np.cos(dec)
+    return np.column_stack((cosDec*np.cos(ra), cosDec*np.sin(ra), np.sin(dec)))
+
+
+def dataIdToKey(dataId):
+    """Canonical string for a data ID, independent of key order."""
+    return json.dumps(dataId, sort_keys=True, default=str)
+
+
+def reserveRows(values, size, fill=0):
+    """Make room for at least ``size`` rows in an array.
+
+    Parameters
+    ----------
+    values : `numpy.ndarray`
+        Array whose first axis is filled up to some length.
+    size : `int`
+        Number of rows needed.
+    fill : scalar, optional
+        Value of the added rows.
+
+    Returns
+    -------
+    values : `numpy.ndarray`
+        ``values`` itself if it is long enough, otherwise a copy with at
+        least twice as many rows, so that growing an array one batch at a
+        time takes linear time overall.
+    """
+    if len(values) >= size:
+        return values
+    grown = np.full((max(size, 2*len(values)),) + values.shape[1:], fill, dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
+
+
+def _rangeRows(starts, stops):
+    """Concatenation of ``arange(start, stop)`` for each pair."""
+    counts = stops - starts
+    before = np.cumsum(counts) - counts
+    return np.repeat(starts - before, counts) + np.arange(counts.sum())
+
+
+def _mergeSorted(columns, batch):
+    """Merge two sets of columns sorted by ``object``.
+
+    The rows of ``batch`` go after the rows of ``columns`` of the same
+    object.  The cost is linear in the total number of rows.
+    """
+    if columns is None:
+        return batch
+    positions = np.searchsorted(columns['object'], batch['object'], side='right')
+    return {name: np.insert(values, positions, batch[name]) for name, values in columns.items()}
+
+
+class ObjectMatcher(object):
+    """Assign sources to objects as they arrive, like `lsst.afw.table.MultiMatch`.
+
+    Each new source is associated with every object whose reference
+    position (that of its first detection) is within the match radius, and
+    unmatched sources become new objects.  Unlike ``MultiMatch``, object ids
+    are known as soon as a catalog is added.
+
+    Parameters
+    ----------
+    matchRadius : `float`
+        Match radius in radians.
+
+    Notes
+    -----
+    The reference positions are indexed by a few k-d trees of decreasing
+    size: the objects added by one call form a new tree, which is merged
+    with the previous one while it is at least as large.  Each reference is
+    therefore indexed again only ``O(log N)`` times, and references added
+    with `addReferences` (e.g. from a persisted state) are indexed once,
+    when the first sources are matched.
+    """
+
+    def __init__(self, matchRadius):
+        self.matchRadius = matchRadius
+        self._ra = np.zeros(0)
+        self._dec = np.zeros(0)
+        self._nObjects = 0
+        # [start, stop, tree] of the references in each tree; trees are
+        # built when first needed.
+        self._levels = []
+
+    @property
+    def nObjects(self):
+        """Number of objects; their ids are 1 to ``nObjects``."""
+        return self._nObjects
+
+    @property
+    def refRa(self):
+        """Reference right ascension of each object in radians."""
+        return self._ra[:self._nObjects]
+
+    @property
+    def refDec(self):
+        """Reference declination of each object in radians."""
+        return self._dec[:self._nObjects]
+
+    def addReferences(self, ra, dec):
+        """Add objects with the given reference positions.
+
+        Parameters
+        ----------
+        ra, dec : `numpy.ndarray`
+            Reference coordinates in radians.
+
+        Returns
+        -------
+        objectIds : `numpy.ndarray`
+            Ids of the new objects.
+        """
+        start = self._nObjects
+        stop = start + len(ra)
+        self._ra = reserveRows(self._ra, stop)
+        self._dec = reserveRows(self._dec, stop)
+        self._ra[start:stop] = ra
+        self._dec[start:stop] = dec
+        self._nObjects = stop
+
+        if stop > start:
+            levels = self._levels
+            levels.append([start, stop, None])
+            while len(levels) > 1 and \
+                    levels[-1][1] - levels[-1][0] >= levels[-2][1] - levels[-2][0]:
+                last = levels.pop()
+                levels[-1] = [levels[-1][0], last[1], None]
+        return np.arange(start, stop, dtype=np.int64) + 1
+
+    def _neighbours(self, ra, dec):
+        """Index of the sources and references within the match radius."""
+        vectors = _unitVectors(ra, dec)
+        chord = 2*np.sin(self.matchRadius/2)
+        sourceIndex = []
+        refIndex = []
+        for level in self._levels:
+            start, stop, tree = level
+            if tree is None:
+                tree = cKDTree(_unitVectors(self._ra[start:stop], self._dec[start:stop]))
+                level[2] = tree
+            neighbours = tree.query_ball_point(vectors, chord)
+            counts = np.array([len(n) for n in neighbours], dtype=np.int64)
+            sourceIndex.append(np.repeat(np.arange(len(ra)), counts))
+            refIndex.append(np.fromiter(itertools.chain.from_iterable(neighbours),
+                                        dtype=np.int64, count=counts.sum()) + start)
+        sourceIndex = np.concatenate(sourceIndex)
+        refIndex = np.concatenate(refIndex)
+        order = np.lexsort((refIndex, sourceIndex))
+        return sourceIndex[order], refIndex[order]
+
+    def match(self, ra, dec):
+        """Match sources to the known objects, adding new ones as needed.
+
+        Parameters
+        ----------
+        ra, dec : `numpy.ndarray`
+            Source coordinates in radians.
+
+        Returns
+        -------
+        rows : `numpy.ndarray`
+            Index of the source of each match; a source appears once per
+            object it matches.  The sources that became new objects come
+            last, in order.
+        objectIds : `numpy.ndarray`
+            Object id of each match.
+        """
+        ra = np.asarray(ra, dtype=float)
+        dec = np.asarray(dec, dtype=float)
+        nSources = len(ra)
+
+        if self.nObjects > 0 and nSources > 0:
+            sourceIndex, refIndex = self._neighbours(ra, dec)
+        else:
+            sourceIndex = np.array([], dtype=np.int64)
+            refIndex = np.array([], dtype=np.int64)
+
+        unmatched = np.flatnonzero(np.bincount(sourceIndex, minlength=nSources) == 0)
+        newIds = self.addReferences(ra[unmatched], dec[unmatched])
+
+        rows = np.concatenate((sourceIndex, unmatched))
+        objectIds = np.concatenate((refIndex + 1, newIds))
+        return rows, objectIds
+
+
+class MatchState(object):
+    """Multi-visit matches and per-object statistics that can be extended.
+
+    Sources are matched with an `ObjectMatcher`, so matching a list of data
+    IDs in several steps gives the same objects as matching it at once.
+
+    Parameters
+    ----------
+    matchRadius : `float`
+        Match radius in radians.
+    useJointCal : `bool`, optional
+        Whether the sources were calibrated with jointcal/meas_mosaic.
+    repoName : `str`, optional
+        Repository of the sources, see
+        `lsst.validate.drp.cache.repositoryName`.
+    skipTEx : `bool`, optional
+        Whether the ellipticities of the sources were left out.
+
+    Notes
+    -----
+    The state consists of the reference positions and ids of all objects,
+    every matched detection, and summary statistics of each object (number
+    of detections, flagged and non-finite detections, median SNR, mean and
+    RMS magnitude, median magnitude error, position RMS and maximum
+    extendedness).  `add` only marks the objects it touches, and `reduce`
+    recomputes the statistics of just those objects.
+
+    The detections are kept sorted by object.  Those added since the last
+    `reduce` or `save` are sorted on their own and merged in, and the
+    detections of the changed objects are found by binary search, so no
+    step sorts or scans all detections.  `save` appends the new objects and
+    detections and the changed statistics to the state directory as a new
+    part; every ``maxParts`` saves, the parts are rewritten as one.
+    """
+
+    version = 2
+    stateName = 'state.json'
+    maxParts = 8
+
+    def __init__(self, matchRadius, useJointCal=False, repoName=None, skipTEx=False):
+        self.matchRadius = matchRadius
+        self.useJointCal = useJointCal
+        self.repoName = repoName
+        self.skipTEx = skipTEx
+        self.dataIdKeys = set()
+        self.matcher = ObjectMatcher(matchRadius)
+        self._columns = None
+        self._newBatches = []
+        self._staleIds = []
+        self._statistics = {name: np.zeros(0) for name in statisticNames}
+
+        # Changes since the last save
+        self._parts = []
+        self._nextPart = 0
+        self._savedObjects = 0
+        self._unsavedColumns = []
+        self._unsavedKeys = []
+        self._changedIds = []
+
+    @property
+    def nObjects(self):
+        """Number of matched objects; their ids are 1 to ``nObjects``."""
+        return self.matcher.nObjects
+
+    @property
+    def statistics(self):
+        """Per-object statistics by name, indexed by object id - 1."""
+        return {name: values[:self.nObjects] for name, values in self._statistics.items()}
+
+    @property
+    def columns(self):
+        """All matched detections, sorted by object, or `None`."""
+        self._mergeNew()
+        return self._columns
+
+    def hasDataId(self, dataId):
+        """Have the sources of ``dataId`` already been matched?"""
+        return dataIdToKey(dataId) in self.dataIdKeys
+
+    def add(self, columns, dataId):
+        """Match the sources of one data ID against the existing objects.
+
+        Parameters
+        ----------
+        columns : `dict` of `numpy.ndarray`
+            Per-source arrays, including ``coord_ra`` and ``coord_dec`` in
+            radians.  The same columns must be given for every data ID.
+        dataId : `dict`
+            Data ID of the sources.
+        """
+        rows, objectIds = self.matcher.match(columns['coord_ra'], columns['coord_dec'])
+        newColumns = {name: np.asarray(values)[rows] for name, values in columns.items()}
+        newColumns['object'] = objectIds
+        self._newBatches.append(newColumns)
+        self._staleIds.append(objectIds)
+
+        key = dataIdToKey(dataId)
+        self.dataIdKeys.add(key)
+        self._unsavedKeys.append(key)
+
+    def _mergeNew(self):
+        """Sort the detections added since the last call and merge them in."""
+        if not self._newBatches:
+            return
+        names = self._newBatches[0].keys()
+        batch = {name: np.concatenate([b[name] for b in self._newBatches]) for name in names}
+        self._newBatches = []
+        order = np.argsort(batch['object'], kind='mergesort')
+        batch = {name: values[order] for name, values in batch.items()}
+        self._unsavedColumns.append(batch)
+        self._columns = _mergeSorted(self._columns, batch)
+
+    def matchedArrays(self):
+        """All matched detections.
+
+        Returns
+        -------
+        matchedArrays : `lsst.validate.drp.matcharrays.MatchedArrays`
+        """
+        return MatchedArrays(self.columns, isSorted=True)
+
+    def _updateStatistics(self):
+        self._mergeNew()
+        for name in statisticNames:
+            self._statistics[name] = reserveRows(self._statistics[name], self.nObjects)
+        if not self._staleIds:
+            return
+        staleIds = np.unique(np.concatenate(self._staleIds))
+        self._staleIds = []
+        self._changedIds.append(staleIds)
+
+        objects = self._columns['object']
+        rows = _rangeRows(np.searchsorted(objects, staleIds, side='left'),
+                          np.searchsorted(objects, staleIds, side='right'))
+        matches = MatchedArrays({name: values[rows] for name, values in self._columns.items()},
+                                isSorted=True)
+        index = matches.ids - 1
+        starts = matches.offsets[:-1]
+
+        flagged = np.zeros(len(rows), dtype=bool)
+        for name in flagNames:
+            flagged |= matches.column(name).astype(bool)
+        nonFinite = ~np.isfinite(matches.column('base_PsfFlux_mag'))
+
+        statistics = self._statistics
+        statistics['nDetections'][index] = matches.counts
+        statistics['nFlagged'][index] = np.add.reduceat(flagged.astype(int), starts)
+        statistics['nNonFinite'][index] = np.add.reduceat(nonFinite.astype(int), starts)
+        statistics['medianSnr'][index] = matches.aggregate(np.median, field='base_PsfFlux_snr')
+        statistics['meanMag'][index] = matches.aggregate(np.mean, field='base_PsfFlux_mag')
+        statistics['magRms'][index] = matches.aggregate(np.std, field='base_PsfFlux_mag')
+        statistics['medianMagErr'][index] = matches.aggregate(np.median,
+                                                              field='base_PsfFlux_magErr')
+        statistics['posRms'][index] = matches.aggregate(positionRmsFromCat)
+        statistics['maxExtended'][index] = np.maximum.reduceat(
+            matches.column('base_ClassificationExtendedness_value'), starts)
+
+    def reduce(self, blob, safeSnr=50.):
+        """Store summary statistics and good and safe matches in a Blob.
+
+        Equivalent to `lsst.validate.drp.matcharrays.reduceStars`, but only
+        the statistics of objects changed since the last call are computed.
+
+        Parameters
+        ----------
+        blob : `lsst.verify.Blob`
+            ``MatchedMultiVisitDataset`` with a ``filterName`` Datum.
+        safeSnr : `float`, optional
+            Minimum median SNR for a match to be considered "safe".
+        """
+        self._updateStatistics()
+        statistics = self.statistics
+
+        with np.errstate(invalid='ignore'):
+            good = (statistics['nDetections'] >= nMatchesRequired) & \
+                (statistics['nFlagged'] == 0) & \
+                (statistics['nNonFinite'] == 0) & \
+                (statistics['medianSnr'] >= goodSnr)
+            safe = good & (statistics['medianSnr'] >= safeSnr) & \
+                (statistics['maxExtended'] < safeMaxExtended)
+
+        setStarStatistics(blob,
+                          snr=statistics['medianSnr'][good],
+                          mag=statistics['meanMag'][good],
+                          magrms=statistics['magRms'][good],
+                          magerr=statistics['medianMagErr'][good],
+                          dist=statistics['posRms'][good])
+
+        allMatches = self.matchedArrays()
+        blob.goodMatches = allMatches.subset(good[allMatches.ids - 1])
+        blob.safeMatches = blob.goodMatches.subset(safe[blob.goodMatches.ids - 1])
+
+    def save(self, directory):
+        """Write the changes since the last save to a state directory.
+
+        Parameters
+        ----------
+        directory : `str`
+            State directory; created if needed.  A state that was not read
+            from it replaces its contents.
+        """
+        self._updateStatistics()
+        if not self._parts and os.path.exists(os.path.join(directory, self.stateName)):
+            shutil.rmtree(directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if len(self._parts) >= self.maxParts:
+            # Rewrite everything as one part.
+            firstObject = 0
+            columns = self._columns
+            changedIds = np.arange(self.nObjects) + 1
+            keys = sorted(self.dataIdKeys)
+            oldParts = self._parts
+            self._parts = []
+        else:
+            firstObject = self._savedObjects
+            columns = None
+            for batch in self._unsavedColumns:
+                columns = _mergeSorted(columns, batch)
+            changedIds = np.unique(np.concatenate(self._changedIds)) if self._changedIds \
+                else np.array([], dtype=np.int64)
+            keys = self._unsavedKeys
+            oldParts = []
+
+        if self.nObjects > firstObject or keys or len(changedIds) or not self._parts:
+            partMeta = {'dataIds': keys, 'firstObject': firstObject}
+            arrays = {'refRa': self.matcher.refRa[firstObject:],
+                      'refDec': self.matcher.refDec[firstObject:],
+                      'statisticIds': changedIds}
+            for name, values in (columns or {}).items():
+                arrays['column_' + name] = values
+            for name in statisticNames:
+                arrays['statistic_' + name] = self._statistics[name][changedIds - 1]
+
+            partName = 'part_%06d.npz' % self._nextPart
+            # Write to a temporary file first so that an interrupted run
+            # does not leave a truncated part behind.
+            tmpFilename = os.path.join(directory, partName + '.tmp.npz')
+            np.savez(tmpFilename, meta=np.array(json.dumps(partMeta)), **arrays)
+            os.rename(tmpFilename, os.path.join(directory, partName))
+            self._parts.append(partName)
+            self._nextPart += 1
+
+        meta = {'version': self.version,
+                'matchRadius': self.matchRadius,
+                'useJointCal': self.useJointCal,
+                'repoName': self.repoName,
+                'skipTEx': self.skipTEx,
+                'parts': self._parts,
+                'nextPart': self._nextPart}
+        tmpFilename = os.path.join(directory, self.stateName + '.tmp')
+        with open(tmpFilename, 'w') as outfile:
+            json.dump(meta, outfile)
+        os.rename(tmpFilename, os.path.join(directory, self.stateName))
+        for partName in oldParts:
+            os.remove(os.path.join(directory, partName))
+
+        self._savedObjects = self.nObjects
+        self._unsavedColumns = []
+        self._unsavedKeys = []
+        self._changedIds = []
+
+    @classmethod
+    def load(cls, directory):
+        """Read a state written by `save`."""
+        with open(os.path.join(directory, cls.stateName)) as infile:
+            meta = json.load(infile)
+        if meta['version'] != cls.version:
+            raise ValueError("Match state %s has version %s, expected %s" %
+                             (directory, meta['version'], cls.version))
+        state = cls(meta['matchRadius'], useJointCal=meta['useJointCal'],
+                    repoName=meta.get('repoName'), skipTEx=meta.get('skipTEx', False))
+        state._parts = meta['parts']
+        state._nextPart = meta['nextPart']
+
+        for partName in meta['parts']:
+            with np.load(os.path.join(directory, partName)) as data:
+                partMeta = json.loads(str(data['meta']))
+                if partMeta['firstObject'] != state.nObjects:
+                    raise ValueError("Match state %s is inconsistent at %s" %
+                                     (directory, partName))
+                state.dataIdKeys.update(partMeta['dataIds'])
+                state.matcher.addReferences(data['refRa'], data['refDec'])
+                index = data['statisticIds'] - 1
+                for name in statisticNames:
+                    values = reserveRows(state._statistics[name], state.nObjects)
+                    values[index] = data['statistic_' + name]
+                    state._statistics[name] = values
+                columns = {name[len('column_'):]: data[name] for name in data.files
+                           if name.startswith('column_')}
+                if columns:
+                    state._columns = _mergeSorted(state._columns, columns)
+        state._savedObjects = state.nObjects
+        return state
+
+    @classmethod
+    def loadOrCreate(cls, directory, matchRadius, useJointCal=False, dataIds=None,
+                     repoName=None, skipTEx=False):
+        """Read a saved state if it is compatible, otherwise start a new one.
+
+        Parameters
+        ----------
+        directory : `str`
+            Directory written by `save`; need not exist.
+        matchRadius : `float`
+            Match radius in radians.
+        useJointCal : `bool`, optional
+            Whether the sources are calibrated with jointcal/meas_mosaic.
+        dataIds : `list` of `dict`, optional
+            Data IDs of this run.  A state that includes other data IDs is
+            not used, so that sources which are no longer requested do not
+            enter the metrics.
+        repoName : `str`, optional
+            Repository of this run.  A state of another repository, or of
+            the same one under another name, is not used.
+        skipTEx : `bool`, optional
+            Whether the ellipticities are left out in this run.
+
+        Returns
+        -------
+        state : `MatchState`
+        """
+        if os.path.exists(os.path.join(directory, cls.stateName)):
+            state = cls.load(directory)
+            if not np.isclose(state.matchRadius, matchRadius) or \
+                    state.useJointCal != useJointCal or state.repoName != repoName or \
+                    state.skipTEx != skipTEx:
+                print("Match state %s was made with a different configuration; "
+                      "matching all data IDs again." % directory)
+            elif dataIds is not None and \
+                    not state.dataIdKeys <= set(dataIdToKey(dataId) for dataId in dataIds):
+                print("Match state %s includes data IDs that are no longer requested; "
+                      "matching all data IDs again." % directory)
+            else:
+                return state
+        return cls(matchRadius, useJointCal=useJointCal, repoName=repoName, skipTEx=skipTEx)
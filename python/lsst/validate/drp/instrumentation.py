@@ -0,0 +1,273 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Lightweight timing, memory and profiling instrumentation of pipeline
+stages.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import cProfile
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+
+__all__ = ['StageTimer', 'peakRssMb']
+
+
+def peakRssMb():
+    """Peak resident set size of this process so far.
+
+    Returns
+    -------
+    rss : `float`
+        Peak RSS in MB.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+    if sys.platform == 'darwin':
+        return maxrss / 1024**2
+    return maxrss / 1024
+
+
+def _cpuSeconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class StageTimer(object):
+    """Accumulate wall time, CPU time and memory use of named stages.
+
+    Parameters
+    ----------
+    traceMemory : `bool`, optional
+        Also record the peak Python heap allocation of each stage with
+        `tracemalloc`, and the largest allocation sites of the outermost
+        stages.  This slows down allocation-heavy code noticeably, so it is
+        off by default.
+    topAllocations : `int`, optional
+        Number of allocation sites to keep per outermost stage when
+        ``traceMemory`` is set.
+    profile : `bool`, optional
+        Also profile each stage with `cProfile`.  The functions with the
+        most time of their own are listed per stage in the summary, and
+        the profiles can be written with `writeProfiles`.
+    topFunctions : `int`, optional
+        Number of functions to list per stage when ``profile`` is set.
+
+    Examples
+    --------
+    >>> timer = StageTimer()
+    >>> for dataId in dataIds:
+    ...     with timer.stage('butler'):
+    ...         cat = butler.get('src', dataId)
+    >>> job.meta['performance'] = timer.summary()
+
+    Entering the same stage more than once accumulates into one entry.
+    Stages may be nested; each one is timed independently, and the traced
+    peak of a stage includes those of the stages nested in it.  Stages may also
+    be timed from several threads, but CPU time is that of the whole
+    process, so it is then counted in every concurrent stage.
+
+    Only one profiler can be active at a time, so only the outermost stages
+    of the thread that created the timer are profiled; the profile of a
+    stage includes the stages nested in it, and stages timed in other
+    threads (e.g. background loading) are not profiled.  Likewise, the
+    `tracemalloc` peak is process-wide and the stack of traced stages
+    belongs to that thread, so stages timed in other threads get no
+    ``traced_peak_mb``; their allocations count towards the concurrent
+    stages of the owning thread.
+    """
+
+    def __init__(self, traceMemory=False, topAllocations=5, profile=False, topFunctions=20):
+        self.traceMemory = traceMemory and tracemalloc is not None
+        self.topAllocations = topAllocations
+        self.profile = profile
+        self.topFunctions = topFunctions
+        self._stages = OrderedDict()
+        self._profiles = OrderedDict()
+        self._profiling = False
+        self._ownerThread = threading.current_thread()
+        self._traceFrames = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager that times the enclosed block as stage ``name``."""
+        ownerThread = threading.current_thread() is self._ownerThread
+        traceFrame = self._enterTrace() if self.traceMemory and ownerThread else None
+
+        profile = None
+        if self.profile and not self._profiling and ownerThread:
+            profile = cProfile.Profile()
+            self._profiling = True
+            profile.enable()
+
+        startWall = time.time()
+        startCpu = _cpuSeconds()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+                if name in self._profiles:
+                    self._profiles[name].add(profile)
+                else:
+                    self._profiles[name] = pstats.Stats(profile)
+
+            wall = time.time() - startWall
+            cpu = _cpuSeconds() - startCpu
+            with self._lock:
+                record = self._stages.setdefault(name, OrderedDict([
+                    ('calls', 0), ('wall_s', 0.), ('cpu_s', 0.), ('peak_rss_mb', 0.)]))
+                record['calls'] += 1
+                record['wall_s'] += wall
+                record['cpu_s'] += cpu
+                record['peak_rss_mb'] = peakRssMb()
+
+            if traceFrame is not None:
+                self._exitTrace(traceFrame, record)
+
+    def _enterTrace(self):
+        """Start tracing the allocations of a stage.
+
+        ``tracemalloc`` has a single peak, so it is reset for each stage and
+        the peak of the enclosing stage so far is kept in its frame.  Only
+        outermost stages take snapshots, which are too slow for the stages
+        entered for every data ID.
+        """
+        outermost = not self._traceFrames
+        startedTracing = False
+        if outermost and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            startedTracing = True
+        current, peak = tracemalloc.get_traced_memory()
+        if not outermost:
+            parent = self._traceFrames[-1]
+            parent['peak'] = max(parent['peak'], peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        frame = {'start': current, 'peak': 0, 'startedTracing': startedTracing,
+                 'snapshot': tracemalloc.take_snapshot() if outermost else None}
+        self._traceFrames.append(frame)
+        return frame
+
+    def _exitTrace(self, frame, record):
+        """Record the traced peak and allocation sites of a stage."""
+        self._traceFrames.pop()
+        peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        if self._traceFrames:
+            # The tracemalloc peak is reset by the next nested stage.
+            parent = self._traceFrames[-1]
+            parent['peak'] = max(parent['peak'], peak)
+        tracedPeakMb = max(peak - frame['start'], 0) / 1024**2
+        record['traced_peak_mb'] = max(record.get('traced_peak_mb', 0.), tracedPeakMb)
+        if frame['snapshot'] is not None:
+            stats = tracemalloc.take_snapshot().compare_to(frame['snapshot'], 'lineno')
+            record['top_allocations'] = [
+                '{0}: {1:.1f} MB'.format(stat.traceback, stat.size_diff / 1024**2)
+                for stat in stats[:self.topAllocations]]
+        if frame['startedTracing']:
+            tracemalloc.stop()
+
+    def summary(self):
+        """Return the recorded measurements.
+
+        Returns
+        -------
+        stages : `collections.OrderedDict`
+            JSON-serializable mapping of stage name to a dict with ``calls``,
+            ``wall_s``, ``cpu_s``, ``peak_rss_mb``, if memory tracing
+            was requested, ``traced_peak_mb`` and (for outermost stages)
+            ``top_allocations`` and, if the stage was profiled,
+            ``hot_functions``.
+
+        Notes
+        -----
+        ``peak_rss_mb`` is the peak RSS of the process up to the last exit
+        from the stage, not that of the stage alone; ``traced_peak_mb`` is
+        the peak Python allocation during the stage.
+        """
+        summary = OrderedDict((name, dict(record)) for name, record in self._stages.items())
+        for name in self._profiles:
+            summary[name]['hot_functions'] = self.hotFunctions(name)
+        return summary
+
+    def hotFunctions(self, name):
+        """List the functions with the most time of their own in a stage.
+
+        Parameters
+        ----------
+        name : `str`
+            A profiled stage.
+
+        Returns
+        -------
+        functions : `list` of `str`
+            Up to ``topFunctions`` functions, with their own and cumulative
+            time and number of calls, slowest first.
+        """
+        entries = sorted(self._profiles[name].stats.items(), key=lambda item: -item[1][2])
+        return ['{0}:{1}({2}): {3:.3f} s own, {4:.3f} s cumulative, {5} calls'.format(
+                filename, line, function, ownTime, cumulativeTime, nCalls)
+                for (filename, line, function), (_, nCalls, ownTime, cumulativeTime, _)
+                in entries[:self.topFunctions]]
+
+    def writeProfiles(self, directory):
+        """Write the profile of each stage and a summary of its hot functions.
+
+        Parameters
+        ----------
+        directory : `str`
+            Output directory; created if needed.  Each profiled stage is
+            written to ``<stage>.prof``, which can be read with `pstats` or
+            a viewer such as snakeviz, and the `hotFunctions` of all stages
+            to ``hot_functions.txt``.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'hot_functions.txt'), 'w') as outfile:
+            for name, stats in self._profiles.items():
+                stats.dump_stats(os.path.join(directory, name + '.prof'))
+                outfile.write('{0} ({1:.2f} s wall)\n'.format(name, self._stages[name]['wall_s']))
+                for line in self.hotFunctions(name):
+                    outfile.write('    ' + line + '\n')
+
+    def report(self):
+        """Print a table of the recorded stages."""
+        print('{0:20s} {1:>6s} {2:>10s} {3:>10s} {4:>20s}'.format(
+            'stage', 'calls', 'wall [s]', 'cpu [s]', 'process max RSS [MB]'))
+        for name, record in self._stages.items():
+            print('{0:20s} {1:6d} {2:10.2f} {3:10.2f} {4:20.1f}'.format(
+                name, record['calls'], record['wall_s'], record['cpu_s'],
+                record['peak_rss_mb']))
@@ -0,0 +1,480 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Matched multi-visit detections stored as plain numpy arrays.
+
+`MatchedArrays` provides the part of the `lsst.afw.table.GroupView` interface
+that the reduction and the `lsst.validate.drp.calcsrd` functions use, so
+that metrics can be computed without afw, e.g. in lightweight worker
+processes or benchmarks.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import numpy as np
+import astropy.units as u
+
+from lsst.verify import Blob, Datum
+
+from .util import (positionRmsFromCat, averageRaFromCat, averageDecFromCat,
+                   groupedAverageRaDec, groupedPositionRms, groupedPositionRmsFromCat)
+
+
+__all__ = ['MatchedArrays', 'compactColumns', 'findPoisonSources', 'reduceStars',
+           'setStarStatistics', 'compactStarStatistics', 'build_matched_dataset_from_arrays']
+
+
+# Columns of the matched catalog that the reduction and metrics use.
+matchedColumnNames = ['id', 'object', 'visit', 'coord_ra', 'coord_dec',
+                      'base_PsfFlux_snr', 'base_PsfFlux_mag', 'base_PsfFlux_magErr',
+                      'e1', 'e2', 'psf_e1', 'psf_e2',
+                      'base_ClassificationExtendedness_value',
+                      'base_PixelFlags_flag_saturated', 'base_PixelFlags_flag_cr',
+                      'base_PixelFlags_flag_bad', 'base_PixelFlags_flag_edge']
+
+# Columns that do not need double precision.  Coordinates do: a float32
+# angle in radians has a resolution of about 10 milliarcsec.
+compactColumnNames = ['base_PsfFlux_snr', 'base_PsfFlux_mag', 'base_PsfFlux_magErr',
+                      'e1', 'e2', 'psf_e1', 'psf_e2',
+                      'base_ClassificationExtendedness_value']
+
+starStatisticNames = ['snr', 'mag', 'magrms', 'magerr', 'dist']
+
+
+class _ArraySchemaItem(object):
+    def __init__(self, name):
+        self.key = name
+        self.field = name
+
+
+class _ArraySchema(object):
+    """Stand-in for `lsst.afw.table.Schema` whose keys are column names."""
+
+    def __init__(self, names):
+        self._names = set(names)
+
+    def find(self, name):
+        if name not in self._names:
+            raise KeyError("Field '%s' not found in MatchedArrays" % name)
+        return _ArraySchemaItem(name)
+
+    def getNames(self):
+        return set(self._names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+
+class _ArrayGroup(object):
+    """The detections of one object; a view into the parent's columns."""
+
+    def __init__(self, columns, start, stop):
+        self._columns = columns
+        self._slice = slice(start, stop)
+
+    def get(self, key):
+        return self._columns[key][self._slice]
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __len__(self):
+        return self._slice.stop - self._slice.start
+
+
+class MatchedArrays(object):
+    """Matched detections as column arrays, grouped by object.
+
+    Parameters
+    ----------
+    columns : `dict` of `numpy.ndarray`
+        Per-detection arrays of equal length, keyed by column name
+        (e.g. ``coord_ra``, ``base_PsfFlux_mag``; see ``matchedColumnNames``).
+        Coordinates are in radians.  An ``id`` column is added if missing.
+    groupField : `str`, optional
+        Name of the column that identifies the object of each detection.
+    isSorted : `bool`, optional
+        Set if the rows of each object in ``columns`` are already
+        contiguous, e.g. sorted by ``groupField``.
+
+    Notes
+    -----
+    Like `lsst.afw.table.GroupView`, a `MatchedArrays` supports ``len``,
+    ``ids``, ``groups``, ``where`` and ``aggregate``, and has a ``schema``
+    whose ``find(name).key`` can be passed to ``group.get``.  Here the keys
+    are simply the column names.
+    """
+
+    def __init__(self, columns, groupField='object', isSorted=False):
+        columns = {name: np.asarray(values) for name, values in columns.items()}
+        if 'id' not in columns:
+            columns['id'] = np.arange(len(columns[groupField]), dtype=np.int64) + 1
+        if not isSorted:
+            order = np.argsort(columns[groupField], kind='mergesort')
+            columns = {name: values[order] for name, values in columns.items()}
+
+        self.columns = columns
+        self.groupField = groupField
+        groups = columns[groupField]
+        if isSorted:
+            # Groups are contiguous, so they start where the id changes.
+            starts = np.flatnonzero(np.concatenate(([len(groups) > 0], groups[1:] != groups[:-1])))
+            self.ids = groups[starts]
+        else:
+            self.ids, starts = np.unique(groups, return_index=True)
+        self.offsets = np.append(starts, len(columns[groupField]))
+        self.schema = _ArraySchema(columns.keys())
+        self._groups = None
+        self._meanRaDec = None
+
+    @classmethod
+    def fromGroupView(cls, groupView, names=None, empty=np.empty):
+        """Copy the columns of an `lsst.afw.table.GroupView`.
+
+        Parameters
+        ----------
+        groupView : `lsst.afw.table.GroupView`
+            Matched catalog, e.g. from ``MultiMatch``.
+        names : `list` of `str`, optional
+            Columns to copy.  Default: those of ``matchedColumnNames`` that
+            exist in the schema.
+        empty : callable, optional
+            Allocates each column, with the signature of `numpy.empty`, e.g.
+            `lsst.validate.drp.memory.MemoryBudget.empty` so that the
+            columns go to disk instead of holding a second copy of the
+            matches in memory.
+
+        Returns
+        -------
+        matchedArrays : `MatchedArrays`
+        """
+        if names is None:
+            schemaNames = groupView.schema.getNames()
+            names = [name for name in matchedColumnNames if name in schemaNames]
+        keys = [groupView.schema.find(name).key for name in names]
+        counts = np.array([len(group) for group in groupView.groups], dtype=int)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        columns = {}
+        for name, key in zip(names, keys):
+            if len(groupView) == 0:
+                columns[name] = np.array([])
+                continue
+            values = None
+            for group, start, stop in zip(groupView.groups, offsets[:-1], offsets[1:]):
+                groupValues = group.get(key)
+                if values is None:
+                    values = empty(offsets[-1], dtype=groupValues.dtype)
+                values[start:stop] = groupValues
+            columns[name] = values
+        columns['object'] = np.repeat(np.asarray(groupView.ids), counts)
+        return cls(columns, isSorted=True)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Memory used by the columns, in bytes."""
+        return sum(values.nbytes for values in self.columns.values())
+
+    def compact(self):
+        """Copy with the columns of ``compactColumnNames`` in single precision."""
+        return MatchedArrays(compactColumns(self.columns), groupField=self.groupField,
+                             isSorted=True)
+
+    @property
+    def counts(self):
+        """Number of detections of each object."""
+        return np.diff(self.offsets)
+
+    @property
+    def groups(self):
+        """Per-object views with a ``get(key)`` method, in ``ids`` order."""
+        if self._groups is None:
+            self._groups = [_ArrayGroup(self.columns, start, stop)
+                            for start, stop in zip(self.offsets[:-1], self.offsets[1:])]
+        return self._groups
+
+    def column(self, name):
+        """Per-detection array of a column, sorted by object."""
+        return self.columns[name]
+
+    def meanRaDec(self):
+        """Average position of each object in radians, see
+        `lsst.validate.drp.util.averageRaDec`."""
+        if self._meanRaDec is None:
+            self._meanRaDec = groupedAverageRaDec(self.columns['coord_ra'],
+                                                  self.columns['coord_dec'], self.offsets)
+        return self._meanRaDec
+
+    def subset(self, mask):
+        """Select objects.
+
+        Parameters
+        ----------
+        mask : `numpy.ndarray` of `bool`
+            One entry per object.
+
+        Returns
+        -------
+        matchedArrays : `MatchedArrays`
+            The selected objects, with all of their detections.
+        """
+        rows = np.repeat(np.asarray(mask, dtype=bool), self.counts)
+        return MatchedArrays({name: values[rows] for name, values in self.columns.items()},
+                             groupField=self.groupField, isSorted=True)
+
+    def where(self, predicate):
+        """Select objects for which ``predicate(group)`` is `True`."""
+        return self.subset(np.array([bool(predicate(group)) for group in self.groups],
+                                    dtype=bool))
+
+    def aggregate(self, function, field=None, dtype=float):
+        """Compute a per-object quantity.
+
+        Parameters
+        ----------
+        function : callable
+            Called with the array of ``field`` for each object, or with the
+            group itself if ``field`` is `None`.
+        field : `str`, optional
+            Column to pass to ``function``.
+        dtype : `numpy.dtype`, optional
+            Type of the result.
+
+        Returns
+        -------
+        result : `numpy.ndarray`
+            One entry per object.
+        """
+        if field is not None and function in (np.mean, np.std) and len(self) > 0:
+            # Vectorized versions of the most common reductions.
+            values = self.columns[field].astype(float)
+            counts = self.counts
+            mean = np.add.reduceat(values, self.offsets[:-1]) / counts
+            if function is np.mean:
+                return mean.astype(dtype)
+            deviation = values - np.repeat(mean, counts)
+            return np.sqrt(np.add.reduceat(deviation**2, self.offsets[:-1]) / counts).astype(dtype)
+
+        if field is None and len(self) > 0 and \
+                function in (positionRmsFromCat, averageRaFromCat, averageDecFromCat):
+            # Positions of all objects at once; the averages are kept for
+            # the other position reductions.
+            meanRa, meanDec = self.meanRaDec()
+            if function is averageRaFromCat:
+                return meanRa.astype(dtype)
+            if function is averageDecFromCat:
+                return meanDec.astype(dtype)
+            return groupedPositionRms(self.columns['coord_ra'], self.columns['coord_dec'],
+                                      self.offsets, meanRa, meanDec).astype(dtype)
+
+        result = np.empty(len(self), dtype=dtype)
+        for i, group in enumerate(self.groups):
+            result[i] = function(group.get(field) if field is not None else group)
+        return result
+
+
+def compactColumns(columns):
+    """Convert the columns of ``compactColumnNames`` to `numpy.float32`.
+
+    Parameters
+    ----------
+    columns : `dict` of `numpy.ndarray`
+        Per-source arrays.
+
+    Returns
+    -------
+    columns : `dict` of `numpy.ndarray`
+        The same arrays, with magnitudes, their errors, SNR, ellipticities
+        and extendedness in single precision.  Other columns, in particular
+        coordinates, are not copied.
+    """
+    return {name: values.astype(np.float32) if name in compactColumnNames else values
+            for name, values in columns.items()}
+
+
+def findPoisonSources(columns):
+    """Find sources that make every group containing them fail the good-match
+    selection of `reduceStars`.
+
+    These are sources with a saturated, cosmic ray, bad or edge pixel flag,
+    a non-finite PSF magnitude, or a NaN PSF SNR (which makes the median
+    SNR NaN).
+
+    Parameters
+    ----------
+    columns : `dict` of `numpy.ndarray`
+        Per-source ``base_PsfFlux_mag``, ``base_PsfFlux_snr`` and pixel flags.
+
+    Returns
+    -------
+    poison : `numpy.ndarray` of `bool`
+    """
+    poison = ~np.isfinite(columns['base_PsfFlux_mag']) | np.isnan(columns['base_PsfFlux_snr'])
+    for flag in ("saturated", "cr", "bad", "edge"):
+        poison |= np.asarray(columns["base_PixelFlags_flag_%s" % flag], dtype=bool)
+    return poison
+
+
+def reduceStars(blob, allMatches, safeSnr=50.0):
+    """Calculate summary statistics for each star. These are persisted
+    as object attributes.
+
+    Parameters
+    ----------
+    allMatches : afw.table.GroupView or `MatchedArrays`
+        GroupView object with matches.
+    safeSnr : float, optional
+        Minimum median SNR for a match to be considered "safe".
+    """
+    # Filter down to matches with at least 2 sources and good flags
+    flagKeys = [allMatches.schema.find("base_PixelFlags_flag_%s" % flag).key
+                for flag in ("saturated", "cr", "bad", "edge")]
+    nMatchesRequired = 2
+
+    psfSnrKey = allMatches.schema.find("base_PsfFlux_snr").key
+    psfMagKey = allMatches.schema.find("base_PsfFlux_mag").key
+    psfMagErrKey = allMatches.schema.find("base_PsfFlux_magErr").key
+    extendedKey = allMatches.schema.find("base_ClassificationExtendedness_value").key
+
+    def goodFilter(cat, goodSnr=3):
+        if len(cat) < nMatchesRequired:
+            return False
+        for flagKey in flagKeys:
+            if cat.get(flagKey).any():
+                return False
+        if not np.isfinite(cat.get(psfMagKey)).all():
+            return False
+        psfSnr = np.median(cat.get(psfSnrKey))
+        # Note that this also implicitly checks for psfSnr being non-nan.
+        return psfSnr >= goodSnr
+
+    goodMatches = allMatches.where(goodFilter)
+
+    # Filter further to a limited range in S/N and extendedness
+    # to select bright stars.
+    safeMaxExtended = 1.0
+
+    def safeFilter(cat):
+        psfSnr = np.median(cat.get(psfSnrKey))
+        extended = np.max(cat.get(extendedKey))
+        return psfSnr >= safeSnr and extended < safeMaxExtended
+
+    safeMatches = goodMatches.where(safeFilter)
+
+    # Pass field=psfMagKey so np.mean just gets that as its input.
+    # The position RMS of all groups is computed at once from their
+    # coordinates.
+    setStarStatistics(blob,
+                      snr=goodMatches.aggregate(np.median, field=psfSnrKey),
+                      mag=goodMatches.aggregate(np.mean, field=psfMagKey),
+                      magrms=goodMatches.aggregate(np.std, field=psfMagKey),
+                      magerr=goodMatches.aggregate(np.median, field=psfMagErrKey),
+                      dist=groupedPositionRmsFromCat(goodMatches))
+
+    # These attributes are not serialized
+    blob.goodMatches = goodMatches
+    blob.safeMatches = safeMatches
+
+
+def setStarStatistics(blob, snr, mag, magrms, magerr, dist):
+    """Store the per-star summary statistics of the good matches as Datums.
+
+    Parameters
+    ----------
+    blob : `lsst.verify.Blob`
+        ``MatchedMultiVisitDataset`` with a ``filterName`` Datum.
+    snr, mag, magrms, magerr, dist : `numpy.ndarray`
+        Median PSF SNR, mean PSF magnitude, RMS of PSF magnitudes,
+        median PSF magnitude uncertainty (mag) and RMS of sky coordinates
+        (milliarcsec) of each star.
+    """
+    filter_name = blob['filterName']
+    blob['snr'] = Datum(quantity=snr * u.Unit(''),
+                        label='SNR({band})'.format(band=filter_name),
+                        description='Median signal-to-noise ratio of PSF magnitudes over '
+                                    'multiple visits')
+    blob['mag'] = Datum(quantity=mag * u.mag,
+                        label='{band}'.format(band=filter_name),
+                        description='Mean PSF magnitudes of stars over multiple visits')
+    blob['magrms'] = Datum(quantity=magrms * u.mag,
+                           label='RMS({band})'.format(band=filter_name),
+                           description='RMS of PSF magnitudes over multiple visits')
+    blob['magerr'] = Datum(quantity=magerr * u.mag,
+                           label='sigma({band})'.format(band=filter_name),
+                           description='Median 1-sigma uncertainty of PSF magnitudes over '
+                                       'multiple visits')
+    blob['dist'] = Datum(quantity=dist * u.milliarcsecond,
+                         label='d',
+                         description='RMS of sky coordinates of stars over multiple visits')
+
+
+def compactStarStatistics(blob):
+    """Store the per-star summary statistics of a Blob in single precision.
+
+    Parameters
+    ----------
+    blob : `lsst.verify.Blob`
+        ``MatchedMultiVisitDataset`` with the Datums of `setStarStatistics`.
+    """
+    setStarStatistics(blob, **{name: blob[name].quantity.value.astype(np.float32)
+                               for name in starStatisticNames})
+
+
+def build_matched_dataset_from_arrays(matchedArrays, filterName, safeSnr=50.,
+                                      useJointCal=False, compact=False):
+    """Construct a matched dataset Blob from `MatchedArrays` without afw.
+
+    Parameters
+    ----------
+    matchedArrays : `MatchedArrays`
+        Matched detections of all stars.
+    filterName : `str`
+        Name of filter used for all observations.
+    safeSnr : `float`, optional
+        Minimum median SNR for a match to be considered "safe".
+    useJointCal : `bool`, optional
+        Whether the detections were calibrated with jointcal/meas_mosaic.
+        Only recorded in the Blob.
+    compact : `bool`, optional
+        Keep magnitudes, SNR, ellipticities and the per-star statistics in
+        single precision, see `MatchedArrays.compact`.
+
+    Returns
+    -------
+    blob : `lsst.verify.Blob`
+        A ``MatchedMultiVisitDataset`` with the same datums and attributes as
+        from `lsst.validate.drp.matchreduce.build_matched_dataset`, except
+        that ``goodMatches`` and ``safeMatches`` are `MatchedArrays` and
+        ``magKey`` is the column name ``'base_PsfFlux_mag'``.
+    """
+    blob = Blob('MatchedMultiVisitDataset')
+    blob['filterName'] = Datum(quantity=filterName, description='Filter name')
+    blob['useJointCal'] = Datum(quantity=useJointCal,
+                                description='Whether jointcal/meas_mosaic calibrations were used')
+    if compact:
+        matchedArrays = matchedArrays.compact()
+    blob._matchedCatalog = matchedArrays
+    blob.magKey = matchedArrays.schema.find("base_PsfFlux_mag").key
+    reduceStars(blob, matchedArrays, safeSnr)
+    if compact:
+        compactStarStatistics(blob)
+    return blob
@@ -3,9 +3,10 @@ from __future__ import division, print_function, absolute_import
 import os
 
 from lsst.pipe.base import CmdLineTask, ArgumentParser, TaskRunner
-from lsst.pex.config import Config, Field
+from lsst.pex.config import Config, Field, ChoiceField
 from lsst.meas.base.forcedPhotCcd import PerTractCcdDataIdContainer
 from .validate import runOneFilter, plot_metrics
+from .matchreduce import findOptionConflict
 
 __all__ = ["MatchedVisitMetricsRunner", "MatchedVisitMetricsConfig", "MatchedVisitMetricsTask"]
 
@@ -29,6 +30,7 @@ class MatchedVisitMetricsRunner(TaskRunner):
                  filterName,
                  parsedCmd.output,
                  id_list_dict[filterName],
+                 parsedCmd.resume,
                  ) for filterName in sorted(id_list_dict.keys())]
 
     def __call__(self, args):
@@ -69,6 +71,11 @@ class MatchedVisitMetricsConfig(Config):
         dtype=bool, default=True,
         doc="Whether to write plot outputs."
     )
+    maxScatterPoints = Field(
+        dtype=int, default=None, optional=True,
+        doc="Maximum number of stars drawn as points in the error model plots before "
+            "switching to density rendering (default: plot.maxScatterPoints)."
+    )
     matchRadius = Field(
         dtype=float, default=1.0,
         doc="Match radius (arcseconds)."
@@ -85,6 +92,95 @@ class MatchedVisitMetricsConfig(Config):
         dtype=bool, default=False,
         doc="More verbose output during validate calculations."
     )
+    traceMemory = Field(
+        dtype=bool, default=False,
+        doc="Record Python memory allocations of each stage with tracemalloc (slower)."
+    )
+    incremental = Field(
+        dtype=bool, default=False,
+        doc="Persist the matches next to the output and only match new data IDs on later runs."
+    )
+    streaming = Field(
+        dtype=bool, default=False,
+        doc="Keep only per-star statistics; bounds memory use but skips all metrics except "
+            "the error models."
+    )
+    tileSize = Field(
+        dtype=float, default=None, optional=True,
+        doc="If set, match sources in independent sky tiles of about this size (degrees)."
+    )
+    nProcesses = Field(
+        dtype=int, default=1,
+        doc="Number of sky tiles matched in parallel when tileSize is set."
+    )
+    prefilter = Field(
+        dtype=bool, default=False,
+        doc="Drop flagged and non-finite sources before matching; metrics are unchanged."
+    )
+    dense = Field(
+        dtype=bool, default=False,
+        doc="Compute AMx and PA1 from object-by-visit arrays of the safe matches; repeat detections "
+            "in one visit and stars with fewer than two distinct visits are left out, so the metrics "
+            "can differ from the default."
+    )
+    compact = Field(
+        dtype=bool, default=False,
+        doc="Store magnitudes, SNR and ellipticities of matched sources in single precision."
+    )
+    readOrder = ChoiceField(
+        dtype=str, default='given',
+        allowed={'given': "Read and match data IDs in the order given",
+                 'visit': "Group data IDs by visit for file system locality"},
+        doc="Order in which data IDs are read and matched."
+    )
+    seedVisit = Field(
+        dtype=str, default=None, optional=True,
+        doc="Visit to match first: a visit number, 'deepest' or 'bestSeeing'."
+    )
+    prefetch = Field(
+        dtype=int, default=0,
+        doc="Number of catalogs loaded ahead of the matching in a background thread (0: none)."
+    )
+    checkpoint = Field(
+        dtype=bool, default=False,
+        doc="Save the calibrated catalog of each data ID as it is loaded, so that the run "
+            "can be continued with --resume."
+    )
+    cacheDir = Field(
+        dtype=str, default=None, optional=True,
+        doc="Directory in which to keep matched datasets, so that the metrics of a repeated "
+            "run are computed without matching again."
+    )
+    resultStore = Field(
+        dtype=str, default=None, optional=True,
+        doc="SQLite file in which to record the measurements for trending."
+    )
+    maxMemory = Field(
+        dtype=float, default=None, optional=True,
+        doc="Memory budget (MB); large arrays are spilled to memory-mapped files beyond it."
+    )
+    exportMatches = ChoiceField(
+        dtype=str, default=None, optional=True,
+        allowed={'npy': "Memory-mappable .npy column files",
+                 'arrow': "The .npy files and an Arrow IPC file"},
+        doc="Write the matched dataset to <outputPrefix>_<filter>_matches for external analysis."
+    )
+    profile = Field(
+        dtype=bool, default=False,
+        doc="Profile each stage with cProfile and write the profiles and hot functions "
+            "to <outputPrefix>_<filter>_profile."
+    )
+
+    def validate(self):
+        Config.validate(self)
+        conflict = findOptionConflict([('streaming', self.streaming),
+                                       ('tileSize', self.tileSize is not None),
+                                       ('prefilter', self.prefilter),
+                                       ('incremental', self.incremental)],
+                                      [('compact', self.compact), ('dense', self.dense),
+                                       ('cacheDir', self.cacheDir is not None)])
+        if conflict is not None:
+            raise ValueError(conflict)
 
 
 class MatchedVisitMetricsTask(CmdLineTask):
@@ -112,7 +208,7 @@ class MatchedVisitMetricsTask(CmdLineTask):
     ConfigClass = MatchedVisitMetricsConfig
     RunnerClass = MatchedVisitMetricsRunner
 
-    def run(self, butler, filterName, output, dataIds):
+    def run(self, butler, filterName, output, dataIds, resume=False):
         """
         Compute cross-visit metrics for one filter.
 
@@ -122,6 +218,7 @@ class MatchedVisitMetricsTask(CmdLineTask):
         filterName  The filter name to be processed.
         output      The output repository to save files to.
         dataIds     The butler dataIds to process.
+        resume      Continue from the checkpoint of an interrupted run.
         """
         output_prefix = os.path.join(output, "%s_%s"%(self.config.outputPrefix, filterName))
         # Metrics are no longer passed. The argument will go away with DM-14274
@@ -133,17 +230,45 @@ class MatchedVisitMetricsTask(CmdLineTask):
                            useJointCal=self.config.useJointCal,
                            skipTEx=self.config.skipTEx,
                            verbose=self.config.verbose,
+                           traceMemory=self.config.traceMemory,
+                           incremental=self.config.incremental,
+                           streaming=self.config.streaming,
+                           tileSize=self.config.tileSize,
+                           nProcesses=self.config.nProcesses,
+                           prefilter=self.config.prefilter,
+                           dense=self.config.dense,
+                           compact=self.config.compact,
+                           checkpoint=self.config.checkpoint,
+                           resume=resume,
+                           readOrder=self.config.readOrder,
+                           seedVisit=self._seedVisit(),
+                           prefetch=self.config.prefetch,
+                           cacheDir=self.config.cacheDir,
+                           resultStore=self.config.resultStore,
+                           maxMemory=self.config.maxMemory,
+                           exportMatches=self.config.exportMatches,
+                           profile=self.config.profile,
                            metrics_package=self.config.metricsRepository,
                            instrument=self.config.instrumentName,
                            dataset_repo_url=self.config.datasetName)
         if self.config.makePlots:
-            plot_metrics(job, filterName, outputPrefix=output_prefix)
+            plot_metrics(job, filterName, outputPrefix=output_prefix,
+                         maxScatterPoints=self.config.maxScatterPoints)
+
+    def _seedVisit(self):
+        seedVisit = self.config.seedVisit
+        if seedVisit is None or seedVisit in ('deepest', 'bestSeeing'):
+            return seedVisit
+        return int(seedVisit)
 
     @classmethod
     def _makeArgumentParser(cls):
         parser = ArgumentParser(name=cls._DefaultName)
         parser.add_id_argument("--id", "wcs", help="data ID, with raw CCD keys + tract",
                                ContainerClass=PerTractCcdDataIdContainer)
+        parser.add_argument("--resume", default=False, action="store_true",
+                            help="Continue an interrupted run from its checkpoint, "
+                                 "loading only the data IDs it had not reached.")
         return parser
 
     def _getConfigName(self):
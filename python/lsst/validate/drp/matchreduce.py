@@ -23,26 +23,35 @@ for measurement classes, plotting functions, and JSON persistence.
 
 from __future__ import print_function, absolute_import
 
+import os
+import shutil
+import tempfile
+
 import numpy as np
-import astropy.units as u
-import sqlite3
-from sqlalchemy.exc import OperationalError
 
 import lsst.afw.geom as afwGeom
 import lsst.afw.image.utils as afwImageUtils
 import lsst.afw.image as afwImage
 import lsst.daf.persistence as dafPersist
-from lsst.afw.table import (SourceCatalog, SchemaMapper, Field,
+from lsst.afw.table import (SourceCatalog, SourceTable, SchemaMapper, Field,
                             MultiMatch, SimpleRecord, GroupView,
                             SOURCE_IO_NO_FOOTPRINTS)
 from lsst.afw.fits import FitsError
 from lsst.verify import Blob, Datum
 
-from .util import (getCcdKeyName, raftSensorToInt, positionRmsFromCat,
-                   ellipticity_from_cat)
+from .util import getCcdKeyName, raftSensorToInt, ellipticity_from_cat
+from .instrumentation import StageTimer
+from .matcharrays import (MatchedArrays, reduceStars, matchedColumnNames, findPoisonSources,
+                          compactColumns, compactColumnNames, compactStarStatistics)
+from .incremental import MatchState, ObjectMatcher
+from .streaming import StreamingStarStatistics
+from .sharding import TiledCatalogs
+from .densematches import DenseMatches
+from .prefetch import Prefetcher
+from .cache import repositoryName
 
 
-__all__ = ['build_matched_dataset']
+__all__ = ['build_matched_dataset', 'findOptionConflict']
 
 
 def build_matched_dataset(repo, dataIds, matchRadius=None, safeSnr=50.,
@@ -69,6 +78,102 @@ def build_matched_dataset(repo, dataIds, matchRadius=None, safeSnr=50.,
     skipTEx : bool, optional
         Skip TEx calculations (useful for older catalogs that don't have
         PsfShape measurements).
+    timer : `lsst.validate.drp.instrumentation.StageTimer`, optional
+        Records time and memory spent in butler I/O, calibration, matching
+        and reduction.
+    matchState : `str`, optional
+        Directory in which to persist the matches and per-object statistics,
+        see `lsst.validate.drp.incremental.MatchState`.  If it exists, only
+        the data IDs that are not yet in it are loaded and matched against
+        the stored objects, and only the statistics of the objects they
+        touch are recomputed.  ``goodMatches`` and ``safeMatches`` are then
+        `lsst.validate.drp.matcharrays.MatchedArrays`, and ``_catalog`` is
+        not available.
+    streaming : `bool`, optional
+        Accumulate the per-star statistics as each catalog is matched and
+        then discard its sources, see
+        `lsst.validate.drp.streaming.StreamingStarStatistics`.  Memory use
+        then scales with the number of stars rather than of detections, but
+        ``goodMatches``, ``safeMatches`` and ``_catalog`` are `None`, so only
+        the error models can be computed from the returned Blob.  Sources
+        are matched with `lsst.validate.drp.incremental.ObjectMatcher`
+        instead of ``MultiMatch``, so a source within the match radius of
+        two objects counts towards both.
+    tileSize : `float`, optional
+        If set, match the sources in sky tiles of about this size (degrees)
+        independently, see `lsst.validate.drp.sharding.shardedMatch`.  The
+        sources are written to temporary files by tile as they are loaded,
+        so only one catalog or tile is held in memory besides the matches.
+        ``goodMatches`` and ``safeMatches`` are then
+        `lsst.validate.drp.matcharrays.MatchedArrays`, and ``_catalog`` is
+        not available.
+    nProcesses : `int`, optional
+        Number of tiles matched in parallel when ``tileSize`` is set.
+    prefilter : `bool`, optional
+        Drop sources that would make their group fail the good-match
+        selection (pixel flags, non-finite magnitude or SNR) when they are
+        loaded.  Their positions are still matched, and every object they
+        match is marked as poisoned and removed before the reduction, so
+        only the memory of their columns is saved.  Sources are matched
+        with `lsst.validate.drp.incremental.ObjectMatcher`, whose objects
+        are those of ``MultiMatch`` unless a source is within the match
+        radius of two objects; ``goodMatches``, ``safeMatches`` and the
+        statistics are then unchanged.  They are
+        `lsst.validate.drp.matcharrays.MatchedArrays` and ``_catalog`` is
+        not available.
+    dense : `bool`, optional
+        Also arrange the safe matches as object-by-visit arrays,
+        ``denseSafeMatches``, which AMx and PA1 then use.  Only the first
+        detection of an object in each visit is kept, so repeat detections
+        in one visit (e.g. on overlapping CCDs) and stars left with fewer
+        than two distinct visits do not enter AMx and PA1, which can then
+        differ from the results without ``dense``.
+    compact : `bool`, optional
+        Keep magnitudes, SNR, ellipticities and the per-star statistics in
+        single precision (coordinates stay in double precision), see
+        `lsst.validate.drp.matcharrays.compactColumns`.  This saves about a
+        third of the memory of the matched columns.  With the default
+        matching, each catalog is also cut down to these columns before
+        ``MultiMatch`` copies it, instead of keeping every ``src`` field
+        until the matches are converted.  The matched catalogs are then
+        `lsst.validate.drp.matcharrays.MatchedArrays` and ``_catalog`` is
+        not available.
+    checkpoint : `lsst.validate.drp.checkpoint.CatalogCheckpoint`, optional
+        Record the calibrated catalog of each data ID as soon as it is
+        loaded, and reuse those of an interrupted earlier run.
+    prefetch : `int`, optional
+        Load up to this many catalogs ahead of the matching in a background
+        thread, see `lsst.validate.drp.prefetch.Prefetcher`.  0 (default)
+        loads them in turn.
+    cache : `lsst.validate.drp.cache.MatchedDatasetCache`, optional
+        Read the dataset from this cache if it was built before with the
+        same repository, data IDs in the same order, ``matchRadius``,
+        ``safeSnr``, ``useJointCal``, ``compact``, ``skipTEx`` and
+        matching method (``tileSize``, ``prefilter`` or ``matchState``);
+        otherwise build it and add it to the cache.  A cached dataset's matches are
+        `lsst.validate.drp.matcharrays.MatchedArrays` and ``_catalog`` is
+        not available.  Cannot be used with ``streaming``.
+    memoryBudget : `lsst.validate.drp.memory.MemoryBudget`, optional
+        Drop the ``keepCatalog`` catalog if the budget is exceeded while
+        loading, convert the matches to
+        `lsst.validate.drp.matcharrays.MatchedArrays` if it is exceeded
+        after matching, writing the columns that do not fit to
+        memory-mapped files, and spill the largest columns of the matches
+        until it is met.  The sharded matching spills its tiles to the
+        ``spillDir`` of the budget.  The budget is also kept as
+        ``memoryBudget`` for the PA1 arrays.
+    keepCatalog : `bool`, optional
+        Also keep all calibrated sources in one catalog, ``_catalog``.  No
+        metric uses it, and it doubles the memory of the sources, so by
+        default it is not built and ``_catalog`` is `None`.  Only
+        available with the default matching (not with ``compact``).
+
+    Raises
+    ------
+    ValueError
+        If more than one of ``streaming``, ``tileSize``, ``prefilter`` and
+        ``matchState`` is set, or ``compact``, ``dense`` or ``cache`` with
+        ``streaming``; see `findOptionConflict`.
 
     Attributes of returned Blob
     ----------
@@ -110,12 +215,61 @@ def build_matched_dataset(repo, dataIds, matchRadius=None, safeSnr=50.,
         catalog tables.
 
         *Not serialized.*
+    denseSafeMatches
+        ``safeMatches`` as a `lsst.validate.drp.densematches.DenseMatches`
+        if ``dense`` is set, otherwise `None`.
+
+        *Not serialized.*
+    """
+
+
+def findOptionConflict(matchingModes, unusedWhenStreaming=()):
+    """Describe a conflict between the matching options of a run.
+
+    Parameters
+    ----------
+    matchingModes : `list` of (`str`, `bool`)
+        Name of the option of each matching mode, streaming first, with
+        whether it is set.  Each one selects a different way of loading and
+        matching, so at most one may be set.
+    unusedWhenStreaming : `list` of (`str`, `bool`), optional
+        Names of options that act on the matched sources, which streaming
+        does not keep, with whether they are set.
+
+    Returns
+    -------
+    message : `str` or `None`
+        Why the options cannot be used together, or `None` if they can.
     """
+    modes = [name for name, isSet in matchingModes if isSet]
+    if len(modes) > 1:
+        return "%s cannot be combined" % " and ".join(modes)
+    if matchingModes and matchingModes[0][1]:
+        for name, isSet in unusedWhenStreaming:
+            if isSet:
+                return "%s has no effect with %s" % (name, matchingModes[0][0])
+    return None
 
 
 def build_matched_dataset(repo, dataIds, matchRadius=None, safeSnr=50.,
-             useJointCal=False, skipTEx=False):
+             useJointCal=False, skipTEx=False, timer=None, matchState=None,
+             streaming=False, tileSize=None, nProcesses=1, prefilter=False,
+             dense=False, compact=False, checkpoint=None, prefetch=0, cache=None,
+             memoryBudget=None, keepCatalog=False):
+    conflict = findOptionConflict([('streaming', streaming),
+                                   ('tileSize', tileSize is not None),
+                                   ('prefilter', prefilter),
+                                   ('matchState', matchState is not None)],
+                                  [('compact', compact), ('dense', dense),
+                                   ('cache', cache is not None)])
+    if conflict is not None:
+        raise ValueError(conflict)
+
     blob = Blob('MatchedMultiVisitDataset')
+    blob.memoryBudget = memoryBudget
+
+    if timer is None:
+        timer = StageTimer()
 
     if not matchRadius:
         matchRadius = afwGeom.Angle(1, afwGeom.arcseconds)
@@ -128,20 +282,135 @@ def build_matched_dataset(repo, dataIds, matchRadius=None, safeSnr=50.,
     blob['useJointCal'] = Datum(quantity=useJointCal,
                                 description='Whether jointcal/meas_mosaic calibrations were used')
 
+    cacheKey = None
+    if cache is not None and not streaming:
+        repoName = repositoryName(repo)
+        if repoName is None:
+            print("Cannot identify the repository of the Butler; not caching the matches.")
+        else:
+            cacheKey = cache.key(repoName, dataIds, matchRadius.asArcseconds(), safeSnr,
+                                 useJointCal, compact=compact,
+                                 matching=_matchingMethod(tileSize, prefilter, matchState),
+                                 skipTEx=skipTEx)
+    cached = cacheKey is not None and cache.has(cacheKey)
+
+    if cached:
+        with timer.stage('butler'):
+            cache.load(cacheKey, blob)
+    elif streaming:
+        statistics = _loadAndReduceStreaming(repo, dataIds, matchRadius,
+                                             useJointCal=useJointCal, skipTEx=skipTEx,
+                                             timer=timer, checkpoint=checkpoint,
+                                             prefetch=prefetch)
+        with timer.stage('reduceStars'):
+            statistics.reduce(blob, safeSnr)
+        blob._catalog = None
+        blob._matchedCatalog = None
+        blob.goodMatches = None
+        blob.safeMatches = None
+        blob.magKey = 'base_PsfFlux_mag'
+    elif tileSize is not None:
+        blob._catalog = None
+        blob._matchedCatalog = _loadAndMatchSharded(repo, dataIds, matchRadius, tileSize,
+                                                    nProcesses=nProcesses,
+                                                    useJointCal=useJointCal, skipTEx=skipTEx,
+                                                    timer=timer, compact=compact,
+                                                    checkpoint=checkpoint, prefetch=prefetch,
+                                                    spillDir=(memoryBudget.spillDir
+                                                              if memoryBudget is not None
+                                                              else None))
+        blob.magKey = blob._matchedCatalog.schema.find("base_PsfFlux_mag").key
+        with timer.stage('reduceStars'):
+            reduceStars(blob, blob._matchedCatalog, safeSnr)
+    elif prefilter:
+        blob._catalog = None
+        blob._matchedCatalog = _loadAndMatchPrefiltered(repo, dataIds, matchRadius,
+                                                        useJointCal=useJointCal,
+                                                        skipTEx=skipTEx, timer=timer,
+                                                        compact=compact, checkpoint=checkpoint,
+                                                        prefetch=prefetch)
+        blob.magKey = blob._matchedCatalog.schema.find("base_PsfFlux_mag").key
+        with timer.stage('reduceStars'):
+            reduceStars(blob, blob._matchedCatalog, safeSnr)
+    elif matchState is not None:
+        state = _loadAndMatchIncrementally(repo, dataIds, matchRadius, matchState,
+                                           useJointCal=useJointCal, skipTEx=skipTEx,
+                                           timer=timer, compact=compact, checkpoint=checkpoint,
+                                           prefetch=prefetch)
+        blob._catalog = None
+        with timer.stage('reduceStars'):
+            state.reduce(blob, safeSnr)
+        blob._matchedCatalog = state.matchedArrays()
+        blob.magKey = blob._matchedCatalog.schema.find("base_PsfFlux_mag").key
+    else:
+        # Match catalogs across visits
+        blob._catalog, blob._matchedCatalog = \
+            _loadAndMatchCatalogs(repo, dataIds, matchRadius,
+                                  useJointCal=useJointCal, skipTEx=False,
+                                  timer=timer, checkpoint=checkpoint,
+                                  prefetch=prefetch, keepCatalog=keepCatalog and not compact,
+                                  compact=compact, memoryBudget=memoryBudget)
+        if compact or (memoryBudget is not None and memoryBudget.exceeded()):
+            blob._catalog = None
+            if memoryBudget is not None:
+                # Columns that would exceed the budget are written to disk
+                # as they are copied, rather than after a second copy of
+                # the matches was made in memory.
+                memoryBudget.release()
+                blob._matchedCatalog = MatchedArrays.fromGroupView(blob._matchedCatalog,
+                                                                   empty=memoryBudget.empty)
+                memoryBudget.release()
+            else:
+                blob._matchedCatalog = MatchedArrays.fromGroupView(blob._matchedCatalog)
+
+        blob.magKey = blob._matchedCatalog.schema.find("base_PsfFlux_mag").key
+        # Reduce catalogs into summary statistics.
+        # These are the serialiable attributes of this class.
+        with timer.stage('reduceStars'):
+            reduceStars(blob, blob._matchedCatalog, safeSnr)
 
-    # Match catalogs across visits
-    blob._catalog, blob._matchedCatalog = \
-        _loadAndMatchCatalogs(repo, dataIds, matchRadius,
-                                   useJointCal=useJointCal, skipTEx=False)
+    if compact and not cached:
+        compactStarStatistics(blob)
+    if memoryBudget is not None:
+        for matches in (blob._matchedCatalog, blob.goodMatches, blob.safeMatches):
+            if isinstance(matches, MatchedArrays):
+                memoryBudget.spillColumns(matches.columns)
+    if cacheKey is not None and not cached:
+        cache.save(cacheKey, blob)
 
-    blob.magKey = blob._matchedCatalog.schema.find("base_PsfFlux_mag").key
-    # Reduce catalogs into summary statistics.
-    # These are the serialiable attributes of this class.
-    _reduceStars(blob, blob._matchedCatalog, safeSnr)
+    blob.denseSafeMatches = None
+    if dense and blob.safeMatches is not None:
+        with timer.stage('dense'):
+            blob.denseSafeMatches = DenseMatches.fromMatches(blob.safeMatches)
     return blob
 
+
+def _matchingMethod(tileSize, prefilter, matchState):
+    """Describe how `build_matched_dataset` matches the catalogs.
+
+    Parameters
+    ----------
+    tileSize, prefilter, matchState
+        Arguments of `build_matched_dataset`.
+
+    Returns
+    -------
+    method : `dict`
+        JSON-serializable description, with the options of the method that
+        change the matches.
+    """
+    if tileSize is not None:
+        return {'method': 'sharded', 'tileSize': float(tileSize)}
+    if prefilter:
+        return {'method': 'prefiltered'}
+    if matchState is not None:
+        return {'method': 'incremental', 'matchState': os.path.abspath(matchState)}
+    return {'method': 'multiMatch'}
+
+
 def _loadAndMatchCatalogs(repo, dataIds, matchRadius,
-                          useJointCal=False, skipTEx=False):
+                          useJointCal=False, skipTEx=False, timer=None, checkpoint=None,
+                          prefetch=0, keepCatalog=False, compact=False, memoryBudget=None):
     """Load data from specific visit. Match with reference.
 
     Parameters
@@ -154,20 +423,423 @@ def _loadAndMatchCatalogs(repo, dataIds, matchRadius,
         calibration.
     matchRadius :  afwGeom.Angle(), optional
         Radius for matching. Default is 1 arcsecond.
+    timer : `lsst.validate.drp.instrumentation.StageTimer`, optional
+        Records the ``butler``, ``calibrate`` and ``match`` stages.
+    checkpoint : `lsst.validate.drp.checkpoint.CatalogCheckpoint`, optional
+        Reuse and record the calibrated catalogs of each data ID.
+    prefetch : `int`, optional
+        Number of catalogs to load ahead in a background thread, see
+        `_loadCalibratedCatalogs`.
+    keepCatalog : `bool`, optional
+        Also return all of the sources in one catalog.
+    compact : `bool`, optional
+        Match only the columns of
+        `lsst.validate.drp.matcharrays.matchedColumnNames`, with those of
+        ``compactColumnNames`` in single precision.
+    memoryBudget : `lsst.validate.drp.memory.MemoryBudget`, optional
+        Stop keeping all of the sources as soon as this budget is exceeded
+        while loading.
 
     Returns
     -------
-    catalog_list : afw.table.SourceCatalog
-        List of all of the catalogs
+    catalog_list : afw.table.SourceCatalog or `None`
+        All of the sources if ``keepCatalog`` is set and they fit in
+        ``memoryBudget``, otherwise `None`.
     matched_catalog : afw.table.GroupView
         An object of matched catalog.
     """
     # Following
     # https://github.com/lsst/afw/blob/tickets/DM-3896/examples/repeatability.ipynb
+    if timer is None:
+        timer = StageTimer()
+
+    butler, ccdKeyName, mapper, newSchema = _setUpLoading(repo, dataIds, timer)
+    matchSchema = newSchema
+    if compact:
+        compactMapper = _makeCompactMapper(newSchema)
+        matchSchema = compactMapper.getOutputSchema()
+
+    # Create an object that matches multiple catalogs with same schema
+    mmatch = MultiMatch(matchSchema,
+                        dataIdFormat={'visit': np.int32, ccdKeyName: np.int32},
+                        radius=matchRadius,
+                        RecordClass=SimpleRecord)
+
+    # create the new extented source catalog, if requested; MultiMatch
+    # keeps its own copy of every source.
+    srcVis = SourceCatalog(newSchema) if keepCatalog else None
+
+    for vId, tmpCat in _loadCalibratedCatalogs(butler, dataIds, ccdKeyName, mapper, newSchema,
+                                               useJointCal=useJointCal, skipTEx=skipTEx,
+                                               timer=timer, checkpoint=checkpoint,
+                                               prefetch=prefetch):
+        if tmpCat is None:
+            continue
+
+        if srcVis is not None:
+            if memoryBudget is not None and memoryBudget.exceeded():
+                print("Memory budget exceeded after loading %d sources; "
+                      "not keeping the calibrated catalog." % len(srcVis))
+                srcVis = None
+                memoryBudget.release()
+            else:
+                with timer.stage('calibrate'):
+                    srcVis.extend(tmpCat, False)
+
+        with timer.stage('match'):
+            if compact:
+                tmpCat = _compactCatalog(tmpCat, compactMapper)
+            mmatch.add(catalog=tmpCat, dataId=vId)
+
+    with timer.stage('match'):
+        # Complete the match, returning a catalog that includes
+        # all matched sources with object IDs that can be used to group them.
+        matchCat = mmatch.finish()
+
+        # Create a mapping object that allows the matches to be manipulated
+        # as a mapping of object ID to catalog of sources.
+        allMatches = GroupView.build(matchCat)
+
+    return srcVis, allMatches
+
+
+def _makeCompactMapper(schema):
+    """Mapper from calibrated source catalogs to the matched columns, see
+    `_compactCatalog`."""
+    compactMapper = SchemaMapper(schema)
+    compactMapper.addMinimalSchema(SourceTable.makeMinimalSchema(), True)
+    minimalNames = compactMapper.getOutputSchema().getNames()
+    for name in matchedColumnNames:
+        if name in minimalNames or name not in schema.getNames():
+            continue
+        if name in compactColumnNames:
+            field = schema.find(name).field
+            compactMapper.addOutputField(Field['F'](name, field.getDoc()))
+        else:
+            compactMapper.addMapping(schema.find(name).key)
+    return compactMapper
+
+
+def _compactCatalog(catalog, compactMapper):
+    """Copy the matched columns of a catalog, in single precision where
+    `lsst.validate.drp.matcharrays.compactColumnNames` allows."""
+    compactCat = SourceCatalog(compactMapper.getOutputSchema())
+    compactCat.reserve(len(catalog))
+    compactCat.extend(catalog, mapper=compactMapper)
+    # Reserving makes the new catalog contiguous, so the single-precision
+    # columns can be assigned as arrays.
+    outputNames = compactMapper.getOutputSchema().getNames()
+    for name in compactColumnNames:
+        if name in outputNames:
+            compactCat[name][:] = catalog[name]
+    return compactCat
+
+
+def _loadAndMatchIncrementally(repo, dataIds, matchRadius, statePath,
+                               useJointCal=False, skipTEx=False, timer=None,
+                               compact=False, checkpoint=None, prefetch=0):
+    """Match only the data IDs that are not yet in a persisted match state.
+
+    Parameters
+    ----------
+    repo : string or Butler
+        A Butler or a repository URL that can be used to construct one
+    dataIds : list of dict
+        List of `butler` data IDs of Image catalogs to compare to
+        reference.
+    matchRadius :  afwGeom.Angle()
+        Radius for matching.
+    statePath : `str`
+        Directory with the `lsst.validate.drp.incremental.MatchState` of an
+        earlier run.  It is created if it does not exist, and updated with
+        the new data IDs.  A state that includes data IDs which are not in
+        ``dataIds`` is replaced.
+    timer : `lsst.validate.drp.instrumentation.StageTimer`, optional
+        Records the ``butler``, ``calibrate`` and ``match`` stages.
+    checkpoint : `lsst.validate.drp.checkpoint.CatalogCheckpoint`, optional
+        Reuse and record the calibrated catalogs of each data ID.
+    prefetch : `int`, optional
+        Number of catalogs to load ahead in a background thread, see
+        `_loadCalibratedCatalogs`.
+    compact : `bool`, optional
+        Store the new sources with `lsst.validate.drp.matcharrays.compactColumns`.
+
+    Returns
+    -------
+    state : `lsst.validate.drp.incremental.MatchState`
+        Matches of all data IDs that could be loaded, in this or earlier runs.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    state = MatchState.loadOrCreate(statePath, matchRadius.asRadians(),
+                                    useJointCal=useJointCal, dataIds=dataIds,
+                                    repoName=repositoryName(repo), skipTEx=skipTEx)
+    newDataIds = [vId for vId in dataIds if not state.hasDataId(vId)]
+    print("Matching %d new of %d data IDs" % (len(newDataIds), len(dataIds)))
+    if not newDataIds:
+        return state
+
+    # _setUpLoading adds keys such as raft_sensor_int to the data IDs it
+    # loads, so the state is keyed by copies of the requested data IDs
+    # that would otherwise no longer match them in the next run.
+    loadDataIds = [dict(vId) for vId in newDataIds]
+    butler, ccdKeyName, mapper, newSchema = _setUpLoading(repo, loadDataIds, timer)
+    columnNames = [name for name in matchedColumnNames if name not in ('object', 'visit')]
+
+    loaded = _loadCalibratedCatalogs(butler, loadDataIds, ccdKeyName, mapper, newSchema,
+                                     useJointCal=useJointCal, skipTEx=skipTEx,
+                                     timer=timer, checkpoint=checkpoint, prefetch=prefetch)
+    for dataId, (vId, tmpCat) in zip(newDataIds, loaded):
+        if tmpCat is None:
+            continue
+
+        with timer.stage('match'):
+            columns = {name: np.array(tmpCat[name]) for name in columnNames}
+            if compact:
+                columns = compactColumns(columns)
+            columns['visit'] = np.full(len(tmpCat), vId['visit'], dtype=np.int32)
+            columns[ccdKeyName] = np.full(len(tmpCat), vId[ccdKeyName], dtype=np.int32)
+            state.add(columns, dataId)
+
+    with timer.stage('match'):
+        state.save(statePath)
+
+    return state
+
+
+def _loadAndMatchPrefiltered(repo, dataIds, matchRadius,
+                             useJointCal=False, skipTEx=False, timer=None,
+                             compact=False, checkpoint=None, prefetch=0):
+    """Match catalogs, keeping only sources that can be in a good match.
+
+    Parameters
+    ----------
+    repo : string or Butler
+        A Butler or a repository URL that can be used to construct one
+    dataIds : list of dict
+        List of `butler` data IDs of Image catalogs to compare to
+        reference.
+    matchRadius :  afwGeom.Angle()
+        Radius for matching.
+    timer : `lsst.validate.drp.instrumentation.StageTimer`, optional
+        Records the ``butler``, ``calibrate`` and ``match`` stages.
+    checkpoint : `lsst.validate.drp.checkpoint.CatalogCheckpoint`, optional
+        Reuse and record the calibrated catalogs of each data ID.
+    prefetch : `int`, optional
+        Number of catalogs to load ahead in a background thread, see
+        `_loadCalibratedCatalogs`.
+    compact : `bool`, optional
+        Store the sources with `lsst.validate.drp.matcharrays.compactColumns`.
+
+    Returns
+    -------
+    matchedArrays : `lsst.validate.drp.matcharrays.MatchedArrays`
+        Matched sources of the objects that no poison source matched.
+
+    Notes
+    -----
+    Poison sources still take part in matching: one may be the first
+    detection of an object, and the objects it matches must be found to
+    drop their other sources.  They are not stored, but they are indexed by
+    the matcher like any other source.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    butler, ccdKeyName, mapper, newSchema = _setUpLoading(repo, dataIds, timer)
+    columnNames = [name for name in matchedColumnNames if name not in ('object', 'visit')]
+
+    matcher = ObjectMatcher(matchRadius.asRadians())
+    kept = []
+    poisonedIds = []
+    nSources = 0
+    nPoison = 0
+    for vId, tmpCat in _loadCalibratedCatalogs(butler, dataIds, ccdKeyName, mapper, newSchema,
+                                               useJointCal=useJointCal, skipTEx=skipTEx,
+                                               timer=timer, checkpoint=checkpoint,
+                                               prefetch=prefetch):
+        if tmpCat is None:
+            continue
+
+        with timer.stage('match'):
+            columns = {name: np.array(tmpCat[name]) for name in columnNames}
+            if compact:
+                columns = compactColumns(columns)
+            poison = findPoisonSources(columns)
+            nSources += len(poison)
+            nPoison += poison.sum()
+
+            rows, objectIds = matcher.match(columns['coord_ra'], columns['coord_dec'])
+            isPoison = poison[rows]
+            poisonedIds.append(objectIds[isPoison])
+            rows = rows[~isPoison]
+            matched = {name: values[rows] for name, values in columns.items()}
+            matched['visit'] = np.full(len(rows), vId['visit'], dtype=np.int32)
+            matched[ccdKeyName] = np.full(len(rows), vId[ccdKeyName], dtype=np.int32)
+            matched['object'] = objectIds[~isPoison]
+            kept.append(matched)
+
+    if not kept:
+        print("No sources were loaded from the %d data IDs" % len(dataIds))
+        return MatchedArrays({name: np.array([])
+                              for name in columnNames + ['object', 'visit', ccdKeyName]})
+
+    with timer.stage('match'):
+        columns = {name: np.concatenate([c[name] for c in kept]) for name in kept[0]}
+        poisoned = np.unique(np.concatenate(poisonedIds))
+        clean = ~np.in1d(columns['object'], poisoned)
+        print("Pre-filter dropped %d of %d sources, poisoning %d of %d objects" %
+              (nPoison, nSources, len(poisoned), matcher.nObjects))
+        return MatchedArrays({name: values[clean] for name, values in columns.items()})
+
+
+def _loadAndMatchSharded(repo, dataIds, matchRadius, tileSize, nProcesses=1,
+                         useJointCal=False, skipTEx=False, timer=None,
+                         compact=False, checkpoint=None, prefetch=0, spillDir=None):
+    """Write the catalogs to disk by sky tile, then match them tile by tile.
+
+    Parameters
+    ----------
+    repo : string or Butler
+        A Butler or a repository URL that can be used to construct one
+    dataIds : list of dict
+        List of `butler` data IDs of Image catalogs to compare to
+        reference.
+    matchRadius :  afwGeom.Angle()
+        Radius for matching.
+    tileSize : `float`
+        Approximate side of the tiles in degrees.
+    nProcesses : `int`, optional
+        Number of tiles matched in parallel.
+    timer : `lsst.validate.drp.instrumentation.StageTimer`, optional
+        Records the ``butler``, ``calibrate`` and ``match`` stages.
+    checkpoint : `lsst.validate.drp.checkpoint.CatalogCheckpoint`, optional
+        Reuse and record the calibrated catalogs of each data ID.
+    prefetch : `int`, optional
+        Number of catalogs to load ahead in a background thread, see
+        `_loadCalibratedCatalogs`.
+    compact : `bool`, optional
+        Store the sources with `lsst.validate.drp.matcharrays.compactColumns`.
+    spillDir : `str`, optional
+        Directory in which to create the temporary directory of the
+        sources, see `lsst.validate.drp.sharding.TiledCatalogs`.  Default:
+        the system temporary directory.
+
+    Returns
+    -------
+    matchedArrays : `lsst.validate.drp.matcharrays.MatchedArrays`
+        All matched sources.
+
+    Notes
+    -----
+    Only one catalog is held in memory while loading, and one tile and the
+    matches while matching.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    butler, ccdKeyName, mapper, newSchema = _setUpLoading(repo, dataIds, timer)
+    columnNames = [name for name in matchedColumnNames if name not in ('object', 'visit')]
+
+    tiled = TiledCatalogs(tempfile.mkdtemp(prefix='validate_drp_tiles_', dir=spillDir),
+                          matchRadius.asRadians(), np.deg2rad(tileSize))
+    try:
+        for vId, tmpCat in _loadCalibratedCatalogs(butler, dataIds, ccdKeyName, mapper, newSchema,
+                                                   useJointCal=useJointCal, skipTEx=skipTEx,
+                                                   timer=timer, checkpoint=checkpoint,
+                                                   prefetch=prefetch):
+            if tmpCat is None:
+                continue
+
+            with timer.stage('calibrate'):
+                columns = {name: np.array(tmpCat[name]) for name in columnNames}
+                if compact:
+                    columns = compactColumns(columns)
+                columns['visit'] = np.full(len(tmpCat), vId['visit'], dtype=np.int32)
+                columns[ccdKeyName] = np.full(len(tmpCat), vId[ccdKeyName], dtype=np.int32)
+                tiled.add(columns)
+
+        with timer.stage('match'):
+            matched = tiled.match(nProcesses=nProcesses)
+    finally:
+        shutil.rmtree(tiled.directory, ignore_errors=True)
+
+    if matched is None:
+        print("No sources were loaded from the %d data IDs" % len(dataIds))
+        matched = {name: np.array([]) for name in columnNames + ['object', 'visit', ccdKeyName]}
+    return MatchedArrays(matched)
+
+
+def _loadAndReduceStreaming(repo, dataIds, matchRadius,
+                            useJointCal=False, skipTEx=False, timer=None, checkpoint=None,
+                            prefetch=0):
+    """Match catalogs one at a time, keeping only per-star statistics.
+
+    Parameters
+    ----------
+    repo : string or Butler
+        A Butler or a repository URL that can be used to construct one
+    dataIds : list of dict
+        List of `butler` data IDs of Image catalogs to compare to
+        reference.
+    matchRadius :  afwGeom.Angle()
+        Radius for matching.
+    timer : `lsst.validate.drp.instrumentation.StageTimer`, optional
+        Records the ``butler``, ``calibrate`` and ``match`` stages.
+    checkpoint : `lsst.validate.drp.checkpoint.CatalogCheckpoint`, optional
+        Reuse and record the calibrated catalogs of each data ID.
+    prefetch : `int`, optional
+        Number of catalogs to load ahead in a background thread, see
+        `_loadCalibratedCatalogs`.
+
+    Returns
+    -------
+    statistics : `lsst.validate.drp.streaming.StreamingStarStatistics`
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    butler, ccdKeyName, mapper, newSchema = _setUpLoading(repo, dataIds, timer)
+    columnNames = [name for name in matchedColumnNames
+                   if name not in ('id', 'object', 'visit', 'e1', 'e2', 'psf_e1', 'psf_e2')]
+
+    matcher = ObjectMatcher(matchRadius.asRadians())
+    statistics = StreamingStarStatistics()
+    for vId, tmpCat in _loadCalibratedCatalogs(butler, dataIds, ccdKeyName, mapper, newSchema,
+                                               useJointCal=useJointCal, skipTEx=skipTEx,
+                                               timer=timer, checkpoint=checkpoint,
+                                               prefetch=prefetch):
+        if tmpCat is None:
+            continue
+
+        with timer.stage('match'):
+            columns = {name: np.array(tmpCat[name]) for name in columnNames}
+            rows, objectIds = matcher.match(columns['coord_ra'], columns['coord_dec'])
+            statistics.update(objectIds,
+                              {name: values[rows] for name, values in columns.items()})
+
+    return statistics
+
+
+def _setUpLoading(repo, dataIds, timer):
+    """Get the butler, CCD key and output schema for loading source catalogs.
+
+    Returns
+    -------
+    butler : `lsst.daf.persistence.Butler`
+    ccdKeyName : `str`
+        Data ID key of the CCD.
+    mapper : `lsst.afw.table.SchemaMapper`
+        Maps the ``src`` schema to ``newSchema``.
+    newSchema : `lsst.afw.table.Schema`
+        ``src`` schema with calibrated magnitudes and ellipticities.
+    """
     if isinstance(repo, dafPersist.Butler):
         butler = repo
     else:
-        butler = dafPersist.Butler(repo)
+        with timer.stage('butler'):
+            butler = dafPersist.Butler(repo)
     dataset = 'src'
 
     # 2016-02-08 MWV:
@@ -183,7 +855,8 @@ def _loadAndMatchCatalogs(repo, dataIds, matchRadius,
         for vId in dataIds:
             vId[ccdKeyName] = raftSensorToInt(vId)
 
-    schema = butler.get(dataset + "_schema").schema
+    with timer.stage('butler'):
+        schema = butler.get(dataset + "_schema").schema
     mapper = SchemaMapper(schema)
     mapper.addMinimalSchema(schema)
     mapper.addOutputField(Field[float]('base_PsfFlux_snr',
@@ -203,83 +876,178 @@ def _loadAndMatchCatalogs(repo, dataIds, matchRadius,
     newSchema = mapper.getOutputSchema()
     newSchema.setAliasMap(schema.getAliasMap())
 
-    # Create an object that matches multiple catalogs with same schema
-    mmatch = MultiMatch(newSchema,
-                        dataIdFormat={'visit': np.int32, ccdKeyName: np.int32},
-                        radius=matchRadius,
-                        RecordClass=SimpleRecord)
+    return butler, ccdKeyName, mapper, newSchema
 
-    # create the new extented source catalog
-    srcVis = SourceCatalog(newSchema)
 
-    for vId in dataIds:
+def _loadCalibratedCatalogs(butler, dataIds, ccdKeyName, mapper, newSchema,
+                            useJointCal=False, skipTEx=False, timer=None, checkpoint=None,
+                            prefetch=0):
+    """Load and calibrate the sources of several data IDs in turn.
 
-        if useJointCal:
-            try:
+    Parameters
+    ----------
+    prefetch : `int`, optional
+        If positive, load the catalogs in a background thread, at most this
+        many ahead of the caller, with a
+        `lsst.validate.drp.prefetch.Prefetcher`, so that reading and
+        matching overlap.  The time spent waiting for catalogs is recorded
+        in the ``prefetchWait`` stage of ``timer``.
+
+    Yields
+    ------
+    vId : `dict`
+        Data ID.
+    tmpCat : `lsst.afw.table.SourceCatalog` or `None`
+        Sources in ``newSchema``, or `None` if the data ID could not be
+        loaded; see `_loadCalibratedCatalog`.
+    """
+    def load(vId):
+        return _loadCalibratedCatalog(butler, vId, ccdKeyName, mapper, newSchema,
+                                      useJointCal=useJointCal, skipTEx=skipTEx,
+                                      timer=timer, checkpoint=checkpoint)
+
+    if prefetch <= 0:
+        for vId in dataIds:
+            yield vId, load(vId)
+        return
+
+    prefetcher = Prefetcher(load, dataIds, depth=prefetch, timer=timer)
+    for vId, tmpCat in prefetcher:
+        yield vId, tmpCat
+    prefetcher.report()
+
+
+def _loadCalibratedCatalog(butler, vId, ccdKeyName, mapper, newSchema,
+                           useJointCal=False, skipTEx=False, timer=None, checkpoint=None):
+    """Load the sources of one data ID and calibrate their magnitudes.
+
+    Returns
+    -------
+    tmpCat : `lsst.afw.table.SourceCatalog` or `None`
+        Sources in ``newSchema``, or `None` if the data ID could not be
+        loaded.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    if checkpoint is not None and checkpoint.hasDataId(vId):
+        with timer.stage('butler'):
+            return checkpoint.load(vId)
+
+    tmpCat = _calibrateCatalog(butler, vId, ccdKeyName, mapper, newSchema,
+                               useJointCal=useJointCal, skipTEx=skipTEx, timer=timer)
+    if checkpoint is not None:
+        with timer.stage('butler'):
+            checkpoint.save(vId, tmpCat)
+    return tmpCat
+
+
+def _updateCoordColumns(catalog, wcs):
+    """Recompute the sky coordinates of all sources from their centroids.
+
+    Equivalent to ``record.updateCoord(wcs)`` for every record, but the
+    centroids are transformed with a single call.
+
+    Parameters
+    ----------
+    catalog : `lsst.afw.table.SourceCatalog`
+        Contiguous catalog with a centroid slot.
+    wcs : `lsst.afw.geom.SkyWcs`
+        WCS to apply, e.g. from jointcal.
+    """
+    if not hasattr(wcs, 'pixelToSkyArray'):
+        # WCS classes without a batched transform.
+        for record in catalog:
+            record.updateCoord(wcs)
+        return
+    x = np.asarray(catalog.getX(), dtype=float)
+    y = np.asarray(catalog.getY(), dtype=float)
+    # Sources without a centroid get NaN coordinates, as from updateCoord.
+    finite = np.isfinite(x) & np.isfinite(y)
+    ra = np.full(len(x), np.nan)
+    dec = np.full(len(x), np.nan)
+    if finite.any():
+        ra[finite], dec[finite] = wcs.pixelToSkyArray(x[finite], y[finite], degrees=False)
+    catalog['coord_ra'][:] = ra
+    catalog['coord_dec'][:] = dec
+
+
+def _calibrateCatalog(butler, vId, ccdKeyName, mapper, newSchema,
+                      useJointCal=False, skipTEx=False, timer=None):
+    """Read and calibrate the sources of one data ID; see
+    `_loadCalibratedCatalog`."""
+
+    if useJointCal:
+        try:
+            with timer.stage('butler'):
                 photoCalib = butler.get("jointcal_photoCalib", vId)
-            except (FitsError, dafPersist.NoResults) as e:
-                print(e)
-                print("Could not open photometric calibration for ", vId)
-                print("Skipping this dataId.")
-                continue
-            try:
+        except (FitsError, dafPersist.NoResults) as e:
+            print(e)
+            print("Could not open photometric calibration for ", vId)
+            print("Skipping this dataId.")
+            return None
+        try:
+            with timer.stage('butler'):
                 wcs = butler.get("jointcal_wcs", vId)
-            except (FitsError, dafPersist.NoResults) as e:
-                print(e)
-                print("Could not open updated WCS for ", vId)
-                print("Skipping this dataId.")
-                continue
-        else:
-            try:
+        except (FitsError, dafPersist.NoResults) as e:
+            print(e)
+            print("Could not open updated WCS for ", vId)
+            print("Skipping this dataId.")
+            return None
+    else:
+        try:
+            with timer.stage('butler'):
                 calib = butler.get("calexp_calib", vId)
-            except (FitsError, dafPersist.NoResults) as e:
-                print(e)
-                print("Could not open calibrated image file for ", vId)
-                print("Skipping this dataId.")
-                continue
-            except TypeError as te:
-                # DECam images that haven't been properly reformatted
-                # can trigger a TypeError because of a residual FITS header
-                # LTV2 which is a float instead of the expected integer.
-                # This generates an error of the form:
-                #
-                # lsst::pex::exceptions::TypeError: 'LTV2 has mismatched type'
-                #
-                # See, e.g., DM-2957 for details.
-                print(te)
-                print("Calibration image header information malformed.")
-                print("Skipping this dataId.")
-                continue
-
-            # We don't want to put this above the first "if useJointCal block"
-            # because we need to use the first `butler.get` above to quickly
-            # catch data IDs with no usable outputs.
-            try:
-                calexpMetadata = butler.get("calexp_md", vId)
-            except (FitsError, dafPersist.NoResults) as e:
-                print(e)
-                print("Could not open calibrated image file for ", vId)
-                print("Skipping %s " % repr(vId))
-                continue
-            except TypeError as te:
-                # DECam images that haven't been properly reformatted
-                # can trigger a TypeError because of a residual FITS header
-                # LTV2 which is a float instead of the expected integer.
-                # This generates an error of the form:
-                #
-                # lsst::pex::exceptions::TypeError: 'LTV2 has mismatched type'
-                #
-                # See, e.g., DM-2957 for details.
-                print(te)
-                print("Calibration image header information malformed.")
-                print("Skipping %s " % repr(vId))
-                continue
-
-            calib = afwImage.Calib(calexpMetadata)
+        except (FitsError, dafPersist.NoResults) as e:
+            print(e)
+            print("Could not open calibrated image file for ", vId)
+            print("Skipping this dataId.")
+            return None
+        except TypeError as te:
+            # DECam images that haven't been properly reformatted
+            # can trigger a TypeError because of a residual FITS header
+            # LTV2 which is a float instead of the expected integer.
+            # This generates an error of the form:
+            #
+            # lsst::pex::exceptions::TypeError: 'LTV2 has mismatched type'
+            #
+            # See, e.g., DM-2957 for details.
+            print(te)
+            print("Calibration image header information malformed.")
+            print("Skipping this dataId.")
+            return None
 
         # We don't want to put this above the first "if useJointCal block"
         # because we need to use the first `butler.get` above to quickly
         # catch data IDs with no usable outputs.
+        try:
+            with timer.stage('butler'):
+                calexpMetadata = butler.get("calexp_md", vId)
+        except (FitsError, dafPersist.NoResults) as e:
+            print(e)
+            print("Could not open calibrated image file for ", vId)
+            print("Skipping %s " % repr(vId))
+            return None
+        except TypeError as te:
+            # DECam images that haven't been properly reformatted
+            # can trigger a TypeError because of a residual FITS header
+            # LTV2 which is a float instead of the expected integer.
+            # This generates an error of the form:
+            #
+            # lsst::pex::exceptions::TypeError: 'LTV2 has mismatched type'
+            #
+            # See, e.g., DM-2957 for details.
+            print(te)
+            print("Calibration image header information malformed.")
+            print("Skipping %s " % repr(vId))
+            return None
+
+        calib = afwImage.Calib(calexpMetadata)
+
+    # We don't want to put this above the first "if useJointCal block"
+    # because we need to use the first `butler.get` above to quickly
+    # catch data IDs with no usable outputs.
+    with timer.stage('butler'):
         try:
             # HSC supports these flags, which dramatically improve I/O
             # performance; support for other cameras is DM-6927.
@@ -289,11 +1057,12 @@ def _loadAndMatchCatalogs(repo, dataIds, matchRadius,
             oldSrc = butler.get('src', vId)
             calexp = butler.get("calexp", vId)
 
-        psf = calexp.getPsf()
+    psf = calexp.getPsf()
 
-        print(len(oldSrc), "sources in ccd %s  visit %s" %
-              (vId[ccdKeyName], vId["visit"]))
+    print(len(oldSrc), "sources in ccd %s  visit %s" %
+          (vId[ccdKeyName], vId["visit"]))
 
+    with timer.stage('calibrate'):
         # create temporary catalog
         tmpCat = SourceCatalog(SourceCatalog(newSchema).table)
         tmpCat.extend(oldSrc, mapper=mapper)
@@ -301,8 +1070,7 @@ def _loadAndMatchCatalogs(repo, dataIds, matchRadius,
             / tmpCat['base_PsfFlux_fluxSigma']
 
         if useJointCal:
-            for record in tmpCat:
-                record.updateCoord(wcs)
+            _updateCoordColumns(tmpCat, wcs)
             photoCalib.instFluxToMagnitude(tmpCat, "base_PsfFlux", "base_PsfFlux")
         else:
             with afwImageUtils.CalibNoThrow():
@@ -318,87 +1086,4 @@ def _loadAndMatchCatalogs(repo, dataIds, matchRadius,
             tmpCat['psf_e1'][:] = psf_e1
             tmpCat['psf_e2'][:] = psf_e2
 
-        srcVis.extend(tmpCat, False)
-        mmatch.add(catalog=tmpCat, dataId=vId)
-
-    # Complete the match, returning a catalog that includes
-    # all matched sources with object IDs that can be used to group them.
-    matchCat = mmatch.finish()
-
-    # Create a mapping object that allows the matches to be manipulated
-    # as a mapping of object ID to catalog of sources.
-    allMatches = GroupView.build(matchCat)
-
-    return srcVis, allMatches
-
-def _reduceStars(blob, allMatches, safeSnr=50.0):
-    """Calculate summary statistics for each star. These are persisted
-    as object attributes.
-
-    Parameters
-    ----------
-    allMatches : afw.table.GroupView
-        GroupView object with matches.
-    safeSnr : float, optional
-        Minimum median SNR for a match to be considered "safe".
-    """
-    # Filter down to matches with at least 2 sources and good flags
-    flagKeys = [allMatches.schema.find("base_PixelFlags_flag_%s" % flag).key
-                for flag in ("saturated", "cr", "bad", "edge")]
-    nMatchesRequired = 2
-
-    psfSnrKey = allMatches.schema.find("base_PsfFlux_snr").key
-    psfMagKey = allMatches.schema.find("base_PsfFlux_mag").key
-    psfMagErrKey = allMatches.schema.find("base_PsfFlux_magErr").key
-    extendedKey = allMatches.schema.find("base_ClassificationExtendedness_value").key
-
-    def goodFilter(cat, goodSnr=3):
-        if len(cat) < nMatchesRequired:
-            return False
-        for flagKey in flagKeys:
-            if cat.get(flagKey).any():
-                return False
-        if not np.isfinite(cat.get(psfMagKey)).all():
-            return False
-        psfSnr = np.median(cat.get(psfSnrKey))
-        # Note that this also implicitly checks for psfSnr being non-nan.
-        return psfSnr >= goodSnr
-
-    goodMatches = allMatches.where(goodFilter)
-
-    # Filter further to a limited range in S/N and extendedness
-    # to select bright stars.
-    safeMaxExtended = 1.0
-
-    def safeFilter(cat):
-        psfSnr = np.median(cat.get(psfSnrKey))
-        extended = np.max(cat.get(extendedKey))
-        return psfSnr >= safeSnr and extended < safeMaxExtended
-
-    safeMatches = goodMatches.where(safeFilter)
-
-    # Pass field=psfMagKey so np.mean just gets that as its input
-    filter_name = blob['filterName']
-    blob['snr'] = Datum(quantity=goodMatches.aggregate(np.median, field=psfSnrKey) * u.Unit(''),
-                        label='SNR({band})'.format(band=filter_name),
-                        description='Median signal-to-noise ratio of PSF magnitudes over '
-                                    'multiple visits')
-    blob['mag'] = Datum(quantity=goodMatches.aggregate(np.mean, field=psfMagKey) * u.mag,
-                        label='{band}'.format(band=filter_name),
-                        description='Mean PSF magnitudes of stars over multiple visits')
-    blob['magrms'] = Datum(quantity=goodMatches.aggregate(np.std, field=psfMagKey) * u.mag,
-                           label='RMS({band})'.format(band=filter_name),
-                           description='RMS of PSF magnitudes over multiple visits')
-    blob['magerr'] = Datum(quantity=goodMatches.aggregate(np.median, field=psfMagErrKey) * u.mag,
-                           label='sigma({band})'.format(band=filter_name),
-                           description='Median 1-sigma uncertainty of PSF magnitudes over '
-                                       'multiple visits')
-    # positionRmsFromCat knows how to query a group
-    # so we give it the whole thing by going with the default `field=None`.
-    blob['dist'] = Datum(quantity=goodMatches.aggregate(positionRmsFromCat) * u.milliarcsecond,
-                         label='d',
-                         description='RMS of sky coordinates of stars over multiple visits')
-
-    # These attributes are not serialized
-    blob.goodMatches = goodMatches
-    blob.safeMatches = safeMatches
+    return tmpCat
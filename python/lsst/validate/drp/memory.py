@@ -0,0 +1,176 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Memory budget of a validation run, with large arrays spilled to
+memory-mapped temporary files when it would be exceeded.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import gc
+import os
+import tempfile
+
+import numpy as np
+
+from .instrumentation import peakRssMb
+
+
+__all__ = ['MemoryBudget', 'currentRssMb']
+
+
+def currentRssMb():
+    """Current resident set size of this process.
+
+    Returns
+    -------
+    rss : `float`
+        RSS in MB, or the peak RSS where the current one is not available.
+    """
+    return _residentMb()[0]
+
+
+def _residentMb():
+    """Current RSS of this process and the part of it that is backed by
+    files, in MB; the peak RSS and 0 where they are not available."""
+    try:
+        with open('/proc/self/statm') as infile:
+            fields = infile.read().split()
+        pageMb = os.sysconf('SC_PAGE_SIZE') / 1024**2
+        return int(fields[1]) * pageMb, int(fields[2]) * pageMb
+    except (IOError, OSError, ValueError, IndexError):
+        return peakRssMb(), 0.
+
+
+class MemoryBudget(object):
+    """Limit on the resident memory of a run.
+
+    Parameters
+    ----------
+    maxMb : `float`
+        Budget in MB.
+    spillDir : `str`, optional
+        Directory of the memory-mapped files.  Default: the system
+        temporary directory.
+    minSpillMb : `float`, optional
+        Arrays smaller than this are never spilled.
+
+    Notes
+    -----
+    The budget is not enforced by the operating system: the pipeline asks
+    it, at the points where it holds large intermediates, whether to
+    release them or move them to disk.  A spilled array is a
+    `numpy.memmap` whose file is unlinked as soon as it is mapped, so that
+    nothing is left behind; its pages are backed by the file instead of
+    swap and the kernel evicts them under memory pressure.
+
+    Resident pages of spilled arrays still count in the RSS until they are
+    evicted, so they are not counted against the budget (see `usedMb`);
+    otherwise spilling would not bring the use under the budget, and every
+    array asked about would be spilled.
+    """
+
+    def __init__(self, maxMb, spillDir=None, minSpillMb=16.):
+        self.maxMb = maxMb
+        self.spillDir = spillDir
+        self.minSpillMb = minSpillMb
+        self.spilledMb = 0.
+        if spillDir is not None and not os.path.exists(spillDir):
+            os.makedirs(spillDir)
+
+    def usedMb(self):
+        """Memory counted against the budget: the RSS without the resident
+        pages of spilled arrays.
+
+        Those pages are file-backed, so at most the smaller of the spilled
+        size and the file-backed RSS is left out.
+        """
+        residentMb, fileBackedMb = _residentMb()
+        return residentMb - min(self.spilledMb, fileBackedMb)
+
+    def availableMb(self):
+        """Memory left in the budget."""
+        return self.maxMb - self.usedMb()
+
+    def exceeded(self, extraBytes=0):
+        """Would the budget be exceeded by allocating ``extraBytes`` more?"""
+        return extraBytes / 1024**2 > self.availableMb()
+
+    def release(self):
+        """Collect garbage after intermediates were dropped, so that the
+        next budget checks see the freed memory."""
+        gc.collect()
+
+    def _mapped(self, shape, dtype):
+        fd, filename = tempfile.mkstemp(prefix='validate_drp_spill_', suffix='.dat',
+                                        dir=self.spillDir)
+        os.close(fd)
+        try:
+            array = np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+        finally:
+            os.remove(filename)
+        self.spilledMb += array.nbytes / 1024**2
+        return array
+
+    def empty(self, shape, dtype=float):
+        """Allocate an array in memory, or on disk if the budget would be
+        exceeded."""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if nbytes / 1024**2 < self.minSpillMb or not self.exceeded(nbytes):
+            return np.empty(shape, dtype=dtype)
+        return self._mapped(shape, dtype)
+
+    def spill(self, array):
+        """Copy of ``array`` on disk if the budget is exceeded, otherwise
+        ``array`` itself.  The caller should drop its reference to the
+        original."""
+        if (isinstance(array, np.memmap) or array.nbytes / 1024**2 < self.minSpillMb or
+                not self.exceeded()):
+            return array
+        mapped = self._mapped(array.shape, array.dtype)
+        mapped[...] = array
+        mapped.flush()
+        return mapped
+
+    def spillColumns(self, columns):
+        """Spill the largest arrays of a `dict`, in place, until the budget
+        is met.
+
+        Only as many arrays are spilled as are needed to cover the excess
+        over the budget when this is called, so that the spilling does not
+        depend on when freed memory shows in the RSS.
+        """
+        excessMb = -self.availableMb()
+        for name in sorted(columns, key=lambda name: columns[name].nbytes, reverse=True):
+            if excessMb <= 0:
+                break
+            array = columns[name]
+            if isinstance(array, np.memmap) or array.nbytes / 1024**2 < self.minSpillMb:
+                continue
+            columns[name] = self._mapped(array.shape, array.dtype)
+            columns[name][...] = array
+            excessMb -= array.nbytes / 1024**2
+            del array
+        self.release()
+
+    def report(self):
+        """Print the memory use against the budget."""
+        print("Memory: %.0f MB used of a %.0f MB budget, %.0f MB spilled to disk" %
+              (self.usedMb(), self.maxMb, self.spilledMb))
@@ -209,7 +209,7 @@ def build_photometric_error_model(matchedMultiVisitDataset, brightSnr=100, media
         matchedMultiVisitDataset['magerr'].quantity,
         matchedMultiVisitDataset['magrms'].quantity,
         matchedMultiVisitDataset['dist'].quantity,
-        len(matchedMultiVisitDataset.goodMatches),
+        len(matchedMultiVisitDataset['snr'].quantity),
         brightSnr,
         medianRef,
         matchRef)
@@ -23,16 +23,24 @@ as analytic models of photometric and astrometric repeatability.
 
 from __future__ import print_function, division
 
+import hashlib
+import json
+import os
+
+import matplotlib
 import matplotlib.pylab as plt
+from matplotlib.colors import LinearSegmentedColormap
 import numpy as np
 import astropy.units as u
 import scipy.stats
 from .astromerrmodel import astromErrModel
 from .photerrmodel import photErrModel
-from lsst.verify import Name
+from .version import __version__
+from lsst.verify import Name, Blob, Datum, Measurement
 
 
-__all__ = ['plotOutlinedAxline',
+__all__ = ['plotOutlinedAxline', 'plotScatterOrDensity',
+           'hashPlotInputs', 'plotIsUpToDate', 'savePlot',
            'plotAstrometryErrorModel',
            'plotAstromErrModelFit', 'plotPhotErrModelFit',
            'plotPhotometryErrorModel', 'plotPA1', 'plotAMx']
@@ -48,6 +56,13 @@ plt.rcParams['axes.labelsize'] = 20
 color = {'all': 'grey', 'bright': 'blue',
          'iqr': 'green', 'rms': 'red'}
 
+# Scatter plots with more points than this are drawn as 2D-binned densities.
+maxScatterPoints = 20000
+
+# Name of the file, in each plot output directory, that records the
+# input hash of every plot written there.
+plotManifestName = '.validate_drp_plots.json'
+
 
 def makeFilename(prefix, formatStr, **kwargs):
     """Return a filename for writing to.
@@ -62,6 +77,125 @@ def makeFilename(prefix, formatStr, **kwargs):
         return "{}_{}".format(prefix, formatted)
 
 
+def _updateHash(hasher, obj):
+    """Feed a plot input into a hashlib object.
+
+    `~lsst.verify.Measurement`, `~lsst.verify.Blob` and `~lsst.verify.Datum`
+    objects are hashed by content, skipping their random identifiers, so that
+    the same values loaded from JSON or freshly measured give the same hash.
+    """
+    if isinstance(obj, Measurement):
+        hasher.update(str(obj.metric_name).encode('utf-8'))
+        _updateHash(hasher, obj.quantity)
+        _updateHash(hasher, obj.extras)
+    elif isinstance(obj, Blob):
+        for name in sorted(obj.keys()):
+            hasher.update(name.encode('utf-8'))
+            _updateHash(hasher, obj[name])
+    elif isinstance(obj, Datum):
+        _updateHash(hasher, obj.quantity)
+        _updateHash(hasher, obj.label)
+    elif isinstance(obj, u.Quantity):
+        hasher.update(str(obj.unit).encode('utf-8'))
+        _updateHash(hasher, obj.value)
+    elif isinstance(obj, np.ndarray):
+        hasher.update('{0} {1}'.format(obj.dtype.str, obj.shape).encode('utf-8'))
+        hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif hasattr(obj, 'json'):
+        # e.g., a Specification
+        hasher.update(json.dumps(obj.json, sort_keys=True, default=str).encode('utf-8'))
+    else:
+        hasher.update(repr(obj).encode('utf-8'))
+
+
+def hashPlotInputs(*inputs, **style):
+    """Compute a digest of everything that determines the content of a plot.
+
+    Parameters
+    ----------
+    *inputs
+        Measurements, blobs, datums, specifications or arrays that are
+        plotted.
+    **style
+        Plotting parameters (titles, thresholds, file names, ...).
+
+    Returns
+    -------
+    digest : `str`
+        Hexadecimal SHA-1 digest.  The matplotlib and validate_drp versions
+        are included so that plots are regenerated after an upgrade.
+    """
+    hasher = hashlib.sha1()
+    hasher.update(matplotlib.__version__.encode('utf-8'))
+    hasher.update(__version__.encode('utf-8'))
+    for obj in inputs:
+        _updateHash(hasher, obj)
+    for key in sorted(style):
+        hasher.update(key.encode('utf-8'))
+        _updateHash(hasher, style[key])
+    return hasher.hexdigest()
+
+
+def _manifestPath(plotPath):
+    return os.path.join(os.path.dirname(plotPath), plotManifestName)
+
+
+def _readPlotManifest(plotPath):
+    try:
+        with open(_manifestPath(plotPath), 'r') as infile:
+            return json.load(infile)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def plotIsUpToDate(plotPath, digest):
+    """Check whether ``plotPath`` was written from inputs hashing to ``digest``.
+
+    Parameters
+    ----------
+    plotPath : `str`
+        Path of the plot file.
+    digest : `str`
+        Digest from `hashPlotInputs` for the plot about to be made.
+
+    Returns
+    -------
+    upToDate : `bool`
+        `True` if the file exists and the plot manifest in its directory
+        records the same digest.
+    """
+    if not os.path.exists(plotPath):
+        return False
+    return _readPlotManifest(plotPath).get(os.path.basename(plotPath)) == digest
+
+
+def savePlot(fig, plotPath, digest=None, **kwargs):
+    """Save and close a figure, recording its input digest.
+
+    Parameters
+    ----------
+    fig : `matplotlib.figure.Figure`
+        Figure to save.
+    plotPath : `str`
+        Output file name.
+    digest : `str`, optional
+        Digest from `hashPlotInputs`.  If given, it is stored in the plot
+        manifest next to ``plotPath`` so that `plotIsUpToDate` can skip
+        regenerating an identical plot.
+    **kwargs
+        Passed on to `matplotlib.pyplot.savefig`.
+    """
+    plt.savefig(plotPath, **kwargs)
+    plt.close(fig)
+    print("Wrote plot:", plotPath)
+
+    if digest is not None:
+        manifest = _readPlotManifest(plotPath)
+        manifest[os.path.basename(plotPath)] = digest
+        with open(_manifestPath(plotPath), 'w') as outfile:
+            json.dump(manifest, outfile, indent=2, sort_keys=True)
+
+
 def plotOutlinedAxline(axMethod, x, **kwargs):
     """Plot an axis line with a white shadow for better contrast.
 
@@ -92,7 +226,133 @@ def plotOutlinedAxline(axMethod, x, **kwargs):
     axMethod(x, **foregroundArgs)
 
 
-def plotAstrometryErrorModel(dataset, astromModel, outputPrefix=''):
+def plotScatterOrDensity(ax, x, y, s=None, color=None, label=None,
+                         maxPoints=None, extent=None,
+                         xscale='linear', yscale='linear', gridsize=100,
+                         overlay=False):
+    """Scatter plot that switches to a 2D-binned density for large samples.
+
+    Parameters
+    ----------
+    ax : `matplotlib.axes.Axes`
+        The Axes to plot to.
+    x, y : `numpy.ndarray` or `astropy.units.Quantity`
+        Coordinates of the points.
+    s : `float`, optional
+        Marker size of the scatter plot.
+    color : `str`, optional
+        Marker color; in density mode the colormap runs from white to this color.
+    label : `str`, optional
+        Legend label.
+    maxPoints : `int`, optional
+        Maximum number of points to draw individually.
+        Default: the module-level ``maxScatterPoints``.
+    extent : 4-element sequence, optional
+        ``[xmin, xmax, ymin, ymax]`` of the plotted window in data units.
+        Only used in density mode, so that the bins cover the visible region.
+    xscale, yscale : `str`, optional
+        ``'linear'`` or ``'log'``.  Used to lay out the density bins.
+    gridsize : `int`, optional
+        Number of hexagons in the x-direction in density mode.
+    overlay : `bool`, optional
+        The points are drawn over another density layer (e.g. the bright
+        subset of all stars).  In density mode they are then drawn as
+        contours, so that the layer below stays visible.
+
+    Returns
+    -------
+    artist : `matplotlib.collections.Collection` or `matplotlib.contour.ContourSet`
+        The `~matplotlib.collections.PathCollection` from
+        `~matplotlib.axes.Axes.scatter`, the
+        `~matplotlib.collections.PolyCollection` from
+        `~matplotlib.axes.Axes.hexbin` or, with ``overlay``, the
+        `~matplotlib.contour.ContourSet` from `~matplotlib.axes.Axes.contour`.
+
+    Notes
+    -----
+    Point layers are always rasterized so that vector output stays small.
+    Above ``maxPoints`` the points are binned with
+    `~matplotlib.axes.Axes.hexbin` on a log count scale, which keeps
+    both render time and file size independent of the catalog size.
+    Overlay contours are at logarithmically spaced counts per bin.
+    """
+    if maxPoints is None:
+        maxPoints = maxScatterPoints
+
+    if len(x) <= maxPoints:
+        scatterArgs = {}
+        if s is not None:
+            scatterArgs['s'] = s
+        return ax.scatter(x, y, color=color, label=label, rasterized=True,
+                          **scatterArgs)
+
+    if isinstance(x, u.Quantity):
+        x = x.value
+    if isinstance(y, u.Quantity):
+        y = y.value
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    inWindow = np.isfinite(x) & np.isfinite(y)
+    if xscale == 'log':
+        inWindow &= x > 0
+    if yscale == 'log':
+        inWindow &= y > 0
+
+    hexExtent = None
+    if extent is not None:
+        xmin, xmax, ymin, ymax = extent
+        inWindow &= (xmin <= x) & (x <= xmax) & (ymin <= y) & (y <= ymax)
+        # hexbin expects the extent of log-scaled axes as powers of 10.
+        if xscale == 'log':
+            xmin, xmax = np.log10(xmin), np.log10(xmax)
+        if yscale == 'log':
+            ymin, ymax = np.log10(ymin), np.log10(ymax)
+        hexExtent = [xmin, xmax, ymin, ymax]
+
+    if overlay:
+        return _plotDensityContours(ax, x[inWindow], y[inWindow], color=color or 'black',
+                                    label=label, extent=hexExtent, xscale=xscale,
+                                    yscale=yscale, gridsize=gridsize)
+
+    cmap = LinearSegmentedColormap.from_list('density', ['white', color or 'black'])
+    return ax.hexbin(x[inWindow], y[inWindow], gridsize=gridsize,
+                     xscale=xscale, yscale=yscale, extent=hexExtent,
+                     bins='log', mincnt=1, cmap=cmap, linewidths=0,
+                     label=label, rasterized=True)
+
+
+def _plotDensityContours(ax, x, y, color, label, extent, xscale, yscale, gridsize,
+                         nLevels=5):
+    """Contours of the log number density of points, for `plotScatterOrDensity`.
+
+    ``extent`` is in the units of ``hexbin``, i.e. powers of 10 on log axes.
+    """
+    binX = np.log10(x) if xscale == 'log' else x
+    binY = np.log10(y) if yscale == 'log' else y
+    if extent is None and len(x) > 0:
+        extent = [binX.min(), binX.max(), binY.min(), binY.max()]
+    # Legend entry, since contour sets have none.
+    legendLine, = ax.plot([], [], color=color, label=label)
+    if extent is None:
+        # No point in the window
+        return legendLine
+
+    counts, xEdges, yEdges = np.histogram2d(binX, binY, bins=max(gridsize // 2, 2),
+                                            range=[extent[:2], extent[2:]])
+    xCenters = 0.5*(xEdges[1:] + xEdges[:-1])
+    yCenters = 0.5*(yEdges[1:] + yEdges[:-1])
+    if xscale == 'log':
+        xCenters = 10**xCenters
+    if yscale == 'log':
+        yCenters = 10**yCenters
+    levels = np.unique(np.logspace(0, np.log10(max(counts.max(), 2)), nLevels))
+    return ax.contour(xCenters, yCenters, counts.T, levels=levels, colors=color,
+                      linewidths=2)
+
+
+def plotAstrometryErrorModel(dataset, astromModel, outputPrefix='',
+                             maxPoints=None, useCache=True):
     """Plot angular distance between matched sources from different exposures.
 
     Creates a file containing the plot with a filename beginning with
@@ -108,7 +368,24 @@ def plotAstrometryErrorModel(dataset, astromModel, outputPrefix=''):
         Prefix to use for filename of plot file.  Will also be used in plot
         titles. E.g., ``outputPrefix='Cfht_output_r_'`` will result in a file
         named ``'Cfht_output_r_check_astrometry.png'``.
+    maxPoints : `int`, optional
+        Maximum number of stars to draw as individual points before switching
+        to density rendering.  See `plotScatterOrDensity`.
+        Default: the module-level ``maxScatterPoints``.
+    useCache : `bool`, optional
+        Skip the plot if an existing file was made from the same inputs.
     """
+    ext = 'png'
+    pathFormat = "{name}.{ext}"
+    plotPath = makeFilename(outputPrefix, pathFormat, name="check_astrometry", ext=ext)
+    if maxPoints is None:
+        maxPoints = maxScatterPoints
+    digest = hashPlotInputs(dataset, astromModel,
+                            outputPrefix=outputPrefix, maxPoints=maxPoints)
+    if useCache and plotIsUpToDate(plotPath, digest):
+        print("Plot is up to date:", plotPath)
+        return
+
     bright, = np.where(dataset['snr'].quantity > astromModel['brightSnr'].quantity)
 
     dist = dataset['dist'].quantity
@@ -140,11 +417,13 @@ def plotAstrometryErrorModel(dataset, astromModel, outputPrefix=''):
     ax[0].legend(loc='upper right')
 
     snr = dataset['snr'].quantity
-    ax[1].scatter(snr, dist,
-                  s=10, color=color['all'], label='All')
-    ax[1].scatter(snr[bright], dist[bright], s=10,
-                  color=color['bright'],
-                  label='SNR > {0:.0f}'.format(astromModel['brightSnr'].quantity.value))
+    plotScatterOrDensity(ax[1], snr, dist,
+                         s=10, color=color['all'], label='All',
+                         maxPoints=maxPoints, xscale='log')
+    plotScatterOrDensity(ax[1], snr[bright], dist[bright], s=10,
+                         color=color['bright'],
+                         label='SNR > {0:.0f}'.format(astromModel['brightSnr'].quantity.value),
+                         maxPoints=maxPoints, xscale='log', overlay=True)
     ax[1].set_xlabel("SNR")
     ax[1].set_xscale("log")
     ax[1].set_ylim([0., 500.])
@@ -175,12 +454,7 @@ def plotAstrometryErrorModel(dataset, astromModel, outputPrefix=''):
     # Using title rather than suptitle because I can't get the top padding
     plt.suptitle("Astrometry Check : %s" % outputPrefix,
                  fontsize=30)
-    ext = 'png'
-    pathFormat = "{name}.{ext}"
-    plotPath = makeFilename(outputPrefix, pathFormat, name="check_astrometry", ext=ext)
-    plt.savefig(plotPath, format=ext)
-    plt.close(fig)
-    print("Wrote plot:", plotPath)
+    savePlot(fig, plotPath, digest=digest, format=ext)
 
 
 def plotAstromErrModelFit(snr, dist, model,
@@ -275,7 +549,8 @@ def plotPhotErrModelFit(mag, mmag_err, photomModel, color='red', ax=None,
 
 
 def plotPhotometryErrorModel(dataset, photomModel,
-                             filterName='', outputPrefix=''):
+                             filterName='', outputPrefix='', maxPoints=None,
+                             useCache=True):
     """Plot photometric RMS for matched sources.
 
     Parameters
@@ -290,7 +565,24 @@ def plotPhotometryErrorModel(dataset, photomModel,
         Prefix to use for filename of plot file.  Will also be used in plot
         titles. E.g., ``outputPrefix='Cfht_output_r_'`` will result in a file
         named ``'Cfht_output_r_check_photometry.png'``.
+    maxPoints : `int`, optional
+        Maximum number of stars to draw as individual points before switching
+        to density rendering.  See `plotScatterOrDensity`.
+        Default: the module-level ``maxScatterPoints``.
+    useCache : `bool`, optional
+        Skip the plot if an existing file was made from the same inputs.
     """
+    ext = 'png'
+    pathFormat = "{name}.{ext}"
+    plotPath = makeFilename(outputPrefix, pathFormat, name="check_photometry", ext=ext)
+    if maxPoints is None:
+        maxPoints = maxScatterPoints
+    digest = hashPlotInputs(dataset, photomModel, filterName=filterName,
+                            outputPrefix=outputPrefix, maxPoints=maxPoints)
+    if useCache and plotIsUpToDate(plotPath, digest):
+        print("Plot is up to date:", plotPath)
+        return
+
     bright, = np.where(dataset['snr'].quantity > photomModel['brightSnr'].quantity)
 
     numMatched = len(dataset['mag'].quantity)
@@ -331,13 +623,16 @@ def plotPhotometryErrorModel(dataset, photomModel,
         magrms=dataset['magrms'], mmagrms=mmagRms))
     ax[0][0].legend(loc='upper right')
     mag = dataset['mag'].quantity
-    ax[0][1].scatter(mag, mmagRms,
-                     s=10, color=color['all'], label='All')
-    ax[0][1].scatter(mag[bright], mmagRmsHighSnr,
-                     s=10, color=color['bright'],
-                     label='{label} > {value:.0f}'.format(
-                         label=photomModel['brightSnr'].label,
-                         value=photomModel['brightSnr'].quantity.value))
+    magRmsExtent = [17, 24, 0, 500]
+    plotScatterOrDensity(ax[0][1], mag, mmagRms,
+                         s=10, color=color['all'], label='All',
+                         maxPoints=maxPoints, extent=magRmsExtent)
+    plotScatterOrDensity(ax[0][1], mag[bright], mmagRmsHighSnr,
+                         s=10, color=color['bright'],
+                         label='{label} > {value:.0f}'.format(
+                             label=photomModel['brightSnr'].label,
+                             value=photomModel['brightSnr'].quantity.value),
+                         maxPoints=maxPoints, extent=magRmsExtent, overlay=True)
     ax[0][1].set_xlabel("{label} [{unit:latex}]".format(label=filterName,
                                                         unit=mag.unit))
     ax[0][1].set_ylabel("{label} [{unit:latex}]".format(label=dataset['magrms'].label,
@@ -361,11 +656,15 @@ def plotPhotometryErrorModel(dataset, photomModel,
                                                       nAll=numMatched),
                   transform=ax[0][1].transAxes, ha='left', va='top')
 
-    ax[1][0].scatter(mmagRms, mmagErr,
-                     s=10, color=color['all'], label=None)
-    ax[1][0].scatter(mmagRmsHighSnr, mmagErrHighSnr,
-                     s=10, color=color['bright'],
-                     label=None)
+    rmsErrExtent = [1, 500, 1, 500]
+    plotScatterOrDensity(ax[1][0], mmagRms, mmagErr,
+                         s=10, color=color['all'], label=None,
+                         maxPoints=maxPoints, extent=rmsErrExtent,
+                         xscale='log', yscale='log')
+    plotScatterOrDensity(ax[1][0], mmagRmsHighSnr, mmagErrHighSnr,
+                         s=10, color=color['bright'], label=None,
+                         maxPoints=maxPoints, extent=rmsErrExtent,
+                         xscale='log', yscale='log', overlay=True)
     ax[1][0].set_xscale('log')
     ax[1][0].set_yscale('log')
     ax[1][0].plot([0, 1000], [0, 1000],
@@ -388,13 +687,17 @@ def plotPhotometryErrorModel(dataset, photomModel,
     ax[1][0].set_ylim([1, 500])
     ax[1][0].legend(loc='upper center')
 
-    ax[1][1].scatter(mag, mmagErr,
-                     color=color['all'], label=None)
+    magErrExtent = [17, 24, 1, 500]
+    plotScatterOrDensity(ax[1][1], mag, mmagErr,
+                         color=color['all'], label=None,
+                         maxPoints=maxPoints, extent=magErrExtent,
+                         yscale='log')
     ax[1][1].set_yscale('log')
-    ax[1][1].scatter(np.asarray(mag)[bright],
-                     mmagErrHighSnr,
-                     s=10, color=color['bright'],
-                     label=None)
+    plotScatterOrDensity(ax[1][1], np.asarray(mag)[bright],
+                         mmagErrHighSnr,
+                         s=10, color=color['bright'], label=None,
+                         maxPoints=maxPoints, extent=magErrExtent,
+                         yscale='log', overlay=True)
     ax[1][1].set_xlabel("{name} [{unit:latex}]".format(
         name=filterName, unit=mag.unit))
     ax[1][1].set_ylabel("Median Reported Magnitude Err [{unit:latex}]".format(
@@ -414,15 +717,10 @@ def plotPhotometryErrorModel(dataset, photomModel,
 
     plt.suptitle("Photometry Check : %s" % outputPrefix,
                  fontsize=30)
-    ext = 'png'
-    pathFormat = "{name}.{ext}"
-    plotPath = makeFilename(outputPrefix, pathFormat, name="check_photometry", ext=ext)
-    plt.savefig(plotPath, format=ext)
-    plt.close(fig)
-    print("Wrote plot:", plotPath)
+    savePlot(fig, plotPath, digest=digest, format=ext)
 
 
-def plotPA1(pa1, outputPrefix=""):
+def plotPA1(pa1, outputPrefix="", useCache=True):
     """Plot the results of calculating the LSST SRC requirement PA1.
 
     Creates a file containing the plot with a filename beginning with
@@ -437,7 +735,17 @@ def plotPA1(pa1, outputPrefix=""):
         titles. E.g., outputPrefix='Cfht_output_r_' will result in a file
         named ``'Cfht_output_r_AM1_D_5_arcmin_17.0-21.5.png'``
         for an ``AMx.name=='AM1'`` and ``AMx.magRange==[17, 21.5]``.
+    useCache : `bool`, optional
+        Skip the plot if an existing file was made from the same inputs.
     """
+    ext = 'png'
+    pathFormat = "{name}.{ext}"
+    plotPath = makeFilename(outputPrefix, pathFormat, name="PA1", ext=ext)
+    digest = hashPlotInputs(pa1, outputPrefix=outputPrefix)
+    if useCache and plotIsUpToDate(plotPath, digest):
+        print("Plot is up to date:", plotPath)
+        return
+
     diffRange = (-100, +100)
     magDiff = pa1.extras['magDiff'].quantity
     magMean = pa1.extras['magMean'].quantity
@@ -448,7 +756,7 @@ def plotPA1(pa1, outputPrefix=""):
     ax1 = fig.add_subplot(1, 2, 1)
     ax1.scatter(magMean[0],
                 magDiff[0],
-                s=10, color=color['bright'], linewidth=0)
+                s=10, color=color['bright'], linewidth=0, rasterized=True)
     # index 0 because we show only the first sample from multiple trials
     ax1.axhline(+rms[0].value, color=color['rms'], linewidth=3)
     ax1.axhline(-rms[0].value, color=color['rms'], linewidth=3)
@@ -477,15 +785,11 @@ def plotPA1(pa1, outputPrefix=""):
         label.set_visible(False)
 
     plt.tight_layout()  # fix padding
-    ext = 'png'
-    pathFormat = "{name}.{ext}"
-    plotPath = makeFilename(outputPrefix, pathFormat, name="PA1", ext=ext)
-    plt.savefig(plotPath, format=ext)
-    plt.close(fig)
-    print("Wrote plot:", plotPath)
+    savePlot(fig, plotPath, digest=digest, format=ext)
 
 
-def plotAMx(job, amx, afx, filterName, amxSpecName='design', outputPrefix=""):
+def plotAMx(job, amx, afx, filterName, amxSpecName='design', outputPrefix="",
+            useCache=True):
     """Plot a histogram of the RMS in relative distance between pairs of
     stars.
 
@@ -507,18 +811,42 @@ def plotAMx(job, amx, afx, filterName, amxSpecName='design', outputPrefix=""):
         titles. E.g., ``outputPrefix='Cfht_output_r_'`` will result in a file
         named ``'Cfht_output_r_AM1_D_5_arcmin_17.0-21.5.png'``
         for an ``AMx.name=='AM1'`` and ``AMx.magRange==[17, 21.5]``.
+    useCache : `bool`, optional
+        Skip the plot if an existing file was made from the same inputs.
     """
     if np.isnan(amx.quantity):
         print("Skipping %s -- no measurement"%str(amx.metric_name))
         return
 
+    annulus = amx.extras['annulus'].quantity
+    magRange = amx.extras['magRange'].quantity
+    metric_name = amx.metric_name
+    amxSpec = job.specs[Name(package=metric_name.package, metric=metric_name.metric, spec=amxSpecName)]
+    afxSpec = job.specs[Name(package=afx.metric_name.package, metric=afx.metric_name.metric, spec='srd')]
+
+    ext = 'png'
+    pathFormat = '{metric}_D_{D:d}_{Dunits}_' + \
+        '{magBright.value}_{magFaint.value}_{magFaint.unit}.{ext}'
+    plotPath = makeFilename(outputPrefix,
+                            pathFormat,
+                            metric=amx.datum.label,
+                            D=int(amx.extras['D'].quantity.value),
+                            Dunits=amx.extras['D'].quantity.unit,
+                            magBright=magRange[0],
+                            magFaint=magRange[1],
+                            ext=ext)
+    digest = hashPlotInputs(amx, afx, amxSpec, afxSpec,
+                            filterName=filterName, amxSpecName=amxSpecName,
+                            outputPrefix=outputPrefix)
+    if useCache and plotIsUpToDate(plotPath, digest):
+        print("Plot is up to date:", plotPath)
+        return
+
     fig = plt.figure(figsize=(10, 6))
     ax1 = fig.add_subplot(1, 1, 1)
 
     histLabelTemplate = 'D: [{inner.value:.1f}{inner.unit:latex}-{outer.value:.1f}{outer.unit:latex}]\n'\
                         'Mag: [{magBright:.1f}-{magFaint:.1f}]'
-    annulus = amx.extras['annulus'].quantity
-    magRange = amx.extras['magRange'].quantity
     ax1.hist(amx.extras['rmsDistMas'].quantity, bins=25, range=(0.0, 100.0),
              histtype='stepfilled',
              label=histLabelTemplate.format(
@@ -526,8 +854,6 @@ def plotAMx(job, amx, afx, filterName, amxSpecName='design', outputPrefix=""):
                  outer=annulus[1],
                  magBright=magRange[0],
                  magFaint=magRange[1]))
-    metric_name = amx.metric_name
-    amxSpec = job.specs[Name(package=metric_name.package, metric=metric_name.metric, spec=amxSpecName)]
     amxSpecLabelTemplate = '{amx.datum.label} {specname}: {amxSpec.threshold:.1f}'
     amxSpecLabel = amxSpecLabelTemplate.format(
         amx=amx,
@@ -545,7 +871,6 @@ def plotAMx(job, amx, afx, filterName, amxSpecName='design', outputPrefix=""):
     ax1.axvline(amxSpec.threshold.value, 0, 1, linewidth=2, color='black',
                 label=amxLabel)
 
-    afxSpec = job.specs[Name(package=afx.metric_name.package, metric=afx.metric_name.metric, spec='srd')]
     if afxSpec.check(afx.quantity):
         afxStatus = 'passed'
     else:
@@ -572,25 +897,12 @@ def plotAMx(job, amx, afx, filterName, amxSpecName='design', outputPrefix=""):
 
     ax1.legend(loc='upper right', fontsize=16)
 
-    ext = 'png'
-    pathFormat = '{metric}_D_{D:d}_{Dunits}_' + \
-        '{magBright.value}_{magFaint.value}_{magFaint.unit}.{ext}'
-    plotPath = makeFilename(outputPrefix,
-                            pathFormat,
-                            metric=amx.datum.label,
-                            D=int(amx.extras['D'].quantity.value),
-                            Dunits=amx.extras['D'].quantity.unit,
-                            magBright=magRange[0],
-                            magFaint=magRange[1],
-                            ext=ext)
-
     plt.tight_layout()  # fix padding
-    plt.savefig(plotPath, dpi=300, format=ext)
-    plt.close(fig)
-    print("Wrote plot:", plotPath)
+    savePlot(fig, plotPath, digest=digest, dpi=300, format=ext)
 
 
-def plotTEx(job, tex, filterName, texSpecName='design', outputPrefix=''):
+def plotTEx(job, tex, filterName, texSpecName='design', outputPrefix='',
+            useCache=True):
     """Plot TEx correlation function measurements and thresholds.
 
     Parameters
@@ -607,20 +919,39 @@ def plotTEx(job, tex, filterName, texSpecName='design', outputPrefix=''):
         Typically one of 'design', 'minimum', 'stretch'
     outputPrefix : str, optional
         Prefix to use for filename of plot file.
+    useCache : bool, optional
+        Skip the plot if an existing file was made from the same inputs.
 
     Effects
     -------
     Saves an output plot file to that starts with specified outputPrefix.
 
     """
-    fig = plt.figure(figsize=(10, 6))
-    ax1 = fig.add_subplot(1, 1, 1)
-    # Plot correlation vs. radius
     radius = tex.extras['radius'].quantity
     xip = tex.extras['xip'].quantity
     xip_err = tex.extras['xip_err'].quantity
     D = tex.extras['D'].quantity
     bin_range_operator = tex.extras['bin_range_operator'].quantity
+    metric_name = tex.metric_name
+    texSpec = job.specs[Name(package=metric_name.package, metric=metric_name.metric, spec=texSpecName)]
+
+    ext = 'png'
+    pathFormat = '{metric}_D_{D:d}_{Dunits}.{ext}'
+    plotPath = makeFilename(outputPrefix,
+                            pathFormat,
+                            metric=tex.datum.label,
+                            D=int(D.value),
+                            Dunits=D.unit,
+                            ext=ext)
+    digest = hashPlotInputs(tex, texSpec, filterName=filterName,
+                            texSpecName=texSpecName, outputPrefix=outputPrefix)
+    if useCache and plotIsUpToDate(plotPath, digest):
+        print("Plot is up to date:", plotPath)
+        return
+
+    fig = plt.figure(figsize=(10, 6))
+    ax1 = fig.add_subplot(1, 1, 1)
+    # Plot correlation vs. radius
 
     ax1.errorbar(radius.value,  xip.value, yerr=xip_err.value)
     ax1.set_xscale('log')
@@ -628,8 +959,6 @@ def plotTEx(job, tex, filterName, texSpecName='design', outputPrefix=''):
     ax1.set_ylabel('Median Residual Ellipticity Correlation', size=19)
 
     # Overlay requirements level
-    metric_name = tex.metric_name
-    texSpec = job.specs[Name(package=metric_name.package, metric=metric_name.metric, spec=texSpecName)]
     texSpecLabel = '{tex.datum.label} {specname}: {texSpec:.2g}'.format(
         tex=tex,
         texSpec=texSpec.threshold,
@@ -664,16 +993,5 @@ def plotTEx(job, tex, filterName, texSpecName='design', outputPrefix=''):
 
     ax1.legend(loc='upper right', fontsize=16)
 
-    ext = 'png'
-    pathFormat = '{metric}_D_{D:d}_{Dunits}.{ext}'
-    plotPath = makeFilename(outputPrefix,
-                            pathFormat,
-                            metric=tex.datum.label,
-                            D=int(D.value),
-                            Dunits=D.unit,
-                            ext=ext)
-
     plt.tight_layout()  # fix padding
-    plt.savefig(plotPath, dpi=300, ext=ext)
-    plt.close(fig)
-    print("Wrote plot:", plotPath)
+    savePlot(fig, plotPath, digest=digest, dpi=300, format=ext)
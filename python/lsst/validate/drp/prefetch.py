@@ -0,0 +1,147 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Background loading of catalogs ahead of the code that matches them.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+
+__all__ = ['Prefetcher']
+
+
+class _Done(object):
+    pass
+
+
+class Prefetcher(object):
+    """Apply a function to items in a background thread, staying ahead of
+    the consumer.
+
+    Parameters
+    ----------
+    function : callable
+        Called with each item, e.g. a data ID, in the background thread.
+    items : iterable
+        Items to process, in order.
+    depth : `int`, optional
+        Maximum number of results waiting for the consumer.  The producer
+        blocks when the queue is full.
+    timer : `lsst.validate.drp.instrumentation.StageTimer`, optional
+        If given, the time the consumer waits for results is recorded as
+        the ``prefetchWait`` stage.
+
+    Notes
+    -----
+    Iterating yields ``(item, result)`` pairs in the order of ``items``.  An
+    exception raised by ``function`` is raised again in the consumer.
+
+    The statistics in `stats` show which side is the bottleneck: if the
+    consumer is often ``starved`` (finds the queue empty), loading is
+    slower than matching and a deeper queue does not help; if the producer
+    spends its time ``blocked`` on a full queue, matching is the slower side.
+
+    Only one background thread is used, so ``function`` need not be
+    thread-safe with respect to itself, only with respect to the consumer.
+    """
+
+    def __init__(self, function, items, depth=2, timer=None):
+        if depth < 1:
+            raise ValueError("Prefetch depth must be at least 1, not %s" % depth)
+        self.function = function
+        self.items = items
+        self.depth = depth
+        self.timer = timer
+        self.stats = {'items': 0, 'starved': 0, 'starved_s': 0., 'blocked_s': 0.,
+                      'mean_depth': 0.}
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+
+    def _produce(self):
+        try:
+            for item in self.items:
+                if self._stop.is_set():
+                    return
+                entry = (item, self.function(item), None)
+                start = time.time()
+                self._queue.put(entry)
+                self.stats['blocked_s'] += time.time() - start
+        except Exception:
+            self._queue.put((None, None, sys.exc_info()[1]))
+            return
+        self._queue.put(_Done)
+
+    def _get(self):
+        depth = self._queue.qsize()
+        self.stats['mean_depth'] += depth
+        if depth > 0:
+            return self._queue.get()
+        self.stats['starved'] += 1
+        start = time.time()
+        if self.timer is not None:
+            with self.timer.stage('prefetchWait'):
+                entry = self._queue.get()
+        else:
+            entry = self._queue.get()
+        self.stats['starved_s'] += time.time() - start
+        return entry
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._produce, name='prefetch')
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                entry = self._get()
+                if entry is _Done:
+                    break
+                item, result, error = entry
+                if error is not None:
+                    raise error
+                self.stats['items'] += 1
+                yield item, result
+        finally:
+            # Let the producer finish if the consumer stopped early.
+            self._stop.set()
+            while thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+            self.stats['mean_depth'] /= max(self.stats['items'] + 1, 1)
+
+    def report(self):
+        """Print the queue statistics."""
+        stats = self.stats
+        print("Prefetch (depth %d): consumer starved %d of %d times for %.2f s, "
+              "producer blocked for %.2f s, mean queue depth %.1f" %
+              (self.depth, stats['starved'], stats['items'] + 1, stats['starved_s'],
+               stats['blocked_s'], stats['mean_depth']))
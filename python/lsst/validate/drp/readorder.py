@@ -0,0 +1,208 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Order in which the catalogs of a matched dataset are read and matched.
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from collections import OrderedDict
+
+from astropy.io import fits
+
+import lsst.daf.persistence as dafPersist
+
+
+__all__ = ['planReadOrder', 'chooseSeedVisit']
+
+
+def planReadOrder(dataIds, seedVisit=None):
+    """Order data IDs by visit, so that the files of a visit are read together.
+
+    Parameters
+    ----------
+    dataIds : `list` of `dict`
+        Data IDs with a ``visit`` key.
+    seedVisit : `int`, optional
+        Visit to read and match first.  Its sources become the reference
+        positions of the objects they match, so a deep, good-seeing visit
+        gives fewer spurious objects.
+
+    Returns
+    -------
+    dataIds : `list` of `dict`
+        The same data IDs.  Visits are in the order of their first data ID
+        (after ``seedVisit``), and the data IDs of a visit are sorted by
+        their other keys (e.g. CCD), the order of the files in a visit
+        directory.
+    """
+    byVisit = OrderedDict()
+    for dataId in dataIds:
+        byVisit.setdefault(dataId['visit'], []).append(dataId)
+
+    visits = list(byVisit.keys())
+    if seedVisit is not None:
+        if seedVisit not in byVisit:
+            raise ValueError("Seed visit %s is not in the data IDs" % seedVisit)
+        visits.remove(seedVisit)
+        visits.insert(0, seedVisit)
+
+    def otherKeys(dataId):
+        return tuple(dataId[key] for key in sorted(dataId) if key != 'visit')
+
+    return [dataId for visit in visits for dataId in sorted(byVisit[visit], key=otherKeys)]
+
+
+def chooseSeedVisit(repo, dataIds, criterion='deepest'):
+    """Find the best visit to seed the matching with.
+
+    Parameters
+    ----------
+    repo : `str` or `lsst.daf.persistence.Butler`
+        A Butler or a repository URL that can be used to construct one.
+    dataIds : `list` of `dict`
+        Data IDs with a ``visit`` key.
+    criterion : {'deepest', 'bestSeeing'}, optional
+        ``'deepest'`` picks the visit with the most sources in all its
+        data IDs, counted without reading their catalogs (see
+        `_estimateSourceCount`).  ``'bestSeeing'`` picks the visit with the
+        smallest PSF determinant radius, from the ``calexp_psf`` of its
+        first data ID.
+
+    Returns
+    -------
+    visit : `int`
+        The chosen visit.
+    """
+    if isinstance(repo, dafPersist.Butler):
+        butler = repo
+    else:
+        butler = dafPersist.Butler(repo)
+
+    byVisit = OrderedDict()
+    for dataId in dataIds:
+        byVisit.setdefault(dataId['visit'], []).append(dataId)
+
+    scores = {}
+    nRead = 0
+    for visit, visitDataIds in byVisit.items():
+        try:
+            if criterion == 'deepest':
+                scores[visit], nVisitRead = _estimateSourceCount(butler, visitDataIds)
+                nRead += nVisitRead
+            elif criterion == 'bestSeeing':
+                psf = butler.get('calexp_psf', visitDataIds[0])
+                scores[visit] = -psf.computeShape().getDeterminantRadius()
+            else:
+                raise ValueError("Unknown criterion '%s'; use 'deepest' or 'bestSeeing'" %
+                                 criterion)
+        except dafPersist.NoResults as e:
+            print(e)
+            print("Could not rank visit %s; it will not be the seed." % visit)
+
+    if nRead:
+        print("Could not count the sources of %d visits without reading their catalogs; "
+              "estimated them from one src catalog per visit." % nRead)
+    if not scores:
+        raise RuntimeError("Could not rank any visit by %s" % criterion)
+    return max(scores, key=scores.get)
+
+
+def _sourceCount(butler, dataId):
+    """Number of sources of a data ID, without reading its catalog.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.persistence.Butler`
+        Butler of the repository.
+    dataId : `dict`
+        Data ID of a ``src`` catalog.
+
+    Returns
+    -------
+    count : `int` or `None`
+        The ``src_len`` of the data ID if the mapper defines it, otherwise
+        the number of rows in the FITS header of the catalog file, or `None`
+        if neither is available (e.g. the catalog is not a local FITS
+        file).
+
+    Raises
+    ------
+    lsst.daf.persistence.NoResults
+        If the data ID has no ``src`` catalog.
+    """
+    try:
+        return int(butler.get('src_len', dataId))
+    except dafPersist.NoResults:
+        raise
+    except (KeyError, RuntimeError):
+        pass
+    # The first extension is the source table; later ones hold footprints.
+    filename = butler.getUri('src', dataId).split('[')[0]
+    try:
+        return int(fits.getheader(filename, 1)['NAXIS2'])
+    except (IOError, OSError, IndexError, KeyError):
+        return None
+
+
+def _estimateSourceCount(butler, dataIds, maxCatalogs=1):
+    """Estimate the total number of sources of some data IDs.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.persistence.Butler`
+        Butler of the repository.
+    dataIds : `list` of `dict`
+        Data IDs of ``src`` catalogs.  Those without one have no sources.
+    maxCatalogs : `int`, optional
+        Number of catalogs that may be read if no data ID can be counted
+        with `_sourceCount`.
+
+    Returns
+    -------
+    count : `float`
+        Number of sources.  Data IDs that cannot be counted are assumed to
+        have the mean number of sources of those that can; if there are
+        none, that is the mean of the first ``maxCatalogs`` catalogs.
+    nRead : `int`
+        Number of catalogs that were read.
+    """
+    counts = []
+    uncounted = []
+    for dataId in dataIds:
+        try:
+            count = _sourceCount(butler, dataId)
+        except dafPersist.NoResults:
+            count = 0
+        if count is None:
+            uncounted.append(dataId)
+        else:
+            counts.append(count)
+
+    nRead = 0
+    if uncounted and not counts:
+        for dataId in uncounted[:maxCatalogs]:
+            try:
+                counts.append(len(butler.get('src', dataId)))
+            except dafPersist.NoResults:
+                counts.append(0)
+            nRead += 1
+    if not counts:
+        return 0., nRead
+    return sum(counts) * len(dataIds) / len(counts), nRead
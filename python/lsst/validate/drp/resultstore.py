@@ -0,0 +1,302 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""SQLite registry of validation runs, for trends across many runs.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+import astropy.units as u
+from astropy.table import Table
+
+from lsst.verify import Job
+
+
+__all__ = ['ResultStore']
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    instrument TEXT,
+    filter_name TEXT,
+    dataset TEXT,
+    code_version TEXT,
+    timestamp REAL,
+    source TEXT,
+    job TEXT
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    metric TEXT,
+    value REAL,
+    unit TEXT
+);
+CREATE TABLE IF NOT EXISTS blob_summaries (
+    run_id INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    blob TEXT,
+    datum TEXT,
+    value REAL,
+    unit TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_selection
+    ON runs (instrument, filter_name, dataset, timestamp);
+CREATE INDEX IF NOT EXISTS runs_by_version ON runs (code_version);
+CREATE INDEX IF NOT EXISTS measurements_by_metric ON measurements (metric, run_id);
+CREATE INDEX IF NOT EXISTS blob_summaries_by_datum ON blob_summaries (blob, datum, run_id);
+"""
+
+
+def _scalar(quantity):
+    """Value and unit of a scalar quantity, or `None` if it is not one."""
+    if isinstance(quantity, u.Quantity):
+        value, unit = quantity.value, str(quantity.unit)
+    else:
+        value, unit = quantity, ''
+    if isinstance(value, (bool, np.bool_)) or np.ndim(value) != 0:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    # NaN is stored as NULL
+    return (value if np.isfinite(value) else None), unit
+
+
+def _metricName(metric):
+    metric = str(metric)
+    return metric if '.' in metric else 'validate_drp.' + metric
+
+
+class ResultStore(object):
+    """Registry of validation runs in a SQLite database.
+
+    Each run is a `lsst.verify.Job` for one filter.  Its measurements and
+    the scalar Datums of the Blobs linked to them (e.g. ``photScatter`` of
+    the ``PhotometricErrorModel``) are stored as rows, indexed by
+    instrument, filter, dataset, code version and time, so that trends
+    over many runs are single queries.  The JSON of the Job is kept too,
+    so that it can be exported again.
+
+    Parameters
+    ----------
+    filename : `str`
+        Database file; created if needed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(_schema)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def addJob(self, job, codeVersion=None, timestamp=None, source=None):
+        """Record a run.
+
+        Parameters
+        ----------
+        job : `lsst.verify.Job`
+            Measurements of one filter, with ``instrument``,
+            ``filter_name`` and ``dataset_repo_url`` in its metadata.
+        codeVersion : `str`, optional
+            Version of the code that made the measurements.  Default:
+            ``job.meta['validate_drp_version']`` if present.
+        timestamp : `float`, optional
+            Time of the run (seconds since the epoch).  Default: now.
+        source : `str`, optional
+            Where the run came from, e.g. its JSON file.
+
+        Returns
+        -------
+        runId : `int`
+            Identifier of the run in the store.
+        """
+        meta = job.meta
+        if codeVersion is None:
+            codeVersion = meta.get('validate_drp_version')
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (instrument, filter_name, dataset, code_version, timestamp, "
+                "source, job) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (meta.get('instrument'), meta.get('filter_name'), meta.get('dataset_repo_url'),
+                 codeVersion, timestamp, source, json.dumps(job.json, default=str)))
+            runId = cursor.lastrowid
+
+            measurementRows = []
+            blobRows = {}
+            for name, measurement in job.measurements.items():
+                value = _scalar(measurement.quantity)
+                if value is not None:
+                    measurementRows.append((runId, str(name)) + value)
+                for blobName, blob in measurement.blobs.items():
+                    for datumName in blob.keys():
+                        value = _scalar(blob[datumName].quantity)
+                        if value is not None:
+                            blobRows[(blobName, datumName)] = (runId, blobName, datumName) + value
+            self.connection.executemany("INSERT INTO measurements VALUES (?, ?, ?, ?)",
+                                        measurementRows)
+            self.connection.executemany("INSERT INTO blob_summaries VALUES (?, ?, ?, ?, ?)",
+                                        list(blobRows.values()))
+        return runId
+
+    def importJson(self, filenames, codeVersion=None):
+        """Record runs from the JSON files written by ``validateDrp.py``.
+
+        The time of each run is the modification time of its file.  A file
+        that is already recorded with that time, by an earlier import or by
+        the run that wrote it, is skipped, so that importing a directory
+        again only adds the new runs.
+
+        Returns
+        -------
+        runIds : `list` of `int`
+            Identifiers of the runs of the files, including those that were
+            already recorded.
+        """
+        runIds = []
+        for filename in filenames:
+            source = os.path.abspath(filename)
+            timestamp = os.path.getmtime(filename)
+            row = self.connection.execute(
+                "SELECT id FROM runs WHERE source = ? AND timestamp = ?",
+                (source, timestamp)).fetchone()
+            if row is not None:
+                print("%s is already recorded as run %d" % (filename, row[0]))
+                runIds.append(row[0])
+                continue
+            with open(filename) as infile:
+                job = Job.deserialize(**json.load(infile))
+            runIds.append(self.addJob(job, codeVersion=codeVersion, timestamp=timestamp,
+                                      source=source))
+        return runIds
+
+    def job(self, runId):
+        """The `lsst.verify.Job` of a run."""
+        row = self.connection.execute("SELECT job FROM runs WHERE id = ?", (runId,)).fetchone()
+        if row is None:
+            raise KeyError("No run %s in %s" % (runId, self.filename))
+        return Job.deserialize(**json.loads(row[0]))
+
+    def exportJson(self, runId, filename):
+        """Write the Job of a run to a JSON file, as ``validateDrp.py`` does."""
+        self.job(runId).write(filename)
+
+    def remove(self, runId):
+        """Delete a run and its measurements."""
+        with self.connection:
+            self.connection.execute("DELETE FROM runs WHERE id = ?", (runId,))
+
+    def _select(self, columns, table, instrument, filterName, dataset, codeVersion, since,
+                extra=None, args=()):
+        conditions = []
+        values = []
+        for column, value in (('runs.instrument', instrument), ('runs.filter_name', filterName),
+                              ('runs.dataset', dataset), ('runs.code_version', codeVersion)):
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                values.append(value)
+        if since is not None:
+            conditions.append('runs.timestamp >= ?')
+            values.append(since)
+        if extra is not None:
+            conditions.append(extra)
+            values.extend(args)
+        query = "SELECT %s FROM %s" % (', '.join(columns), table)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY runs.timestamp, runs.id"
+        return self.connection.execute(query, values).fetchall()
+
+    def runs(self, instrument=None, filterName=None, dataset=None, codeVersion=None, since=None):
+        """Runs matching all the given criteria, oldest first.
+
+        Returns
+        -------
+        runs : `astropy.table.Table`
+            With columns ``id``, ``instrument``, ``filter_name``,
+            ``dataset``, ``code_version``, ``timestamp`` and ``source``.
+        """
+        names = ['id', 'instrument', 'filter_name', 'dataset', 'code_version', 'timestamp',
+                 'source']
+        columns = ["COALESCE(runs.%s, '')" % name if name not in ('id', 'timestamp')
+                   else 'runs.' + name for name in names]
+        rows = self._select(columns, 'runs',
+                            instrument, filterName, dataset, codeVersion, since)
+        return Table(rows=rows or None, names=names,
+                     dtype=None if rows else [int, str, str, str, str, float, str])
+
+    def trend(self, metric, instrument=None, filterName=None, dataset=None, codeVersion=None,
+              since=None, blob=None):
+        """Values of a metric, or of a Blob Datum, over the matching runs.
+
+        Parameters
+        ----------
+        metric : `str`
+            Metric name, e.g. ``'validate_drp.AM1'`` (``'AM1'`` is taken to
+            be in ``validate_drp``), or the name of a Datum of ``blob``.
+        instrument, filterName, dataset, codeVersion : `str`, optional
+            Only include runs with these metadata.
+        since : `float`, optional
+            Only include runs at or after this time (seconds since the
+            epoch).
+        blob : `str`, optional
+            Name of the Blob of ``metric``, e.g. ``'PhotometricErrorModel'``.
+
+        Returns
+        -------
+        trend : `astropy.table.Table`
+            With columns ``id``, ``timestamp``, ``code_version``,
+            ``filter_name``, ``value`` (NaN where it could not be measured)
+            and ``unit``, oldest first.
+        """
+        columns = ['runs.id', 'runs.timestamp', "COALESCE(runs.code_version, '')",
+                   "COALESCE(runs.filter_name, '')", 'value', 'unit']
+        if blob is None:
+            rows = self._select(columns, 'measurements JOIN runs ON measurements.run_id = runs.id',
+                                instrument, filterName, dataset, codeVersion, since,
+                                extra='measurements.metric = ?', args=(_metricName(metric),))
+        else:
+            rows = self._select(columns,
+                                'blob_summaries JOIN runs ON blob_summaries.run_id = runs.id',
+                                instrument, filterName, dataset, codeVersion, since,
+                                extra='blob_summaries.blob = ? AND blob_summaries.datum = ?',
+                                args=(blob, metric))
+        rows = [row[:4] + (np.nan if row[4] is None else row[4],) + row[5:] for row in rows]
+        names = ['id', 'timestamp', 'code_version', 'filter_name', 'value', 'unit']
+        return Table(rows=rows or None, names=names,
+                     dtype=None if rows else [int, float, str, str, float, str])
@@ -0,0 +1,345 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Long-lived local service that keeps matched datasets in memory and
+recomputes metrics on request.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import json
+import time
+from collections import OrderedDict
+
+import numpy as np
+import astropy.units as u
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import lsst.daf.persistence as dafPersist
+from lsst.verify import MetricSet
+
+from .cache import MatchedDatasetCache
+from .incremental import dataIdToKey
+from .instrumentation import StageTimer
+from .matchreduce import build_matched_dataset
+from .photerrmodel import build_photometric_error_model
+from .astromerrmodel import build_astrometric_error_model
+from .calcsrd import measurePA1, measureAMx, measureTEx
+from .util import discoverDataIds
+
+
+__all__ = ['ValidationService', 'RequestError', 'serve']
+
+
+class RequestError(ValueError):
+    """A request to a `ValidationService` is malformed."""
+    pass
+
+
+class ValidationService(object):
+    """Compute metrics of matched datasets that are kept in memory between
+    requests.
+
+    Butlers, data ID lists and matched datasets are built on the first
+    request that needs them and reused by later ones, so that changing a
+    measurement parameter (e.g. ``brightSnr``, the AMx annulus width or
+    magnitude range) only repeats the measurement.
+
+    Parameters
+    ----------
+    metrics_package : `str`, optional
+        Package with the metric definitions.
+    maxDatasets : `int`, optional
+        Number of matched datasets kept in memory; the least recently used
+        one is dropped when another is built.
+    cacheDir : `str`, optional
+        Directory of a `lsst.validate.drp.cache.MatchedDatasetCache` from
+        which datasets are read, and to which they are added, so that they
+        survive a restart of the service.
+    **buildOptions
+        Further options of
+        `lsst.validate.drp.matchreduce.build_matched_dataset`, e.g.
+        ``dense`` or ``compact``.
+
+    Notes
+    -----
+    A request is a `dict` with the keys
+
+    ``repo``
+        Repository path (required).
+    ``dataIds``
+        `list` of data IDs to match, in the order they are read.  If
+        missing, all data IDs of ``filter`` in the repository are used.
+    ``filter``
+        Filter name, if ``dataIds`` is not given.
+    ``useJointCal``, ``safeSnr``
+        Options of the matched dataset.
+    ``metrics``
+        Names of the metrics to compute, from ``AM1``, ``AM2``, ``AM3``,
+        ``PA1``, ``TE1``, ``TE2``, ``photScatter`` and ``astromRms``.
+        Default: all but ``TE1`` and ``TE2``.
+    ``brightSnr``
+        Minimum SNR of the stars of the error models.
+    ``annulusWidth``, ``magRange``
+        Width (arcmin) and magnitude range of the AMx measurements.
+
+    A malformed request raises `RequestError`, which the HTTP interface
+    reports with status 400; other errors are reported with status 500.
+    """
+
+    amxDistances = OrderedDict([('AM1', 5.), ('AM2', 20.), ('AM3', 200.)])
+    texDistances = OrderedDict([('TE1', (1.0, '<=')), ('TE2', (5.0, '>='))])
+    defaultMetrics = ['AM1', 'AM2', 'AM3', 'PA1', 'photScatter', 'astromRms']
+
+    def __init__(self, metrics_package='verify_metrics', maxDatasets=4, cacheDir=None,
+                 **buildOptions):
+        self.metrics = MetricSet.load_metrics_package(package_name_or_path=metrics_package,
+                                                      subset='validate_drp')
+        self.maxDatasets = maxDatasets
+        self.cache = MatchedDatasetCache(cacheDir) if cacheDir else None
+        self.buildOptions = buildOptions
+        self.butlers = {}
+        self.dataIds = {}
+        self.datasets = OrderedDict()
+
+    def butler(self, repo):
+        """Butler of a repository, constructed once."""
+        if repo not in self.butlers:
+            self.butlers[repo] = dafPersist.Butler(repo)
+        return self.butlers[repo]
+
+    def dataset(self, repo, dataIds=None, filterName=None, useJointCal=False, safeSnr=50.):
+        """Matched dataset of some data IDs, built once.
+
+        Returns
+        -------
+        matchedDataset : `lsst.verify.Blob`
+            ``MatchedMultiVisitDataset``.
+        warm : `bool`
+            Whether the dataset was already in memory.
+        """
+        if dataIds is None:
+            if filterName is None:
+                raise RequestError("A request needs either dataIds or a filter")
+            if (repo, filterName) not in self.dataIds:
+                self.dataIds[(repo, filterName)] = discoverDataIds(repo, filter=filterName)
+            dataIds = self.dataIds[(repo, filterName)]
+
+        # Matching depends on the order of the data IDs, so it is part of
+        # the key.
+        key = json.dumps([repo, [dataIdToKey(dataId) for dataId in dataIds],
+                          bool(useJointCal), float(safeSnr)])
+        if key in self.datasets:
+            self.datasets[key] = self.datasets.pop(key)
+            return self.datasets[key], True
+
+        # Loading adds keys such as raft_sensor_int to the data IDs it is
+        # given; build from copies so that those discovered once keep
+        # giving the same key.
+        dataIds = [dict(dataId) for dataId in dataIds]
+        matchedDataset = build_matched_dataset(self.butler(repo), dataIds,
+                                               useJointCal=useJointCal, safeSnr=safeSnr,
+                                               timer=StageTimer(), cache=self.cache,
+                                               **self.buildOptions)
+        self.datasets[key] = matchedDataset
+        while len(self.datasets) > self.maxDatasets:
+            self.datasets.popitem(last=False)
+        return matchedDataset, False
+
+    def compute(self, request):
+        """Compute the metrics of a request.
+
+        Parameters
+        ----------
+        request : `dict`
+            See the class documentation.
+
+        Returns
+        -------
+        result : `dict`
+            ``measurements``: value and unit of each metric, by name
+            (`None` if it could not be measured); ``warm``: whether the
+            dataset was already in memory; ``elapsed``: time taken (s).
+        """
+        start = time.time()
+        _checkRequest(request)
+        matchedDataset, warm = self.dataset(request['repo'],
+                                            dataIds=request.get('dataIds'),
+                                            filterName=request.get('filter'),
+                                            useJointCal=request.get('useJointCal', False),
+                                            safeSnr=request.get('safeSnr', 50.))
+        filterName = matchedDataset['filterName'].quantity
+        brightSnr = request.get('brightSnr', 100)
+        width = request.get('annulusWidth', 2.)
+        magRange = request.get('magRange')
+
+        measurements = OrderedDict()
+        for name in request.get('metrics', self.defaultMetrics):
+            if name in self.amxDistances:
+                quantity = measureAMx(self.metrics['validate_drp.' + name], matchedDataset,
+                                      self.amxDistances[name]*u.arcmin, width=width,
+                                      magRange=magRange).quantity
+            elif name == 'PA1':
+                quantity = measurePA1(self.metrics['validate_drp.PA1'], matchedDataset,
+                                      filterName).quantity
+            elif name in self.texDistances:
+                D, operator = self.texDistances[name]
+                quantity = measureTEx(self.metrics['validate_drp.' + name], matchedDataset,
+                                      D*u.arcmin, operator).quantity
+            elif name == 'photScatter':
+                quantity = build_photometric_error_model(matchedDataset,
+                                                         brightSnr=brightSnr)['photScatter'].quantity
+            elif name == 'astromRms':
+                quantity = build_astrometric_error_model(matchedDataset,
+                                                         brightSnr=brightSnr)['astromRms'].quantity
+            measurements[name] = _quantityToJson(quantity)
+
+        return {'measurements': measurements, 'warm': warm, 'elapsed': time.time() - start}
+
+    def status(self):
+        """Repositories and datasets held in memory."""
+        return {'butlers': sorted(self.butlers),
+                'datasets': [json.loads(key) for key in self.datasets]}
+
+    def evict(self, repo=None):
+        """Drop the butler, data IDs and datasets of a repository, or all of
+        them, e.g. after it was reprocessed."""
+        for key in list(self.datasets):
+            if repo is None or json.loads(key)[0] == repo:
+                del self.datasets[key]
+        for repoFilter in list(self.dataIds):
+            if repo is None or repoFilter[0] == repo:
+                del self.dataIds[repoFilter]
+        for name in list(self.butlers):
+            if repo is None or name == repo:
+                del self.butlers[name]
+
+
+def _checkRequest(request):
+    """Raise `RequestError` if a request cannot be computed.
+
+    This is checked before any dataset is built, so that errors raised
+    while building or measuring are not mistaken for errors of the request.
+    """
+    if not isinstance(request, dict):
+        raise RequestError("A request must be a JSON object")
+    if 'repo' not in request:
+        raise RequestError("A request needs a repo")
+    dataIds = request.get('dataIds')
+    if dataIds is not None and not all(isinstance(dataId, dict) for dataId in dataIds):
+        raise RequestError("dataIds must be a list of objects")
+    knownMetrics = (list(ValidationService.amxDistances) + list(ValidationService.texDistances) +
+                    ['PA1', 'photScatter', 'astromRms'])
+    for name in request.get('metrics', []):
+        if name not in knownMetrics:
+            raise RequestError("Unknown metric '%s'" % name)
+
+
+def _quantityToJson(quantity):
+    if quantity is None:
+        return None
+    if isinstance(quantity, u.Quantity):
+        value, unit = quantity.value, str(quantity.unit)
+    else:
+        value, unit = quantity, ''
+    value = float(value)
+    if not np.isfinite(value):
+        return None
+    return {'value': value, 'unit': unit}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """JSON API of a `ValidationService`.
+
+    ``POST /metrics`` computes a request; ``POST /evict`` drops the data of
+    the ``repo`` of the request body (all data if none); ``GET /status``
+    lists what is in memory.
+    """
+
+    service = None
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self._reply(200, self.service.status())
+        else:
+            self._reply(404, {'error': "Unknown path %s" % self.path})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                request = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            except ValueError as e:
+                raise RequestError("Invalid JSON: %s" % e)
+            if self.path.rstrip('/') == '/metrics':
+                self._reply(200, self.service.compute(request))
+            elif self.path.rstrip('/') == '/evict':
+                self.service.evict(request.get('repo'))
+                self._reply(200, self.service.status())
+            else:
+                self._reply(404, {'error': "Unknown path %s" % self.path})
+        except RequestError as e:
+            self._reply(400, {'error': "Bad request: %s" % e})
+        except Exception as e:
+            self._reply(500, {'error': "%s: %s" % (type(e).__name__, e)})
+
+    def _reply(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(service, host='localhost', port=8732):
+    """Answer requests to a `ValidationService` over HTTP until interrupted.
+
+    Parameters
+    ----------
+    service : `ValidationService`
+        Service that computes the metrics.
+    host : `str`, optional
+        Address to listen on.  The default only accepts local connections.
+    port : `int`, optional
+        Port to listen on.
+
+    Notes
+    -----
+    Requests are answered one at a time, so a dataset is never built twice
+    concurrently.  For example::
+
+        curl -d '{"repo": "CFHT/output", "filter": "r", "annulusWidth": 1}' \\
+            localhost:8732/metrics
+    """
+    handler = type('RequestHandler', (_RequestHandler,), {'service': service})
+    server = HTTPServer((host, port), handler)
+    print("Serving validate_drp metrics on http://%s:%d" % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,395 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Multi-visit matching split into independent sky tiles.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object, range
+
+import multiprocessing
+import os
+
+import numpy as np
+
+from .incremental import ObjectMatcher
+
+
+__all__ = ['SkyTiling', 'shardedMatch', 'TiledCatalogs']
+
+
+class SkyTiling(object):
+    """Partition of the sphere into tiles of roughly equal size.
+
+    Tiles are bounded by lines of constant declination (bands) and constant
+    right ascension.  Each band has as many tiles as fit at its edge closest
+    to the equator, so no tile is narrower than ``tileSize``.
+
+    Parameters
+    ----------
+    tileSize : `float`
+        Approximate side of a tile in radians.
+    """
+
+    def __init__(self, tileSize):
+        self.nBands = max(1, int(np.ceil(np.pi / tileSize)))
+        self.bandHeight = np.pi / self.nBands
+        lower = -np.pi/2 + self.bandHeight*np.arange(self.nBands)
+        upper = lower + self.bandHeight
+        nearEquator = np.where((lower < 0) & (upper > 0), 0., np.minimum(np.abs(lower), np.abs(upper)))
+        self.nRa = np.maximum(1, np.floor(2*np.pi*np.cos(nearEquator) / tileSize)).astype(int)
+        self.raWidth = 2*np.pi / self.nRa
+        self.firstTile = np.concatenate(([0], np.cumsum(self.nRa)[:-1]))
+        self.bandLower = lower
+
+    @property
+    def nTiles(self):
+        return int(self.nRa.sum())
+
+    def _band(self, dec):
+        return np.clip(((dec + np.pi/2) / self.bandHeight).astype(int), 0, self.nBands - 1)
+
+    def tile(self, ra, dec):
+        """Tile that contains each position."""
+        ra = np.asarray(ra) % (2*np.pi)
+        band = self._band(np.asarray(dec))
+        ix = np.minimum((ra / self.raWidth[band]).astype(int), self.nRa[band] - 1)
+        return self.firstTile[band] + ix
+
+    def tilesWithin(self, ra, dec, margin):
+        """Tiles whose area, grown by ``margin``, contains each position.
+
+        Parameters
+        ----------
+        ra, dec : `numpy.ndarray`
+            Positions in radians.
+        margin : `float`
+            Margin in radians.
+
+        Returns
+        -------
+        rows : `numpy.ndarray`
+            Index of the position.
+        tiles : `numpy.ndarray`
+            Tile id; every tile within ``margin`` of a position is listed once.
+        """
+        ra = np.asarray(ra) % (2*np.pi)
+        dec = np.asarray(dec)
+        index = np.arange(len(ra))
+        band = self._band(dec)
+        # Conservative RA half-width of the margin at these declinations.
+        cosDec = np.cos(np.minimum(np.abs(dec) + margin, np.pi/2))
+        dra = np.where(cosDec > margin / np.pi, margin / np.maximum(cosDec, 1e-12), np.pi)
+
+        allRows = []
+        allTiles = []
+        nBandSteps = int(np.ceil(margin / self.bandHeight))
+        for step in range(-nBandSteps, nBandSteps + 1):
+            b = band + step
+            valid = (b >= 0) & (b < self.nBands)
+            b = np.clip(b, 0, self.nBands - 1)
+            lower = self.bandLower[b]
+            valid &= (dec >= lower - margin) & (dec <= lower + self.bandHeight + margin)
+            width = self.raWidth[b]
+            first = np.floor((ra - dra) / width).astype(int)
+            last = np.floor((ra + dra) / width).astype(int)
+            for offset in range(int((last - first).max()) + 1 if len(ra) else 0):
+                ix = first + offset
+                use = valid & (ix <= last)
+                allRows.append(index[use])
+                allTiles.append(self.firstTile[b[use]] + ix[use] % self.nRa[b[use]])
+
+        rows = np.concatenate(allRows) if allRows else np.array([], dtype=int)
+        tiles = np.concatenate(allTiles) if allTiles else np.array([], dtype=int)
+        key = np.unique(rows.astype(np.int64) * self.nTiles + tiles)
+        return key // self.nTiles, key % self.nTiles
+
+
+def _matchTile(args):
+    """Match the sources of one tile, in order of their catalogs."""
+    tile, ra, dec, catalogIndex, isCore, matchRadius = args
+    matcher = ObjectMatcher(matchRadius)
+    tileRows = []
+    tileObjects = []
+    refRows = []
+    # Sources are sorted by catalog, so the catalogs are contiguous.
+    bounds = np.flatnonzero(np.diff(catalogIndex)) + 1
+    for start, stop in zip(np.append(0, bounds), np.append(bounds, len(ra))):
+        nObjects = matcher.nObjects
+        rows, objectIds = matcher.match(ra[start:stop], dec[start:stop])
+        tileRows.append(rows + start)
+        tileObjects.append(objectIds)
+        # New objects are the unmatched sources, in order, at the end.
+        refRows.append(rows[len(rows) - (matcher.nObjects - nObjects):] + start)
+
+    tileRows = np.concatenate(tileRows) if tileRows else np.array([], dtype=int)
+    tileObjects = np.concatenate(tileObjects) if tileObjects else np.array([], dtype=int)
+    refRows = np.concatenate(refRows) if refRows else np.array([], dtype=int)
+
+    # Keep only objects whose reference source lies in the core of this
+    # tile; the others belong to a neighbouring tile.
+    coreObject = isCore[refRows]
+    keep = coreObject[tileObjects - 1]
+    return tile, tileRows[keep], tileObjects[keep], refRows
+
+
+def _makeTiling(matchRadius, tileSize, margin):
+    """Tiling and margin for matching, see `shardedMatch`."""
+    if margin is None:
+        margin = 2*matchRadius
+    if margin < matchRadius:
+        raise ValueError("The tile margin must be at least the match radius")
+    return SkyTiling(max(tileSize, 2*margin)), margin
+
+
+def _numberObjects(sourceRanks, refRanks):
+    """Global object ids of the matches of all tiles.
+
+    Parameters
+    ----------
+    sourceRanks : `numpy.ndarray`
+        Processing rank of the source of each match.
+    refRanks : `numpy.ndarray`
+        Processing rank of the reference source of the object of each match.
+
+    Returns
+    -------
+    objectIds : `numpy.ndarray`
+        Object id of each match, numbered by the rank of its reference.
+    order : `numpy.ndarray`
+        Order of the matches of `ObjectMatcher`: by source rank, then object.
+    """
+    uniqueRanks, objectIndex = np.unique(refRanks, return_inverse=True)
+    objectIds = objectIndex + 1
+    return objectIds, np.lexsort((objectIds, sourceRanks))
+
+
+def shardedMatch(ra, dec, catalogIndex, matchRadius, tileSize, margin=None, nProcesses=1):
+    """Match sources across catalogs, tile by tile.
+
+    Parameters
+    ----------
+    ra, dec : `numpy.ndarray`
+        Coordinates of all sources in radians.
+    catalogIndex : `numpy.ndarray`
+        Index of the catalog (data ID) of each source.  Catalogs are matched
+        in increasing order, and sources within a catalog in their given
+        order, as `lsst.afw.table.MultiMatch` does.
+    matchRadius : `float`
+        Match radius in radians.
+    tileSize : `float`
+        Approximate side of a tile in radians; see `SkyTiling`.
+    margin : `float`, optional
+        Sources within this distance of a tile are matched with it.  Must be
+        at least ``matchRadius``; default ``2*matchRadius``.
+    nProcesses : `int`, optional
+        Number of tiles matched in parallel.
+
+    Returns
+    -------
+    rows : `numpy.ndarray`
+        Index of the source of each match.
+    objectIds : `numpy.ndarray`
+        Object id of each match, starting at 1 and numbered in the order in
+        which objects are first detected.
+
+    Notes
+    -----
+    Each object is owned by the tile that contains its reference position
+    (that of its first detection), and the matches of all sources within
+    the margin of that tile are computed there.  The result is the same as
+    matching all sources at once with `lsst.validate.drp.incremental.ObjectMatcher`,
+    unless references form chains of overlapping match circles that extend
+    beyond the margin, which for sub-arcsecond radii only happens in very
+    crowded fields.
+    """
+    tiling, margin = _makeTiling(matchRadius, tileSize, margin)
+
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    catalogIndex = np.asarray(catalogIndex)
+    nSources = len(ra)
+    # Global processing order: by catalog, then by position in the catalog.
+    order = np.argsort(catalogIndex, kind='mergesort')
+    rank = np.empty(nSources, dtype=np.int64)
+    rank[order] = np.arange(nSources)
+
+    coreTile = tiling.tile(ra, dec)
+    memberRows, memberTiles = tiling.tilesWithin(ra, dec, margin)
+
+    # Sort members by tile, then by processing order.
+    memberOrder = np.lexsort((rank[memberRows], memberTiles))
+    memberRows = memberRows[memberOrder]
+    memberTiles = memberTiles[memberOrder]
+    tiles, starts = np.unique(memberTiles, return_index=True)
+    stops = np.append(starts[1:], len(memberTiles))
+
+    def tasks():
+        for tile, start, stop in zip(tiles, starts, stops):
+            rows = memberRows[start:stop]
+            yield (tile, ra[rows], dec[rows], catalogIndex[rows],
+                   coreTile[rows] == tile, matchRadius)
+
+    if nProcesses > 1:
+        pool = multiprocessing.Pool(nProcesses)
+        try:
+            results = pool.map(_matchTile, tasks())
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_matchTile(task) for task in tasks()]
+
+    # Stitch: give every kept object a global id, numbered by the
+    # processing rank of its reference source.
+    allRows = []
+    allRefRanks = []
+    startOf = dict(zip(tiles, starts))
+    for tile, tileRows, tileObjects, refRows in results:
+        globalRows = memberRows[startOf[tile] + tileRows]
+        refGlobalRows = memberRows[startOf[tile] + refRows]
+        allRows.append(globalRows)
+        allRefRanks.append(rank[refGlobalRows][tileObjects - 1])
+
+    if not allRows:
+        return np.array([], dtype=int), np.array([], dtype=np.int64)
+    rows = np.concatenate(allRows)
+    objectIds, outputOrder = _numberObjects(rank[rows], np.concatenate(allRefRanks))
+    return rows[outputOrder], objectIds[outputOrder]
+
+
+def _matchSpilledTile(args):
+    """Read the sources of one tile written by `TiledCatalogs` and match them."""
+    tile, directory, chunks, names, tiling, matchRadius = args
+    columns = {}
+    for name in names + ['rank']:
+        columns[name] = np.concatenate(
+            [np.load(os.path.join(directory, 'catalog_%06d' % catalogIndex, name + '.npy'),
+                     mmap_mode='r')[start:stop] for catalogIndex, start, stop in chunks])
+    ra = columns['coord_ra'].astype(float)
+    dec = columns['coord_dec'].astype(float)
+    catalogIndex = np.repeat([chunk[0] for chunk in chunks],
+                             [chunk[2] - chunk[1] for chunk in chunks])
+    isCore = tiling.tile(ra, dec) == tile
+
+    tile, tileRows, tileObjects, refRows = _matchTile((tile, ra, dec, catalogIndex, isCore,
+                                                       matchRadius))
+    rank = columns.pop('rank')
+    matched = {name: values[tileRows] for name, values in columns.items()}
+    return matched, rank[tileRows], rank[refRows][tileObjects - 1]
+
+
+class TiledCatalogs(object):
+    """Source catalogs written to disk by sky tile, to be matched one tile
+    at a time.
+
+    Only one catalog, one tile and the matches are held in memory, instead
+    of all sources at once as for `shardedMatch`, whose result this gives.
+
+    Parameters
+    ----------
+    directory : `str`
+        Directory for the sources of each catalog, sorted by tile.  It is
+        created if needed; the caller removes it.
+    matchRadius : `float`
+        Match radius in radians.
+    tileSize : `float`
+        Approximate side of a tile in radians; see `SkyTiling`.
+    margin : `float`, optional
+        Sources within this distance of a tile are matched with it; see
+        `shardedMatch`.
+    """
+
+    def __init__(self, directory, matchRadius, tileSize, margin=None):
+        self.directory = directory
+        self.matchRadius = matchRadius
+        self.tiling, self.margin = _makeTiling(matchRadius, tileSize, margin)
+        self.names = None
+        self.nCatalogs = 0
+        self.nSources = 0
+        # Catalog index and row range of the sources of each tile.
+        self._chunks = {}
+
+    def add(self, columns):
+        """Write the sources of the next catalog.
+
+        Parameters
+        ----------
+        columns : `dict` of `numpy.ndarray`
+            Per-source arrays including ``coord_ra`` and ``coord_dec`` in
+            radians.  The same columns must be given for every catalog.
+        """
+        if self.names is None:
+            self.names = sorted(columns)
+        rows, tiles = self._tileRows(columns['coord_ra'], columns['coord_dec'])
+
+        catalogDir = os.path.join(self.directory, 'catalog_%06d' % self.nCatalogs)
+        os.makedirs(catalogDir)
+        for name in self.names:
+            np.save(os.path.join(catalogDir, name + '.npy'), np.asarray(columns[name])[rows])
+        # Sources are matched in order of this rank, as in shardedMatch.
+        np.save(os.path.join(catalogDir, 'rank.npy'), rows.astype(np.int64) + self.nSources)
+
+        tileIds, starts = np.unique(tiles, return_index=True)
+        stops = np.append(starts[1:], len(tiles))
+        for tile, start, stop in zip(tileIds, starts, stops):
+            self._chunks.setdefault(tile, []).append((self.nCatalogs, start, stop))
+        self.nCatalogs += 1
+        self.nSources += len(columns['coord_ra'])
+
+    def _tileRows(self, ra, dec):
+        """Rows of each tile within the margin of the sources, sorted by tile."""
+        rows, tiles = self.tiling.tilesWithin(ra, dec, self.margin)
+        order = np.lexsort((rows, tiles))
+        return rows[order], tiles[order]
+
+    def match(self, nProcesses=1):
+        """Match the sources of all catalogs, tile by tile.
+
+        Parameters
+        ----------
+        nProcesses : `int`, optional
+            Number of tiles matched in parallel.
+
+        Returns
+        -------
+        matched : `dict` of `numpy.ndarray`
+            Columns of the source of each match, in the order of
+            `shardedMatch`, and its ``object`` id.
+        """
+        tasks = [(tile, self.directory, chunks, self.names, self.tiling, self.matchRadius)
+                 for tile, chunks in sorted(self._chunks.items())]
+        if nProcesses > 1:
+            pool = multiprocessing.Pool(nProcesses)
+            try:
+                results = pool.map(_matchSpilledTile, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_matchSpilledTile(task) for task in tasks]
+
+        if not results:
+            return None
+        objectIds, order = _numberObjects(np.concatenate([r[1] for r in results]),
+                                          np.concatenate([r[2] for r in results]))
+        matched = {'object': objectIds[order]}
+        for name in self.names:
+            matched[name] = np.concatenate([r[0].pop(name) for r in results])[order]
+        return matched
@@ -0,0 +1,235 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Per-object summary statistics accumulated one catalog at a time,
+without keeping the individual detections.
+"""
+
+from __future__ import print_function, absolute_import, division
+from builtins import object
+
+import numpy as np
+
+from .matcharrays import setStarStatistics
+from .incremental import flagNames, nMatchesRequired, goodSnr, safeMaxExtended, reserveRows
+
+
+__all__ = ['StreamingStarStatistics']
+
+
+def _occurrenceRank(objectIds):
+    """Rank of each entry among the entries with the same object id."""
+    order = np.argsort(objectIds, kind='mergesort')
+    sortedIds = objectIds[order]
+    isStart = np.ones(len(sortedIds), dtype=bool)
+    isStart[1:] = sortedIds[1:] != sortedIds[:-1]
+    starts = np.flatnonzero(isStart)
+    groupStart = np.repeat(starts, np.diff(np.append(starts, len(sortedIds))))
+    rank = np.empty(len(objectIds), dtype=int)
+    rank[order] = np.arange(len(sortedIds)) - groupStart
+    return rank
+
+
+def _sampleMedian(samples, count):
+    """Median of the filled reservoir slots of each object.
+
+    Slots are filled in order, so an object with ``count`` detections has
+    its first ``min(count, nSlots)`` slots filled and the others are NaN.
+    As with `numpy.median` in `lsst.validate.drp.matcharrays.reduceStars`,
+    the median is NaN if a kept value is NaN.
+    """
+    filled = np.arange(samples.shape[1]) < count[:, np.newaxis]
+    hasNan = np.any(filled & np.isnan(samples), axis=1)
+    median = np.nanmedian(samples, axis=1)
+    median[hasNan] = np.nan
+    return median
+
+
+class StreamingStarStatistics(object):
+    """Running per-object statistics of matched detections.
+
+    Parameters
+    ----------
+    quantileSamples : `int`, optional
+        Number of values kept per object for the median SNR and median
+        magnitude uncertainty.  Medians are exact for objects with at most
+        this many detections, and are estimated from a uniform random
+        sample (reservoir) of that size otherwise.
+    seed : `int`, optional
+        Seed for the reservoir sampling.
+
+    Notes
+    -----
+    Mean and RMS magnitudes are accumulated with Welford's algorithm, and the
+    position RMS from Welford accumulators of the offsets from the first
+    detection in the local tangent plane, which is accurate well beyond the
+    match radius.  Memory use is proportional to the number of objects and
+    independent of the number of visits.
+
+    The statistics are those of `lsst.validate.drp.matcharrays.reduceStars`,
+    but individual detections are not kept, so ``goodMatches`` and
+    ``safeMatches`` are not available for the metrics that need them.
+
+    Object ids must come from a matcher that assigns them as catalogs
+    arrive, i.e. `lsst.validate.drp.incremental.ObjectMatcher` rather than
+    `lsst.afw.table.MultiMatch`.  Its objects are not quite those of
+    ``MultiMatch``: a source is matched to every object whose first
+    detection lies within the match radius, so a source between two close
+    objects contributes to both, whereas ``MultiMatch`` assigns it to one.
+    """
+
+    # Value of the accumulators of an object without detections.
+    _initialValues = {'maxExtended': -np.inf, 'snrSamples': np.nan, 'magErrSamples': np.nan}
+
+    def __init__(self, quantileSamples=32, seed=None):
+        self.quantileSamples = quantileSamples
+        self._rng = np.random.RandomState(seed)
+        self.nObjects = 0
+
+        # Per-object accumulators with room for more objects; the public
+        # attributes are views of their first ``nObjects`` rows.
+        self._buffers = {}
+        for name in ('count', 'nFlagged', 'nNonFinite'):
+            self._buffers[name] = np.zeros(0, dtype=np.int64)
+        for name in ('maxExtended', 'magMean', 'magM2', 'ra0', 'dec0', 'xMean', 'xM2', 'yMean',
+                     'yM2'):
+            self._buffers[name] = np.zeros(0)
+        self._buffers['snrSamples'] = np.zeros((0, quantileSamples))
+        self._buffers['magErrSamples'] = np.zeros((0, quantileSamples))
+        self._grow(0)
+
+    def _grow(self, nObjects):
+        nObjects = max(nObjects, self.nObjects)
+        for name, values in self._buffers.items():
+            values = reserveRows(values, nObjects, fill=self._initialValues.get(name, 0))
+            self._buffers[name] = values
+            setattr(self, name, values[:nObjects])
+        self.nObjects = nObjects
+
+    def update(self, objectIds, columns):
+        """Add matched detections.
+
+        Parameters
+        ----------
+        objectIds : `numpy.ndarray`
+            Object id (starting at 1) of each detection.
+        columns : `dict` of `numpy.ndarray`
+            Per-detection ``coord_ra``, ``coord_dec`` (radians),
+            ``base_PsfFlux_mag``, ``base_PsfFlux_magErr``,
+            ``base_PsfFlux_snr``, ``base_ClassificationExtendedness_value``
+            and pixel flags.
+        """
+        objectIds = np.asarray(objectIds)
+        if len(objectIds) == 0:
+            return
+        self._grow(objectIds.max())
+
+        flagged = np.zeros(len(objectIds), dtype=bool)
+        for name in flagNames:
+            flagged |= np.asarray(columns[name], dtype=bool)
+        mag = np.asarray(columns['base_PsfFlux_mag'], dtype=float)
+        snr = np.asarray(columns['base_PsfFlux_snr'], dtype=float)
+        # A non-finite SNR makes the median SNR non-finite, which fails
+        # every SNR cut, so it is counted like a non-finite magnitude.
+        nonFinite = ~np.isfinite(mag) | np.isnan(snr)
+
+        # Each object occurs at most once per round, so the updates of a
+        # round can be applied with fancy indexing.
+        rank = _occurrenceRank(objectIds)
+        for r in range(rank.max() + 1):
+            rows = np.flatnonzero(rank == r)
+            self._updateRound(objectIds[rows] - 1, rows, columns, flagged, nonFinite)
+
+    def _updateRound(self, index, rows, columns, flagged, nonFinite):
+        ra = np.asarray(columns['coord_ra'], dtype=float)[rows]
+        dec = np.asarray(columns['coord_dec'], dtype=float)[rows]
+        mag = np.asarray(columns['base_PsfFlux_mag'], dtype=float)[rows]
+
+        first = self.count[index] == 0
+        self.ra0[index[first]] = ra[first]
+        self.dec0[index[first]] = dec[first]
+
+        self.count[index] += 1
+        n = self.count[index]
+        self.nFlagged[index] += flagged[rows]
+        self.nNonFinite[index] += nonFinite[rows]
+        self.maxExtended[index] = np.maximum(
+            self.maxExtended[index],
+            np.asarray(columns['base_ClassificationExtendedness_value'], dtype=float)[rows])
+
+        # Welford updates.  Non-finite magnitudes make the object bad, so
+        # they are left out rather than poisoning the mean.
+        finite = np.isfinite(mag)
+        delta = np.where(finite, mag - self.magMean[index], 0.)
+        self.magMean[index] += delta / n
+        self.magM2[index] += delta * np.where(finite, mag - self.magMean[index], 0.)
+
+        dra = (ra - self.ra0[index] + np.pi) % (2*np.pi) - np.pi
+        for offset, meanName, m2Name in ((dra * np.cos(self.dec0[index]), 'xMean', 'xM2'),
+                                         (dec - self.dec0[index], 'yMean', 'yM2')):
+            mean = getattr(self, meanName)
+            m2 = getattr(self, m2Name)
+            delta = offset - mean[index]
+            mean[index] += delta / n
+            m2[index] += delta * (offset - mean[index])
+
+        # Reservoir sampling for the medians.
+        slot = n - 1
+        full = slot >= self.quantileSamples
+        slot[full] = (self._rng.uniform(size=full.sum()) * n[full]).astype(int)
+        keep = slot < self.quantileSamples
+        for samples, name in ((self.snrSamples, 'base_PsfFlux_snr'),
+                              (self.magErrSamples, 'base_PsfFlux_magErr')):
+            values = np.asarray(columns[name], dtype=float)[rows]
+            samples[index[keep], slot[keep]] = values[keep]
+
+    def reduce(self, blob, safeSnr=50.):
+        """Store the summary statistics of the good stars in a Blob.
+
+        Parameters
+        ----------
+        blob : `lsst.verify.Blob`
+            ``MatchedMultiVisitDataset`` with a ``filterName`` Datum.
+        safeSnr : `float`, optional
+            Minimum median SNR for a match to be considered "safe".
+
+        Returns
+        -------
+        good, safe : `numpy.ndarray` of `bool`
+            Which objects are good and safe matches.
+        """
+        with np.errstate(invalid='ignore'):
+            medianSnr = _sampleMedian(self.snrSamples, self.count)
+            medianMagErr = _sampleMedian(self.magErrSamples, self.count)
+
+            good = (self.count >= nMatchesRequired) & (self.nFlagged == 0) & \
+                (self.nNonFinite == 0) & (medianSnr >= goodSnr)
+            safe = good & (medianSnr >= safeSnr) & (self.maxExtended < safeMaxExtended)
+
+            n = np.maximum(self.count, 1)
+            magRms = np.sqrt(self.magM2 / n)
+            posRms = np.rad2deg(np.sqrt((self.xM2 + self.yM2) / n))*3600*1000
+
+        setStarStatistics(blob,
+                          snr=medianSnr[good],
+                          mag=self.magMean[good],
+                          magrms=magRms[good],
+                          magerr=medianMagErr[good],
+                          dist=posRms[good])
+        return good, safe
@@ -0,0 +1,240 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+"""Synthetic multi-visit star fields for testing and benchmarking the
+metric calculations without a Butler repository.
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import numpy as np
+import astropy.units as u
+
+import lsst.pipe.base as pipeBase
+
+from .photerrmodel import photErrModel
+from .astromerrmodel import astromErrModel
+
+
+__all__ = ['makeSyntheticStarField', 'makeSyntheticGroupView',
+           'makeSyntheticMatchedArrays', 'makeSyntheticMatchedDataset']
+
+
+flagNames = ['base_PixelFlags_flag_%s' % flag for flag in ("saturated", "cr", "bad", "edge")]
+
+
+def makeSyntheticStarField(nObjects=1000, nVisits=5, footprint=1.0,
+                           raCenter=150.0, decCenter=2.0, magRange=(17.0, 24.5),
+                           sigmaSys=0.005, gamma=0.039, m5=24.35,
+                           seeing=700.0, astromSigmaSys=5.0,
+                           psfEllipticityRms=0.02, shapeNoise=0.01,
+                           detectionFraction=1.0, seed=None):
+    """Make a matched multi-visit catalog of stars with known noise properties.
+
+    Parameters
+    ----------
+    nObjects : `int`, optional
+        Number of stars.
+    nVisits : `int`, optional
+        Number of visits.
+    footprint : `float`, optional
+        Side of the square sky region covered by the stars (degrees).
+    raCenter, decCenter : `float`, optional
+        Center of the sky region (degrees).
+    magRange : 2-element sequence, optional
+        Stars are drawn with magnitudes uniformly distributed in this range.
+    sigmaSys, gamma, m5 : `float`, optional
+        Parameters of the single-visit photometric error model, see
+        `lsst.validate.drp.photerrmodel.photErrModel` (mag, '', mag).
+    seeing, astromSigmaSys : `float`, optional
+        Parameters of the astrometric error model, see
+        `lsst.validate.drp.astromerrmodel.astromErrModel` (milliarcsec).
+        The model gives the per-coordinate scatter of each detection.
+    psfEllipticityRms : `float`, optional
+        RMS of the per-visit PSF ellipticity components.
+    shapeNoise : `float`, optional
+        RMS of the measured star ellipticity around the PSF ellipticity.
+    detectionFraction : `float`, optional
+        Probability that a star is detected in a given visit.
+    seed : `int`, optional
+        Seed for the random number generator.
+
+    Returns
+    -------
+    field : `lsst.pipe.base.Struct`
+        Per-detection arrays sorted by object, named like the columns of
+        the matched catalog: ``object``, ``visit``, ``coord_ra``,
+        ``coord_dec`` (radians), ``base_PsfFlux_mag``,
+        ``base_PsfFlux_magErr``, ``base_PsfFlux_snr``, ``e1``, ``e2``,
+        ``psf_e1``, ``psf_e2``, ``base_ClassificationExtendedness_value``
+        and the pixel flags used to select good matches (all `False`).
+        The true positions and magnitudes of the stars are in
+        ``trueRa``, ``trueDec`` (radians) and ``trueMag``.
+    """
+    rng = np.random.RandomState(seed)
+
+    halfWidth = footprint / 2
+    trueDec = decCenter + rng.uniform(-halfWidth, halfWidth, nObjects)
+    trueRa = raCenter + rng.uniform(-halfWidth, halfWidth, nObjects) / np.cos(np.deg2rad(trueDec))
+    trueMag = rng.uniform(magRange[0], magRange[1], nObjects)
+
+    visits = np.arange(nVisits) + 1
+    psfE1 = rng.normal(0, psfEllipticityRms, nVisits)
+    psfE2 = rng.normal(0, psfEllipticityRms, nVisits)
+
+    objectIndex, visitIndex = np.meshgrid(np.arange(nObjects), np.arange(nVisits), indexing='ij')
+    detected = rng.uniform(size=objectIndex.shape) < detectionFraction
+    objectIndex = objectIndex[detected]
+    visitIndex = visitIndex[detected]
+    nDetections = len(objectIndex)
+
+    magErr = photErrModel(trueMag[objectIndex], sigmaSys, gamma, m5)
+    mag = trueMag[objectIndex] + rng.normal(0, 1, nDetections) * magErr
+    # sigma(mag) = 2.5/ln(10) / SNR
+    snr = 2.5 / np.log(10) / magErr
+
+    posErr = astromErrModel(snr, theta=seeing, sigmaSys=astromSigmaSys) * u.marcsec
+    posErrDeg = posErr.to(u.deg).value
+    dec = trueDec[objectIndex] + rng.normal(0, 1, nDetections) * posErrDeg
+    ra = trueRa[objectIndex] + \
+        rng.normal(0, 1, nDetections) * posErrDeg / np.cos(np.deg2rad(trueDec[objectIndex]))
+
+    e1 = psfE1[visitIndex] + rng.normal(0, shapeNoise, nDetections)
+    e2 = psfE2[visitIndex] + rng.normal(0, shapeNoise, nDetections)
+
+    columns = {
+        'object': objectIndex + 1,
+        'visit': visits[visitIndex],
+        'coord_ra': np.deg2rad(ra),
+        'coord_dec': np.deg2rad(dec),
+        'base_PsfFlux_mag': mag,
+        'base_PsfFlux_magErr': magErr,
+        'base_PsfFlux_snr': snr,
+        'e1': e1,
+        'e2': e2,
+        'psf_e1': psfE1[visitIndex],
+        'psf_e2': psfE2[visitIndex],
+        'base_ClassificationExtendedness_value': np.zeros(nDetections),
+    }
+    for flagName in flagNames:
+        columns[flagName] = np.zeros(nDetections, dtype=bool)
+
+    return pipeBase.Struct(trueRa=np.deg2rad(trueRa), trueDec=np.deg2rad(trueDec),
+                           trueMag=trueMag, **columns)
+
+
+def makeSyntheticGroupView(field):
+    """Convert a synthetic star field into an `lsst.afw.table.GroupView`.
+
+    Parameters
+    ----------
+    field : `lsst.pipe.base.Struct`
+        Output of `makeSyntheticStarField`.
+
+    Returns
+    -------
+    groupView : `lsst.afw.table.GroupView`
+        Matched detections grouped by ``object``, with the same column names
+        as the output of `lsst.validate.drp.matchreduce.build_matched_dataset`.
+    """
+    import lsst.afw.table as afwTable
+
+    schema = afwTable.SimpleTable.makeMinimalSchema()
+    schema.addField('object', type=np.int64, doc='Object ID')
+    schema.addField('visit', type=np.int32, doc='Visit ID')
+    for name in ('base_PsfFlux_mag', 'base_PsfFlux_magErr', 'base_PsfFlux_snr',
+                 'e1', 'e2', 'psf_e1', 'psf_e2', 'base_ClassificationExtendedness_value'):
+        schema.addField(name, type=float, doc=name)
+    for flagName in flagNames:
+        schema.addField(flagName, type='Flag', doc=flagName)
+
+    catalog = afwTable.SimpleCatalog(schema)
+    # A freshly resized catalog is contiguous, so columns can be assigned
+    # as arrays.  Flags are left at their default of False.
+    catalog.resize(len(field.object))
+    catalog['id'][:] = np.arange(len(field.object)) + 1
+    for name in schema.getNames():
+        if name == 'id' or name in flagNames:
+            continue
+        catalog[name][:] = getattr(field, name)
+
+    return afwTable.GroupView.build(catalog)
+
+
+def makeSyntheticMatchedArrays(field):
+    """Convert a synthetic star field into a
+    `lsst.validate.drp.matcharrays.MatchedArrays`.
+
+    Parameters
+    ----------
+    field : `lsst.pipe.base.Struct`
+        Output of `makeSyntheticStarField`.
+
+    Returns
+    -------
+    matchedArrays : `lsst.validate.drp.matcharrays.MatchedArrays`
+        Matched detections grouped by ``object``.
+    """
+    from .matcharrays import MatchedArrays
+
+    names = ['object', 'visit', 'coord_ra', 'coord_dec',
+             'base_PsfFlux_mag', 'base_PsfFlux_magErr', 'base_PsfFlux_snr',
+             'e1', 'e2', 'psf_e1', 'psf_e2',
+             'base_ClassificationExtendedness_value'] + flagNames
+    return MatchedArrays({name: getattr(field, name) for name in names}, isSorted=True)
+
+
+def makeSyntheticMatchedDataset(field, safeSnr=50., backend='afw'):
+    """Build a matched dataset Blob from a synthetic star field.
+
+    Parameters
+    ----------
+    field : `lsst.pipe.base.Struct`
+        Output of `makeSyntheticStarField`.
+    safeSnr : `float`, optional
+        Minimum median SNR for a match to be considered "safe".
+    backend : {'afw', 'arrays'}, optional
+        Store the matches in an `lsst.afw.table.GroupView` or in a
+        `lsst.validate.drp.matcharrays.MatchedArrays`.
+
+    Returns
+    -------
+    blob : `lsst.verify.Blob`
+        A ``MatchedMultiVisitDataset`` like that of
+        `lsst.validate.drp.matchreduce.build_matched_dataset`, suitable for
+        the `lsst.validate.drp.calcsrd` measurement functions.
+    """
+    from .matcharrays import build_matched_dataset_from_arrays, reduceStars
+
+    if backend == 'arrays':
+        return build_matched_dataset_from_arrays(makeSyntheticMatchedArrays(field),
+                                                 'synthetic', safeSnr=safeSnr)
+    elif backend != 'afw':
+        raise ValueError("Unknown backend '%s'; use 'afw' or 'arrays'" % backend)
+
+    from lsst.verify import Blob, Datum
+
+    blob = Blob('MatchedMultiVisitDataset')
+    blob['filterName'] = Datum(quantity='synthetic', description='Filter name')
+    blob['useJointCal'] = Datum(quantity=False,
+                                description='Whether jointcal/meas_mosaic calibrations were used')
+    blob._matchedCatalog = makeSyntheticGroupView(field)
+    blob.magKey = blob._matchedCatalog.schema.find("base_PsfFlux_mag").key
+    reduceStars(blob, blob._matchedCatalog, safeSnr)
+    return blob
@@ -24,15 +24,16 @@ from builtins import zip
 from past.builtins import basestring
 
 import os
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 from numpy.lib import scimath as SM
 
 import yaml
 
-import lsst.daf.persistence as dafPersist
-import lsst.pipe.base as pipeBase
-import lsst.afw.geom as afwGeom
+# The butler and pipe_base are imported by the functions that need them,
+# so that the numpy backend (e.g. `lsst.validate.drp.matcharrays`) can be
+# used without them.
 
 
 def ellipticity_from_cat(cat, slot_shape='slot_Shape'):
@@ -112,16 +113,26 @@ def averageRaDec(ra, dec):
     -------
     float, float
        meanRa, meanDec -- Tuple of average RA, Dec [radians]
+
+    Notes
+    -----
+    The average is the direction of the sum of the unit vectors,
+    as in `lsst.afw.geom.averageSpherePoint`, but computed with numpy
+    so that it does not require afw.
     """
     assert(len(ra) == len(dec))
 
-    angleRa = [afwGeom.Angle(r, afwGeom.radians) for r in ra]
-    angleDec = [afwGeom.Angle(d, afwGeom.radians) for d in dec]
-    coords = [afwGeom.SpherePoint(ar, ad, afwGeom.radians) for (ar, ad) in zip(angleRa, angleDec)]
+    ra = np.asarray(ra)
+    dec = np.asarray(dec)
+    cosDec = np.cos(dec)
+    x = np.sum(cosDec*np.cos(ra))
+    y = np.sum(cosDec*np.sin(ra))
+    z = np.sum(np.sin(dec))
 
-    meanRa, meanDec = afwGeom.averageSpherePoint(coords)
+    meanRa = np.arctan2(y, x) % (2*np.pi)
+    meanDec = np.arctan2(z, np.hypot(x, y))
 
-    return meanRa.asRadians(), meanDec.asRadians()
+    return meanRa, meanDec
 
 
 def averageRaDecFromCat(cat):
@@ -166,7 +177,7 @@ def positionRms(ra_avg, dec_avg, ra, dec):
     # We've already taken out the average,
     #   so we want the sqrt of the mean of the squares.
     pos_rms_rad = np.sqrt(np.mean(separations**2))  # radians
-    pos_rms_mas = afwGeom.radToMas(pos_rms_rad)  # milliarcsec
+    pos_rms_mas = np.rad2deg(pos_rms_rad)*3600*1000  # milliarcsec
 
     return pos_rms_mas
 
@@ -188,6 +199,98 @@ def positionRmsFromCat(cat):
     return positionRms(ra_avg, dec_avg, ra, dec)
 
 
+def groupedAverageRaDec(ra, dec, offsets):
+    """Calculate the average RA, Dec of many groups of positions at once.
+
+    Parameters
+    ----------
+    ra, dec : numpy.array of float
+        Positions [radians], sorted by group.
+    offsets : numpy.array of int
+        Index of the first position of each group, followed by the total
+        number of positions.  Groups must not be empty.
+
+    Returns
+    -------
+    numpy.array, numpy.array
+       meanRa, meanDec -- Average RA, Dec of each group [radians], as from
+       `averageRaDec`.
+    """
+    if len(offsets) < 2:
+        return np.array([]), np.array([])
+    starts = offsets[:-1]
+    cosDec = np.cos(dec)
+    x = np.add.reduceat(cosDec*np.cos(ra), starts)
+    y = np.add.reduceat(cosDec*np.sin(ra), starts)
+    z = np.add.reduceat(np.sin(dec), starts)
+
+    meanRa = np.arctan2(y, x) % (2*np.pi)
+    meanDec = np.arctan2(z, np.hypot(x, y))
+    return meanRa, meanDec
+
+
+def groupedPositionRms(ra, dec, offsets, meanRa=None, meanDec=None):
+    """Calculate the RMS of positions around their average for many groups.
+
+    Parameters
+    ----------
+    ra, dec : numpy.array of float
+        Positions [radians], sorted by group.
+    offsets : numpy.array of int
+        Index of the first position of each group, followed by the total
+        number of positions.  Groups must not be empty.
+    meanRa, meanDec : numpy.array of float, optional
+        Average position of each group [radians], if already known, e.g.
+        from `groupedAverageRaDec`.
+
+    Returns
+    -------
+    pos_rms -- RMS of positions of each group in milliarcsecond, as from
+        `positionRmsFromCat`.  numpy.array.
+    """
+    if len(offsets) < 2:
+        return np.array([])
+    if meanRa is None or meanDec is None:
+        meanRa, meanDec = groupedAverageRaDec(ra, dec, offsets)
+    counts = np.diff(offsets)
+    separations = sphDist(np.repeat(meanRa, counts), np.repeat(meanDec, counts), ra, dec)
+    pos_rms_rad = np.sqrt(np.add.reduceat(separations**2, offsets[:-1]) / counts)
+    return np.rad2deg(pos_rms_rad)*3600*1000
+
+
+def groupedPositionRmsFromCat(groupView):
+    """Calculate the RMS of positions of every group of a GroupView.
+
+    Equivalent to ``groupView.aggregate(positionRmsFromCat)``, but the
+    positions are only gathered from the groups, and the averages and RMS
+    are computed for all groups at once.
+
+    Parameters
+    ----------
+    groupView -- lsst.afw.table.GroupView or
+        lsst.validate.drp.matcharrays.MatchedArrays with 'coord_ra' and
+        'coord_dec' fields in radians.
+
+    Returns
+    -------
+    pos_rms -- RMS of positions of each group in milliarcsecond.  numpy.array.
+    """
+    if hasattr(groupView, 'offsets'):
+        ra = groupView.column('coord_ra')
+        dec = groupView.column('coord_dec')
+        offsets = groupView.offsets
+    else:
+        raKey = groupView.schema.find('coord_ra').key
+        decKey = groupView.schema.find('coord_dec').key
+        groups = groupView.groups
+        if len(groups) == 0:
+            return np.array([])
+        ra = np.concatenate([group.get(raKey) for group in groups])
+        dec = np.concatenate([group.get(decKey) for group in groups])
+        offsets = np.append(0, np.cumsum([len(group) for group in groups]))
+    return groupedPositionRms(ra, dec, offsets)
+
+
 def sphDist(ra1, dec1, ra2, dec2):
     """Calculate distance on the surface of a unit sphere.
 
@@ -212,8 +315,8 @@ def sphDist(ra1, dec1, ra2, dec2):
 
     # This will also work, but must run separately for each element
     # whereas the numpy version will run on either scalars or arrays:
-    #   sp1 = afwGeom.SpherePoint(ra1, dec1, afwGeom.radians)
-    #   sp2 = afwGeom.SpherePoint(ra2, dec2, afwGeom.radians)
+    #   sp1 = lsst.afw.geom.SpherePoint(ra1, dec1, lsst.afw.geom.radians)
+    #   sp2 = lsst.afw.geom.SpherePoint(ra2, dec2, lsst.afw.geom.radians)
     #   return sp1.separation(sp2).asRadians()
 
     return dist
@@ -390,13 +493,37 @@ def repoNameToPrefix(repo):
     return baserepo.lstrip('.').strip(os.sep).replace(os.sep, "_")
 
 
-def discoverDataIds(repo, **kwargs):
+def _makeButler(repo):
+    """Butler of a repository path."""
+    import lsst.daf.persistence as dafPersist
+    return dafPersist.Butler(repo)
+
+
+def discoverDataIds(repo, existenceCheck='scan', nThreads=8, **kwargs):
     """Retrieve a list of all dataIds in a repo.
 
     Parameters
     ----------
     repo : str
         Path of a repository with 'src' entries.
+    existenceCheck : {'scan', 'stat', 'butler'}, optional
+        How to check that the 'src' and 'calexp' datasets exist:
+
+        - ``'scan'``: list each directory that contains datasets once
+          (see `findExistingFiles`),
+        - ``'stat'``: stat every file, ``nThreads`` at a time,
+        - ``'butler'``: ask the butler about every dataset, ``nThreads``
+          at a time.  Use this for repositories whose datasets are not
+          plain files.
+
+        ``'scan'`` and ``'stat'`` build the file names from the butler's
+        templates, ask the butler about the files they do not find (e.g.
+        those of parent repositories), and fall back to ``'butler'`` if the
+        butler cannot give the file names.
+    nThreads : int, optional
+        Number of threads of the ``'stat'`` and ``'butler'`` checks.
+    **kwargs
+        Data ID keys and values to restrict the search to.
 
     Returns
     -------
@@ -405,22 +532,103 @@ def discoverDataIds(repo, **kwargs):
 
     Notes
     -----
-    May consider making this an iterator if large N becomes important.
-    However, will likely need to know things like, "all unique filters"
-    of a data set anyway, so would need to go through chain at least once.
+    All data IDs and their filters are obtained with a single metadata
+    query, instead of one query per data ID.
     """
-    butler = dafPersist.Butler(repo)
-    thisSubset = butler.subset(datasetType='src', **kwargs)
-    # This totally works, but would be better to do this as a TaskRunner?
-    dataIds = [dr.dataId for dr in thisSubset
-               if dr.datasetExists(datasetType='src') and dr.datasetExists(datasetType='calexp')]
-    # Make sure we have the filter information
-    for dId in dataIds:
-        response = butler.queryMetadata(datasetType='src', format=['filter'], dataId=dId)
-        filterForThisDataId = response[0]
-        dId['filter'] = filterForThisDataId
+    butler = _makeButler(repo)
+    keys = list(butler.getKeys(datasetType='src').keys())
+    if 'filter' not in keys:
+        keys.append('filter')
+    rows = butler.queryMetadata(datasetType='src', format=keys, dataId=kwargs)
+    if len(keys) == 1:
+        rows = [(row,) for row in rows]
+    dataIds = [dict(zip(keys, row)) for row in rows]
+
+    exists = np.ones(len(dataIds), dtype=bool)
+    for datasetType in ('src', 'calexp'):
+        exists &= _datasetsExist(butler, datasetType, dataIds, existenceCheck, nThreads)
+
+    return [dId for dId, e in zip(dataIds, exists) if e]
+
+
+def _datasetsExist(butler, datasetType, dataIds, existenceCheck, nThreads):
+    """Check whether a dataset exists for each of many data IDs."""
+    def datasetExists(dataId):
+        return butler.datasetExists(datasetType, dataId)
+
+    if existenceCheck in ('scan', 'stat'):
+        try:
+            # In write mode the butler fills in the file name template
+            # without looking for the file.  Strip FITS HDU specifications,
+            # e.g. ``calexp.fits[0]``.
+            paths = [butler.getUri(datasetType, dId, write=True).split('[')[0]
+                     for dId in dataIds]
+        except (AttributeError, TypeError, RuntimeError, NotImplementedError) as e:
+            print("Cannot get file names of %s datasets (%s); asking the butler instead" %
+                  (datasetType, e))
+        else:
+            exists = findExistingFiles(paths, method=existenceCheck, nThreads=nThreads)
+            # Datasets of a parent repository are not at the template path
+            # of this one, so the butler decides for the files not found.
+            missing = np.flatnonzero(~exists)
+            if len(missing) > 0:
+                exists[missing] = _threadMap(datasetExists, [dataIds[i] for i in missing],
+                                             nThreads)
+            return exists
+    elif existenceCheck != 'butler':
+        raise ValueError("Unknown existence check '%s'; use 'scan', 'stat' or 'butler'" %
+                         existenceCheck)
+
+    return np.array(_threadMap(datasetExists, dataIds, nThreads), dtype=bool)
+
+
+def _threadMap(function, items, nThreads):
+    if nThreads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(nThreads, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
 
-    return dataIds
+
+def findExistingFiles(paths, method='scan', nThreads=8):
+    """Check which of many files exist.
+
+    Parameters
+    ----------
+    paths : list of str
+        File names.
+    method : {'scan', 'stat'}, optional
+        ``'scan'`` lists every directory in ``paths`` once, which is much
+        faster than a stat per file on network file systems when there are
+        many files per directory.  ``'stat'`` stats every file, ``nThreads``
+        at a time.
+    nThreads : int, optional
+        Number of threads of the ``'stat'`` method.
+
+    Returns
+    -------
+    numpy.array of bool
+        Whether each file exists.
+    """
+    if method == 'stat':
+        return np.array(_threadMap(os.path.exists, paths, nThreads), dtype=bool)
+    if method != 'scan':
+        raise ValueError("Unknown method '%s'; use 'scan' or 'stat'" % method)
+
+    listings = {}
+    exists = np.zeros(len(paths), dtype=bool)
+    for i, path in enumerate(paths):
+        directory, name = os.path.split(path)
+        if directory not in listings:
+            try:
+                listings[directory] = set(os.listdir(directory or '.'))
+            except OSError:
+                listings[directory] = set()
+        exists[i] = name in listings[directory]
+    return exists
 
 
 def loadParameters(configFile):
@@ -438,6 +646,8 @@ def loadParameters(configFile):
     pipeBase.Struct
         with configuration parameters
     """
+    import lsst.pipe.base as pipeBase
+
     with open(configFile, mode='r') as stream:
         data = yaml.load(stream)
 
@@ -461,6 +671,8 @@ def loadDataIdsAndParameters(configFile):
         dataIds - dict
         and configuration parameters
     """
+    import lsst.pipe.base as pipeBase
+
     parameters = loadParameters(configFile).getDict()
 
     ccdKeyName = getCcdKeyName(parameters)
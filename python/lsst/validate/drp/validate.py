@@ -39,6 +39,16 @@ from lsst.verify import Blob, Datum, Name
 from lsst.verify import Job, MetricSet, SpecificationSet
 
 from .util import repoNameToPrefix
+from .instrumentation import StageTimer
+from .checkpoint import CatalogCheckpoint
+from .cache import MatchedDatasetCache, repositoryName
+from .incremental import dataIdToKey
+from .resultstore import ResultStore
+from .version import __version__
+from .readorder import planReadOrder, chooseSeedVisit
+from .estimate import measureWorkload
+from .memory import MemoryBudget
+from .export import exportMatchedDataset
 from .matchreduce import build_matched_dataset
 from .photerrmodel import build_photometric_error_model
 from .astromerrmodel import build_astrometric_error_model 
@@ -108,8 +118,8 @@ def get_filter_name_from_job(job):
 
 
 def run(repo_or_json, metrics=None,
-        outputPrefix=None, makePrint=True, makePlot=True,
-        level='design', metrics_package='verify_metrics', **kwargs):
+        outputPrefix=None, makePrint=True, makePlot=True, forcePlot=False,
+        maxScatterPoints=None, level='design', metrics_package='verify_metrics', **kwargs):
     """Main entrypoint from ``validateDrp.py``.
 
     Parameters
@@ -123,6 +133,11 @@ def run(repo_or_json, metrics=None,
         Print calculated quantities (to stdout).
     makePlot : `bool`, optional
         Create plots for metrics.  Saved to current working directory.
+    forcePlot : `bool`, optional
+        Regenerate plots even if existing files were made from the same inputs.
+    maxScatterPoints : `int`, optional
+        Maximum number of stars drawn as individual points in the error model
+        plots before switching to density rendering.
     level : `str`
         Use <level> E.g., 'design', 'minimum', 'stretch'.
     """
@@ -138,6 +153,9 @@ def run(repo_or_json, metrics=None,
     if outputPrefix is None:
         outputPrefix = repoNameToPrefix(base_name)
 
+    # The runs are recorded below, once their JSON files are final.
+    resultStore = kwargs.pop('resultStore', None)
+
     if load_json:
         if not os.path.isfile(repo_or_json):
             print("Could not find JSON file %s" % (repo_or_json))
@@ -157,18 +175,44 @@ def run(repo_or_json, metrics=None,
                           metrics_package=metrics_package, **kwargs)
 
     for filterName, job in jobs.items():
+        if outputPrefix is None or outputPrefix == '':
+            thisOutputPrefix = "%s" % filterName
+        else:
+            thisOutputPrefix = "%s_%s" % (outputPrefix, filterName)
         if makePrint:
             print_metrics(job)
         if makePlot:
-            if outputPrefix is None or outputPrefix == '':
-                thisOutputPrefix = "%s" % filterName
-            else:
-                thisOutputPrefix = "%s_%s" % (outputPrefix, filterName)
-            plot_metrics(job, filterName, outputPrefix=thisOutputPrefix)
+            timer = StageTimer()
+            with timer.stage('plot'):
+                plot_metrics(job, filterName, outputPrefix=thisOutputPrefix,
+                             maxScatterPoints=maxScatterPoints, useCache=not forcePlot)
+            if 'performance' in job.meta:
+                performance = dict(job.meta['performance'])
+                performance.update(timer.summary())
+                job.meta['performance'] = performance
+                # Persist the plotting time along with the other stages.
+                if not load_json and kwargs.get('makeJson', True):
+                    job.write(thisOutputPrefix+'.json')
+        if not load_json and resultStore:
+            _recordRun(resultStore, job,
+                       thisOutputPrefix+'.json' if kwargs.get('makeJson', True) else None)
 
     print_pass_fail_summary(jobs, default_level=level)
 
 
+def _recordRun(resultStore, job, jsonFile=None):
+    """Record a run in a `lsst.validate.drp.resultstore.ResultStore`.
+
+    The run is recorded with the path and modification time of its JSON
+    file, if it was written, so that importing the file later does not
+    record it again; the file must not be rewritten afterwards.
+    """
+    source = os.path.abspath(jsonFile) if jsonFile else None
+    with ResultStore(resultStore) as store:
+        store.addJob(job, source=source,
+                     timestamp=os.path.getmtime(source) if source else None)
+
+
 def runOneRepo(repo, dataIds=None, metrics=None, outputPrefix='', verbose=False,
                metrics_package='verify_metrics', **kwargs):
     """Calculate statistics for all filters in a repo.
@@ -229,7 +273,11 @@ def runOneRepo(repo, dataIds=None, metrics=None, outputPrefix='', verbose=False,
 def runOneFilter(repo, visitDataIds, metrics, brightSnr=100,
                  makeJson=True, filterName=None, outputPrefix='',
                  useJointCal=False, skipTEx=False, verbose=False,
-                 metrics_package='verify_metrics', **kwargs):
+                 metrics_package='verify_metrics', traceMemory=False, incremental=False,
+                 streaming=False, tileSize=None, nProcesses=1, prefilter=False, dense=False,
+                 compact=False, checkpoint=False, resume=False, readOrder='given',
+                 seedVisit=None, prefetch=0, cacheDir=None, resultStore=None,
+                 maxMemory=None, exportMatches=None, profile=False, **kwargs):
     """Main executable for the case where there is just one filter.
 
     Plot files and JSON files are generated in the local directory
@@ -267,15 +315,133 @@ def runOneFilter(repo, visitDataIds, metrics, brightSnr=100,
         PsfShape measurements).
     verbose : bool, optional
         Output additional information on the analysis steps.
+    traceMemory : bool, optional
+        Record Python heap allocations of each stage with `tracemalloc`.
+    incremental : bool, optional
+        Keep the matches in the ``<outputPrefix>_matchState`` directory and
+        only load and match data IDs that are not yet in it.
+    streaming : bool, optional
+        Keep only per-star statistics instead of all matched sources.  This
+        bounds memory use by the number of stars, but only the error models
+        are computed; the AMx, AFx, ADx, PA1, PA2, PF1 and TEx metrics need
+        the individual sources and are skipped.
+    tileSize : float, optional
+        Match the sources in independent sky tiles of about this size
+        (degrees) instead of all at once.
+    nProcesses : int, optional
+        Number of tiles matched in parallel.
+    prefilter : bool, optional
+        Drop flagged sources and sources with non-finite magnitudes before
+        matching; the metrics are unchanged.
+    dense : bool, optional
+        Arrange the safe matches as object-by-visit arrays, from which AMx
+        and PA1 are computed with array operations.  Repeat detections of
+        an object in one visit are left out, as are stars with fewer than
+        two distinct visits, so AMx and PA1 can differ from the default.
+    compact : bool, optional
+        Keep magnitudes, SNR, ellipticities and per-star statistics in
+        single precision to roughly halve the memory of the matches.
+    checkpoint : bool, optional
+        Write the calibrated catalog of each data ID to
+        ``<outputPrefix>_checkpoint/`` as soon as it is loaded.  The
+        directory is removed once the matched dataset is built.
+    resume : bool, optional
+        Continue an interrupted run from its checkpoint, loading only the
+        data IDs it had not reached.  Implies ``checkpoint``.
+    readOrder : {'given', 'visit'}, optional
+        Read and match the data IDs in the given order, or grouped by visit
+        with `lsst.validate.drp.readorder.planReadOrder`.
+    seedVisit : int or {'deepest', 'bestSeeing'}, optional
+        Visit to read and match first, whose sources then become the
+        reference positions of the objects.  ``'deepest'`` and
+        ``'bestSeeing'`` choose it with
+        `lsst.validate.drp.readorder.chooseSeedVisit`.  Implies
+        ``readOrder='visit'``.
+    prefetch : int, optional
+        Load up to this many catalogs ahead of the matching in a background
+        thread.  How often the matching waited for them is printed and
+        recorded in the ``prefetchWait`` stage.
+    cacheDir : str, optional
+        Directory of a `lsst.validate.drp.cache.MatchedDatasetCache`.  The
+        matched dataset is read from it if it was built before from the
+        same data IDs and options, so the metrics can be recomputed without
+        loading and matching the catalogs again.
+    resultStore : str, optional
+        SQLite file of a `lsst.validate.drp.resultstore.ResultStore` in
+        which the measurements of this run are recorded.
+    maxMemory : float, optional
+        Memory budget (MB), see `lsst.validate.drp.memory.MemoryBudget`.
+        Intermediates are released as soon as they are no longer needed,
+        and the matches and PA1 arrays are spilled to memory-mapped files
+        when the budget would be exceeded.
+    exportMatches : {None, 'npy', 'arrow'}, optional
+        Write the matched dataset to ``outputPrefix + '_matches'`` with
+        `lsst.validate.drp.export.exportMatchedDataset`, as ``.npy`` column
+        files (``'npy'``) or also as an Arrow IPC file (``'arrow'``), for
+        analysis with `lsst.validate.drp.export.openMatchedDataset`.
+    profile : bool, optional
+        Profile each stage with `cProfile`.  The profiles are written to
+        ``outputPrefix + '_profile'``, with a list of the hot functions of
+        each stage that is also stored in ``job.meta['performance']``.
+
+    Notes
+    -----
+    Wall time, CPU time and peak memory of each stage (butler I/O,
+    calibration, matching, reduction, error models, AMx, PA1, TEx) are
+    stored in ``job.meta['performance']``, and the numbers of data IDs,
+    detections and objects in ``job.meta['workload']``, from which
+    `lsst.validate.drp.estimate.CostModel.fromJobs` calibrates estimates.
     """
+    timer = StageTimer(traceMemory=traceMemory, profile=profile)
+    if seedVisit in ('deepest', 'bestSeeing'):
+        with timer.stage('butler'):
+            seedVisit = chooseSeedVisit(repo, visitDataIds, criterion=seedVisit)
+        print("Seeding the matches with visit %s" % seedVisit)
+    if readOrder == 'visit' or seedVisit is not None:
+        visitDataIds = planReadOrder(visitDataIds, seedVisit=seedVisit)
+    elif readOrder != 'given':
+        raise ValueError("Unknown read order '%s'; use 'given' or 'visit'" % readOrder)
+    matchState = outputPrefix + '_matchState' if incremental else None
+    catalogCheckpoint = None
+    if checkpoint or resume:
+        # A checkpoint of other inputs must not be resumed.
+        checkpointConfig = {'repo': repositoryName(repo),
+                            'dataIds': sorted(dataIdToKey(dataId) for dataId in visitDataIds),
+                            'useJointCal': useJointCal,
+                            'skipTEx': skipTEx}
+        catalogCheckpoint = CatalogCheckpoint(outputPrefix + '_checkpoint', checkpointConfig,
+                                              resume=resume)
+    matchedDatasetCache = MatchedDatasetCache(cacheDir) if cacheDir else None
+    memoryBudget = MemoryBudget(maxMemory) if maxMemory else None
     matchedDataset = build_matched_dataset(repo, visitDataIds,
                                               useJointCal=useJointCal,
-                                              skipTEx=skipTEx)
-
-
-    photomModel = build_photometric_error_model(matchedDataset)
-
-    astromModel = build_astrometric_error_model(matchedDataset)
+                                              skipTEx=skipTEx,
+                                              timer=timer,
+                                              matchState=matchState,
+                                              streaming=streaming,
+                                              tileSize=tileSize,
+                                              nProcesses=nProcesses,
+                                              prefilter=prefilter,
+                                              dense=dense,
+                                              compact=compact,
+                                              checkpoint=catalogCheckpoint,
+                                              prefetch=prefetch,
+                                              cache=matchedDatasetCache,
+                                              memoryBudget=memoryBudget)
+    if catalogCheckpoint is not None:
+        catalogCheckpoint.clear()
+    if exportMatches:
+        if exportMatches not in ('npy', 'arrow'):
+            raise ValueError("Unknown export format '%s'; use 'npy' or 'arrow'" % exportMatches)
+        with timer.stage('export'):
+            exportMatchedDataset(matchedDataset, outputPrefix + '_matches',
+                                 arrow=exportMatches == 'arrow')
+
+
+    with timer.stage('errorModels'):
+        photomModel = build_photometric_error_model(matchedDataset)
+
+        astromModel = build_astrometric_error_model(matchedDataset)
 
     linkedBlobs = [matchedDataset, photomModel, astromModel]
 
@@ -297,57 +463,79 @@ def runOneFilter(repo, visitDataIds, metrics, brightSnr=100,
             measurement.link_blob(blob)
         job.measurements.insert(measurement)
 
-    for x, D in zip((1, 2, 3), (5., 20., 200.)):
-        amxName = 'AM{0:d}'.format(x)
-        afxName = 'AF{0:d}'.format(x)
-        adxName = 'AD{0:d}'.format(x)
-
-
-        amx = measureAMx(metrics['validate_drp.'+amxName], matchedDataset, D*u.arcmin)
-        add_measurement(amx)
-
-        afx_spec_set = specs.subset(required_meta={'instrument':'HSC'}, spec_tags=[afxName,])
-        adx_spec_set = specs.subset(required_meta={'instrument':'HSC'}, spec_tags=[adxName,])
-        for afx_spec_key, adx_spec_key in zip(afx_spec_set, adx_spec_set):
-            afx_spec = afx_spec_set[afx_spec_key]
-            adx_spec = adx_spec_set[adx_spec_key]
-            adx = measureADx(metrics[adx_spec.metric_name], amx, afx_spec)
-            add_measurement(adx)
-            afx = measureAFx(metrics[afx_spec.metric_name], amx, adx, adx_spec)
-            add_measurement(afx)
-
-    pa1 = measurePA1(metrics['validate_drp.PA1'], matchedDataset, filterName)
-    add_measurement(pa1)
-
-
-    pf1_spec_set = specs.subset(required_meta={'instrument':instrument, 'filter_name':filterName},
-                                           spec_tags=['PF1',])
-    pa2_spec_set = specs.subset(required_meta={'instrument':instrument, 'filter_name':filterName},
-                                           spec_tags=['PA2',])
-    # I worry these might not always be in the right order.  Sorting...
-    pf1_spec_keys = list(pf1_spec_set.keys())
-    pa2_spec_keys = list(pa2_spec_set.keys())
-    pf1_spec_keys.sort()
-    pa2_spec_keys.sort()
-    for pf1_spec_key, pa2_spec_key in zip(pf1_spec_keys, pa2_spec_keys):
-        pf1_spec = pf1_spec_set[pf1_spec_key]
-        pa2_spec = pa2_spec_set[pa2_spec_key]
-
-        pa2 = measurePA2(metrics[pa2_spec.metric_name], pa1, pf1_spec.threshold)
-        add_measurement(pa2)
-
-        pf1 = measurePF1(metrics[pf1_spec.metric_name], pa1, pa2_spec)
-        add_measurement(pf1)
-
-    if not skipTEx:
+    haveSources = matchedDataset.safeMatches is not None
+    if not haveSources:
+        print("Individual sources were not kept; skipping AMx, AFx, ADx, PA1, PA2, PF1 and TEx.")
+    else:
+        for x, D in zip((1, 2, 3), (5., 20., 200.)):
+            amxName = 'AM{0:d}'.format(x)
+            afxName = 'AF{0:d}'.format(x)
+            adxName = 'AD{0:d}'.format(x)
+
+
+            with timer.stage('AMx'):
+                amx = measureAMx(metrics['validate_drp.'+amxName], matchedDataset, D*u.arcmin)
+            add_measurement(amx)
+
+            afx_spec_set = specs.subset(required_meta={'instrument':'HSC'}, spec_tags=[afxName,])
+            adx_spec_set = specs.subset(required_meta={'instrument':'HSC'}, spec_tags=[adxName,])
+            for afx_spec_key, adx_spec_key in zip(afx_spec_set, adx_spec_set):
+                afx_spec = afx_spec_set[afx_spec_key]
+                adx_spec = adx_spec_set[adx_spec_key]
+                adx = measureADx(metrics[adx_spec.metric_name], amx, afx_spec)
+                add_measurement(adx)
+                afx = measureAFx(metrics[afx_spec.metric_name], amx, adx, adx_spec)
+                add_measurement(afx)
+
+        with timer.stage('PA1'):
+            pa1 = measurePA1(metrics['validate_drp.PA1'], matchedDataset, filterName)
+        add_measurement(pa1)
+
+
+        pf1_spec_set = specs.subset(required_meta={'instrument':instrument, 'filter_name':filterName},
+                                               spec_tags=['PF1',])
+        pa2_spec_set = specs.subset(required_meta={'instrument':instrument, 'filter_name':filterName},
+                                               spec_tags=['PA2',])
+        # I worry these might not always be in the right order.  Sorting...
+        pf1_spec_keys = list(pf1_spec_set.keys())
+        pa2_spec_keys = list(pa2_spec_set.keys())
+        pf1_spec_keys.sort()
+        pa2_spec_keys.sort()
+        for pf1_spec_key, pa2_spec_key in zip(pf1_spec_keys, pa2_spec_keys):
+            pf1_spec = pf1_spec_set[pf1_spec_key]
+            pa2_spec = pa2_spec_set[pa2_spec_key]
+
+            pa2 = measurePA2(metrics[pa2_spec.metric_name], pa1, pf1_spec.threshold)
+            add_measurement(pa2)
+
+            pf1 = measurePF1(metrics[pf1_spec.metric_name], pa1, pa2_spec)
+            add_measurement(pf1)
+
+    if not skipTEx and haveSources:
         for x, D, bin_range_operator in zip((1, 2), (1.0, 5.0), ("<=", ">=")):
             texName = 'TE{0:d}'.format(x)
-            tex = measureTEx(metrics['validate_drp.'+texName], matchedDataset, D*u.arcmin, bin_range_operator)
+            with timer.stage('TEx'):
+                tex = measureTEx(metrics['validate_drp.'+texName], matchedDataset, D*u.arcmin,
+                                 bin_range_operator)
             add_measurement(tex)
 
+    job.meta['validate_drp_version'] = __version__
+    job.meta['performance'] = timer.summary()
+    if profile:
+        timer.writeProfiles(outputPrefix + '_profile')
+        print("Wrote stage profiles to %s_profile" % outputPrefix)
+    job.meta['workload'] = measureWorkload(matchedDataset, visitDataIds)
+    if verbose:
+        timer.report()
+        if memoryBudget is not None:
+            memoryBudget.report()
+
     if makeJson:
         job.write(outputPrefix+'.json')
 
+    if resultStore:
+        _recordRun(resultStore, job, outputPrefix+'.json' if makeJson else None)
+
     return job
 
 
@@ -358,7 +546,8 @@ def get_metric(level, metric_label, in_specs):
     return Name(package=spec.package, metric=spec.metric)
 
 
-def plot_metrics(job, filterName, outputPrefix=''):
+def plot_metrics(job, filterName, outputPrefix='', maxScatterPoints=None,
+                 useCache=True):
     """Plot AM1, AM2, AM3, PA1 plus related informational plots.
 
     Parameters
@@ -367,6 +556,11 @@ def plot_metrics(job, filterName, outputPrefix=''):
         The job to load data from.
     filterName : `str`
         string identifying the filter.
+    maxScatterPoints : `int`, optional
+        Maximum number of stars drawn as individual points in the error model
+        plots before switching to density rendering.
+    useCache : `bool`, optional
+        Skip plots whose existing files were made from the same inputs.
     """
     astropy.visualization.quantity_support()
 
@@ -378,31 +572,39 @@ def plot_metrics(job, filterName, outputPrefix=''):
         afxName = 'AF{0:d}'.format(x)
         # ADx is included on the AFx plots
 
-        amx = measurements[get_metric(spec_name, amxName, specs)]
-        afx = measurements[get_metric(spec_name, afxName, specs)]
+        try:
+            amx = measurements[get_metric(spec_name, amxName, specs)]
+            afx = measurements[get_metric(spec_name, afxName, specs)]
+        except KeyError:
+            # Not measured, e.g. in streaming mode.
+            print('\tSkipped plot{}'.format(amxName))
+            continue
 
         if amx.quantity is not None:
             try:
                 plotAMx(job, amx, afx, filterName, amxSpecName=spec_name,
-                        outputPrefix=outputPrefix)
+                        outputPrefix=outputPrefix, useCache=useCache)
             except RuntimeError as e:
                 print(e)
                 print('\tSkipped plot{}'.format(amxName))
 
     try:
         pa1 = measurements[get_metric(spec_name, 'PA1', specs)]
-        plotPA1(pa1, outputPrefix=outputPrefix)
-    except RuntimeError as e:
+        plotPA1(pa1, outputPrefix=outputPrefix, useCache=useCache)
+    except (RuntimeError, KeyError) as e:
         print(e)
         print('\tSkipped plotPA1')
 
     try:
+        pa1 = measurements[get_metric(spec_name, 'PA1', specs)]
         matchedDataset = pa1.blobs['MatchedMultiVisitDataset']
         photomModel = pa1.blobs['PhotometricErrorModel']
         filterName = pa1.extras['filter_name']
         plotPhotometryErrorModel(matchedDataset, photomModel,
                                  filterName=filterName,
-                                 outputPrefix=outputPrefix)
+                                 outputPrefix=outputPrefix,
+                                 maxPoints=maxScatterPoints,
+                                 useCache=useCache)
     except KeyError as e:
         print(e)
         print('\tSkipped plotPhotometryErrorModel')
@@ -412,7 +614,9 @@ def plot_metrics(job, filterName, outputPrefix=''):
         matchedDataset = am1.blobs['MatchedMultiVisitDataset']
         astromModel = am1.blobs['AnalyticAstrometryModel']
         plotAstrometryErrorModel(matchedDataset, astromModel,
-                                 outputPrefix=outputPrefix)
+                                 outputPrefix=outputPrefix,
+                                 maxPoints=maxScatterPoints,
+                                 useCache=useCache)
     except KeyError as e:
         print(e)
         print('\tSkipped plotAstrometryErrorModel')
@@ -424,8 +628,9 @@ def plot_metrics(job, filterName, outputPrefix=''):
             measurement = measurements[get_metric(spec_name, texName, specs)]
             plotTEx(job, measurement, filterName,
                     texSpecName='design',
-                    outputPrefix=outputPrefix)
-        except RuntimeError as e:
+                    outputPrefix=outputPrefix,
+                    useCache=useCache)
+        except (RuntimeError, KeyError) as e:
             print(e)
             print('\tSkipped plot{}'.format(texName))
 
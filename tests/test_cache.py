@@ -0,0 +1,98 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+from lsst.verify import Blob, Datum
+
+from lsst.validate.drp.cache import MatchedDatasetCache
+from lsst.validate.drp.synthetic import makeSyntheticStarField, makeSyntheticMatchedDataset
+
+
+class MatchedDatasetCacheTestCase(lsst.utils.tests.TestCase):
+    """Testing the round trip of matched datasets through the cache."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cache = MatchedDatasetCache(self.tmpDir)
+        self.dataIds = [{'visit': 1, 'ccd': 2}, {'visit': 3, 'ccd': 4}]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testKey(self):
+        key = self.cache.key('repo', self.dataIds, 1.0, 50., False)
+        self.assertEqual(key, self.cache.key('repo', [dict(dataId) for dataId in self.dataIds],
+                                             1.0, 50., False, matching={'method': 'multiMatch'}))
+        # Matching depends on the read order.
+        self.assertNotEqual(key, self.cache.key('repo', self.dataIds[::-1], 1.0, 50., False))
+        self.assertNotEqual(key, self.cache.key('repo', self.dataIds[:1], 1.0, 50., False))
+        self.assertNotEqual(key, self.cache.key('repo', self.dataIds, 2.0, 50., False))
+        self.assertNotEqual(key, self.cache.key('repo', self.dataIds, 1.0, 50., True))
+        self.assertNotEqual(key, self.cache.key('repo', self.dataIds, 1.0, 50., False,
+                                                skipTEx=True))
+        sharded = self.cache.key('repo', self.dataIds, 1.0, 50., False,
+                                 matching={'method': 'sharded', 'tileSize': 0.5})
+        self.assertNotEqual(key, sharded)
+        self.assertNotEqual(sharded, self.cache.key('repo', self.dataIds, 1.0, 50., False,
+                                                    matching={'method': 'sharded', 'tileSize': 1.}))
+        self.assertNotEqual(key, self.cache.key('repo', self.dataIds, 1.0, 50., False,
+                                                matching={'method': 'prefiltered'}))
+
+    def testRoundTrip(self):
+        field = makeSyntheticStarField(nObjects=300, nVisits=4, footprint=0.3, seed=1357)
+        for backend in ('afw', 'arrays'):
+            dataset = makeSyntheticMatchedDataset(field, backend=backend)
+            key = self.cache.key(backend, self.dataIds, 1.0, 50., False)
+            self.assertFalse(self.cache.has(key))
+            self.cache.save(key, dataset)
+            self.assertTrue(self.cache.has(key))
+
+            blob = Blob('MatchedMultiVisitDataset')
+            blob['filterName'] = Datum(quantity='synthetic', description='Filter name')
+            blob['useJointCal'] = Datum(quantity=False, description='useJointCal')
+            self.cache.load(key, blob)
+            for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+                self.assertFloatsEqual(blob[name].quantity.value, dataset[name].quantity.value)
+            self.assertFloatsEqual(blob.goodMatches.ids, dataset.goodMatches.ids)
+            self.assertFloatsEqual(blob.safeMatches.ids, dataset.safeMatches.ids)
+            if backend == 'arrays':
+                self.assertFloatsEqual(blob.safeMatches.column('base_PsfFlux_mag'),
+                                       dataset.safeMatches.column('base_PsfFlux_mag'))
+
+        self.cache.clear()
+        self.assertFalse(self.cache.has(key))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
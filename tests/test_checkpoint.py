@@ -0,0 +1,93 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+from lsst.validate.drp.checkpoint import CatalogCheckpoint
+
+
+class _FakeCatalog(object):
+    def writeFits(self, filename):
+        open(filename, 'w').close()
+
+
+class CatalogCheckpointTestCase(lsst.utils.tests.TestCase):
+    """Testing the progress bookkeeping of catalog checkpoints."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmpDir, 'checkpoint')
+        self.config = {'useJointCal': False, 'skipTEx': False}
+        self.dataIds = [{'visit': 1, 'ccd': 2}, {'visit': 3, 'ccd': 4}]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testResume(self):
+        checkpoint = CatalogCheckpoint(self.directory, self.config)
+        checkpoint.save(self.dataIds[0], _FakeCatalog())
+        checkpoint.save(self.dataIds[1], None)
+        # A run killed while writing the progress file.
+        with open(os.path.join(self.directory, CatalogCheckpoint.progressName), 'a') as outfile:
+            outfile.write('{"dataId": "{\\"ccd\\": 6')
+
+        resumed = CatalogCheckpoint(self.directory, self.config, resume=True)
+        self.assertTrue(resumed.hasDataId({'ccd': 2, 'visit': 1}))
+        # A data ID that could not be loaded is tried again.
+        self.assertFalse(resumed.hasDataId(self.dataIds[1]))
+        self.assertFalse(resumed.hasDataId({'visit': 5, 'ccd': 6}))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def testDiscard(self):
+        checkpoint = CatalogCheckpoint(self.directory, self.config)
+        checkpoint.save(self.dataIds[0], _FakeCatalog())
+
+        otherConfig = dict(self.config, useJointCal=True)
+        self.assertFalse(CatalogCheckpoint(self.directory, otherConfig,
+                                           resume=True).hasDataId(self.dataIds[0]))
+
+        checkpoint = CatalogCheckpoint(self.directory, dict(self.config, dataIds=['a', 'b']))
+        checkpoint.save(self.dataIds[0], _FakeCatalog())
+        self.assertFalse(CatalogCheckpoint(self.directory, dict(self.config, dataIds=['a']),
+                                           resume=True).hasDataId(self.dataIds[0]))
+
+        checkpoint = CatalogCheckpoint(self.directory, self.config)
+        checkpoint.save(self.dataIds[0], _FakeCatalog())
+        self.assertFalse(CatalogCheckpoint(self.directory, self.config).hasDataId(self.dataIds[0]))
+        self.assertEqual(os.listdir(self.directory), [CatalogCheckpoint.progressName])
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
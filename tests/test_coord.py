@@ -22,14 +22,19 @@
 
 from __future__ import print_function
 
+import time
 import unittest
 
 import numpy as np
 from numpy.testing import assert_allclose
 
 import lsst.utils
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
 
 from lsst.validate.drp import util
+from lsst.validate.drp.matchreduce import _updateCoordColumns
 
 
 class CoordTestCase(unittest.TestCase):
@@ -59,6 +64,53 @@ class CoordTestCase(unittest.TestCase):
         assert_allclose([19.493625, 37.60447], np.rad2deg([meanRa, meanDec]))
 
 
+class UpdateCoordTestCase(lsst.utils.tests.TestCase):
+    """Testing the batched update of source coordinates from a WCS."""
+
+    def setUp(self):
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        afwTable.Point2DKey.addFields(schema, 'base_SdssCentroid', 'centroid', 'pixel')
+        schema.addField('base_SdssCentroid_flag', type='Flag', doc='centroid failed')
+        schema.getAliasMap().set('slot_Centroid', 'base_SdssCentroid')
+
+        nSources = 20000
+        rng = np.random.RandomState(31)
+        self.catalog = afwTable.SourceCatalog(schema)
+        self.catalog.resize(nSources)
+        self.catalog['base_SdssCentroid_x'][:] = rng.uniform(0, 2048, nSources)
+        self.catalog['base_SdssCentroid_y'][:] = rng.uniform(0, 4096, nSources)
+        # Failed centroids
+        self.catalog['base_SdssCentroid_x'][:10] = np.nan
+        self.catalog['base_SdssCentroid_y'][5:15] = np.nan
+
+        self.wcs = afwGeom.makeSkyWcs(
+            crpix=afwGeom.Point2D(1024, 2048),
+            crval=afwGeom.SpherePoint(150.0, 2.0, afwGeom.degrees),
+            cdMatrix=afwGeom.makeCdMatrix(scale=0.2*afwGeom.arcseconds, orientation=30*afwGeom.degrees))
+
+    def testSameAsUpdateCoord(self):
+        """Are the coordinates those of record.updateCoord, NaN included?"""
+        expected = self.catalog.copy(deep=True)
+        start = time.time()
+        for record in expected:
+            record.updateCoord(self.wcs)
+        loopTime = time.time() - start
+
+        start = time.time()
+        _updateCoordColumns(self.catalog, self.wcs)
+        batchTime = time.time() - start
+
+        for name in ('coord_ra', 'coord_dec'):
+            values = self.catalog[name]
+            expectedValues = expected[name]
+            self.assertTrue(np.array_equal(np.isnan(values), np.isnan(expectedValues)))
+            self.assertTrue(np.isnan(values[:15]).all())
+            finite = np.isfinite(expectedValues)
+            self.assertFloatsAlmostEqual(values[finite], expectedValues[finite],
+                                         rtol=0, atol=1e-12)
+        self.assertLess(batchTime, loopTime)
+
+
 def setup_module(module):
     lsst.utils.tests.init()
 
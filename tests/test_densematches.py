@@ -0,0 +1,166 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import io
+import sys
+import unittest
+
+import numpy as np
+import astropy.units as u
+
+import lsst.utils.tests
+
+from lsst.validate.drp.matcharrays import MatchedArrays
+from lsst.validate.drp.densematches import DenseMatches
+from lsst.validate.drp.synthetic import makeSyntheticStarField, makeSyntheticMatchedDataset
+from lsst.validate.drp.calcsrd.amx import calcRmsDistances
+from lsst.validate.drp.calcsrd.pa1 import calcPa1
+
+
+class DenseMatchesTestCase(lsst.utils.tests.TestCase):
+    """Testing the object-by-visit arrangement of matches."""
+
+    def testLayout(self):
+        """Are detections placed by object and visit code?"""
+        matches = MatchedArrays({'object': np.array([1, 1, 2, 2, 2]),
+                                 'visit': np.array([30, 10, 10, 20, 10]),
+                                 'coord_ra': np.array([0.1, 0.2, 0.3, 0.4, 0.5]),
+                                 'coord_dec': np.zeros(5)})
+        dense = DenseMatches.fromMatches(matches)
+        self.assertEqual((dense.nObjects, dense.nVisits), (2, 3))
+        self.assertFloatsEqual(dense.visits, np.array([10, 20, 30]))
+        self.assertFloatsEqual(dense.visitCode([20, 30]), np.array([1, 2]))
+        self.assertTrue(np.array_equal(np.ma.getmaskarray(dense['coord_ra']),
+                                       [[False, True, False], [False, False, True]]))
+        # The duplicate detection of object 2 in visit 10 is dropped.
+        self.assertEqual(dense.nDuplicates, 1)
+        self.assertFloatsEqual(dense['coord_ra'][1, 0], 0.3)
+        self.assertFloatsEqual(dense.nObserved(), np.array([2, 2]))
+        with self.assertRaises(KeyError):
+            dense.visitCode(40)
+
+    def testDuplicates(self):
+        """Are repeated detections in a visit counted, reported and left out?"""
+        field = makeSyntheticStarField(nObjects=200, nVisits=4, footprint=0.3, seed=1123)
+        matches = makeSyntheticMatchedDataset(field, backend='arrays')._matchedCatalog
+        # Detect some objects a second time in the same visit, as on
+        # overlapping CCDs, with a different position.
+        rng = np.random.RandomState(1124)
+        repeated = np.flatnonzero(rng.uniform(size=len(field.object)) < 0.05)
+        columns = {name: np.concatenate((values, values[repeated]))
+                   for name, values in matches.columns.items()}
+        columns['coord_ra'][len(field.object):] += 1e-7
+        withDuplicates = MatchedArrays(columns)
+
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            dense = DenseMatches.fromMatches(withDuplicates)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(dense.nDuplicates, len(repeated))
+        self.assertIn("left out %d" % len(repeated), output)
+
+        expected = DenseMatches.fromMatches(matches)
+        self.assertEqual(expected.nDuplicates, 0)
+        self.assertFloatsEqual(dense['coord_ra'].filled(0), expected['coord_ra'].filled(0))
+
+
+class DenseMetricsTestCase(lsst.utils.tests.TestCase):
+    """Testing that the array metrics agree with the per-group ones."""
+
+    def setUp(self):
+        field = makeSyntheticStarField(nObjects=500, nVisits=6, footprint=0.3,
+                                       detectionFraction=0.8, seed=1122)
+        self.dataset = makeSyntheticMatchedDataset(field, backend='arrays')
+        self.dense = DenseMatches.fromMatches(self.dataset.safeMatches)
+
+    def testRmsDistances(self):
+        annulus = np.array([0.5, 1.5]) * u.arcmin
+        magRange = np.array([17, 21.5]) * u.mag
+        expected = calcRmsDistances(self.dataset.safeMatches, annulus, magRange)
+        rms = calcRmsDistances(self.dense, annulus, magRange)
+        self.assertGreater(len(expected), 0)
+        self.assertFloatsAlmostEqual(rms.value, expected.value, rtol=1e-10, atol=1e-16)
+
+    def testPa1(self):
+        np.random.seed(42)
+        expected = calcPa1(self.dataset.safeMatches, self.dataset.magKey)
+        np.random.seed(42)
+        pa1 = calcPa1(self.dense, 'base_PsfFlux_mag')
+        self.assertEqual(pa1['magDiff'].shape, expected['magDiff'].shape)
+        self.assertFloatsAlmostEqual(pa1['magMean'].value, expected['magMean'].value, rtol=1e-12)
+        # Different random pairs, but the same distribution.
+        self.assertFloatsAlmostEqual(pa1['PA1'].value, expected['PA1'].value, rtol=0.2)
+
+    def testRepeatDetections(self):
+        """Do the array metrics leave out repeat detections in one visit?
+
+        The per-group metrics use every detection, so with repeat detections
+        they differ from the array ones, which agree with the per-group
+        metrics of the matches without the repeats.
+        """
+        safeMatches = self.dataset.safeMatches
+        rng = np.random.RandomState(1125)
+        firstRows = safeMatches.offsets[:-1]
+        repeated = firstRows[rng.uniform(size=len(firstRows)) < 0.2]
+        columns = {name: np.concatenate((values, values[repeated]))
+                   for name, values in safeMatches.columns.items()}
+        columns['coord_ra'][len(safeMatches.columns['coord_ra']):] += 1e-6
+        withRepeats = MatchedArrays(columns)
+
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            dense = DenseMatches.fromMatches(withRepeats)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(dense.nDuplicates, len(repeated))
+
+        annulus = np.array([0.5, 1.5]) * u.arcmin
+        magRange = np.array([17, 21.5]) * u.mag
+        expected = calcRmsDistances(safeMatches, annulus, magRange)
+        rms = calcRmsDistances(dense, annulus, magRange)
+        self.assertFloatsAlmostEqual(rms.value, expected.value, rtol=1e-10, atol=1e-16)
+        withRepeatsRms = calcRmsDistances(withRepeats, annulus, magRange)
+        self.assertFalse(len(withRepeatsRms) == len(expected) and
+                         np.allclose(withRepeatsRms.value, expected.value, rtol=1e-10, atol=1e-16))
+
+        np.random.seed(43)
+        expected = calcPa1(safeMatches, self.dataset.magKey)
+        np.random.seed(43)
+        pa1 = calcPa1(dense, 'base_PsfFlux_mag')
+        self.assertEqual(pa1['magDiff'].shape, expected['magDiff'].shape)
+        self.assertFloatsAlmostEqual(pa1['magMean'].value, expected['magMean'].value, rtol=1e-12)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,95 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+from lsst.validate.drp.estimate import CostModel, measureWorkload
+from lsst.validate.drp.synthetic import makeSyntheticStarField, makeSyntheticMatchedDataset
+
+
+class CostModelTestCase(lsst.utils.tests.TestCase):
+    """Testing the calibration of the cost model."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def writeRun(self, name, detections, seconds, peakMb):
+        workload = {'dataIds': 10, 'visits': 5, 'detections': detections,
+                    'objects': detections // 4, 'goodObjects': detections // 8,
+                    'safeObjects': detections // 40, 'amxComparisons': None,
+                    'visitDetections': detections // 4 * 5}
+        performance = {'match': {'calls': 10, 'wall_s': seconds, 'cpu_s': seconds,
+                                 'peak_rss_mb': peakMb}}
+        filename = os.path.join(self.tmpDir, name)
+        with open(filename, 'w') as outfile:
+            json.dump({'meta': {'workload': workload, 'performance': performance}}, outfile)
+        return filename
+
+    def testFromJobs(self):
+        filenames = [self.writeRun('a.json', 100000, 2., 600.),
+                     self.writeRun('b.json', 300000, 4., 1000.)]
+        model = CostModel.fromJobs(filenames)
+        self.assertFloatsAlmostEqual(model.secondsPerUnit['match'], 6. / 400000, rtol=1e-12)
+        self.assertEqual(model.secondsPerUnit['PA1'], CostModel.defaultSecondsPerUnit['PA1'])
+        self.assertFloatsAlmostEqual(model.mbPerDetection, 2e-3, rtol=1e-9)
+        self.assertFloatsAlmostEqual(model.baseMb, 400., rtol=1e-9)
+        self.assertFloatsAlmostEqual(model.detectionsPerObjectPerVisit, 0.8, rtol=1e-9)
+        self.assertFloatsAlmostEqual(model.goodFraction, 0.5, rtol=1e-9)
+        self.assertFloatsAlmostEqual(model.safeFraction, 0.2, rtol=1e-9)
+
+
+class WorkloadTestCase(lsst.utils.tests.TestCase):
+    """Testing the sizes recorded for calibration."""
+
+    def testWorkload(self):
+        field = makeSyntheticStarField(nObjects=300, nVisits=4, footprint=0.3, seed=97531)
+        dataIds = [{'visit': visit, 'ccd': 1} for visit in range(4)]
+        for backend in ('afw', 'arrays'):
+            dataset = makeSyntheticMatchedDataset(field, backend=backend)
+            workload = measureWorkload(dataset, dataIds)
+            self.assertEqual(workload['visits'], 4)
+            self.assertEqual(workload['objects'], len(dataset._matchedCatalog))
+            self.assertEqual(workload['goodObjects'], len(dataset.goodMatches))
+            self.assertEqual(workload['safeObjects'], len(dataset.safeMatches))
+            self.assertLessEqual(workload['detections'], 4 * workload['objects'])
+            json.dumps(workload)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,125 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+
+from lsst.validate.drp import exportreader
+from lsst.validate.drp.export import exportMatchedDataset, openMatchedDataset
+from lsst.validate.drp.matcharrays import MatchedArrays
+from lsst.validate.drp.synthetic import makeSyntheticStarField, makeSyntheticMatchedDataset
+
+
+class ExportTestCase(lsst.utils.tests.TestCase):
+    """Testing the round trip of matched datasets through column files."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.field = makeSyntheticStarField(nObjects=300, nVisits=4, footprint=0.3, seed=2468)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testRoundTrip(self):
+        for backend in ('afw', 'arrays'):
+            dataset = makeSyntheticMatchedDataset(self.field, backend=backend)
+            matches = dataset._matchedCatalog
+            if not isinstance(matches, MatchedArrays):
+                matches = MatchedArrays.fromGroupView(matches)
+            directory = os.path.join(self.tmpDir, backend)
+            exportMatchedDataset(dataset, directory)
+
+            exported = openMatchedDataset(directory)
+            self.assertIsInstance(exported.columns['coord_ra'], np.memmap)
+            self.assertEqual(len(exported), len(matches))
+            self.assertEqual(exported.meta['nDetections'], exported.offsets[-1])
+            self.assertFloatsEqual(exported.ids, matches.ids)
+            self.assertFloatsEqual(exported.offsets, matches.offsets)
+            for name in ('coord_ra', 'base_PsfFlux_mag'):
+                self.assertFloatsEqual(exported.columns[name], matches.column(name))
+            self.assertFloatsEqual(exported.ids[exported.good], dataset.goodMatches.ids)
+            self.assertFloatsEqual(exported.ids[exported.safe], dataset.safeMatches.ids)
+            for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+                self.assertFloatsEqual(exported.statistics[name], dataset[name].quantity.value)
+            first = exported.group(0)
+            self.assertEqual(len(first['coord_ra']), exported.counts[0])
+
+    def testIncomplete(self):
+        dataset = makeSyntheticMatchedDataset(self.field, backend='arrays')
+        exportMatchedDataset(dataset, self.tmpDir)
+        manifestFile = os.path.join(self.tmpDir, 'manifest.json')
+        with open(manifestFile) as infile:
+            manifest = json.load(infile)
+        manifest['formatVersion'] += 1
+        with open(manifestFile, 'w') as outfile:
+            json.dump(manifest, outfile)
+        with self.assertRaises(ValueError):
+            openMatchedDataset(self.tmpDir)
+        os.remove(manifestFile)
+        with self.assertRaises(IOError):
+            openMatchedDataset(self.tmpDir)
+
+    def testReadWithoutStack(self):
+        """Can an export be read by the standalone reader without lsst?"""
+        if sys.version_info < (3, 5):
+            self.skipTest('The example loads the reader with importlib.util')
+        dataset = makeSyntheticMatchedDataset(self.field, backend='arrays')
+        exportMatchedDataset(dataset, self.tmpDir)
+        # Any import of lsst fails in the child process.
+        script = """
+import importlib.util
+import sys
+sys.modules['lsst'] = None
+spec = importlib.util.spec_from_file_location('exportreader', sys.argv[1])
+exportreader = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(exportreader)
+matches = exportreader.openMatchedDataset(sys.argv[2])
+print(len(matches), int(matches.offsets[-1]))
+"""
+        output = subprocess.check_output([sys.executable, '-c', script,
+                                          exportreader.__file__.replace('.pyc', '.py'),
+                                          self.tmpDir])
+        nObjects, nDetections = map(int, output.decode('utf-8').split())
+        matches = dataset._matchedCatalog
+        self.assertEqual(nObjects, len(matches))
+        self.assertEqual(nDetections, matches.offsets[-1])
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
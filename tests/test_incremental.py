@@ -0,0 +1,206 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import astropy.units as u
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+from lsst.verify import Blob, Datum
+
+from lsst.validate.drp import matchreduce
+from lsst.validate.drp.incremental import MatchState
+from lsst.validate.drp.synthetic import makeSyntheticStarField, makeSyntheticMatchedDataset
+
+
+class MatchStateTestCase(lsst.utils.tests.TestCase):
+    """Testing incremental matching against a persisted state."""
+
+    def setUp(self):
+        self.field = makeSyntheticStarField(nObjects=300, nVisits=4, footprint=0.3, seed=97)
+        self.names = [name for name in vars(self.field)
+                      if name not in ('object', 'trueRa', 'trueDec', 'trueMag')]
+        self.matchRadius = (1 * u.arcsec).to(u.radian).value
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def addVisits(self, state, visits):
+        for visit in visits:
+            rows = self.field.visit == visit
+            state.add({name: getattr(self.field, name)[rows] for name in self.names},
+                      {'visit': int(visit), 'ccd': 0})
+
+    def makeBlob(self, state):
+        blob = Blob('MatchedMultiVisitDataset')
+        blob['filterName'] = Datum(quantity='synthetic', description='Filter name')
+        state.reduce(blob)
+        return blob
+
+    def testIncrementalEqualsFullMatch(self):
+        """Does matching in two runs give the same result as one run?"""
+        full = MatchState(self.matchRadius)
+        self.addVisits(full, [1, 2, 3, 4])
+        fullBlob = self.makeBlob(full)
+
+        directory = os.path.join(self.tmpDir, 'state')
+        first = MatchState(self.matchRadius)
+        self.addVisits(first, [1, 2])
+        self.makeBlob(first)
+        first.save(directory)
+
+        second = MatchState.loadOrCreate(directory, self.matchRadius)
+        self.assertTrue(second.hasDataId({'ccd': 0, 'visit': 2}))
+        self.assertFalse(second.hasDataId({'ccd': 0, 'visit': 3}))
+        self.addVisits(second, [3])
+        second.save(directory)
+
+        third = MatchState.loadOrCreate(directory, self.matchRadius)
+        self.addVisits(third, [4])
+        thirdBlob = self.makeBlob(third)
+
+        self.assertEqual(third.nObjects, full.nObjects)
+        for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+            self.assertFloatsAlmostEqual(thirdBlob[name].quantity.value,
+                                         fullBlob[name].quantity.value, rtol=1e-12)
+        self.assertFloatsEqual(thirdBlob.safeMatches.ids, fullBlob.safeMatches.ids)
+
+    def testCompaction(self):
+        """Does a state rewritten as one part read back the same?"""
+        directory = os.path.join(self.tmpDir, 'state')
+        state = MatchState(self.matchRadius)
+        state.maxParts = 2
+        for visit in [1, 2, 3, 4]:
+            self.addVisits(state, [visit])
+            state.save(directory)
+        self.assertLessEqual(len([name for name in os.listdir(directory)
+                                  if name.startswith('part_')]), 2)
+
+        loaded = MatchState.load(directory)
+        self.assertEqual(loaded.nObjects, state.nObjects)
+        self.assertEqual(loaded.dataIdKeys, state.dataIdKeys)
+        for name, values in state.statistics.items():
+            self.assertFloatsEqual(loaded.statistics[name], values)
+        for name, values in state.columns.items():
+            self.assertTrue(np.array_equal(loaded.columns[name], values))
+
+    def testSameAsReduceStars(self):
+        """Are the statistics those of a non-incremental reduction?"""
+        state = MatchState(self.matchRadius)
+        self.addVisits(state, [1, 2, 3, 4])
+        blob = self.makeBlob(state)
+
+        expected = makeSyntheticMatchedDataset(self.field, backend='arrays')
+        self.assertEqual(state.nObjects, len(np.unique(self.field.object)))
+        for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+            self.assertFloatsAlmostEqual(blob[name].quantity.value,
+                                         expected[name].quantity.value, rtol=1e-10)
+
+    def testConfigurationChange(self):
+        """Is a state made with another match radius discarded?"""
+        directory = os.path.join(self.tmpDir, 'state')
+        state = MatchState(self.matchRadius)
+        self.addVisits(state, [1])
+        state.save(directory)
+        other = MatchState.loadOrCreate(directory, 2*self.matchRadius)
+        self.assertEqual(other.nObjects, 0)
+
+    def testInputChange(self):
+        """Is a state of another repository or skipTEx discarded?"""
+        directory = os.path.join(self.tmpDir, 'state')
+        state = MatchState(self.matchRadius, repoName='repo')
+        self.addVisits(state, [1])
+        state.save(directory)
+        same = MatchState.loadOrCreate(directory, self.matchRadius, repoName='repo')
+        self.assertEqual(same.nObjects, state.nObjects)
+        for kwargs in ({'repoName': 'otherRepo'}, {'repoName': 'repo', 'skipTEx': True}):
+            other = MatchState.loadOrCreate(directory, self.matchRadius, **kwargs)
+            self.assertEqual(other.nObjects, 0)
+
+    def testDroppedDataIds(self):
+        """Is a state with data IDs that are no longer requested discarded?"""
+        directory = os.path.join(self.tmpDir, 'state')
+        state = MatchState(self.matchRadius)
+        self.addVisits(state, [1, 2])
+        state.save(directory)
+
+        dataIds = [{'visit': 1, 'ccd': 0}, {'visit': 2, 'ccd': 0}, {'visit': 3, 'ccd': 0}]
+        kept = MatchState.loadOrCreate(directory, self.matchRadius, dataIds=dataIds)
+        self.assertEqual(kept.nObjects, state.nObjects)
+        pruned = MatchState.loadOrCreate(directory, self.matchRadius, dataIds=dataIds[1:])
+        self.assertEqual(pruned.nObjects, 0)
+
+    def testSensorDataIds(self):
+        """Are sensor data IDs found again in the next run?
+
+        Loading adds ``raft_sensor_int`` to sensor data IDs, which must not
+        change the keys under which they are stored.
+        """
+        field = self.field
+
+        def setUpLoading(repo, dataIds, timer):
+            for vId in dataIds:
+                vId['raft_sensor_int'] = matchreduce.raftSensorToInt(vId)
+            return None, 'raft_sensor_int', None, None
+
+        def loadCalibratedCatalogs(butler, dataIds, ccdKeyName, mapper, newSchema, **kwargs):
+            for vId in dataIds:
+                rows = field.visit == vId['visit']
+                catalog = {name: getattr(field, name)[rows] for name in self.names}
+                catalog['id'] = np.arange(rows.sum())
+                yield vId, catalog
+
+        setUp, load = matchreduce._setUpLoading, matchreduce._loadCalibratedCatalogs
+        matchreduce._setUpLoading = setUpLoading
+        matchreduce._loadCalibratedCatalogs = loadCalibratedCatalogs
+        try:
+            dataIds = [{'visit': int(visit), 'raft': '2,2', 'sensor': '1,1'}
+                       for visit in np.unique(field.visit)]
+            directory = os.path.join(self.tmpDir, 'state')
+            matchRadius = afwGeom.Angle(self.matchRadius, afwGeom.radians)
+            first = matchreduce._loadAndMatchIncrementally(None, dataIds, matchRadius, directory)
+            nDetections = first.statistics['nDetections'].sum()
+            self.assertNotIn('raft_sensor_int', dataIds[0])
+
+            second = matchreduce._loadAndMatchIncrementally(None, dataIds, matchRadius, directory)
+        finally:
+            matchreduce._setUpLoading, matchreduce._loadCalibratedCatalogs = setUp, load
+        self.assertEqual(second.nObjects, first.nObjects)
+        self.assertEqual(second.statistics['nDetections'].sum(), nDetections)
+        self.assertEqual(nDetections, len(field.visit))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,158 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import lsst.utils.tests
+
+from lsst.validate.drp.instrumentation import StageTimer
+
+
+class StageTimerTestCase(lsst.utils.tests.TestCase):
+    """Testing stage timing and memory instrumentation."""
+
+    def testAccumulateStages(self):
+        """Do repeated stages accumulate into one entry?"""
+        timer = StageTimer()
+        for _ in range(3):
+            with timer.stage('sleep'):
+                time.sleep(0.01)
+        with timer.stage('other'):
+            pass
+
+        summary = timer.summary()
+        self.assertEqual(list(summary.keys()), ['sleep', 'other'])
+        self.assertEqual(summary['sleep']['calls'], 3)
+        self.assertGreaterEqual(summary['sleep']['wall_s'], 0.03)
+        self.assertGreater(summary['other']['peak_rss_mb'], 0)
+        # Must be storable in Job metadata.
+        json.dumps(summary)
+
+    def testStageRecordedOnException(self):
+        """Is a stage recorded even if its block raises?"""
+        timer = StageTimer()
+        with self.assertRaises(RuntimeError):
+            with timer.stage('fail'):
+                raise RuntimeError('failed')
+        self.assertEqual(timer.summary()['fail']['calls'], 1)
+
+    def testTraceMemory(self):
+        """Is the allocation peak of a stage recorded with traceMemory?"""
+        timer = StageTimer(traceMemory=True)
+        if not timer.traceMemory:
+            self.skipTest('tracemalloc is not available')
+        with timer.stage('allocate'):
+            data = [0] * 1000000
+            del data
+        summary = timer.summary()
+        self.assertGreater(summary['allocate']['traced_peak_mb'], 1)
+        json.dumps(summary)
+
+    def testTraceMemoryNested(self):
+        """Do nested stages keep the traced peak of the outer stage?"""
+        timer = StageTimer(traceMemory=True)
+        if not timer.traceMemory:
+            self.skipTest('tracemalloc is not available')
+        with timer.stage('outer'):
+            data = [0] * 2000000
+            del data
+            for _ in range(3):
+                with timer.stage('inner'):
+                    data = [0] * 10000
+                    del data
+        summary = timer.summary()
+        self.assertGreater(summary['outer']['traced_peak_mb'], 10)
+        self.assertLess(summary['inner']['traced_peak_mb'], 10)
+        # Only outermost stages take snapshots.
+        self.assertIn('top_allocations', summary['outer'])
+        self.assertNotIn('top_allocations', summary['inner'])
+
+    def testTraceMemoryOtherThread(self):
+        """Do stages of another thread leave the traced stages intact?
+
+        A background stage that starts inside a stage of the owning thread
+        and ends after it must not pop that stage's trace.
+        """
+        timer = StageTimer(traceMemory=True)
+        if not timer.traceMemory:
+            self.skipTest('tracemalloc is not available')
+        started = threading.Event()
+        release = threading.Event()
+
+        def background():
+            with timer.stage('background'):
+                started.set()
+                release.wait()
+
+        thread = threading.Thread(target=background)
+        with timer.stage('outer'):
+            thread.start()
+            started.wait()
+            data = [0] * 2000000
+            del data
+        release.set()
+        thread.join()
+
+        summary = timer.summary()
+        self.assertEqual(summary['background']['calls'], 1)
+        self.assertNotIn('traced_peak_mb', summary['background'])
+        self.assertGreater(summary['outer']['traced_peak_mb'], 10)
+        self.assertEqual(timer._traceFrames, [])
+
+    def testProfile(self):
+        """Are the outermost stages profiled, and their profiles written?"""
+        def work():
+            return sum(i * i for i in range(100000))
+
+        timer = StageTimer(profile=True, topFunctions=3)
+        for _ in range(2):
+            with timer.stage('outer'):
+                with timer.stage('inner'):
+                    work()
+        summary = timer.summary()
+        self.assertNotIn('hot_functions', summary['inner'])
+        self.assertEqual(len(summary['outer']['hot_functions']), 3)
+        json.dumps(summary)
+
+        tmpDir = tempfile.mkdtemp()
+        try:
+            timer.writeProfiles(tmpDir)
+            self.assertEqual(sorted(os.listdir(tmpDir)), ['hot_functions.txt', 'outer.prof'])
+        finally:
+            shutil.rmtree(tmpDir)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -30,6 +30,7 @@ import lsst.utils
 from lsst.utils.tests import ExecutablesTestCase
 from lsst.validate.drp.validate import (
     get_filter_name_from_job, load_json_output, plot_metrics, print_metrics)
+from lsst.validate.drp.plot import plotManifestName
 
 
 class ParseJsonJob(ExecutablesTestCase):
@@ -103,6 +104,28 @@ class ParseJsonJob(ExecutablesTestCase):
         for filename in outputPrefixFiles:
             assert os.path.exists(filename), "File not created: %s"%filename
             os.remove(filename)
+        os.remove(plotManifestName)
+
+    def testPlotCacheSkipsUnchangedPlots(self):
+        """Is an up-to-date plot left alone, and remade once it is removed?"""
+        job = load_json_output(self.jsonFile)
+        filterName = get_filter_name_from_job(job)
+        outputPrefix = 'plotcache'
+        plotPath = '%s_PA1.png' % outputPrefix
+
+        plot_metrics(job, filterName, outputPrefix=outputPrefix)
+        mtime = os.path.getmtime(plotPath)
+        os.utime(plotPath, (mtime - 100, mtime - 100))
+        plot_metrics(job, filterName, outputPrefix=outputPrefix)
+        self.assertEqual(os.path.getmtime(plotPath), mtime - 100)
+
+        plot_metrics(job, filterName, outputPrefix=outputPrefix, useCache=False)
+        self.assertGreater(os.path.getmtime(plotPath), mtime - 100)
+
+        for filename in os.listdir('.'):
+            if filename.startswith(outputPrefix + '_') and filename.endswith('.png'):
+                os.remove(filename)
+        os.remove(plotManifestName)
 
 
 def setup_module(module):
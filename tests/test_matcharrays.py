@@ -0,0 +1,346 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function, division
+
+import contextlib
+import subprocess
+import sys
+import unittest
+
+import numpy as np
+import astropy.units as u
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+
+from lsst.validate.drp import matchreduce
+from lsst.validate.drp.memory import MemoryBudget
+from lsst.validate.drp.matchedVisitMetricsTask import MatchedVisitMetricsConfig
+from lsst.validate.drp.matcharrays import (MatchedArrays, findPoisonSources,
+                                           build_matched_dataset_from_arrays)
+from lsst.validate.drp.synthetic import (makeSyntheticStarField,
+                                         makeSyntheticMatchedArrays,
+                                         makeSyntheticMatchedDataset)
+from lsst.validate.drp.calcsrd.amx import calcRmsDistances
+from lsst.validate.drp.calcsrd.pa1 import calcPa1
+
+
+def makeSourceCatalogs(field, poisonRows=()):
+    """Split a synthetic star field into calibrated source catalogs by visit.
+
+    Returns the schema and a list of (data ID, `lsst.afw.table.SourceCatalog`)
+    with the cosmic ray flag set for the sources in ``poisonRows``.
+    """
+    schema = afwTable.SourceTable.makeMinimalSchema()
+    for name in ('base_PsfFlux_mag', 'base_PsfFlux_magErr', 'base_PsfFlux_snr',
+                 'e1', 'e2', 'psf_e1', 'psf_e2', 'base_ClassificationExtendedness_value'):
+        schema.addField(name, type=float, doc=name)
+    for flag in ("saturated", "cr", "bad", "edge"):
+        schema.addField("base_PixelFlags_flag_%s" % flag, type='Flag', doc=flag)
+    crKey = schema.find('base_PixelFlags_flag_cr').key
+
+    catalogs = []
+    for visit in np.unique(field.visit):
+        rows = np.flatnonzero(field.visit == visit)
+        catalog = afwTable.SourceCatalog(schema)
+        catalog.resize(len(rows))
+        catalog['id'][:] = rows + 1
+        for name in ('coord_ra', 'coord_dec', 'base_PsfFlux_mag', 'base_PsfFlux_magErr',
+                     'base_PsfFlux_snr', 'e1', 'e2', 'psf_e1', 'psf_e2',
+                     'base_ClassificationExtendedness_value'):
+            catalog[name][:] = getattr(field, name)[rows]
+        for index in np.flatnonzero(np.in1d(rows, poisonRows)):
+            catalog[int(index)].set(crKey, True)
+        catalogs.append(({'visit': int(visit), 'ccd': 0}, catalog))
+    return schema, catalogs
+
+
+@contextlib.contextmanager
+def fakeLoading(schema, catalogs):
+    """Make the loaders of `lsst.validate.drp.matchreduce` return ``catalogs``
+    instead of reading a repository."""
+    def setUpLoading(repo, dataIds, timer):
+        return None, 'ccd', None, schema
+
+    def loadCalibratedCatalogs(butler, dataIds, ccdKeyName, mapper, newSchema, **kwargs):
+        return iter(catalogs)
+
+    setUp, load = matchreduce._setUpLoading, matchreduce._loadCalibratedCatalogs
+    matchreduce._setUpLoading = setUpLoading
+    matchreduce._loadCalibratedCatalogs = loadCalibratedCatalogs
+    try:
+        yield
+    finally:
+        matchreduce._setUpLoading, matchreduce._loadCalibratedCatalogs = setUp, load
+
+
+class MatchedArraysTestCase(lsst.utils.tests.TestCase):
+    """Testing the numpy GroupView stand-in."""
+
+    def testImportWithoutButler(self):
+        """Can the numpy backend be imported without afw, the butler and
+        pipe_base?"""
+        script = """
+import sys
+for name in ('lsst.afw', 'lsst.daf.persistence', 'lsst.pipe.base'):
+    sys.modules[name] = None
+import numpy as np
+from lsst.validate.drp.matcharrays import MatchedArrays
+import lsst.validate.drp.calcsrd
+arrays = MatchedArrays({'object': np.array([1, 1, 2, 2]),
+                        'base_PsfFlux_mag': np.array([20., 20.2, 19., 19.2])})
+assert np.allclose(arrays.aggregate(np.mean, field='base_PsfFlux_mag'), [20.1, 19.1])
+"""
+        subprocess.check_call([sys.executable, '-c', script])
+
+    def setUp(self):
+        self.arrays = MatchedArrays({'object': np.array([3, 1, 3, 2, 1, 3]),
+                                     'mag': np.array([20., 18., 22., 19., 19., 21.])})
+
+    def testGrouping(self):
+        """Are detections grouped and sorted by object?"""
+        self.assertEqual(len(self.arrays), 3)
+        self.assertFloatsEqual(self.arrays.ids, np.array([1, 2, 3]))
+        self.assertFloatsEqual(self.arrays.counts, np.array([2, 1, 3]))
+        key = self.arrays.schema.find('mag').key
+        self.assertFloatsEqual(self.arrays.groups[2].get(key), np.array([20., 22., 21.]))
+        self.assertEqual(len(self.arrays.column('id')), 6)
+
+    def testAggregate(self):
+        """Do the vectorized reductions agree with per-group ones?"""
+        for function in (np.mean, np.std, np.median):
+            expected = [function(group.get('mag')) for group in self.arrays.groups]
+            self.assertFloatsAlmostEqual(self.arrays.aggregate(function, field='mag'),
+                                         np.array(expected), rtol=1e-12)
+
+    def testWhere(self):
+        """Does where keep all detections of the selected objects?"""
+        selected = self.arrays.where(lambda group: len(group) >= 2)
+        self.assertFloatsEqual(selected.ids, np.array([1, 3]))
+        self.assertEqual(len(selected.column('mag')), 5)
+
+
+class ArrayBackendTestCase(lsst.utils.tests.TestCase):
+    """Testing that the afw and numpy backends give the same metrics."""
+
+    def setUp(self):
+        field = makeSyntheticStarField(nObjects=500, nVisits=4, footprint=0.3, seed=2468)
+        self.afwDataset = makeSyntheticMatchedDataset(field, backend='afw')
+        self.arrayDataset = makeSyntheticMatchedDataset(field, backend='arrays')
+
+    def testReduceStars(self):
+        for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+            self.assertFloatsAlmostEqual(self.arrayDataset[name].quantity.value,
+                                         self.afwDataset[name].quantity.value, rtol=1e-10)
+        self.assertEqual(len(self.arrayDataset.safeMatches), len(self.afwDataset.safeMatches))
+
+    def testMetrics(self):
+        np.random.seed(42)
+        afwPa1 = calcPa1(self.afwDataset.safeMatches, self.afwDataset.magKey)
+        np.random.seed(42)
+        arrayPa1 = calcPa1(self.arrayDataset.safeMatches, self.arrayDataset.magKey)
+        self.assertFloatsAlmostEqual(arrayPa1['PA1'].value, afwPa1['PA1'].value, rtol=1e-10)
+
+        annulus = np.array([0.5, 1.5]) * u.arcmin
+        magRange = np.array([17, 21.5]) * u.mag
+        afwRms = calcRmsDistances(self.afwDataset.safeMatches, annulus, magRange)
+        arrayRms = calcRmsDistances(self.arrayDataset.safeMatches, annulus, magRange)
+        self.assertFloatsAlmostEqual(arrayRms.value, afwRms.value, rtol=1e-10)
+
+
+class CompactTestCase(lsst.utils.tests.TestCase):
+    """Testing that single-precision storage does not change the metrics."""
+
+    def setUp(self):
+        field = makeSyntheticStarField(nObjects=500, nVisits=4, footprint=0.3, seed=9753)
+        self.allMatches = makeSyntheticMatchedArrays(field)
+        self.dataset = build_matched_dataset_from_arrays(self.allMatches, 'synthetic')
+        self.compactDataset = build_matched_dataset_from_arrays(self.allMatches, 'synthetic',
+                                                                compact=True)
+
+    def testStorage(self):
+        compact = self.compactDataset._matchedCatalog
+        self.assertEqual(compact.column('base_PsfFlux_mag').dtype, np.float32)
+        self.assertEqual(compact.column('coord_ra').dtype, np.float64)
+        self.assertLess(compact.nbytes, 0.8*self.allMatches.nbytes)
+        for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+            self.assertEqual(self.compactDataset[name].quantity.value.dtype, np.float32)
+
+    def testMetrics(self):
+        for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+            self.assertFloatsAlmostEqual(self.compactDataset[name].quantity.value,
+                                         self.dataset[name].quantity.value, rtol=1e-5, atol=1e-6)
+        self.assertFloatsEqual(self.compactDataset.safeMatches.ids, self.dataset.safeMatches.ids)
+
+        np.random.seed(42)
+        pa1 = calcPa1(self.dataset.safeMatches, self.dataset.magKey)
+        np.random.seed(42)
+        compactPa1 = calcPa1(self.compactDataset.safeMatches, self.compactDataset.magKey)
+        self.assertFloatsAlmostEqual(compactPa1['PA1'].value, pa1['PA1'].value, rtol=1e-4)
+
+        annulus = np.array([0.5, 1.5]) * u.arcmin
+        magRange = np.array([17, 21.5]) * u.mag
+        rms = calcRmsDistances(self.dataset.safeMatches, annulus, magRange)
+        compactRms = calcRmsDistances(self.compactDataset.safeMatches, annulus, magRange)
+        self.assertFloatsAlmostEqual(compactRms.value, rms.value, rtol=1e-10)
+
+
+class CompactLoadingTestCase(lsst.utils.tests.TestCase):
+    """Testing that the default matching compacts catalogs as it loads them."""
+
+    def testCompactMultiMatch(self):
+        field = makeSyntheticStarField(nObjects=300, nVisits=4, footprint=0.3, seed=1361)
+        schema, catalogs = makeSourceCatalogs(field)
+        dataIds = [dataId for dataId, catalog in catalogs]
+        matchRadius = afwGeom.Angle(1, afwGeom.arcseconds)
+        with fakeLoading(schema, catalogs):
+            catalog, groupView = matchreduce._loadAndMatchCatalogs(None, dataIds, matchRadius)
+            catalog, compactView = matchreduce._loadAndMatchCatalogs(None, dataIds, matchRadius,
+                                                                     compact=True)
+
+        expected = MatchedArrays.fromGroupView(groupView).compact()
+        matches = MatchedArrays.fromGroupView(compactView)
+        self.assertEqual(matches.column('base_PsfFlux_mag').dtype, np.float32)
+        self.assertEqual(matches.column('coord_ra').dtype, np.float64)
+        self.assertLess(matches.nbytes, MatchedArrays.fromGroupView(groupView).nbytes)
+        self.assertFloatsEqual(matches.ids, expected.ids)
+        for name in expected.columns:
+            self.assertFloatsEqual(matches.column(name).astype(float),
+                                   expected.column(name).astype(float))
+
+
+class MemoryBudgetLoadingTestCase(lsst.utils.tests.TestCase):
+    """Testing that the default matching keeps to a memory budget."""
+
+    def testExhaustedBudget(self):
+        field = makeSyntheticStarField(nObjects=300, nVisits=4, footprint=0.3, seed=1367)
+        schema, catalogs = makeSourceCatalogs(field)
+        dataIds = [dataId for dataId, catalog in catalogs]
+        matchRadius = afwGeom.Angle(1, afwGeom.arcseconds)
+        budget = MemoryBudget(0., minSpillMb=0.)
+        with fakeLoading(schema, catalogs):
+            catalog, groupView = matchreduce._loadAndMatchCatalogs(None, dataIds, matchRadius,
+                                                                   keepCatalog=True)
+            self.assertIsNotNone(catalog)
+            catalog, groupView = matchreduce._loadAndMatchCatalogs(None, dataIds, matchRadius,
+                                                                   keepCatalog=True,
+                                                                   memoryBudget=budget)
+        self.assertIsNone(catalog)
+
+        expected = MatchedArrays.fromGroupView(groupView)
+        matches = MatchedArrays.fromGroupView(groupView, empty=budget.empty)
+        self.assertIsInstance(matches.column('base_PsfFlux_mag'), np.memmap)
+        self.assertFloatsEqual(matches.ids, expected.ids)
+        for name in expected.columns:
+            self.assertFloatsEqual(matches.column(name).astype(float),
+                                   expected.column(name).astype(float))
+
+
+class OptionConflictTestCase(lsst.utils.tests.TestCase):
+    """Testing that conflicting matching options are rejected."""
+
+    def testBuildMatchedDataset(self):
+        dataIds = [{'visit': 1, 'ccd': 0, 'filter': 'r'}]
+        for kwargs in ({'streaming': True, 'tileSize': 0.5},
+                       {'prefilter': True, 'matchState': 'state'},
+                       {'streaming': True, 'compact': True},
+                       {'streaming': True, 'dense': True}):
+            with self.assertRaises(ValueError):
+                matchreduce.build_matched_dataset(None, dataIds, **kwargs)
+
+    def testConfig(self):
+        config = MatchedVisitMetricsConfig()
+        config.instrumentName = 'HSC'
+        config.datasetName = 'validation_data_hsc'
+        config.validate()
+        config.tileSize = 0.5
+        config.incremental = True
+        with self.assertRaises(ValueError):
+            config.validate()
+        config.incremental = False
+        config.validate()
+        config.tileSize = None
+        config.streaming = True
+        config.cacheDir = 'cache'
+        with self.assertRaises(ValueError):
+            config.validate()
+
+
+class PoisonSourcesTestCase(lsst.utils.tests.TestCase):
+    """Testing that dropping poisoned objects does not change the reduction."""
+
+    def testDropPoisonedObjects(self):
+        field = makeSyntheticStarField(nObjects=500, nVisits=4, seed=1357)
+        rng = np.random.RandomState(2468)
+        nDetections = len(field.object)
+        field.base_PixelFlags_flag_cr[:] = rng.uniform(size=nDetections) < 0.02
+        field.base_PsfFlux_mag[rng.uniform(size=nDetections) < 0.02] = np.nan
+
+        allMatches = makeSyntheticMatchedArrays(field)
+        poison = findPoisonSources(allMatches.columns)
+        self.assertGreater(poison.sum(), 0)
+        poisoned = np.unique(allMatches.column('object')[poison])
+        clean = ~np.in1d(allMatches.column('object'), poisoned)
+        cleanMatches = MatchedArrays({name: values[clean]
+                                      for name, values in allMatches.columns.items()})
+
+        expected = build_matched_dataset_from_arrays(allMatches, 'synthetic')
+        prefiltered = build_matched_dataset_from_arrays(cleanMatches, 'synthetic')
+        for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+            self.assertFloatsEqual(prefiltered[name].quantity.value,
+                                   expected[name].quantity.value)
+        self.assertFloatsEqual(prefiltered.safeMatches.ids, expected.safeMatches.ids)
+
+    def testSameAsMultiMatch(self):
+        """Does the pre-filtered loader give the statistics of MultiMatch?"""
+        field = makeSyntheticStarField(nObjects=300, nVisits=4, footprint=0.3, seed=1359)
+        rng = np.random.RandomState(2470)
+        nDetections = len(field.object)
+        poisonRows = np.flatnonzero(rng.uniform(size=nDetections) < 0.03)
+        field.base_PsfFlux_mag[rng.uniform(size=nDetections) < 0.02] = np.nan
+
+        schema, catalogs = makeSourceCatalogs(field, poisonRows)
+        dataIds = [dataId for dataId, catalog in catalogs]
+        matchRadius = afwGeom.Angle(1, afwGeom.arcseconds)
+        with fakeLoading(schema, catalogs):
+            catalog, groupView = matchreduce._loadAndMatchCatalogs(None, dataIds, matchRadius)
+            prefilteredMatches = matchreduce._loadAndMatchPrefiltered(None, dataIds, matchRadius)
+
+        expected = build_matched_dataset_from_arrays(MatchedArrays.fromGroupView(groupView),
+                                                     'synthetic')
+        prefiltered = build_matched_dataset_from_arrays(prefilteredMatches, 'synthetic')
+        self.assertLess(len(prefiltered.goodMatches), len(np.unique(field.object)))
+        self.assertEqual(len(prefiltered.safeMatches), len(expected.safeMatches))
+        for name in ('snr', 'mag', 'magrms', 'magerr', 'dist'):
+            self.assertFloatsAlmostEqual(np.sort(prefiltered[name].quantity.value),
+                                         np.sort(expected[name].quantity.value), rtol=1e-12)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,99 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+
+from lsst.validate.drp.memory import MemoryBudget, currentRssMb
+from lsst.validate.drp.synthetic import makeSyntheticStarField, makeSyntheticMatchedDataset
+from lsst.validate.drp.calcsrd.pa1 import calcPa1
+
+
+class MemoryBudgetTestCase(lsst.utils.tests.TestCase):
+    """Testing the spilling of arrays beyond a memory budget."""
+
+    def testSpill(self):
+        self.assertGreater(currentRssMb(), 0)
+        exhausted = MemoryBudget(0., minSpillMb=0.)
+        generous = MemoryBudget(1e9, minSpillMb=0.)
+        self.assertTrue(exhausted.exceeded())
+        self.assertFalse(generous.exceeded())
+
+        self.assertIsInstance(exhausted.empty((3, 4)), np.memmap)
+        self.assertNotIsInstance(generous.empty((3, 4)), np.memmap)
+
+        array = np.arange(12.).reshape(3, 4)
+        spilled = exhausted.spill(array)
+        self.assertIsInstance(spilled, np.memmap)
+        self.assertFloatsEqual(spilled, array)
+        self.assertIs(generous.spill(array), array)
+
+        columns = {'a': np.arange(10.), 'b': np.arange(1000.)}
+        exhausted.spillColumns(columns)
+        self.assertIsInstance(columns['b'], np.memmap)
+        self.assertFloatsEqual(columns['a'], np.arange(10.))
+        self.assertGreater(exhausted.spilledMb, 0.)
+
+    def testSpillExcessOnly(self):
+        """Are only as many columns spilled as cover the excess, and do
+        spilled arrays stop counting against the budget?"""
+        columns = {'a': np.ones(8*1024**2 // 8), 'b': np.ones(2*1024**2 // 8),
+                   'c': np.ones(1024**2 // 8)}
+        budget = MemoryBudget(0., minSpillMb=0.)
+        budget.maxMb = budget.usedMb() - 3.
+        budget.spillColumns(columns)
+        self.assertIsInstance(columns['a'], np.memmap)
+        self.assertNotIsInstance(columns['b'], np.memmap)
+        self.assertNotIsInstance(columns['c'], np.memmap)
+        self.assertEqual(budget.spilledMb, 8.)
+        self.assertLessEqual(budget.usedMb(), currentRssMb())
+        self.assertFloatsEqual(columns['a'], np.ones(len(columns['a'])))
+
+    def testPa1(self):
+        """Are the PA1 arrays the same when spilled?"""
+        field = makeSyntheticStarField(nObjects=300, nVisits=4, footprint=0.3, seed=86420)
+        dataset = makeSyntheticMatchedDataset(field, backend='arrays')
+        exhausted = MemoryBudget(0., minSpillMb=0.)
+        results = []
+        for budget in (None, exhausted):
+            np.random.seed(4321)
+            results.append(calcPa1(dataset.safeMatches, dataset.magKey, numRandomShuffles=5,
+                                   memoryBudget=budget))
+        self.assertGreater(exhausted.spilledMb, 0.)
+        for name in ('rms', 'iqr', 'magDiff', 'magMean'):
+            self.assertFloatsEqual(results[0][name].value, results[1][name].value)
+        self.assertEqual(results[0]['magDiff'].shape, (5, len(dataset.safeMatches)))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,135 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import unittest
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+from matplotlib.collections import PathCollection, PolyCollection  # noqa: E402
+from matplotlib.contour import ContourSet  # noqa: E402
+import numpy as np  # noqa: E402
+import astropy.units as u  # noqa: E402
+
+import lsst.utils.tests  # noqa: E402
+
+import lsst.validate.drp.plot as validatePlot  # noqa: E402
+from lsst.validate.drp.plot import plotScatterOrDensity  # noqa: E402
+
+
+class PlotScatterOrDensityTestCase(lsst.utils.tests.TestCase):
+    """Testing the switch between scatter and density rendering."""
+
+    def setUp(self):
+        rng = np.random.RandomState(1234)
+        self.x = 10**rng.uniform(0.5, 3, size=2000)
+        self.y = rng.normal(100, 20, size=2000) * u.marcsec
+        self.fig, self.ax = plt.subplots()
+
+    def tearDown(self):
+        plt.close(self.fig)
+
+    def testScatter(self):
+        artist = plotScatterOrDensity(self.ax, self.x, self.y, s=10, color='blue',
+                                      maxPoints=len(self.x))
+        self.assertIsInstance(artist, PathCollection)
+        self.assertEqual(len(artist.get_offsets()), len(self.x))
+
+    def testDensity(self):
+        extent = [10, 1000, 50, 150]
+        artist = plotScatterOrDensity(self.ax, self.x, self.y, color='grey', maxPoints=100,
+                                      extent=extent, xscale='log')
+        self.assertIsInstance(artist, PolyCollection)
+        # Only the points in the window are binned, at least one per drawn bin.
+        y = self.y.value
+        inWindow = (self.x >= 10) & (self.x <= 1000) & (y >= 50) & (y <= 150)
+        counts = artist.get_array()
+        self.assertGreater(len(counts), 0)
+        self.assertLessEqual(counts.sum(), inWindow.sum())
+
+    def testOverlay(self):
+        """Is a density layer drawn over another one drawn as contours?"""
+        below = plotScatterOrDensity(self.ax, self.x, self.y, color='grey', maxPoints=100,
+                                     xscale='log', label='All')
+        bright = self.x > 100
+        above = plotScatterOrDensity(self.ax, self.x[bright], self.y[bright], color='blue',
+                                     maxPoints=100, xscale='log', label='Bright',
+                                     overlay=True)
+        self.assertIsInstance(below, PolyCollection)
+        self.assertIsInstance(above, ContourSet)
+        labels = self.ax.get_legend_handles_labels()[1]
+        self.assertIn('Bright', labels)
+
+        # The overlay of a small sample is still drawn as points.
+        points = plotScatterOrDensity(self.ax, self.x[:50], self.y[:50], color='blue',
+                                      maxPoints=100, overlay=True)
+        self.assertIsInstance(points, PathCollection)
+
+
+class PlotCacheTestCase(lsst.utils.tests.TestCase):
+    """Testing the digest that decides whether a plot is redrawn."""
+
+    def setUp(self):
+        self.maxScatterPoints = validatePlot.maxScatterPoints
+        self.version = validatePlot.__version__
+        self.hashPlotInputs = validatePlot.hashPlotInputs
+        self.plotIsUpToDate = validatePlot.plotIsUpToDate
+
+    def tearDown(self):
+        validatePlot.maxScatterPoints = self.maxScatterPoints
+        validatePlot.__version__ = self.version
+        validatePlot.hashPlotInputs = self.hashPlotInputs
+        validatePlot.plotIsUpToDate = self.plotIsUpToDate
+
+    def testVersion(self):
+        """Does a new validate_drp version change the digest?"""
+        digest = validatePlot.hashPlotInputs(np.arange(10), outputPrefix='a')
+        self.assertEqual(validatePlot.hashPlotInputs(np.arange(10), outputPrefix='a'), digest)
+        validatePlot.__version__ = self.version + '.post1'
+        self.assertNotEqual(validatePlot.hashPlotInputs(np.arange(10), outputPrefix='a'), digest)
+
+    def testDefaultThreshold(self):
+        """Is the default scatter threshold hashed as its current value?"""
+        hashedStyles = []
+
+        def hashPlotInputs(*inputs, **style):
+            hashedStyles.append(style)
+            return 'digest'
+
+        validatePlot.hashPlotInputs = hashPlotInputs
+        validatePlot.plotIsUpToDate = lambda plotPath, digest: True
+        validatePlot.maxScatterPoints = 123
+        validatePlot.plotAstrometryErrorModel(None, None, outputPrefix='a_')
+        validatePlot.plotPhotometryErrorModel(None, None, outputPrefix='a_')
+        self.assertEqual([style['maxPoints'] for style in hashedStyles], [123, 123])
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
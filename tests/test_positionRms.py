@@ -103,6 +103,23 @@ def test_wrap_positionRms():
     assert_almost_equal(obs, exp, decimal=7)  # 1e-7 rad == 5.73e-6 deg == 36 milliarcsec
 
 
+def test_grouped_positionRms():
+    ra = np.deg2rad(np.array([10.0010, 10.0005, 10.0000, 10.0005,
+                              10.0010, 10.0005, 190.0000, 190.0005,
+                              30.0]))
+    dec = np.deg2rad(np.array([20.001, 20.006, 20.002, 20.004,
+                               89.999, 89.998, 89.999, 89.998,
+                               -10.0]))
+    offsets = np.array([0, 4, 8, 9])
+
+    exp = [util.positionRms(*(util.averageRaDec(ra[start:stop], dec[start:stop]) +
+                              (ra[start:stop], dec[start:stop])))
+           for start, stop in zip(offsets[:-1], offsets[1:])]
+    obs = util.groupedPositionRms(ra, dec, offsets)
+
+    assert_almost_equal(obs, exp, decimal=7)
+
+
 if __name__ == "__main__":
     lsst.utils.tests.init()
     unittest.main()
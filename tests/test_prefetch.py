@@ -0,0 +1,80 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import time
+import unittest
+
+import lsst.utils.tests
+
+from lsst.validate.drp.instrumentation import StageTimer
+from lsst.validate.drp.prefetch import Prefetcher
+
+
+class PrefetcherTestCase(lsst.utils.tests.TestCase):
+    """Testing the background loading queue."""
+
+    def testOrder(self):
+        timer = StageTimer()
+        prefetcher = Prefetcher(lambda x: x**2, range(20), depth=3, timer=timer)
+        self.assertEqual(list(prefetcher), [(x, x**2) for x in range(20)])
+        self.assertEqual(prefetcher.stats['items'], 20)
+
+    def testStarvation(self):
+        def slowSquare(x):
+            time.sleep(0.02)
+            return x**2
+
+        timer = StageTimer()
+        prefetcher = Prefetcher(slowSquare, range(5), depth=2, timer=timer)
+        for item, result in prefetcher:
+            pass
+        self.assertGreater(prefetcher.stats['starved'], 0)
+        self.assertIn('prefetchWait', timer.summary())
+
+    def testError(self):
+        def failOnThree(x):
+            if x == 3:
+                raise RuntimeError("cannot load 3")
+            return x
+
+        results = []
+        with self.assertRaises(RuntimeError):
+            for item, result in Prefetcher(failOnThree, range(10)):
+                results.append(result)
+        self.assertEqual(results, [0, 1, 2])
+
+    def testEarlyStop(self):
+        for item, result in Prefetcher(lambda x: x, range(1000), depth=2):
+            if item == 5:
+                break
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,143 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from astropy.io import fits
+
+import lsst.utils.tests
+import lsst.daf.persistence as dafPersist
+
+import lsst.validate.drp.readorder as readorder
+from lsst.validate.drp.readorder import planReadOrder, chooseSeedVisit
+
+
+class ReadOrderTestCase(lsst.utils.tests.TestCase):
+    """Testing the grouping of data IDs by visit."""
+
+    def setUp(self):
+        self.dataIds = [{'visit': v, 'ccd': c, 'filter': 'r'}
+                        for c in (3, 1, 2) for v in (20, 10)]
+
+    def testGroupByVisit(self):
+        ordered = planReadOrder(self.dataIds)
+        self.assertEqual([(d['visit'], d['ccd']) for d in ordered],
+                         [(20, 1), (20, 2), (20, 3), (10, 1), (10, 2), (10, 3)])
+
+    def testSeedVisit(self):
+        ordered = planReadOrder(self.dataIds, seedVisit=10)
+        self.assertEqual([d['visit'] for d in ordered], [10, 10, 10, 20, 20, 20])
+        with self.assertRaises(ValueError):
+            planReadOrder(self.dataIds, seedVisit=30)
+
+
+class FakeButler(object):
+    """Stand-in for a Gen2 butler without ``src_len``, whose ``src``
+    catalogs are ``<root>/<visit>-<ccd>.fits``."""
+
+    def __init__(self, root, nSources):
+        self.root = root
+        self.nSources = nSources
+        self.read = []
+
+    def get(self, datasetType, dataId):
+        if datasetType == 'src_len':
+            raise KeyError("Unknown dataset type src_len")
+        self.read.append((dataId['visit'], dataId['ccd']))
+        return [None] * self.nSources[(dataId['visit'], dataId['ccd'])]
+
+    def getUri(self, datasetType, dataId):
+        if (dataId['visit'], dataId['ccd']) not in self.nSources:
+            raise dafPersist.NoResults("No locations for getUri: ", datasetType, dataId)
+        return os.path.join(self.root, '%(visit)d-%(ccd)d.fits[0]' % dataId)
+
+
+class SeedVisitTestCase(lsst.utils.tests.TestCase):
+    """Testing the choice of the deepest visit."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.nSources = {(1, 0): 10, (1, 1): 10, (2, 0): 30, (2, 1): 0}
+        self.dataIds = [{'visit': visit, 'ccd': ccd, 'filter': 'r'} for visit, ccd in
+                        sorted(self.nSources)]
+        self.dafPersist = readorder.dafPersist
+
+        class Persistence(object):
+            Butler = FakeButler
+            NoResults = dafPersist.NoResults
+
+        readorder.dafPersist = Persistence
+
+    def tearDown(self):
+        readorder.dafPersist = self.dafPersist
+        shutil.rmtree(self.directory)
+
+    def writeCatalogs(self, fitsFiles=True):
+        for (visit, ccd), nSources in self.nSources.items():
+            filename = os.path.join(self.directory, '%d-%d.fits' % (visit, ccd))
+            if fitsFiles:
+                table = fits.BinTableHDU.from_columns(
+                    [fits.Column(name='id', format='K', array=np.arange(nSources))])
+                fits.HDUList([fits.PrimaryHDU(), table]).writeto(filename)
+            else:
+                open(filename, 'w').close()
+
+    def testFitsHeaders(self):
+        """Are the sources counted from the FITS headers?"""
+        self.writeCatalogs()
+        butler = FakeButler(self.directory, self.nSources)
+        self.assertEqual(readorder._sourceCount(butler, self.dataIds[2]), 30)
+        self.assertEqual(chooseSeedVisit(butler, self.dataIds), 2)
+        self.assertEqual(butler.read, [])
+
+    def testReadCatalogs(self):
+        """Is only one catalog per visit read if the sources cannot be
+        counted without reading them?"""
+        self.writeCatalogs(fitsFiles=False)
+        butler = FakeButler(self.directory, self.nSources)
+        self.assertIsNone(readorder._sourceCount(butler, self.dataIds[0]))
+        self.assertEqual(chooseSeedVisit(butler, self.dataIds), 2)
+        self.assertEqual(butler.read, [(1, 0), (2, 0)])
+
+    def testMissingCatalogs(self):
+        """Do data IDs without a catalog count as empty?"""
+        self.writeCatalogs()
+        del self.nSources[(2, 0)]
+        butler = FakeButler(self.directory, self.nSources)
+        self.assertEqual(readorder._estimateSourceCount(butler, self.dataIds), (20., 0))
+        self.assertEqual(chooseSeedVisit(butler, self.dataIds), 1)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,119 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import astropy.units as u
+
+import lsst.utils.tests
+from lsst.verify import Blob, Datum, Job, Measurement
+
+from lsst.validate.drp.resultstore import ResultStore
+
+
+def makeJob(filterName, am1, photScatter):
+    photomModel = Blob('PhotometricErrorModel')
+    photomModel['photScatter'] = Datum(quantity=photScatter*u.mmag, description='scatter')
+    photomModel['brightSnr'] = Datum(quantity=100*u.Unit(''), description='SNR')
+    measurement = Measurement('validate_drp.AM1', am1*u.marcsec)
+    measurement.link_blob(photomModel)
+    return Job(measurements=[measurement],
+               meta={'instrument': 'HSC', 'filter_name': filterName,
+                     'dataset_repo_url': 'validation_data_hsc'})
+
+
+class ResultStoreTestCase(lsst.utils.tests.TestCase):
+    """Testing the SQLite registry of validation runs."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.store = ResultStore(os.path.join(self.tmpDir, 'results.sqlite3'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpDir)
+
+    def testTrend(self):
+        for i, (filterName, am1) in enumerate([('r', 8.), ('i', 9.), ('r', 7.), ('r', np.nan)]):
+            self.store.addJob(makeJob(filterName, am1, 10. + i), codeVersion='v%d' % i,
+                              timestamp=1000. + i)
+
+        trend = self.store.trend('AM1', filterName='r')
+        self.assertEqual(list(trend['code_version']), ['v0', 'v2', 'v3'])
+        self.assertFloatsEqual(trend['value'][:2], np.array([8., 7.]))
+        self.assertTrue(np.isnan(trend['value'][2]))
+        self.assertEqual(trend['unit'][0], 'marcsec')
+
+        trend = self.store.trend('photScatter', blob='PhotometricErrorModel', since=1001.)
+        self.assertFloatsEqual(trend['value'], np.array([11., 12., 13.]))
+
+        self.assertEqual(len(self.store.runs(instrument='HSC')), 4)
+        self.assertEqual(len(self.store.runs(instrument='CFHT')), 0)
+        self.assertEqual(len(self.store.trend('AM2')), 0)
+
+    def testJsonRoundTrip(self):
+        filename = os.path.join(self.tmpDir, 'run_r.json')
+        makeJob('r', 8., 10.).write(filename)
+        runId, = self.store.importJson([filename])
+        self.assertEqual(self.store.runs()['source'][0], os.path.abspath(filename))
+
+        exported = os.path.join(self.tmpDir, 'exported_r.json')
+        self.store.exportJson(runId, exported)
+        runId2, = self.store.importJson([exported])
+        self.assertFloatsEqual(self.store.trend('AM1')['value'], np.array([8., 8.]))
+
+        self.store.remove(runId)
+        self.assertEqual(list(self.store.runs()['id']), [runId2])
+        with self.assertRaises(KeyError):
+            self.store.job(runId)
+
+    def testImportAgain(self):
+        """Is a file imported again only once it was rewritten?"""
+        filename = os.path.join(self.tmpDir, 'run_r.json')
+        job = makeJob('r', 8., 10.)
+        job.meta['validate_drp_version'] = 'v1'
+        job.write(filename)
+        runId, = self.store.importJson([filename])
+        self.assertEqual(self.store.importJson([filename]), [runId])
+        self.assertEqual(list(self.store.runs()['code_version']), ['v1'])
+
+        mtime = os.path.getmtime(filename)
+        os.utime(filename, (mtime + 10, mtime + 10))
+        runId2, = self.store.importJson([filename])
+        self.assertNotEqual(runId2, runId)
+        self.assertEqual(len(self.store.runs()), 2)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
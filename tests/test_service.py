@@ -0,0 +1,183 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+from __future__ import print_function, division
+
+import json
+import threading
+import unittest
+
+try:
+    from http.server import HTTPServer
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import HTTPServer
+    from urllib2 import urlopen, Request, HTTPError
+
+import lsst.utils.tests
+
+import lsst.validate.drp.service as service
+from lsst.validate.drp.service import ValidationService, RequestError, _RequestHandler
+
+
+class _FakeService(object):
+    def __init__(self):
+        self.requests = []
+
+    def compute(self, request):
+        self.requests.append(request)
+        if 'repo' not in request:
+            raise RequestError('A request needs a repo')
+        if request['repo'] == 'broken':
+            # An internal error, not one of the request.
+            raise KeyError('base_PsfFlux_mag')
+        return {'measurements': {'AM1': {'value': 7.5, 'unit': 'marcsec'}},
+                'warm': len(self.requests) > 1, 'elapsed': 0.}
+
+    def status(self):
+        return {'butlers': [], 'datasets': []}
+
+    def evict(self, repo=None):
+        pass
+
+
+class ServiceHandlerTestCase(lsst.utils.tests.TestCase):
+    """Testing the HTTP interface of the validation service."""
+
+    def setUp(self):
+        self.service = _FakeService()
+        handler = type('RequestHandler', (_RequestHandler,), {'service': self.service})
+        handler.log_message = lambda *args: None
+        self.server = HTTPServer(('localhost', 0), handler)
+        self.url = 'http://localhost:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def post(self, path, content):
+        request = Request(self.url + path, data=json.dumps(content).encode('utf-8'))
+        return json.loads(urlopen(request).read().decode('utf-8'))
+
+    def testMetrics(self):
+        request = {'repo': 'CFHT/output', 'filter': 'r', 'annulusWidth': 1.}
+        result = self.post('/metrics', request)
+        self.assertEqual(result['measurements']['AM1']['value'], 7.5)
+        self.assertFalse(result['warm'])
+        self.assertTrue(self.post('/metrics', request)['warm'])
+        self.assertEqual(self.service.requests[0], request)
+
+    def testErrors(self):
+        with self.assertRaises(HTTPError) as context:
+            self.post('/metrics', {'filter': 'r'})
+        self.assertEqual(context.exception.code, 400)
+        with self.assertRaises(HTTPError) as context:
+            urlopen(Request(self.url + '/metrics', data=b'{"repo": '))
+        self.assertEqual(context.exception.code, 400)
+        with self.assertRaises(HTTPError) as context:
+            self.post('/metrics', {'repo': 'broken'})
+        self.assertEqual(context.exception.code, 500)
+        with self.assertRaises(HTTPError) as context:
+            urlopen(self.url + '/unknown')
+        self.assertEqual(context.exception.code, 404)
+        self.assertEqual(json.loads(urlopen(self.url + '/status').read().decode('utf-8')),
+                         {'butlers': [], 'datasets': []})
+
+
+class _FakeMetricSet(object):
+    @staticmethod
+    def load_metrics_package(package_name_or_path, subset=None):
+        return {}
+
+
+class ValidationServiceTestCase(lsst.utils.tests.TestCase):
+    """Testing how the service reuses matched datasets."""
+
+    def setUp(self):
+        self.originals = (service.MetricSet, service.dafPersist, service.discoverDataIds,
+                          service.build_matched_dataset)
+        self.builds = []
+
+        def discoverDataIds(repo, filter=None):
+            return [{'visit': 1, 'raft': '2,2', 'sensor': '1,1', 'filter': filter},
+                    {'visit': 2, 'raft': '2,2', 'sensor': '1,1', 'filter': filter}]
+
+        def build_matched_dataset(repo, dataIds, **kwargs):
+            # Like loading, add keys to the data IDs.
+            for dataId in dataIds:
+                dataId['raft_sensor_int'] = 1111
+            self.builds.append(dataIds)
+            return object()
+
+        service.MetricSet = _FakeMetricSet
+        service.dafPersist = type('FakeDafPersist', (object,), {'Butler': staticmethod(str)})
+        service.discoverDataIds = discoverDataIds
+        service.build_matched_dataset = build_matched_dataset
+
+    def tearDown(self):
+        (service.MetricSet, service.dafPersist, service.discoverDataIds,
+         service.build_matched_dataset) = self.originals
+
+    def testDiscoveredDataIdsReused(self):
+        """Is a dataset of discovered data IDs built once, even though
+        building adds keys to the data IDs?"""
+        validationService = ValidationService()
+        dataset, warm = validationService.dataset('repo', filterName='r')
+        self.assertFalse(warm)
+        self.assertIs(validationService.dataset('repo', filterName='r')[0], dataset)
+        self.assertTrue(validationService.dataset('repo', filterName='r')[1])
+        self.assertEqual(len(self.builds), 1)
+        self.assertNotIn('raft_sensor_int', validationService.dataIds[('repo', 'r')][0])
+
+    def testReadOrder(self):
+        """Are the same data IDs in another order matched again?"""
+        validationService = ValidationService()
+        dataIds = [{'visit': 1, 'ccd': 1, 'filter': 'r'}, {'visit': 2, 'ccd': 1, 'filter': 'r'}]
+        validationService.dataset('repo', dataIds=dataIds)
+        self.assertTrue(validationService.dataset('repo', dataIds=list(dataIds))[1])
+        self.assertFalse(validationService.dataset('repo', dataIds=dataIds[::-1])[1])
+
+    def testRequestErrors(self):
+        validationService = ValidationService()
+        with self.assertRaises(RequestError):
+            validationService.compute({'filter': 'r'})
+        with self.assertRaises(RequestError):
+            validationService.compute({'repo': 'repo', 'filter': 'r', 'metrics': ['AM4']})
+        with self.assertRaises(RequestError):
+            validationService.compute({'repo': 'repo'})
+        self.assertEqual(self.builds, [])
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
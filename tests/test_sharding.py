@@ -0,0 +1,125 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import astropy.units as u
+
+import lsst.utils.tests
+
+from lsst.validate.drp.incremental import ObjectMatcher
+from lsst.validate.drp.sharding import SkyTiling, shardedMatch, TiledCatalogs
+from lsst.validate.drp.synthetic import makeSyntheticStarField
+
+
+class ShardedMatchTestCase(lsst.utils.tests.TestCase):
+    """Testing that tiled matching agrees with a global match."""
+
+    matchRadius = (1 * u.arcsec).to(u.radian).value
+
+    def globalMatch(self, field):
+        matcher = ObjectMatcher(self.matchRadius)
+        allRows = []
+        allObjects = []
+        for visit in np.unique(field.visit):
+            visitRows = np.flatnonzero(field.visit == visit)
+            rows, objectIds = matcher.match(field.coord_ra[visitRows], field.coord_dec[visitRows])
+            allRows.append(visitRows[rows])
+            allObjects.append(objectIds)
+        return np.concatenate(allRows), np.concatenate(allObjects)
+
+    def checkField(self, field, nProcesses=1):
+        # Match visit by visit, in the order of a global match.
+        order = np.argsort(field.visit, kind='mergesort')
+        expectedRows, expectedObjects = self.globalMatch(field)
+        rows, objectIds = shardedMatch(field.coord_ra[order], field.coord_dec[order],
+                                       field.visit[order], self.matchRadius,
+                                       np.deg2rad(0.1), nProcesses=nProcesses)
+        rows = order[rows]
+        # Compare as sets of (source, object) pairs.
+        expected = np.lexsort((expectedObjects, expectedRows))
+        actual = np.lexsort((objectIds, rows))
+        self.assertFloatsEqual(rows[actual], expectedRows[expected])
+        self.assertFloatsEqual(objectIds[actual], expectedObjects[expected])
+
+    def testSameAsGlobalMatch(self):
+        field = makeSyntheticStarField(nObjects=2000, nVisits=3, footprint=0.5,
+                                       detectionFraction=0.8, seed=5)
+        self.checkField(field)
+
+    def testParallel(self):
+        field = makeSyntheticStarField(nObjects=1000, nVisits=3, footprint=0.3, seed=6)
+        self.checkField(field, nProcesses=2)
+
+    def testRaWrap(self):
+        field = makeSyntheticStarField(nObjects=1000, nVisits=3, footprint=0.3,
+                                       raCenter=0.0, decCenter=-30.0, seed=7)
+        field.coord_ra %= 2*np.pi
+        self.checkField(field)
+
+    def testTiledCatalogs(self):
+        """Does matching tiles written to disk give the result of shardedMatch?"""
+        field = makeSyntheticStarField(nObjects=1000, nVisits=3, footprint=0.3, seed=9)
+        order = np.argsort(field.visit, kind='mergesort')
+        rows, objectIds = shardedMatch(field.coord_ra[order], field.coord_dec[order],
+                                       field.visit[order], self.matchRadius, np.deg2rad(0.1))
+        rows = order[rows]
+
+        directory = tempfile.mkdtemp()
+        try:
+            tiled = TiledCatalogs(os.path.join(directory, 'tiles'), self.matchRadius,
+                                  np.deg2rad(0.1))
+            for visit in np.unique(field.visit):
+                visitRows = np.flatnonzero(field.visit == visit)
+                tiled.add({'coord_ra': field.coord_ra[visitRows],
+                           'coord_dec': field.coord_dec[visitRows],
+                           'row': visitRows})
+            matched = tiled.match()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        self.assertFloatsEqual(matched['row'], rows)
+        self.assertFloatsEqual(matched['object'], objectIds)
+
+    def testTilesWithinIncludeOwnTile(self):
+        tiling = SkyTiling(np.deg2rad(1.0))
+        rng = np.random.RandomState(8)
+        ra = rng.uniform(0, 2*np.pi, 1000)
+        dec = np.arcsin(rng.uniform(-1, 1, 1000))
+        rows, tiles = tiling.tilesWithin(ra, dec, np.deg2rad(0.01))
+        own = set(zip(np.arange(1000), tiling.tile(ra, dec)))
+        self.assertTrue(own <= set(zip(rows, tiles)))
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
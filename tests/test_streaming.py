@@ -0,0 +1,106 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function, division
+
+import unittest
+
+import numpy as np
+import astropy.units as u
+
+import lsst.utils.tests
+from lsst.verify import Blob, Datum
+
+from lsst.validate.drp.incremental import ObjectMatcher
+from lsst.validate.drp.streaming import StreamingStarStatistics
+from lsst.validate.drp.synthetic import makeSyntheticStarField, makeSyntheticMatchedDataset
+
+
+class StreamingStarStatisticsTestCase(lsst.utils.tests.TestCase):
+    """Testing the streaming per-star reduction."""
+
+    def setUp(self):
+        self.field = makeSyntheticStarField(nObjects=400, nVisits=6, footprint=0.3, seed=11)
+        self.names = [name for name in vars(self.field)
+                      if name not in ('object', 'trueRa', 'trueDec', 'trueMag')]
+
+    def reduce(self, quantileSamples):
+        matcher = ObjectMatcher((1 * u.arcsec).to(u.radian).value)
+        statistics = StreamingStarStatistics(quantileSamples=quantileSamples, seed=3)
+        for visit in np.unique(self.field.visit):
+            rows = self.field.visit == visit
+            columns = {name: getattr(self.field, name)[rows] for name in self.names}
+            matchRows, objectIds = matcher.match(columns['coord_ra'], columns['coord_dec'])
+            statistics.update(objectIds, {name: values[matchRows]
+                                          for name, values in columns.items()})
+
+        blob = Blob('MatchedMultiVisitDataset')
+        blob['filterName'] = Datum(quantity='synthetic', description='Filter name')
+        good, safe = statistics.reduce(blob)
+        return statistics, blob, good, safe
+
+    def testSameAsReduceStars(self):
+        """With enough samples, are the statistics those of reduceStars?"""
+        statistics, blob, good, safe = self.reduce(quantileSamples=8)
+        expected = makeSyntheticMatchedDataset(self.field, backend='arrays')
+
+        self.assertEqual(safe.sum(), len(expected.safeMatches))
+        for name in ('snr', 'mag', 'magrms', 'magerr'):
+            self.assertFloatsAlmostEqual(blob[name].quantity.value,
+                                         expected[name].quantity.value, rtol=1e-10)
+        # Tangent-plane offsets instead of great-circle distances.
+        self.assertFloatsAlmostEqual(blob['dist'].quantity.value,
+                                     expected['dist'].quantity.value, rtol=1e-6)
+
+    def testNonFiniteMagErr(self):
+        """Is a NaN magnitude uncertainty kept in the median, as in reduceStars?"""
+        rng = np.random.RandomState(12)
+        magErr = self.field.base_PsfFlux_magErr
+        magErr[rng.uniform(size=len(magErr)) < 0.02] = np.nan
+        statistics, blob, good, safe = self.reduce(quantileSamples=8)
+        expected = makeSyntheticMatchedDataset(self.field, backend='arrays')
+
+        isNan = np.isnan(blob['magerr'].quantity.value)
+        self.assertGreater(isNan.sum(), 0)
+        self.assertTrue(np.array_equal(isNan, np.isnan(expected['magerr'].quantity.value)))
+        self.assertFloatsAlmostEqual(blob['magerr'].quantity.value[~isNan],
+                                     expected['magerr'].quantity.value[~isNan], rtol=1e-10)
+
+    def testBoundedMedians(self):
+        """Are medians approximate but reasonable with fewer samples than visits?"""
+        statistics, blob, good, safe = self.reduce(quantileSamples=3)
+        expected = makeSyntheticMatchedDataset(self.field, backend='arrays')
+
+        self.assertEqual(statistics.snrSamples.shape, (statistics.nObjects, 3))
+        self.assertFloatsAlmostEqual(blob['magrms'].quantity.value,
+                                     expected['magrms'].quantity.value, rtol=1e-10)
+        ratio = blob['snr'].quantity.value / expected['snr'].quantity.value
+        self.assertLess(np.abs(np.median(ratio) - 1), 0.05)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,128 @@
+#
+# LSST Data Management System
+# Copyright 2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+from __future__ import print_function, division
+
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+
+from lsst.validate.drp.synthetic import (makeSyntheticStarField,
+                                         makeSyntheticMatchedDataset)
+from lsst.validate.drp.calcsrd.pa1 import calcPa1
+from lsst.validate.drp.benchmark import (runScalingBenchmark, runReadOrderBenchmark,
+                                         findRegressions)
+
+
+class SyntheticFieldTestCase(lsst.utils.tests.TestCase):
+    """Testing the synthetic star field generator."""
+
+    def setUp(self):
+        self.nObjects, self.nVisits = 500, 4
+        self.field = makeSyntheticStarField(nObjects=self.nObjects, nVisits=self.nVisits,
+                                            sigmaSys=0.005, seed=1234)
+
+    def testShapes(self):
+        """Does every star have one detection per visit, sorted by object?"""
+        nDetections = self.nObjects * self.nVisits
+        self.assertEqual(len(self.field.object), nDetections)
+        self.assertEqual(len(self.field.coord_ra), nDetections)
+        self.assertTrue((np.diff(self.field.object) >= 0).all())
+        self.assertEqual(len(np.unique(self.field.visit)), self.nVisits)
+
+    def testReproducible(self):
+        """Does the same seed give the same field?"""
+        other = makeSyntheticStarField(nObjects=self.nObjects, nVisits=self.nVisits,
+                                       sigmaSys=0.005, seed=1234)
+        self.assertFloatsEqual(self.field.base_PsfFlux_mag, other.base_PsfFlux_mag)
+
+    def testDetectionFraction(self):
+        """Are detections dropped with detectionFraction < 1?"""
+        field = makeSyntheticStarField(nObjects=self.nObjects, nVisits=self.nVisits,
+                                       detectionFraction=0.5, seed=1234)
+        self.assertLess(len(field.object), 0.6 * self.nObjects * self.nVisits)
+
+    def testPhotometricRepeatability(self):
+        """Is the PA1 of bright synthetic stars close to the input noise floor?"""
+        field = makeSyntheticStarField(nObjects=2000, nVisits=4, magRange=(17, 19),
+                                       sigmaSys=0.005, seed=4321)
+        dataset = makeSyntheticMatchedDataset(field)
+        pa1 = calcPa1(dataset.safeMatches, dataset.magKey, numRandomShuffles=5)
+        # Bright stars are dominated by sigmaSys = 5 mmag.
+        self.assertFloatsAlmostEqual(pa1['PA1'].value, 5.0, atol=1.5)
+
+
+class BenchmarkTestCase(lsst.utils.tests.TestCase):
+    """Testing the scaling benchmark."""
+
+    def testRunAndCompare(self):
+        """Does a small benchmark run, and are regressions flagged?"""
+        results = runScalingBenchmark([200], nVisits=3)
+        self.assertEqual(set(r['stage'] for r in results),
+                         set(['reduceStars', 'AMx', 'PA1', 'TEx']))
+        self.assertEqual(findRegressions(results, results), [])
+
+        faster = [dict(r, wall_s=r['wall_s'] / 10,
+                       traced_peak_mb=r['traced_peak_mb'] / 10) for r in results]
+        self.assertTrue(findRegressions(results, faster, minTime=0))
+
+    def testMemoryFloor(self):
+        """Is growth from a negligible memory baseline ignored?"""
+        baseline = [{'nObjects': 100, 'nVisits': 3, 'stage': 'PA1', 'wall_s': 1.0,
+                     'cpu_s': 1.0, 'traced_peak_mb': 0.01}]
+        results = [dict(baseline[0], traced_peak_mb=0.5)]
+        self.assertEqual(findRegressions(results, baseline), [])
+        results = [dict(baseline[0], traced_peak_mb=5.)]
+        self.assertEqual(len(findRegressions(results, baseline)), 1)
+
+    def testBackendsNotCompared(self):
+        """Are results only compared with a baseline of the same backend?"""
+        baseline = [{'nObjects': 100, 'nVisits': 3, 'stage': 'PA1', 'wall_s': 1.0,
+                     'cpu_s': 1.0, 'traced_peak_mb': 10.}]
+        results = [dict(baseline[0], backend='arrays', wall_s=5.)]
+        self.assertEqual(findRegressions(results, baseline), [])
+        results = [dict(baseline[0], backend='afw', wall_s=5.)]
+        self.assertEqual(len(findRegressions(results, baseline)), 1)
+
+    def testReadOrderMatchers(self):
+        """Does only the ObjectMatcher put detections in several objects?"""
+        for matcher in ('multiMatch', 'objectMatcher'):
+            results = runReadOrderBenchmark(nObjects=300, nVisits=4, matchRadius=2.0,
+                                            matcher=matcher)
+            self.assertEqual([r['order'] for r in results], ['visit', 'deepest', 'bestSeeing'])
+            for result in results:
+                self.assertEqual(result['matcher'], matcher)
+                self.assertGreater(result['nObjects'], 0)
+                self.assertLessEqual(result['fragmentedFraction'], 1.0)
+                if matcher == 'multiMatch':
+                    self.assertEqual(result['multiAssignedFraction'], 0.0)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -21,6 +21,9 @@
 
 from __future__ import division, print_function
 
+import os
+import shutil
+import tempfile
 import unittest
 
 import lsst.utils
@@ -88,6 +91,98 @@ class UtilCalculations(lsst.utils.tests.TestCase):
         self.assertFloatsAlmostEqual(exp_e2, obs_e2)
 
 
+class FindExistingFilesTestCase(lsst.utils.tests.TestCase):
+    """Test the bulk file existence checks."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'a'))
+        self.paths = [os.path.join(self.directory, 'a', 'x.fits'),
+                      os.path.join(self.directory, 'a', 'y.fits'),
+                      os.path.join(self.directory, 'b', 'x.fits'),
+                      os.path.join(self.directory, 'z.fits')]
+        for path in (self.paths[0], self.paths[3]):
+            open(path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testMethods(self):
+        for method in ('scan', 'stat'):
+            exists = util.findExistingFiles(self.paths, method=method, nThreads=2)
+            self.assertEqual(list(exists), [True, False, False, True])
+        with self.assertRaises(ValueError):
+            util.findExistingFiles(self.paths, method='walk')
+
+
+class FakeButler(object):
+    """Stand-in for a Gen2 butler of a repository with ``src`` and
+    ``calexp`` files laid out as ``<root>/<datasetType>/<visit>-<ccd>.fits``."""
+
+    dataIds = [(1, 0, 'r'), (1, 1, 'r'), (2, 0, 'r'), (2, 1, 'r')]
+    # Data IDs whose datasets are in a parent repository.
+    inParent = [(2, 1)]
+
+    def __init__(self, root):
+        self.root = root
+        self.asked = []
+
+    def getKeys(self, datasetType):
+        return {'visit': int, 'ccd': int}
+
+    def queryMetadata(self, datasetType, format, dataId):
+        assert format == ['visit', 'ccd', 'filter']
+        return list(self.dataIds)
+
+    def getUri(self, datasetType, dataId, write=False):
+        if not write:
+            raise RuntimeError("No locations for get: datasetType:%s dataId:%s" %
+                               (datasetType, dataId))
+        return os.path.join(self.root, datasetType,
+                            '%(visit)d-%(ccd)d.fits[0]' % dataId)
+
+    def datasetExists(self, datasetType, dataId):
+        self.asked.append((datasetType, dataId['visit'], dataId['ccd']))
+        return (dataId['visit'], dataId['ccd']) in self.inParent
+
+
+class DiscoverDataIdsTestCase(lsst.utils.tests.TestCase):
+    """Test finding the data IDs of a repository."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for datasetType in ('src', 'calexp'):
+            os.mkdir(os.path.join(self.directory, datasetType))
+            # Visit 2, CCD 0 has no calexp.
+            for visit, ccd in [(1, 0), (1, 1), (2, 0)]:
+                if (datasetType, visit, ccd) != ('calexp', 2, 0):
+                    open(os.path.join(self.directory, datasetType,
+                                      '%d-%d.fits' % (visit, ccd)), 'w').close()
+        self.butlers = []
+        self.makeButler = util._makeButler
+
+        def makeButler(root):
+            self.butlers.append(FakeButler(root))
+            return self.butlers[-1]
+
+        util._makeButler = makeButler
+
+    def tearDown(self):
+        util._makeButler = self.makeButler
+        shutil.rmtree(self.directory)
+
+    def testExistenceChecks(self):
+        for check in ('scan', 'stat', 'butler'):
+            dataIds = util.discoverDataIds(self.directory, existenceCheck=check, nThreads=2)
+            self.assertEqual(sorted((d['visit'], d['ccd']) for d in dataIds),
+                             [(1, 0), (1, 1), (2, 1)])
+            self.assertEqual(dataIds[0]['filter'], 'r')
+            if check != 'butler':
+                # Only the files that were not found are left to the butler.
+                self.assertEqual(sorted(self.butlers[-1].asked),
+                                 [('calexp', 2, 0), ('calexp', 2, 1), ('src', 2, 1)])
+
+
 def setup_module(module):
     lsst.utils.tests.init()
 